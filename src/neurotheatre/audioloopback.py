@@ -1,53 +1,129 @@
+import time
+import typing
+
 import ezmsg.core as ez
 from ezmsg.util.messages.axisarray import AxisArray
 import numpy as np
 import pyaudio
 from typing import AsyncGenerator
 
+from neurotheatre.resampler import adaptive_resample, DriftController, SampleFifo
+
 class AudioLoopbackSettings(ez.Settings):
     sample_rate: int = 44100  # Default sample rate for audio playback
     channels: int = 1         # Number of audio channels (e.g., mono = 1, stereo = 2)
     format: int = pyaudio.paFloat32  # Audio format (32-bit float)
+    adaptive: bool = True  # Resample to the sound card clock and hold target_latency; False writes blocks as they arrive
+    target_latency: float = 0.15  # sec of audio buffered ahead of the sound card; covers an EEG block plus delivery jitter
+    max_latency: float = 1.0  # sec; the oldest audio is dropped beyond this
+    frames_per_buffer: int = 512  # sound card callback size
+    drift_bandwidth: float = 0.01  # Hz; clock drift loop bandwidth (lower = steadier pitch, slower lock)
+    stats_interval: float = 10.0  # sec between latency/drift log lines; 0 disables
 
 class AudioLoopbackState(ez.State):
     audio_stream: pyaudio.Stream = None  # PyAudio stream object
     pyaudio_instance: pyaudio.PyAudio = None  # PyAudio instance
+    resample: typing.Optional[typing.Generator] = None
+    fifo: typing.Optional[SampleFifo] = None
+    controller: typing.Optional[DriftController] = None
+    underruns: int = 0
+    last_stats: float = 0.0
 
 class AudioLoopback(ez.Unit):
+    """
+    Plays a signal on the sound card.
+
+    In adaptive mode (default) the signal is resampled to `sample_rate` and queued for a
+    callback-driven stream.  The EEG device and the sound card run on independent clocks, so
+    the queue's fill level is fed back to trim the resampling ratio and hold `target_latency`
+    instead of slowly draining or growing.
+    """
     SETTINGS = AudioLoopbackSettings
     STATE = AudioLoopbackState
 
     INPUT_SIGNAL = ez.InputStream(AxisArray)
 
-    @ez.subscriber(INPUT_SIGNAL)
-    async def play_audio(self, msg: AxisArray) -> AsyncGenerator:
-        # Initialize PyAudio if not already initialized
-        if self.STATE.pyaudio_instance is None:
-            self.STATE.pyaudio_instance = pyaudio.PyAudio()
+    def open_stream(self) -> None:
+        self.STATE.pyaudio_instance = pyaudio.PyAudio()
+        if not self.SETTINGS.adaptive:
             self.STATE.audio_stream = self.STATE.pyaudio_instance.open(
                 format=self.SETTINGS.format,
                 channels=self.SETTINGS.channels,
                 rate=self.SETTINGS.sample_rate,
                 output=True
             )
+            return
+
+        rate = self.SETTINGS.sample_rate
+        self.STATE.resample = adaptive_resample(axis='time', fs_out=rate, dtype=np.float32)
+        self.STATE.fifo = SampleFifo(
+            capacity=int(self.SETTINGS.max_latency * rate),
+            channels=self.SETTINGS.channels,
+            prime=int(self.SETTINGS.target_latency * rate),
+        )
+        self.STATE.controller = DriftController(self.SETTINGS.target_latency, bandwidth=self.SETTINGS.drift_bandwidth)
+        self.STATE.last_stats = time.monotonic()
+
+        fifo = self.STATE.fifo
+        def callback(in_data, frame_count, time_info, status):
+            return fifo.read(frame_count).tobytes(), pyaudio.paContinue
 
+        self.STATE.audio_stream = self.STATE.pyaudio_instance.open(
+            format=pyaudio.paFloat32,
+            channels=self.SETTINGS.channels,
+            rate=rate,
+            output=True,
+            frames_per_buffer=self.SETTINGS.frames_per_buffer,
+            stream_callback=callback,
+        )
+
+    def frames(self, msg: AxisArray) -> np.ndarray:
+        """ (time, channels) float32 frames for the configured number of audio channels """
+        data = np.moveaxis(msg.data, msg.get_axis_idx('time'), 0).reshape(msg.data.shape[msg.get_axis_idx('time')], -1)
+        if data.shape[1] == self.SETTINGS.channels:
+            pass
+        elif data.shape[1] == 1:  # If mono, duplicate data for stereo
+            data = np.tile(data, (1, self.SETTINGS.channels))
+        elif self.SETTINGS.channels == 1:  # Mix several signal channels down to mono
+            data = data.mean(axis=1, keepdims=True)
+        else:
+            raise ValueError("Input signal channels do not match the configured audio channels.")
+        # Convert data to 32-bit float for PyAudio; no conversion if upstream already works in float32
+        return np.ascontiguousarray(data, dtype=np.float32)
+
+    @ez.subscriber(INPUT_SIGNAL)
+    async def play_audio(self, msg: AxisArray) -> AsyncGenerator:
         # Ensure the input signal is compatible with the audio format
         if 'time' not in msg.axes:
             raise ValueError("Input signal must have a 'time' axis for audio playback.")
 
-        # Reshape the data to match the number of channels
-        data = msg.data
-        if self.SETTINGS.channels > 1:
-            if len(data.shape) == 1:  # If mono, duplicate data for stereo
-                data = np.tile(data, (self.SETTINGS.channels, 1)).T
-            elif data.shape[1] != self.SETTINGS.channels:
-                raise ValueError("Input signal channels do not match the configured audio channels.")
+        # Initialize PyAudio if not already initialized
+        if self.STATE.pyaudio_instance is None:
+            self.open_stream()
+
+        if not self.SETTINGS.adaptive:
+            # Write audio data to the PyAudio stream
+            self.STATE.audio_stream.write(self.frames(msg).tobytes())
+            return
 
-        # Convert data to 32-bit float for PyAudio
-        audio_data = data.astype(np.float32).tobytes()
+        fifo, controller = self.STATE.fifo, self.STATE.controller
+        fifo.write(self.frames(self.STATE.resample.send(msg)))
 
-        # Write audio data to the PyAudio stream
-        self.STATE.audio_stream.write(audio_data)
+        now = time.monotonic()
+        if fifo.underruns != self.STATE.underruns:
+            # Ran dry: playback restarts once target_latency is buffered again
+            self.STATE.underruns = fifo.underruns
+            controller.restart()
+            self.STATE.resample.send({'correction': controller.correction})
+        elif fifo.primed:
+            self.STATE.resample.send({'correction': controller.update(fifo.fill / self.SETTINGS.sample_rate, now)})
+
+        if self.SETTINGS.stats_interval and now - self.STATE.last_stats >= self.SETTINGS.stats_interval:
+            self.STATE.last_stats = now
+            ez.logger.info(
+                f'audio latency {fifo.fill / self.SETTINGS.sample_rate * 1e3:.0f} ms, '
+                f'clock drift {controller.drift_ppm:+.0f} ppm, underruns {fifo.underruns}, dropped {fifo.dropped} frames'
+            )
 
     async def shutdown(self):
         # Clean up PyAudio resources on shutdown
@@ -55,4 +131,4 @@ class AudioLoopback(ez.Unit):
             self.STATE.audio_stream.stop_stream()
             self.STATE.audio_stream.close()
         if self.STATE.pyaudio_instance is not None:
-            self.STATE.pyaudio_instance.terminate()
\ No newline at end of file
+            self.STATE.pyaudio_instance.terminate()
@@ -0,0 +1,282 @@
+import csv
+import itertools
+import json
+import math
+import os
+import typing
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.control import SSVEP_PARAMS
+from neurotheatre.features import preproc_stage, envelope_stage, ssvep_stage, PERFORMER_AXIS
+from neurotheatre.offline import live_blocks
+
+
+@dataclass
+class Rehearsal:
+    """
+    A labeled rehearsal recording and the intermediates every grid point shares: the
+    preprocessed EEG the SSVEP decoder replays and the jaw clench envelope.
+    """
+    name: str
+    fs: float # raw sample rate
+    t0: float
+    duration: float # sec
+    blocksize: int # live block size the decoder is replayed with
+    labels: typing.Optional[np.ndarray] # attended SSVEP target per raw sample, -1 for none
+    jaw: typing.Optional[np.ndarray] # nonzero while clenching, per raw sample
+    preproc: typing.Optional[AxisArray] # [performer (1), time, ch]
+    envelope_time: typing.Optional[np.ndarray]
+    envelope: typing.Optional[np.ndarray]
+
+
+@dataclass
+class SweepResult:
+    """
+    Detection performance of one grid point over all rehearsals.
+
+    An event is a labeled clench or SSVEP trial; a detection counts for it from its onset
+    until `grace` seconds after it ends.
+    """
+    settings: typing.Dict[str, typing.Any] # EEGOSCSettings names and values
+    accuracy: float # detections during events that picked the labeled target (always 1 for the jaw)
+    detected: float # fraction of events with a correct detection
+    false_per_min: float # detections outside events, per minute without events
+    latency: float # sec, median from event onset to its first correct detection; nan if none
+
+
+def load_rehearsal(path: str, blocksize: int = 10) -> Rehearsal:
+    """
+    Loads a rehearsal .npz and computes its intermediates.
+
+    The recording holds raw `data` (time, ch) and `fs`, optionally `t0`, SSVEP `labels` (target
+    index per sample, -1 for none; as for `calibrate_ssvep`) and `jaw` (1 while clenching).
+    Preprocessing and the envelope run over the whole recording at once: their filters don't
+    depend on block boundaries, so this is what the live path computes.
+    """
+    with np.load(path) as rec:
+        data, fs = rec['data'], float(rec['fs'])
+        t0 = float(rec['t0']) if 't0' in rec else 0.0
+        labels = rec['labels'] if 'labels' in rec else None
+        jaw = rec['jaw'] if 'jaw' in rec else None
+    msg = AxisArray(
+        np.asarray(data, dtype = float)[None],
+        dims = [PERFORMER_AXIS, 'time', 'ch'],
+        axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = t0)},
+    )
+    preproc = preproc_stage()(msg) if labels is not None else None
+    envelope_time = envelope = None
+    if jaw is not None:
+        out = envelope_stage()(msg)
+        axis = out.get_axis('time')
+        envelope = out.data[0, :, 0]
+        envelope_time = axis.offset + np.arange(len(envelope)) * axis.gain
+    return Rehearsal(path, fs, t0, len(data) / fs, blocksize, labels, jaw, preproc, envelope_time, envelope)
+
+
+def _events(rehearsal: Rehearsal, labels: np.ndarray) -> typing.List[typing.Tuple[float, float, int]]:
+    """ (onset, end, target) of each run of equal labels >= 0 """
+    edges = np.flatnonzero(np.diff(labels)) + 1
+    starts, stops = np.concatenate([[0], edges]), np.concatenate([edges, [len(labels)]])
+    return [
+        (rehearsal.t0 + start / rehearsal.fs, rehearsal.t0 + stop / rehearsal.fs, int(labels[start]))
+        for start, stop in zip(starts, stops) if labels[start] >= 0
+    ]
+
+
+class _Tally:
+    """ Detection counts summed over rehearsals """
+
+    def __init__(self):
+        self.correct = 0
+        self.attended = 0
+        self.false = 0
+        self.rest = 0.0 # sec without events
+        self.events = 0
+        self.latencies: typing.List[float] = []
+
+    def add(self, times: np.ndarray, choices: np.ndarray, events: typing.List[typing.Tuple[float, float, int]], duration: float, grace: float) -> None:
+        self.events += len(events)
+        self.rest += duration - sum(end - onset for onset, end, _ in events)
+        onsets = np.array([onset for onset, _, _ in events])
+        first_correct: typing.Dict[int, float] = {}
+        for t, choice in zip(times.tolist(), choices.tolist()):
+            e = int(np.searchsorted(onsets, t, side = 'right')) - 1
+            if e < 0 or t > events[e][1] + grace:
+                self.false += 1
+                continue
+            self.attended += 1
+            if choice == events[e][2]:
+                self.correct += 1
+                first_correct.setdefault(e, t - events[e][0])
+        self.latencies.extend(first_correct.values())
+
+    def result(self, settings: typing.Dict[str, typing.Any]) -> SweepResult:
+        return SweepResult(
+            settings,
+            accuracy = self.correct / self.attended if self.attended else math.nan,
+            detected = len(self.latencies) / self.events if self.events else math.nan,
+            false_per_min = float(self.false / (self.rest / 60.0)) if self.rest > 0 else math.nan,
+            latency = float(np.median(self.latencies)) if self.latencies else math.nan,
+        )
+
+
+def sweep_jaw(rehearsals: typing.Sequence[Rehearsal], thresholds: typing.Sequence[float], grace: float = 0.5) -> typing.List[SweepResult]:
+    """
+    Jaw clench detection at each of `thresholds`.
+
+    A detection is a rising edge of the envelope through the threshold, as :obj:`EEGOSC`
+    sends a hand 'close'.  All thresholds are compared against the cached envelope at once.
+    """
+    tallies = [_Tally() for _ in thresholds]
+    for rehearsal in rehearsals:
+        if rehearsal.jaw is None:
+            continue
+        events = _events(rehearsal, np.where(np.asarray(rehearsal.jaw) > 0, 0, -1))
+        envelope = rehearsal.envelope
+        previous = np.concatenate([[0.0], envelope[:-1]])
+        th = np.asarray(thresholds, dtype = float)[:, None]
+        rising = (previous <= th) & (envelope > th)
+        for tally, edges in zip(tallies, rising):
+            times = rehearsal.envelope_time[edges]
+            tally.add(times, np.zeros(len(times), dtype = int), events, rehearsal.duration, grace)
+    return [tally.result({'jaw_thresh': float(thresh)}) for tally, thresh in zip(tallies, thresholds)]
+
+
+def replay_ssvep(rehearsal: Rehearsal, **params) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    SSVEP decisions on a rehearsal, fed in live blocks.
+
+    Args:
+        rehearsal: From :obj:`load_rehearsal`, with `labels`.
+        **params: :obj:`ssvep_stage` arguments.
+
+    Returns:
+        (time of each decision, index of the chosen target).
+    """
+    decoder = ssvep_stage(**params)
+    times, choices = [], []
+    for block in live_blocks(rehearsal.preproc, rehearsal.fs, rehearsal.t0, rehearsal.blocksize):
+        decision = decoder.send(block)
+        if decision.data.size:
+            axis = block.get_axis('time')
+            times.append(axis.offset + (block.data.shape[1] - 1) * axis.gain)
+            choices.append(int(np.argmax(decision.data[0])))
+    return np.array(times), np.array(choices, dtype = int)
+
+
+_REHEARSALS: typing.Sequence[Rehearsal] = ()
+
+
+def _init_worker(rehearsals: typing.Sequence[Rehearsal]) -> None:
+    global _REHEARSALS
+    _REHEARSALS = rehearsals
+
+
+def _evaluate_ssvep(args: typing.Tuple[typing.Dict[str, typing.Any], typing.Dict[str, typing.Any], float]) -> SweepResult:
+    point, base, grace = args
+    params = {SSVEP_PARAMS[k]: v for k, v in {**base, **point}.items() if k in SSVEP_PARAMS}
+    tally = _Tally()
+    for rehearsal in _REHEARSALS:
+        if rehearsal.labels is None:
+            continue
+        times, choices = replay_ssvep(rehearsal, **params)
+        tally.add(times, choices, _events(rehearsal, np.asarray(rehearsal.labels)), rehearsal.duration, grace)
+    return tally.result(point)
+
+
+def ssvep_grid(
+    min_durs: typing.Sequence[float],
+    max_durs: typing.Sequence[float],
+    harmonics: typing.Sequence[int],
+    prob_threshs: typing.Sequence[float],
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """ Grid points as EEGOSCSettings values; windows whose minimum exceeds their maximum are left out """
+    return [
+        {'ssvep_harmonics': int(h), 'ssvep_dur': float(max_dur), 'ssvep_min_dur': float(min_dur), 'ssvep_prob_thresh': float(p)}
+        for h, max_dur, min_dur, p in itertools.product(harmonics, max_durs, min_durs, prob_threshs)
+        if min_dur <= max_dur
+    ]
+
+
+def sweep_ssvep(
+    rehearsals: typing.Sequence[Rehearsal],
+    grid: typing.Sequence[typing.Dict[str, typing.Any]],
+    base: typing.Dict[str, typing.Any],
+    workers: typing.Optional[int] = None,
+    grace: float = 1.0,
+) -> typing.List[SweepResult]:
+    """
+    SSVEP decoding at each grid point, spread across a process pool.
+
+    Each worker receives the rehearsals' preprocessed EEG once.  Neighbouring grid points
+    (the grid is ordered by harmonics) go to the same worker, so its decoders share the
+    cached reference signals (:obj:`reference_design`).
+
+    Args:
+        rehearsals: From :obj:`load_rehearsal`; those without `labels` are skipped.
+        grid: EEGOSCSettings values of each point, e.g. from :obj:`ssvep_grid`.
+        base: Settings shared by every point, including `ssvep_freqs`.
+        workers: Processes to use.  Default: one per CPU.
+        grace: Sec after a trial during which decisions still count for it.
+
+    Returns:
+        One :obj:`SweepResult` per grid point, in order.
+    """
+    tasks = [(point, base, grace) for point in grid]
+    with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker, initargs = (list(rehearsals),)) as pool:
+        chunksize = max(1, len(tasks) // (4 * (workers or os.cpu_count() or 1)))
+        return list(pool.map(_evaluate_ssvep, tasks, chunksize = chunksize))
+
+
+def best(results: typing.Sequence[SweepResult], max_false_per_min: float = 1.0) -> SweepResult:
+    """
+    The grid point detecting the most events correctly (`detected` times `accuracy`), then
+    the fastest, among those within `max_false_per_min`; the one with the fewest false
+    triggers if none is.
+    """
+    allowed = [r for r in results if not r.false_per_min > max_false_per_min]
+    if not allowed:
+        return min(results, key = lambda r: r.false_per_min)
+    def rank(r: SweepResult) -> typing.Tuple[float, float]:
+        return (
+            np.nan_to_num(r.detected) * np.nan_to_num(r.accuracy, nan = 1.0),
+            -np.nan_to_num(r.latency, nan = np.inf),
+        )
+    return max(allowed, key = rank)
+
+
+def write_report(path: str, results: typing.Sequence[SweepResult]) -> None:
+    """ Every grid point's settings and metrics as CSV """
+    keys = list(dict.fromkeys(k for r in results for k in r.settings))
+    with open(path, 'w', newline = '') as f:
+        writer = csv.writer(f)
+        writer.writerow(keys + ['accuracy', 'detected', 'false_per_min', 'latency'])
+        for r in results:
+            writer.writerow([r.settings.get(k, '') for k in keys] + [r.accuracy, r.detected, r.false_per_min, r.latency])
+
+
+def save_settings(path: str, values: typing.Dict[str, typing.Any]) -> None:
+    """ Writes EEGOSCSettings values as JSON, for `osc --settings` """
+    with open(path, 'w') as f:
+        json.dump(values, f, indent = 2)
+
+
+def load_settings(path: str, allowed: typing.Optional[typing.Collection[str]] = None) -> typing.Dict[str, typing.Any]:
+    """
+    EEGOSCSettings values from a JSON settings file.
+
+    Raises:
+        ValueError: If the file names settings outside `allowed`.
+    """
+    with open(path) as f:
+        values = json.load(f)
+    unknown = sorted(set(values) - set(allowed)) if allowed is not None else []
+    if unknown:
+        raise ValueError(f'{path}: unknown settings {unknown}')
+    return values
@@ -1,12 +1,17 @@
 import argparse
+import dataclasses
+import typing
 
 import ezmsg.core as ez
 
 from ezmsg.unicorn.device import UnicornSettings
 from ezmsg.panel.application import Application, ApplicationSettings
 from ezmsg.sigproc.butterworthfilter import ButterworthFilterSettings
-from ezmsg.panel.timeseriesplot import TimeSeriesPlotSettings
-from neurotheatre.osc import OSCSystem, OSCSystemSettings, EEGOSCSettings
+from neurotheatre.osc import OSCSystem, OSCSystemSettings, EEGOSCSettings, BACKPRESSURE
+from neurotheatre.eegcodec import CODECS
+from neurotheatre.osc import SyntheticOSCSystem, SyntheticOSCSystemSettings
+from neurotheatre.synthetic import SyntheticSourceSettings
+from neurotheatre.features import FEATURES
 
 from neurotheatre.injector import InjectorSettings
 from neurotheatre.midiunit import MidiSettings
@@ -14,34 +19,147 @@ from neurotheatre.bandunit import BandUnitSettings
 from neurotheatre.signal_to_midi import SignalToMidiSystem, SignalToMidiSystemSettings
 from neurotheatre.signal_to_band import WaveSystem, WaveSystemSettings
 
+def settings_file(parser: argparse.ArgumentParser, settings_type: type, dests: typing.Iterable[str]) -> typing.Dict[str, typing.Any]:
+    """
+    Reads `--settings`, a JSON file of `settings_type` values (e.g. from `calibrate`).  Values of
+    the command line options with destinations `dests` become their defaults, so options given
+    explicitly still win; the other values are returned to be applied to the settings.
+    """
+    from neurotheatre.calibration import load_settings
+
+    known, _ = parser.parse_known_args()
+    if known.settings is None:
+        return {}
+    values = load_settings(known.settings, [f.name for f in dataclasses.fields(settings_type)])
+    dests = set(dests)
+    parser.set_defaults(**{k: v for k, v in values.items() if k in dests})
+    return {k: v for k, v in values.items() if k not in dests}
+
+class OSCArgs:
+    """ Options of :obj:`add_osc_arguments` """
+    td_address: str
+    imu_address: str
+    hand_address: str
+    multicast_ttl: int
+    multicast_interface: typing.Optional[str]
+    blocksize: int
+    jaw_thresh: float
+    precision: str
+    control_address: typing.Optional[str]
+    features: typing.List[str]
+    shm_name: typing.Optional[str]
+    preproc_codec: typing.Optional[str]
+    preproc_bits: int
+    quality: bool
+    quality_line_freq: float
+    ssvep_thread: bool
+    backpressure: str
+    latency_budget: float
+    ssvep_method: str
+    ssvep_templates: str
+    montage: str
+    ssvep_stim_t0: typing.Optional[float]
+    speed: float
+    settings: typing.Optional[str]
+
+def add_osc_arguments(parser: argparse.ArgumentParser) -> typing.List[str]:
+    """ Adds the options `osc` and `multiosc` share; returns their destinations """
+    actions = [
+        parser.add_argument('--td-address', help = 'remote OSC server address; a comma-separated list sends every message to each, and a multicast group (e.g. 239.1.1.1:8000) to every machine that joins it; default: 127.0.0.1:8000', default = '127.0.0.1:8000'),
+        parser.add_argument('--imu-address', help = 'remote imu server address, or several as --td-address, default: 127.0.0.1:9001', default = '127.0.0.1:9001'),
+        parser.add_argument('--hand-address', help = 'remote hand server address, or several as --td-address, default: 127.0.0.1:8002', default = '127.0.0.1:8002'),
+        parser.add_argument('--multicast-ttl', help = 'hops multicast packets may take, 1 stays on the local network, default: 1', default = 1, type = int),
+        parser.add_argument('--multicast-interface', help = 'address of the network interface to send multicast from (default: the system\'s choice)', default = None),
+        parser.add_argument('--blocksize', help = 'eeg sample block size @ 200 Hz', default = 10, type = int),
+        parser.add_argument('--jaw_thresh', help = 'Jaw Clenching decoding threshold frequency', default = '20.0', type = float),
+        parser.add_argument('--precision', help = 'working precision, default: float64', default = 'float64', choices = ['float32', 'float64']),
+        parser.add_argument('--control-address', help = 'host:port to accept /config/<setting> OSC updates on, e.g. 0.0.0.0:9000 (default: off)', default = None),
+        parser.add_argument('--features', help = 'features to compute and send (also /config/features), default: all', nargs = '*', default = list(FEATURES), choices = FEATURES),
+        parser.add_argument('--shm-name', help = 'also write features to shared-memory rings with this name prefix for local readers, e.g. neurotheatre (default: off)', default = None),
+        parser.add_argument('--preproc-codec', help = 'send the preprocessed eeg as one quantized packet per block on /eeg/preproc/packet instead of a message per sample (default: off)', default = None, choices = list(CODECS)),
+        parser.add_argument('--preproc-bits', help = 'resolution of the --preproc-codec packets, 2-16; fewer bits compress better with the -zlib codecs, default: 16', default = 16, type = int),
+        parser.add_argument('--quality', help = 'track channel signal quality on /eeg/quality/... and compute features only from usable channels', action = 'store_true'),
+        parser.add_argument('--quality-line-freq', help = 'mains frequency for the line-noise quality metric, default: 60', default = 60.0, type = float),
+        parser.add_argument('--ssvep-thread', help = 'decode ssvep on a worker thread so imu and config messages are handled meanwhile', action = 'store_true'),
+        parser.add_argument('--backpressure', help = 'when blocks queue up behind a slow one: process each in turn (none), together (merge), or together sending only the newest samples (latest), or merge and split blocks to fit --latency-budget (adaptive); default: none', default = 'none', choices = BACKPRESSURE),
+        parser.add_argument('--latency-budget', help = 'sec a sample may wait for its outputs with --backpressure adaptive, default: 0.1', default = 0.1, type = float),
+        parser.add_argument('--ssvep-method', help = 'ssvep decoder; trca/ecca need a calibration (see calibrate_ssvep), default: cca', default = 'cca', choices = ['cca', 'trca', 'ecca']),
+        parser.add_argument('--ssvep-templates', help = 'ssvep calibration cache directory, default: templates', default = 'templates'),
+        parser.add_argument('--montage', help = 'electrode montage name the calibration was made with, default: unicorn8', default = 'unicorn8'),
+        parser.add_argument('--ssvep-stim-t0', help = 'sec, headset time at which every ssvep stimulus was at phase 0 (also /config/ssvep_stim_t0), default: the calibration\'s', default = None, type = float),
+        parser.add_argument('--speed', help = 'synthetic headset speed as a multiple of real-time, default: 1.0', default = 1.0, type = float),
+        parser.add_argument('--settings', help = 'json file of further settings, e.g. from calibrate; options given here override it', default = None),
+    ]
+    return [action.dest for action in actions]
+
+def osc_settings_kwargs(args: OSCArgs) -> typing.Dict[str, typing.Any]:
+    """ :obj:`EEGOSCSettings` values of the options of :obj:`add_osc_arguments` """
+    return dict(
+        td_address = args.td_address,
+        imu_address = args.imu_address,
+        hand_address = args.hand_address,
+        multicast_ttl = args.multicast_ttl,
+        multicast_interface = args.multicast_interface,
+        jaw_thresh = args.jaw_thresh,
+        precision = args.precision,
+        control_address = args.control_address,
+        features = args.features,
+        shm_name = args.shm_name,
+        preproc_codec = args.preproc_codec,
+        preproc_bits = args.preproc_bits,
+        quality = args.quality,
+        quality_line_freq = args.quality_line_freq,
+        ssvep_thread = args.ssvep_thread,
+        backpressure = args.backpressure,
+        latency_budget = args.latency_budget,
+        ssvep_method = args.ssvep_method,
+        ssvep_templates = args.ssvep_templates,
+        ssvep_montage = args.montage,
+        ssvep_stim_t0 = args.ssvep_stim_t0,
+    )
+
 def osc():
 
     parser = argparse.ArgumentParser(description = 'unicorn OSC client')
-    parser.add_argument('-d', '--device', help = 'device address', default = 'simulator')
-    parser.add_argument('--td-address', help = 'remote OSC server address, default: 127.0.0.1:8000', default = '127.0.0.1:8000')
-    parser.add_argument('--imu-address', help = 'remote imu server address, default: 127.0.0.1:9001', default = '127.0.0.1:9001')
-    parser.add_argument('--hand-address', help = 'remote hand server address, default: 127.0.0.1:8002', default = '127.0.0.1:8002')
-    parser.add_argument('--blocksize', help = 'eeg sample block size @ 200 Hz', default = 10, type = int)
-    parser.add_argument('--jaw_thresh', help = 'Jaw Clenching decoding threshold frequency', default = '20.0', type = float)
-
-    class Args:
+    options = [
+        parser.add_argument('-d', '--device', help = 'device address', default = 'simulator'),
+        parser.add_argument('--performer', help = 'performer name, selects the ssvep calibration, default: p1', default = 'p1'),
+        parser.add_argument('--synthetic', help = 'use a synthetic headset instead of a device (no dashboard)', action = 'store_true'),
+    ]
+    dests = [action.dest for action in options] + add_osc_arguments(parser)
+
+    class Args(OSCArgs):
         device: str
-        td_address: str
-        imu_address: str
-        hand_address: str
-        blocksize: int
-        jaw_thresh: float
+        performer: str
+        synthetic: bool
 
+    extra = settings_file(parser, EEGOSCSettings, dests)
     args = parser.parse_args(namespace = Args)
 
+    osc_settings = EEGOSCSettings(
+        **osc_settings_kwargs(args),
+        performer = args.performer,
+    )
+    osc_settings = dataclasses.replace(osc_settings, **extra)
+
+    if args.synthetic:
+        ez.run(
+            OSC = SyntheticOSCSystem(
+                SyntheticOSCSystemSettings(
+                    osc_settings = osc_settings,
+                    source_settings = SyntheticSourceSettings(
+                        blocksize = args.blocksize,
+                        speed = args.speed,
+                        dtype = args.precision,
+                    )
+                )
+            )
+        )
+        return
+
     osc = OSCSystem(
         OSCSystemSettings(
-            osc_settings = EEGOSCSettings(
-                td_address = args.td_address,
-                imu_address = args.imu_address,
-                hand_address = args.hand_address,
-                jaw_thresh = args.jaw_thresh
-            ),
+            osc_settings = osc_settings,
             unicorn_settings = UnicornSettings(
                 address = args.device,
                 n_samp = args.blocksize
@@ -65,21 +183,303 @@ def osc():
         APP = app,
     )
 
+def multiosc():
+
+    from neurotheatre.multiosc import MultiOSCSystem, MultiOSCSystemSettings, MultiEEGOSCSettings
+    from neurotheatre.multiosc import SyntheticMultiOSCSystem, SyntheticMultiOSCSystemSettings
+
+    parser = argparse.ArgumentParser(description = 'unicorn OSC client for several performers; addresses are namespaced /p1/..., /p2/...')
+    options = [
+        parser.add_argument('-d', '--device', help = 'device address, once per performer', action = 'append', default = []),
+        parser.add_argument('--synthetic', help = 'number of synthetic headsets to use instead of devices (no dashboards)', default = 0, type = int),
+        parser.add_argument('--max-skew', help = 'sec a headset may lag before the others continue without it, default: 0.5', default = 0.5, type = float),
+    ]
+    dests = [action.dest for action in options] + add_osc_arguments(parser)
+
+    class Args(OSCArgs):
+        device: typing.List[str]
+        synthetic: int
+        max_skew: float
+
+    extra = settings_file(parser, MultiEEGOSCSettings, dests)
+    args = parser.parse_args(namespace = Args)
+
+    n_performers = args.synthetic if args.synthetic else len(args.device)
+    if n_performers == 0:
+        parser.error('specify at least one --device or --synthetic N')
+
+    osc_settings = MultiEEGOSCSettings(
+        **osc_settings_kwargs(args),
+        performers = [f'p{i + 1}' for i in range(n_performers)],
+        max_skew = args.max_skew,
+    )
+    osc_settings = dataclasses.replace(osc_settings, **extra)
+
+    if args.synthetic:
+        ez.run(
+            OSC = SyntheticMultiOSCSystem.for_performers(osc_settings.performers)(
+                SyntheticMultiOSCSystemSettings(
+                    osc_settings = osc_settings,
+                    source_settings = SyntheticSourceSettings(
+                        blocksize = args.blocksize,
+                        speed = args.speed,
+                        dtype = args.precision,
+                    )
+                )
+            )
+        )
+        return
+
+    osc = MultiOSCSystem.for_performers(osc_settings.performers)(
+        MultiOSCSystemSettings(
+            osc_settings = osc_settings,
+            unicorn_settings = [
+                UnicornSettings(address = device, n_samp = args.blocksize)
+                for device in args.device
+            ]
+        )
+    )
+
+    app = Application(
+        ApplicationSettings(
+            port = 8888,
+            name = 'Neurotheatre'
+        )
+    )
+
+    app.panels = {
+        f'osc_{performer}': dashboard.app
+        for performer, dashboard in zip(osc_settings.performers, osc.dashboards)
+    }
+
+    ez.run(
+        OSC = osc,
+        APP = app,
+    )
+
+def calibrate_ssvep():
+
+    import numpy as np
+    from neurotheatre.features import calibrate_ssvep as fit
+    from neurotheatre.trca import TemplateCache
+
+    parser = argparse.ArgumentParser(description = 'fit trca/ecca ssvep templates for a performer from a calibration recording')
+    parser.add_argument('recording', help = '.npz with raw `data` (time, ch), `labels` (time,) target index or -1, `fs`; optionally `t0`, `stim_t0`, `freqs`')
+    parser.add_argument('--performer', help = 'performer name, default: p1', default = 'p1')
+    parser.add_argument('--montage', help = 'electrode montage name, default: unicorn8', default = 'unicorn8')
+    parser.add_argument('--cache', help = 'calibration cache directory, default: templates', default = 'templates')
+    parser.add_argument('--freqs', help = 'stimulus frequencies (Hz) if not in the recording', nargs = '+', type = float, default = None)
+    parser.add_argument('--stim-t0', help = 'time at which all stimuli were at phase 0, if not in the recording', type = float, default = None)
+
+    class Args:
+        recording: str
+        performer: str
+        montage: str
+        cache: str
+        freqs: typing.Optional[typing.List[float]]
+        stim_t0: typing.Optional[float]
+
+    args = parser.parse_args(namespace = Args)
+
+    with np.load(args.recording) as rec:
+        freqs = args.freqs if args.freqs is not None else rec['freqs'].tolist()
+        stim_t0 = args.stim_t0 if args.stim_t0 is not None else float(rec['stim_t0']) if 'stim_t0' in rec else 0.0
+        templates = fit(
+            rec['data'],
+            rec['labels'],
+            float(rec['fs']),
+            freqs,
+            t0 = float(rec['t0']) if 't0' in rec else 0.0,
+            stim_t0 = stim_t0,
+        )
+
+    fname = TemplateCache(args.cache).save(args.performer, args.montage, templates)
+    print(f'saved {args.performer} ({args.montage}) calibration for {freqs} Hz to {fname}')
+
+def calibrate():
+
+    from neurotheatre.calibration import load_rehearsal, sweep_jaw, sweep_ssvep, ssvep_grid, best, save_settings, write_report
+
+    defaults = EEGOSCSettings()
+    parser = argparse.ArgumentParser(description = 'sweep jaw_thresh and ssvep windows over labeled rehearsal recordings; saves the best as a settings file for osc --settings')
+    parser.add_argument('recordings', help = '.npz with raw `data` (time, ch), `fs`, and `labels` (ssvep target per sample, -1 for none) and/or `jaw` (1 while clenching); optionally `t0`', nargs = '+')
+    parser.add_argument('-o', '--out', help = 'settings file to write, default: calibration.json', default = 'calibration.json')
+    parser.add_argument('--report', help = 'csv file for the metrics of every grid point (default: off)', default = None)
+    parser.add_argument('-j', '--workers', help = 'processes to spread ssvep grid points over, default: one per cpu', default = None, type = int)
+    parser.add_argument('--blocksize', help = 'live eeg block size to replay with, default: 10', default = 10, type = int)
+    parser.add_argument('--jaw-thresh', help = 'jaw thresholds to try, default: 10 15 20 25 30 40 50', nargs = '+', type = float, default = [10.0, 15.0, 20.0, 25.0, 30.0, 40.0, 50.0])
+    parser.add_argument('--min-dur', help = 'shortest ssvep windows (sec) to try, default: 0.5 1 1.5 2 3', nargs = '+', type = float, default = [0.5, 1.0, 1.5, 2.0, 3.0])
+    parser.add_argument('--max-dur', help = 'longest ssvep windows (sec) to try, default: 4 8', nargs = '+', type = float, default = [4.0, 8.0])
+    parser.add_argument('--harmonics', help = 'ssvep reference harmonics to try, default: 0 1 2 3', nargs = '+', type = int, default = [0, 1, 2, 3])
+    parser.add_argument('--prob-thresh', help = 'ssvep posterior thresholds to try, default: 0.45 0.6 0.75', nargs = '+', type = float, default = [0.45, 0.6, 0.75])
+    parser.add_argument('--freqs', help = f'ssvep target frequencies (Hz), default: {" ".join(f"{f:g}" for f in defaults.ssvep_freqs)}', nargs = '+', type = float, default = defaults.ssvep_freqs)
+    parser.add_argument('--max-false-rate', help = 'false triggers per minute of rest allowed, default: 1', default = 1.0, type = float)
+
+    class Args:
+        recordings: typing.List[str]
+        out: str
+        report: typing.Optional[str]
+        workers: typing.Optional[int]
+        blocksize: int
+        jaw_thresh: typing.List[float]
+        min_dur: typing.List[float]
+        max_dur: typing.List[float]
+        harmonics: typing.List[int]
+        prob_thresh: typing.List[float]
+        freqs: typing.List[float]
+        max_false_rate: float
+
+    args = parser.parse_args(namespace = Args)
+
+    rehearsals = [load_rehearsal(path, args.blocksize) for path in args.recordings]
+    settings: typing.Dict[str, typing.Any] = {}
+    results = []
+
+    if any(r.jaw is not None for r in rehearsals):
+        jaw = sweep_jaw(rehearsals, args.jaw_thresh)
+        chosen = best(jaw, args.max_false_rate)
+        settings.update(chosen.settings)
+        results += jaw
+        print(f'jaw_thresh {chosen.settings["jaw_thresh"]:g}: {chosen.detected:.0%} of clenches detected after {chosen.latency:.2f} s, {chosen.false_per_min:.2f} false/min')
+
+    if any(r.labels is not None for r in rehearsals):
+        base = {
+            'ssvep_freqs': args.freqs,
+            'ssvep_step': defaults.ssvep_step,
+            'ssvep_margin_thresh': defaults.ssvep_margin_thresh,
+            'ssvep_refractory': defaults.ssvep_refractory,
+        }
+        grid = ssvep_grid(args.min_dur, args.max_dur, args.harmonics, args.prob_thresh)
+        ssvep = sweep_ssvep(rehearsals, grid, base, workers = args.workers)
+        chosen = best(ssvep, args.max_false_rate)
+        settings.update({'ssvep_freqs': args.freqs, **chosen.settings})
+        results += ssvep
+        print(f'{chosen.settings}: accuracy {chosen.accuracy:.0%}, {chosen.detected:.0%} of trials detected after {chosen.latency:.2f} s, {chosen.false_per_min:.2f} false/min')
+
+    if not results:
+        parser.error('the recordings have neither `labels` nor `jaw`')
+    if args.report is not None:
+        write_report(args.report, results)
+    save_settings(args.out, settings)
+    print(f'saved {args.out}; run with osc --settings {args.out}')
+
+def imu_receive():
+
+    from neurotheatre.osc import IMUOSCSystem, IMUOSCSystemSettings
+    from neurotheatre.imu_udp_receive import IMUReceiverSettings
+
+    parser = argparse.ArgumentParser(description = 'receive IMU streams over UDP (from another machine\'s osc --imu-address) and send orientation over OSC')
+    parser.add_argument('--listen', help = 'host:port to receive IMU datagrams on, or a multicast group:port to join, default: 0.0.0.0:9001', default = '0.0.0.0:9001')
+    parser.add_argument('--td-address', help = 'remote OSC server address, default: 127.0.0.1:8000', default = '127.0.0.1:8000')
+    parser.add_argument('--address-prefix', help = 'prepended to every OSC address, e.g. /p2 (default: none)', default = '')
+    parser.add_argument('--forward', help = 'host:port to forward the IMU blocks on to (default: off)', default = '')
+    parser.add_argument('--stats-interval', help = 'sec between packet loss/jitter log lines, default: 10', default = 10.0, type = float)
+
+    class Args:
+        listen: str
+        td_address: str
+        address_prefix: str
+        forward: str
+        stats_interval: float
+
+    args = parser.parse_args(namespace = Args)
+
+    ez.run(
+        IMU = IMUOSCSystem(
+            IMUOSCSystemSettings(
+                receiver_settings = IMUReceiverSettings(
+                    address = args.listen,
+                    stats_interval = args.stats_interval,
+                ),
+                osc_settings = EEGOSCSettings(
+                    td_address = args.td_address,
+                    imu_address = args.forward,
+                    address_prefix = args.address_prefix,
+                    features = [],
+                ),
+            )
+        )
+    )
+
+def extract_features():
+
+    import time
+    from neurotheatre.offline import run_batch, throughput
+
+    parser = argparse.ArgumentParser(description = 'compute the osc features of recorded sessions offline, far faster than real time')
+    parser.add_argument('recordings', help = '.npz files with raw `data` (time, ch) and `fs`; optionally `t0`', nargs = '+')
+    parser.add_argument('-o', '--out', help = 'directory for the <recording>.features.npz files, default: features', default = 'features')
+    parser.add_argument('-j', '--workers', help = 'processes to spread recordings over, default: one per cpu', default = None, type = int)
+    parser.add_argument('--blocksize', help = 'live eeg block size to match, default: 10', default = 10, type = int)
+    parser.add_argument('--chunk-dur', help = 'sec of recording processed at once, default: 60', default = 60.0, type = float)
+    parser.add_argument('--features', help = 'features to compute, default: all', nargs = '*', default = list(FEATURES), choices = FEATURES)
+    parser.add_argument('--bandpower-engine', help = 'band power engine, default: window', default = 'window', choices = ['window', 'iir'])
+    parser.add_argument('--ssvep-freqs', help = 'ssvep target frequencies (Hz), default: 7 9 11', nargs = '+', type = float, default = [7.0, 9.0, 11.0])
+    parser.add_argument('--precision', help = 'working precision, default: float64', default = 'float64', choices = ['float32', 'float64'])
+    parser.add_argument('--store', help = 'precision of the stored values, default: float32', default = 'float32', choices = ['float32', 'float64'])
+
+    class Args:
+        recordings: typing.List[str]
+        out: str
+        workers: typing.Optional[int]
+        blocksize: int
+        chunk_dur: float
+        features: typing.List[str]
+        bandpower_engine: str
+        ssvep_freqs: typing.List[float]
+        precision: str
+        store: str
+
+    args = parser.parse_args(namespace = Args)
+
+    settings = EEGOSCSettings()
+    tick = time.perf_counter()
+    results = run_batch(
+        args.recordings,
+        args.out,
+        workers = args.workers,
+        callback = lambda r: print(f'{r.recording}: {r.duration / 60.0:.1f} min in {r.elapsed:.1f} s -> {r.output}'),
+        store = args.store,
+        blocksize = args.blocksize,
+        chunk_dur = args.chunk_dur,
+        bands = settings.bands,
+        enabled = args.features,
+        bandpower_engine = args.bandpower_engine,
+        bandpower_order = settings.bandpower_order,
+        bandpower_tau = settings.bandpower_tau,
+        bands_tau = settings.bands_tau,
+        ssvep_freqs = args.ssvep_freqs,
+        ssvep_min_dur = settings.ssvep_min_dur,
+        ssvep_max_dur = settings.ssvep_dur,
+        ssvep_step = settings.ssvep_step,
+        ssvep_prob_thresh = settings.ssvep_prob_thresh,
+        ssvep_margin_thresh = settings.ssvep_margin_thresh,
+        ssvep_refractory = settings.ssvep_refractory,
+        dtype = args.precision,
+    )
+    wall = time.perf_counter() - tick
+    hours = sum(r.duration for r in results) / 3600.0
+    print(f'{len(results)} recordings, {hours:.2f} h in {wall:.1f} s: {throughput(results, wall):.1f} recording-hours per minute')
+
 def museosc():
 
-    from neurotheatre.osc import MuseOSCSystem, MuseOSCSystemSettings
+    from neurotheatre.museosc import MuseOSCSystem, MuseOSCSystemSettings
     from neurotheatre.muse.musedevice import MuseUnitSettings
+    from neurotheatre.envelopeplot import EnvelopePlotSettings
 
     parser = argparse.ArgumentParser(description='Muse OSC client')
     parser.add_argument('-d', '--device', help='Muse device name (leave empty for auto-detection)', default=None)
     parser.add_argument('-a', '--address', help='Remote OSC server address', default='localhost')
     parser.add_argument('-p', '--port', help='Remote OSC server port (UDP)', default=8000, type=int)
     parser.add_argument('--blocksize', help = 'eeg sample block size @ 256 Hz', default = 10, type = int)
+    parser.add_argument('--display-rate', help = 'plot columns per second; each column is drawn as the min and max of its samples, default: 64', default = 64.0, type = float)
 
     class Args:
-        muse_name: str
+        device: typing.Optional[str]
         address: str
         port: int
+        blocksize: int
+        display_rate: float
 
     args = parser.parse_args(namespace=Args)
 
@@ -90,12 +490,11 @@ def museosc():
                 blocksize=args.blocksize,
             ),
             osc_settings=EEGOSCSettings(
-                address=args.address,
-                port=args.port,
+                td_address=f'{args.address}:{args.port}',
             ),
-            plot_settings=TimeSeriesPlotSettings(
+            plot_settings=EnvelopePlotSettings(
                 name="Muse EEG Data",
-                downsample_factor=2,
+                display_rate=args.display_rate,
             ),
         )
     )
@@ -126,6 +525,7 @@ def to_audio():
     parser = argparse.ArgumentParser(description = 'unicorn OSC client')
     parser.add_argument('-d', '--device', help = 'device address', default = 'simulator')
     parser.add_argument('--blocksize', help = 'eeg sample block size @ 200 Hz', default = 10, type = int)
+    parser.add_argument('--latency', help = 'sec of audio buffered ahead of the sound card, default: 0.15', default = 0.15, type = float)
 
 
     class Args:
@@ -133,6 +533,7 @@ def to_audio():
         address: str
         port: int
         blocksize: int
+        latency: float
 
     args = parser.parse_args(namespace = Args)
 
@@ -158,11 +559,13 @@ def to_audio():
             upsample_settings= UpsampleSettings(
                 axis = 'time',
                 factor = 3,
+                dtype = 'float32', # audio is played as float32 anyway
             ),
 
             audio_settings= AudioLoopbackSettings(
                 sample_rate= 44100,
                 channels= 1,
+                target_latency= args.latency,
             ),
         )
     )
@@ -0,0 +1,160 @@
+import asyncio
+import time
+import typing
+
+from dataclasses import dataclass
+
+from pythonosc.dispatcher import Dispatcher
+from pythonosc.osc_server import AsyncIOOSCUDPServer
+
+from neurotheatre.fanout import parse_destinations
+from neurotheatre.features import FEATURES
+
+
+CONFIG_PREFIX = '/config/'
+
+# Settings that can change while running, and the stage each one touches:
+#   'none'      read directly from SETTINGS on every block
+#   'ssvep'     parameter update sent to the running decoder (windows are kept)
+#   'templates' SSVEP calibrations reloaded and sent to the running decoder
+#   'zscore'    z-score restarted from its current statistics
+#   'bandpower' band power and z-score rebuilt (the number of features changes)
+#   'clients'   the setting's destinations reopened
+#   'features'  stages of disabled features dropped, newly enabled ones built and warmed up
+RUNTIME_SETTINGS: typing.Dict[str, str] = {
+    'jaw_thresh': 'none',
+    'quality_interval': 'none',
+    'ssvep_freqs': 'ssvep',
+    'ssvep_dur': 'ssvep',
+    'ssvep_min_dur': 'ssvep',
+    'ssvep_step': 'ssvep',
+    'ssvep_prob_thresh': 'ssvep',
+    'ssvep_margin_thresh': 'ssvep',
+    'ssvep_refractory': 'ssvep',
+    'ssvep_harmonics': 'ssvep',
+    'ssvep_stim_t0': 'templates',
+    'bands_tau': 'zscore',
+    'bands': 'bandpower',
+    'bandpower_order': 'bandpower',
+    'bandpower_tau': 'bandpower',
+    'td_address': 'clients',
+    'imu_address': 'clients',
+    'hand_address': 'clients',
+    'features': 'features',
+}
+
+# EEGOSC setting -> dynamic_stopping_decode parameter
+SSVEP_PARAMS: typing.Dict[str, str] = {
+    'ssvep_freqs': 'freqs',
+    'ssvep_dur': 'max_dur',
+    'ssvep_min_dur': 'min_dur',
+    'ssvep_step': 'step',
+    'ssvep_prob_thresh': 'prob_thresh',
+    'ssvep_margin_thresh': 'margin_thresh',
+    'ssvep_refractory': 'refractory',
+    'ssvep_harmonics': 'harmonics',
+}
+
+# Runtime settings that must be above zero, and those that can't be below it
+POSITIVE_SETTINGS = {'ssvep_dur', 'ssvep_min_dur', 'ssvep_step', 'bands_tau', 'bandpower_order', 'bandpower_tau', 'quality_interval'}
+NON_NEGATIVE_SETTINGS = {'ssvep_prob_thresh', 'ssvep_margin_thresh', 'ssvep_refractory', 'ssvep_harmonics'}
+
+
+@dataclass
+class ConfigUpdate:
+    setting: str
+    value: typing.Any
+    received: float # time.perf_counter() when the request arrived
+    blocks_dropped: int # input blocks dropped so far when the request arrived
+
+
+def parse_update(setting: str, args: typing.Sequence[typing.Any]) -> typing.Any:
+    """
+    Convert the arguments of an OSC `/config/<setting>` message to a settings value.
+
+    Args:
+        setting: Name of an entry of `RUNTIME_SETTINGS`.
+        args: OSC message arguments.  Lists are sent as several arguments
+            (`/config/ssvep_freqs 7.0 9.0 11.0`) and bands as name/low/high triples
+            (`/config/bands alpha 8 13 beta 13 30`).  `/config/features` lists the
+            features to keep running (`/config/features bandpower jaw`); none disables all.
+            Addresses are one or more host:port destinations (`/config/td_address
+            10.0.0.5:8000 239.1.1.1:8000`).
+
+    Returns:
+        The value to put in the settings.
+
+    Raises:
+        ValueError: If the setting can't change at runtime or the arguments don't fit it.
+            Checks that need other settings or the input (`ssvep_min_dur` <= `ssvep_dur`,
+            bands below Nyquist) are left to the owner when it applies the update.
+    """
+    if setting not in RUNTIME_SETTINGS:
+        raise ValueError(f'{setting} cannot be changed at runtime')
+    if setting == 'features':
+        unknown = [str(a) for a in args if a not in FEATURES]
+        if unknown:
+            raise ValueError(f'unknown features {unknown}; expected some of {list(FEATURES)}')
+        return [f for f in FEATURES if f in args]
+    if len(args) == 0:
+        raise ValueError(f'{setting} needs a value')
+
+    if setting == 'ssvep_freqs':
+        freqs = [float(a) for a in args]
+        if not all(f > 0 for f in freqs):
+            raise ValueError(f'ssvep_freqs must be positive, got {freqs}')
+        return freqs
+    if setting == 'bands':
+        if len(args) % 3:
+            raise ValueError('bands needs name/low/high triples')
+        bands = {str(args[i]): (float(args[i + 1]), float(args[i + 2])) for i in range(0, len(args), 3)}
+        for name, (low, high) in bands.items():
+            if not 0 < low < high:
+                raise ValueError(f'band {name} needs 0 < low < high, got {low} {high}')
+        return bands
+    if setting.endswith('_address'):
+        address = ','.join(str(a) for a in args)
+        try:
+            parse_destinations(address)
+        except ValueError as e:
+            raise ValueError(f'{setting} must be host:port destinations: {e}')
+        return address
+    value = int(args[0]) if setting in ('bandpower_order', 'ssvep_harmonics') else float(args[0])
+    if setting in POSITIVE_SETTINGS and not value > 0:
+        raise ValueError(f'{setting} must be positive, got {value}')
+    if setting in NON_NEGATIVE_SETTINGS and not value >= 0:
+        raise ValueError(f'{setting} must not be negative, got {value}')
+    return value
+
+
+async def serve_control(
+    address: str,
+    on_update: typing.Callable[[str, typing.Any, float], None],
+    on_error: typing.Callable[[str, str], None],
+) -> asyncio.DatagramTransport:
+    """
+    Listen for `/config/<setting> args...` OSC messages on `address` ('host:port').
+
+    Valid updates are passed to `on_update(setting, value, received)`, anything else to
+    `on_error(osc_address, reason)`.  Both run on the calling event loop, so the owner can
+    queue updates and apply them between blocks.  Close the returned transport to stop.
+    """
+    def handle(osc_address: str, *args: typing.Any) -> None:
+        received = time.perf_counter()
+        if not osc_address.startswith(CONFIG_PREFIX):
+            on_error(osc_address, f'expected {CONFIG_PREFIX}<setting>')
+            return
+        setting = osc_address[len(CONFIG_PREFIX):]
+        try:
+            value = parse_update(setting, args)
+        except ValueError as e:
+            on_error(osc_address, str(e))
+            return
+        on_update(setting, value, received)
+
+    dispatcher = Dispatcher()
+    dispatcher.set_default_handler(handle)
+    host, port = address.rsplit(':', 1)
+    server = AsyncIOOSCUDPServer((host, int(port)), dispatcher, asyncio.get_running_loop())
+    transport, _ = await server.create_serve_endpoint()
+    return transport
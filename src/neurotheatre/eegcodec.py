@@ -0,0 +1,155 @@
+import struct
+import time
+import typing
+import zlib
+
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from neurotheatre.imu_udp_receive import LinkStats
+
+
+# Compact packets of preprocessed EEG for the network.
+#
+# Instead of one OSC message of float32 values per sample, :obj:`EEGOSC` can send each
+# block as a single packet (the blob argument of a `<prefix>/eeg/preproc/packet` OSC
+# message) with the samples quantized to int16 against one scale and offset per block.
+# With 'delta' the samples are stored as differences from the previous sample; with
+# 'zlib' the payload is compressed (both lossless, on top of the quantization).
+#
+# Layout (little-endian, offsets in bytes):
+#
+#     0    4s   magic b'NTEQ'
+#     4    u8   version (1)
+#     5    u8   flags: 1 delta-encoded, 2 zlib-compressed
+#     6    u16  channels
+#     8    u32  seq: packets sent before this one on the stream (wraps at 2**32)
+#     12   u32  samples in the block
+#     16   f64  stream time of the first sample (sec)
+#     24   f32  sample rate (Hz)
+#     28   f32  scale
+#     32   f32  offset
+#     36   ...  payload
+#
+# The payload is int16 q[samples, channels] (row-major), and a sample's value is
+# `offset + scale * q`.  Delta-encoded, row 0 holds q[0] and row i holds q[i] - q[i - 1],
+# wrapping around at 16 bits: a running sum that wraps the same way undoes it exactly.
+# Compressed, the payload bytes are first split into all the low bytes followed by all
+# the high bytes (small deltas make the high bytes nearly constant), then deflated with
+# zlib; a block that doesn't get smaller is sent uncompressed, without the flag.
+# :obj:`decode_packet` is the reference decoder.
+
+MAGIC = b'NTEQ'
+VERSION = 1
+HEADER = struct.Struct('<4sBBHIIdfff')
+
+FLAG_DELTA = 1
+FLAG_ZLIB = 2
+
+# Codec names as used in settings and on the command line, with their flags
+CODECS = {
+    'int16': 0,
+    'int16-delta': FLAG_DELTA,
+    'int16-zlib': FLAG_ZLIB,
+    'int16-delta-zlib': FLAG_DELTA | FLAG_ZLIB,
+}
+
+
+def encode_block(data: np.ndarray, t0: float, fs: float, seq: int, codec: str = 'int16', bits: int = 16, level: int = 1) -> bytes:
+    """
+    One block of EEG as a packet.
+
+    Args:
+        data: Samples (time, ch).
+        t0: Stream time of the first sample (sec).
+        fs: Sample rate (Hz).
+        seq: Sequence number of the packet on its stream.
+        codec: One of `CODECS`.
+        bits: Resolution, 2 to 16: the block's range is spread over 2**bits - 1 levels.
+            The samples are still int16, but with fewer bits in use the '-zlib' codecs
+            have redundancy to remove; at 16 bits the low bits of EEG are noise that
+            doesn't compress.
+        level: zlib compression level for the '-zlib' codecs.
+
+    Returns:
+        The packet; the values come back from :obj:`decode_packet` within half a
+        quantization step (`scale` / 2, the block's range / (2**bits - 2)).
+    """
+    if not 2 <= bits <= 16:
+        raise ValueError(f'bits must be 2 to 16, not {bits}')
+    flags = CODECS[codec]
+    data = np.asarray(data)
+    n, n_ch = data.shape
+    lo, hi = (float(data.min()), float(data.max())) if data.size else (0.0, 0.0)
+    offset = np.float32((hi + lo) / 2)
+    q_max = 2 ** (bits - 1) - 1
+    scale = np.float32((hi - lo) / (2 * q_max)) or np.float32(1.0)
+    # Quantize against the float32 scale and offset the decoder will see
+    q = np.rint((data - offset) / scale)
+    q = np.clip(q, -q_max, q_max, out = q).astype('<i2')
+    if flags & FLAG_DELTA and n > 1:
+        q[1:] = np.diff(q, axis = 0) # int16 arithmetic wraps
+    payload = q.tobytes()
+    if flags & FLAG_ZLIB:
+        compressed = zlib.compress(q.view(np.uint8).reshape(-1, 2).T.tobytes(), level)
+        if len(compressed) < len(payload):
+            payload = compressed
+        else:
+            flags &= ~FLAG_ZLIB # short blocks of noisy samples may not compress at all
+    header = HEADER.pack(MAGIC, VERSION, flags, n_ch, seq % 2 ** 32, n, t0, fs, scale, offset)
+    return header + payload
+
+
+@dataclass
+class EEGPacket:
+    """ A decoded packet """
+    seq: int
+    t0: float # sec, stream time of the first sample
+    fs: float # Hz
+    data: np.ndarray # float32 (time, ch)
+
+    @property
+    def times(self) -> np.ndarray:
+        return self.t0 + np.arange(self.data.shape[0]) / self.fs
+
+
+def decode_packet(packet: bytes) -> EEGPacket:
+    """ The samples of a packet from :obj:`encode_block`; ValueError if it isn't one """
+    if len(packet) < HEADER.size:
+        raise ValueError(f'packet of {len(packet)} bytes is shorter than the {HEADER.size} byte header')
+    magic, version, flags, n_ch, seq, n, t0, fs, scale, offset = HEADER.unpack_from(packet)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'not an EEG packet (magic {magic!r}, version {version})')
+    payload = memoryview(packet)[HEADER.size:]
+    if flags & FLAG_ZLIB:
+        shuffled = np.frombuffer(zlib.decompress(payload), np.uint8)
+        payload = shuffled.reshape(2, -1).T.tobytes()
+    q = np.frombuffer(payload, '<i2', n * n_ch).reshape(n, n_ch)
+    if flags & FLAG_DELTA:
+        q = np.cumsum(q, axis = 0, dtype = np.int16) # wraps like the encoder's differences
+    data = q.astype(np.float32)
+    data *= np.float32(scale)
+    data += np.float32(offset)
+    return EEGPacket(seq, t0, fs, data)
+
+
+@dataclass
+class EEGStreamDecoder:
+    """
+    Decodes the packets of one stream (one performer) and tracks their :obj:`LinkStats`.
+
+    `push` returns None for duplicates; packets that arrive after a later one are still
+    returned (their `t0` places them), so a consumer that needs time to move forward
+    should compare `seq` with `stats.max_seq` before pushing.
+    """
+    stats: LinkStats = field(default_factory = LinkStats)
+    bytes_received: int = 0
+
+    def push(self, packet: bytes, arrival: typing.Optional[float] = None) -> typing.Optional[EEGPacket]:
+        decoded = decode_packet(packet)
+        self.bytes_received += len(packet)
+        arrival = time.time() if arrival is None else arrival
+        if self.stats.update(decoded.seq, decoded.t0, arrival) == 'duplicate':
+            return None
+        return decoded
@@ -0,0 +1,120 @@
+import typing
+
+import numpy as np
+
+import ezmsg.core as ez
+from ezmsg.util.generator import consumer
+from ezmsg.util.messages.axisarray import AxisArray, replace
+from ezmsg.sigproc.base import GenAxisArray
+
+from neurotheatre.workspace import Workspace
+
+
+@consumer
+def minmax_envelope(
+    axis: typing.Optional[str] = None,
+    display_rate: float = 200.0,
+) -> typing.Generator[AxisArray, AxisArray, None]:
+    """
+    Reduces a signal to the min/max envelope of each plot column, for display.
+
+    A plot `width` pixels wide showing `duration` seconds draws `width / duration` columns
+    per second (`display_rate`); any samples beyond that land on the same pixel column.
+    Each column of samples becomes two: its minimum and its maximum, in the order they
+    occurred, so a line through them covers every pixel the full-rate line would and a
+    single-sample spike (an EMG burst, a clench) still reaches its peak.  Plain decimation
+    keeps every `q`-th sample instead and misses whatever falls between them.
+
+    The output is a regular stream at twice the column rate, so plots that need a linear
+    time axis take it as they would the signal.  Samples that don't fill a column are held
+    for the next block; a change of sampling rate or of the other dimensions starts over.
+    Signals at no more than twice the column rate pass through unchanged.
+
+    Args:
+        axis: Name of the time axis, a :obj:`AxisArray.LinearAxis`. None is the first dim.
+        display_rate: Plot columns per second.
+
+    Returns:
+        A primed generator object ready to receive an :obj:`AxisArray` via `.send(axis_array)`
+        and yields an :obj:`AxisArray` of the envelope of the columns completed so far.
+    """
+    msg_out = AxisArray(np.array([]), dims=[""])
+    work = Workspace()
+
+    key = None
+    q = 1 # samples per column
+    n_held = 0
+    held_offset = 0.0 # time of the first held sample
+
+    while True:
+        msg_in: AxisArray = yield msg_out
+
+        if axis is None:
+            axis = msg_in.dims[0]
+        axis_info = msg_in.get_axis(axis)
+        axis_idx = msg_in.get_axis_idx(axis)
+        data = np.moveaxis(msg_in.data, axis_idx, 0)
+
+        new_key = (axis_info.gain, data.shape[1:], data.dtype)
+        if new_key != key:
+            key = new_key
+            q = max(1, int(round(1.0 / (axis_info.gain * display_rate))))
+            n_held = 0
+        if q <= 2:
+            msg_out = msg_in
+            continue
+
+        # Held samples, then this block
+        if n_held:
+            pending = work.get('pending', (n_held + data.shape[0],) + data.shape[1:], data.dtype)
+            pending[:n_held] = work.get('held', (q,) + data.shape[1:], data.dtype)[:n_held]
+            pending[n_held:] = data
+        else:
+            pending = data
+            held_offset = axis_info.offset
+        n_cols = pending.shape[0] // q
+
+        columns = pending[:n_cols * q].reshape((n_cols, q) + data.shape[1:])
+        first = np.argmin(columns, axis=1)
+        last = np.argmax(columns, axis=1)
+        lo = np.take_along_axis(columns, first[:, None], axis=1)[:, 0]
+        hi = np.take_along_axis(columns, last[:, None], axis=1)[:, 0]
+        # The output is the one fresh array per block: it is published and held downstream
+        envelope = np.empty((2 * n_cols,) + data.shape[1:], data.dtype)
+        min_first = first <= last
+        np.copyto(envelope[0::2], np.where(min_first, lo, hi))
+        np.copyto(envelope[1::2], np.where(min_first, hi, lo))
+
+        out_offset = held_offset
+        n_held = pending.shape[0] - n_cols * q
+        held_offset += n_cols * q * axis_info.gain
+        if n_held:
+            work.get('held', (q,) + data.shape[1:], data.dtype)[:n_held] = pending[n_cols * q:]
+
+        msg_out = replace(
+            msg_in,
+            data=np.moveaxis(envelope, 0, axis_idx),
+            axes={
+                **msg_in.axes,
+                axis: replace(axis_info, gain=axis_info.gain * q / 2, offset=out_offset),
+            },
+        )
+
+
+class MinMaxEnvelopeSettings(ez.Settings):
+    """
+    Settings for :obj:`MinMaxEnvelope` node.
+    """
+    axis: typing.Optional[str] = None
+    display_rate: float = 200.0 # plot columns per second: width in pixels / seconds shown
+
+class MinMaxEnvelope(GenAxisArray):
+    """:obj:`Unit` for :obj:`minmax_envelope`."""
+
+    SETTINGS = MinMaxEnvelopeSettings
+
+    def construct_generator(self):
+        self.STATE.gen = minmax_envelope(
+            axis=self.SETTINGS.axis,
+            display_rate=self.SETTINGS.display_rate,
+        )
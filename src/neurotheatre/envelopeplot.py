@@ -0,0 +1,79 @@
+import typing
+
+import ezmsg.core as ez
+import panel
+
+from ezmsg.util.messagequeue import MessageQueue, MessageQueueSettings
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.butterworthfilter import ButterworthFilter, ButterworthFilterSettings
+from ezmsg.panel.scrollinglineplot import ScrollingLinePlot, ScrollingLinePlotSettings
+from ezmsg.panel.tabbedapp import Tab
+from ezmsg.panel.timeseriesplot import ButterworthFilterControl
+
+from neurotheatre.envelope import MinMaxEnvelope, MinMaxEnvelopeSettings
+
+
+class EnvelopePlotSettings(ez.Settings):
+    name: str = "Envelope Plot"
+    time_axis: typing.Optional[str] = None # If not specified, dim 0 is used.
+    initial_gain: float = 1.0
+    display_rate: float = 200.0 # plot columns per second: width in pixels / seconds shown
+
+
+class EnvelopePlot(ez.Collection, Tab):
+    """
+    A :obj:`TimeSeriesPlot` that streams the min/max envelope of each plot column to the
+    browser instead of every (or every `downsample_factor`-th) sample.  The interactive
+    filter runs on the full-rate signal, before the envelope.
+    """
+
+    SETTINGS = EnvelopePlotSettings
+
+    INPUT_SIGNAL = ez.InputStream(AxisArray)
+
+    BPFILT = ButterworthFilter()
+    BPFILT_CONTROL = ButterworthFilterControl()
+    ENVELOPE = MinMaxEnvelope()
+    QUEUE = MessageQueue(MessageQueueSettings(maxsize = 10, leaky = True))
+    SCROLLING_PLOT = ScrollingLinePlot()
+
+    @property
+    def title(self) -> str:
+        return self.SETTINGS.name
+
+    def content(self) -> panel.viewable.Viewable:
+        return self.SCROLLING_PLOT.content()
+
+    def sidebar(self) -> panel.viewable.Viewable:
+        return panel.Column(self.SCROLLING_PLOT.sidebar(), self.BPFILT_CONTROL.controls())
+
+    def configure(self) -> None:
+        filter_settings = ButterworthFilterSettings(axis = self.SETTINGS.time_axis)
+        self.BPFILT_CONTROL.apply_settings(filter_settings)
+        self.BPFILT.apply_settings(filter_settings)
+        self.ENVELOPE.apply_settings(
+            MinMaxEnvelopeSettings(
+                axis = self.SETTINGS.time_axis,
+                display_rate = self.SETTINGS.display_rate,
+            )
+        )
+        self.SCROLLING_PLOT.apply_settings(
+            ScrollingLinePlotSettings(
+                name = self.SETTINGS.name,
+                time_axis = self.SETTINGS.time_axis,
+                initial_gain = self.SETTINGS.initial_gain,
+                downsample_factor = 1, # the envelope is already at the display rate
+            )
+        )
+
+    def network(self) -> ez.NetworkDefinition:
+        return (
+            (self.BPFILT_CONTROL.OUTPUT_SETTINGS, self.BPFILT.INPUT_FILTER),
+            (self.INPUT_SIGNAL, self.BPFILT.INPUT_SIGNAL),
+            (self.BPFILT.OUTPUT_SIGNAL, self.ENVELOPE.INPUT_SIGNAL),
+            (self.ENVELOPE.OUTPUT_SIGNAL, self.QUEUE.INPUT),
+            (self.QUEUE.OUTPUT, self.SCROLLING_PLOT.INPUT_SIGNAL),
+        )
+
+    def panel(self) -> panel.viewable.Viewable:
+        return panel.Row(self.content(), self.sidebar())
@@ -0,0 +1,112 @@
+import ipaddress
+import socket
+import typing
+
+from dataclasses import dataclass
+
+import ezmsg.core as ez
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+
+@dataclass
+class DestinationStats:
+    """ What was sent to one destination of a :obj:`FanOut` """
+    address: str # host:port as given
+    multicast: bool = False
+    datagrams: int = 0
+    bytes: int = 0
+    errors: int = 0 # datagrams the socket refused (unreachable host, full send buffer, ...)
+    last_error: typing.Optional[str] = None
+
+
+def parse_destinations(spec: str) -> typing.List[typing.Tuple[str, int]]:
+    """
+    Destinations of a comma-separated list of 'host:port' (e.g. '10.0.0.5:8000,239.1.1.1:8000').
+
+    Raises:
+        ValueError: If an entry isn't host:port.
+    """
+    destinations = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError(f'{entry!r} must be host:port')
+        destinations.append((host, int(port)))
+    return destinations
+
+
+def is_multicast(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_multicast
+    except ValueError:
+        return False # a host name
+
+
+class FanOut:
+    """
+    Sends each datagram to every destination of `spec` (see :obj:`parse_destinations`) from one UDP socket.
+
+    An OSC message is encoded once, however many destinations it goes to, and host names
+    are resolved once here rather than on every send.  A multicast group (224.0.0.0/4) is
+    one destination however many machines join it: packets are sent with time-to-live
+    `multicast_ttl` (1 stays on the local network) from the interface with address
+    `multicast_interface` (None: the system's choice).  The socket never blocks; a
+    destination that refuses a datagram counts an error in its `stats` and the others
+    still get it.  An empty `spec` sends nowhere.
+    """
+
+    def __init__(self, spec: str, multicast_ttl: int = 1, multicast_interface: typing.Optional[str] = None):
+        self.spec = spec
+        self.destinations: typing.List[typing.Tuple[str, int]] = []
+        self.stats: typing.List[DestinationStats] = []
+        for host, port in parse_destinations(spec):
+            # Resolved once; SimpleUDPClient looks a host name up again on every send
+            sockaddr = socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+            self.destinations.append(sockaddr)
+            self.stats.append(DestinationStats(f'{host}:{port}', multicast = is_multicast(sockaddr[0])))
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        if any(stats.multicast for stats in self.stats):
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, multicast_ttl)
+            if multicast_interface is not None:
+                self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(multicast_interface))
+
+    def __len__(self) -> int:
+        return len(self.destinations)
+
+    def send(self, dgram: bytes) -> None:
+        """ Sends `dgram` to every destination """
+        sendto = self.sock.sendto
+        for destination, stats in zip(self.destinations, self.stats):
+            try:
+                sendto(dgram, destination)
+            except OSError as e:
+                if not stats.errors:
+                    ez.logger.warning(f'cannot send to {stats.address}: {e}')
+                stats.errors += 1
+                stats.last_error = str(e)
+                continue
+            stats.datagrams += 1
+            stats.bytes += len(dgram)
+
+    def send_message(self, address: str, value: typing.Any) -> None:
+        """ Encodes an OSC message once and sends it to every destination, like `SimpleUDPClient.send_message` """
+        if not self.destinations:
+            return
+        builder = OscMessageBuilder(address = address)
+        if value is None:
+            pass
+        elif isinstance(value, (list, tuple)):
+            for arg in value:
+                builder.add_arg(arg)
+        else:
+            builder.add_arg(value)
+        self.send(builder.build().dgram)
+
+    def close(self) -> None:
+        self.sock.close()
@@ -0,0 +1,622 @@
+import typing
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+import numpy.typing as npt
+
+from vqf import VQF
+
+from ezmsg.util.messages.axisarray import AxisArray, replace
+
+from ezmsg.util.generator import compose
+from ezmsg.sigproc.window import windowing
+from ezmsg.sigproc.butterworthfilter import butter
+from ezmsg.sigproc.downsample import downsample
+from ezmsg.sigproc.aggregate import ranged_aggregate
+from ezmsg.sigproc.spectrum import spectrum, SpectralTransform
+from ezmsg.sigproc.filter import filtergen
+from ezmsg.sigproc.math.abs import abs
+from ezmsg.sigproc.math.log import log
+from ezmsg.sigproc.math.scale import scale
+
+from neurotheatre.frequencydecoder import dynamic_stopping_decode
+from neurotheatre.bandpower import iir_bandpower
+from neurotheatre.normalize import ewm_zscore
+from neurotheatre.preproc import decimating_preproc
+from neurotheatre.quality import signal_quality
+from neurotheatre.trca import SSVEPTemplates, fit_templates
+from neurotheatre.workspace import Workspace
+
+
+PERFORMER_AXIS = 'performer'
+
+# Features the OSC units can compute; 'preproc' is the preprocessed EEG itself
+FEATURES = ('preproc', 'bandpower', 'ssvep', 'jaw')
+# Features computed from the preprocessed EEG (the jaw envelope works on the raw signal)
+PREPROC_FEATURES = ('preproc', 'bandpower', 'ssvep')
+
+
+@dataclass
+class EEGFeatures:
+    """ The per-block EEG feature stages shared by the OSC units; None where a feature is disabled """
+    preproc: typing.Optional[typing.Callable[[AxisArray], AxisArray]]
+    bandpower: typing.Optional[typing.Callable[[AxisArray], AxisArray]]
+    bandpower_axis: str # axis along which bandpower/zscore produce updates
+    zscore: typing.Optional[typing.Generator[AxisArray, AxisArray, None]]
+    ssvep: typing.Optional[typing.Generator[AxisArray, AxisArray, None]]
+    enveloper: typing.Optional[typing.Callable[[AxisArray], AxisArray]]
+    quality: typing.Optional[typing.Generator[AxisArray, AxisArray, None]] = None # gates the stages above; see compute_features
+    ch_axis: str = 'ch'
+    channels: typing.Optional[bytes] = None # good-channel mask the SSVEP decoder was last sent, as bytes
+    work: Workspace = field(default_factory = Workspace) # channel subset matrices
+
+
+def eeg_features(
+    time_axis: str = 'time',
+    ch_axis: str = 'ch',
+    bands: typing.Sequence[typing.Tuple[float, float]] = (),
+    bandpower_engine: str = 'window',
+    bandpower_order: int = 1,
+    bandpower_tau: float = 0.02,
+    bands_tau: float = 5.0,
+    bands_zscore_per_channel: bool = False,
+    zscore_init: typing.Optional[typing.Dict[str, np.ndarray]] = None,
+    ssvep_freqs: typing.Sequence[float] = (),
+    ssvep_min_dur: float = 1.0,
+    ssvep_max_dur: float = 8.0,
+    ssvep_step: float = 0.25,
+    ssvep_prob_thresh: float = 0.6,
+    ssvep_margin_thresh: float = 0.2,
+    ssvep_refractory: float = 1.0,
+    ssvep_harmonics: int = 2,
+    ssvep_method: str = 'cca',
+    ssvep_templates: typing.Optional[typing.Sequence[typing.Optional[SSVEPTemplates]]] = None,
+    dtype: npt.DTypeLike = np.float64,
+    enabled: typing.Collection[str] = FEATURES,
+    quality: bool = False,
+    quality_line_freq: float = 60.0,
+    quality_min_channels: int = 4,
+) -> EEGFeatures:
+    """
+    Build the EEG feature stages for input with dims `[PERFORMER_AXIS, time_axis, ch_axis]`.
+
+    Every stage is vectorized over the performer axis, so N headsets stacked into one
+    array are processed with one pass per stage instead of N.  A single headset is a
+    performer axis of length 1.  Only the stages of the `enabled` features are built.
+
+    Args:
+        time_axis: Name of the time axis.
+        ch_axis: Name of the channel axis.
+        bands: (low, high) Hz of each band power feature.
+        bandpower_engine: 'window' (2 s FFT windows every 0.5 s) or 'iir' (streaming filter bank).
+        bandpower_order: 'iir' engine Butterworth order.
+        bandpower_tau: 'iir' engine smoothing time constant (sec).
+        bands_tau: Time constant (sec) of the band power z-score statistics.
+        bands_zscore_per_channel: z-score each channel's band power instead of the channel mean.
+        zscore_init: `init_mean` / `init_var` to warm-start the z-score with.
+        ssvep_*: See :obj:`dynamic_stopping_decode`.
+        dtype: Working precision of neurotheatre's own stages.
+        enabled: Names from `FEATURES` to build stages for.
+        quality: Also build a :obj:`signal_quality` stage on the raw input, which gates the
+            band power and SSVEP stages (see :obj:`compute_features`).
+        quality_line_freq: Mains frequency (Hz) the quality stage checks for.
+        quality_min_channels: Good channels a performer needs for its features to be computed.
+
+    Returns:
+        The stages as an :obj:`EEGFeatures`.
+    """
+    unknown = set(enabled) - set(FEATURES)
+    if unknown:
+        raise ValueError(f'unknown features {sorted(unknown)}; expected some of {FEATURES}')
+    features = EEGFeatures(None, None, time_axis if bandpower_engine == 'iir' else 'window', None, None, None, ch_axis = ch_axis)
+
+    if quality:
+        features.quality = quality_stage(time_axis, ch_axis, quality_line_freq, quality_min_channels)
+
+    if any(f in enabled for f in PREPROC_FEATURES):
+        features.preproc = preproc_stage(time_axis, ch_axis)
+
+    if 'bandpower' in enabled:
+        features.bandpower, features.bandpower_axis = bandpower_stage(time_axis, bands, bandpower_engine, bandpower_order, bandpower_tau, dtype)
+        features.zscore = zscore_stage(features.bandpower_axis, ch_axis, bands_tau, bands_zscore_per_channel, zscore_init)
+
+    if 'ssvep' in enabled:
+        features.ssvep = ssvep_stage(
+            time_axis, ssvep_freqs, ssvep_min_dur, ssvep_max_dur, ssvep_step, ssvep_prob_thresh,
+            ssvep_margin_thresh, ssvep_refractory, ssvep_method, ssvep_templates, dtype, ssvep_harmonics,
+        )
+
+    if 'jaw' in enabled:
+        features.enveloper = envelope_stage(time_axis, ch_axis)
+
+    return features
+
+
+def ssvep_stage(
+    time_axis: str = 'time',
+    freqs: typing.Sequence[float] = (),
+    min_dur: float = 1.0,
+    max_dur: float = 8.0,
+    step: float = 0.25,
+    prob_thresh: float = 0.6,
+    margin_thresh: float = 0.2,
+    refractory: float = 1.0,
+    method: str = 'cca',
+    templates: typing.Optional[typing.Sequence[typing.Optional[SSVEPTemplates]]] = None,
+    dtype: npt.DTypeLike = np.float64,
+    harmonics: int = 2,
+) -> typing.Generator[AxisArray, AxisArray, None]:
+    """ SSVEP stage of :obj:`eeg_features`: performer-batched :obj:`dynamic_stopping_decode` """
+    return dynamic_stopping_decode(
+        time_axis = time_axis,
+        freqs = list(freqs),
+        harmonics = harmonics,
+        min_dur = min_dur,
+        max_dur = max_dur,
+        step = step,
+        prob_thresh = prob_thresh,
+        margin_thresh = margin_thresh,
+        softmax_beta = 5.0,
+        refractory = refractory,
+        batch_axis = PERFORMER_AXIS,
+        method = method,
+        templates = templates,
+        dtype = dtype,
+    )
+
+
+def envelope_stage(time_axis: str = 'time', ch_axis: str = 'ch') -> typing.Callable[[AxisArray], AxisArray]:
+    """ Jaw clench stage of :obj:`eeg_features`: channel-averaged EMG envelope of the raw signal at 1/10 the rate """
+    return compose(
+        # 1. Remove Powerline Noise
+        butter(axis = time_axis, order = 3, cutoff = 58.0, cuton = 62.0),
+        # 2. Temporal Differential
+        filtergen(
+            axis = time_axis,
+            coefs = (
+                np.array([1.0, -1.0]),
+                np.array([1.0, 0.0])),
+            coef_type = 'ba'
+        ),
+        # 3. Rectify
+        abs(),
+        # 4. Smooth
+        butter(axis = time_axis, order = 3, cutoff = 10.0),
+        # 5. Downsample
+        downsample(axis = time_axis, factor = 10),
+        # 6. Average channels
+        ranged_aggregate(axis = ch_axis, bands = [(0, 7)]),
+    )
+
+
+def quality_stage(time_axis: str = 'time', ch_axis: str = 'ch', line_freq: float = 60.0, min_channels: int = 4) -> typing.Generator[AxisArray, AxisArray, None]:
+    """ Signal quality stage of :obj:`eeg_features`: per-channel metrics of the raw signal and the good-channel mask """
+    return signal_quality(time_axis, ch_axis, line_freq = line_freq, min_channels = min_channels)
+
+
+def channel_subsets(good: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Matrices that confine the feature stages to each performer's good channels.
+
+    Args:
+        good: (performer, ch) mask of usable channels.
+
+    Returns:
+        `(reference, fill)`, each (performer, ch, ch) to right-multiply (time, ch) data with.
+        `reference` moves common-average-referenced data to the average of the good channels
+        only.  `fill` replaces each bad channel with the mean of the good ones, so that
+        averages over channels are averages over the good channels.  Performers without
+        good channels get identities.
+    """
+    g = good.astype(np.float64)
+    n_good = g.sum(axis = 1)
+    weights = np.divide(g, n_good[:, None], out = np.zeros_like(g), where = n_good[:, None] > 0)
+    eye = np.eye(good.shape[1])
+    reference = eye - weights[:, :, None]
+    fill = eye * g[:, None, :] + weights[:, :, None] * (1.0 - g[:, None, :])
+    fill[n_good == 0] = eye
+    return reference, fill
+
+
+def preproc_stage(time_axis: str = 'time', ch_axis: str = 'ch') -> typing.Callable[[AxisArray], AxisArray]:
+    """ Preprocessing stage of :obj:`eeg_features`: 1-50 Hz band-pass, decimate by 2, common average reference """
+    return decimating_preproc(time_axis, ch_axis, order = 3, cuton = 1.0, cutoff = 50.0, factor = 2).send
+
+
+def compute_features(features: EEGFeatures, msg: AxisArray) -> typing.Dict[str, AxisArray]:
+    """
+    Run one block through the built stages of `features`.
+
+    With a quality stage, its good-channel mask gates the expensive stages: while no
+    performer has usable channels, band power, z-score and SSVEP don't run at all (their
+    windows and filters simply see a gap).  Otherwise the band power and SSVEP stages get
+    the preprocessed EEG referenced to the good channels only; the band power of bad
+    channels is replaced by the mean of the good ones, and the SSVEP decoder ignores them
+    and pauses performers without any (see :obj:`channel_subsets`).  Performers that
+    aren't `attrs['live']` in `msg` count as having no good channels.  The preprocessed EEG
+    itself is passed on as is.
+
+    Returns:
+        Each stage's output by name ('quality', 'preproc', 'bandpower', 'zscore', 'ssvep',
+        'envelope'); stages that aren't built or are gated are skipped and absent.  'zscore'
+        is only present when band power produced an update.
+    """
+    out = {}
+    good: typing.Optional[np.ndarray] = None
+    if features.quality is not None:
+        quality = out['quality'] = features.quality.send(msg)
+        good = quality.attrs.get('good')
+    live = msg.attrs.get('live')
+    if live is not None and not live.all():
+        # Headsets that haven't sent data yet (see PerformerStack) have no usable channels
+        n_ch = msg.data.shape[msg.get_axis_idx(features.ch_axis)]
+        good = (np.ones((len(live), n_ch), dtype = bool) if good is None else good) & live[:, None]
+    if features.preproc is not None:
+        preproc = out['preproc'] = features.preproc(msg)
+        fill: typing.Optional[np.ndarray] = None
+        if good is not None:
+            key = good.tobytes() # cheaper to compare and search than the mask
+            if features.ssvep is not None and key != features.channels:
+                features.ssvep.send({'channels': good})
+                features.channels = key
+            if b'\x01' not in key:
+                # Nothing worth computing: skip the expensive stages altogether
+                if features.enveloper is not None:
+                    out['envelope'] = features.enveloper(msg)
+                return out
+            if b'\x00' in key:
+                reference, fill = features.work.cached('subsets', (good.shape, key), lambda: channel_subsets(good))
+                preproc = replace(preproc, data = preproc.data @ reference)
+        if features.bandpower is not None:
+            bandpower = out['bandpower'] = features.bandpower(preproc)
+            if bandpower.data.size != 0:
+                if live is not None and not live.all():
+                    # Their power falls to the dB floor once the filters settle on zeros; keep it out of the z-score statistics
+                    axis = bandpower.get_axis_idx(PERFORMER_AXIS)
+                    data = np.moveaxis(bandpower.data, axis, 0).copy()
+                    data[~live] = 0.0
+                    bandpower = out['bandpower'] = replace(bandpower, data = np.moveaxis(data, 0, axis))
+                if fill is not None:
+                    bandpower = out['bandpower'] = _apply_per_performer(bandpower, features.ch_axis, fill)
+                out['zscore'] = features.zscore.send(bandpower)
+        if features.ssvep is not None:
+            out['ssvep'] = features.ssvep.send(preproc)
+    if features.enveloper is not None:
+        out['envelope'] = features.enveloper(msg)
+    return out
+
+
+def _apply_per_performer(msg: AxisArray, ch_axis: str, matrices: np.ndarray) -> AxisArray:
+    """
+    `msg` with each performer's channels right-multiplied by its (ch, ch) matrix.
+
+    Only performers whose matrix isn't the identity are mixed, and the channels their matrix
+    drops are zeroed first: a dropped channel's value may not be finite, and it would turn
+    every output channel into NaN through the zeros it is multiplied by.
+    """
+    axes = [msg.get_axis_idx(PERFORMER_AXIS), msg.get_axis_idx(ch_axis)]
+    data = np.moveaxis(msg.data, axes, [0, -1])
+    mix = np.flatnonzero((matrices != np.eye(matrices.shape[-1])).any(axis = (1, 2)))
+    if len(mix) == 0:
+        return msg
+    mixed = data.copy()
+    rows = data[mix].reshape(len(mix), -1, data.shape[-1])
+    rows = np.where(matrices[mix].any(axis = -1)[:, None, :], rows, 0.0)
+    mixed[mix] = (rows @ matrices[mix]).reshape(mixed[mix].shape)
+    return replace(msg, data = np.moveaxis(mixed, [0, -1], axes))
+
+
+def enable_features(features: EEGFeatures, fresh: EEGFeatures, history: typing.Iterable[AxisArray]) -> None:
+    """
+    Move the newly built stages of `fresh` into `features`, warming them up first.
+
+    `fresh` comes from :obj:`eeg_features` with only the features being enabled.  It is
+    run over the `history` blocks (see :obj:`BlockHistory`) with outputs discarded, so
+    windowed stages are full and filters have settled by the next live block; the SSVEP
+    decoder only accumulates and evaluates its full window on that block.  Stages
+    already running in `features` are kept, including the shared preprocessing.
+    """
+    if fresh.ssvep is not None:
+        # Fill the window without deciding: a decision now would start a refractory period
+        fresh.ssvep.send({'hold': True})
+    for msg in history:
+        compute_features(fresh, msg)
+    if fresh.ssvep is not None:
+        fresh.ssvep.send({'hold': False})
+    if features.preproc is None:
+        features.preproc = fresh.preproc
+    if fresh.bandpower is not None:
+        features.bandpower, features.bandpower_axis, features.zscore = fresh.bandpower, fresh.bandpower_axis, fresh.zscore
+    if fresh.ssvep is not None:
+        features.ssvep = fresh.ssvep
+        features.channels = fresh.channels
+    if fresh.enveloper is not None:
+        features.enveloper = fresh.enveloper
+
+
+def disable_features(features: EEGFeatures, enabled: typing.Collection[str]) -> None:
+    """ Drop the stages (and the state they buffer) that none of the `enabled` features need """
+    if 'bandpower' not in enabled:
+        features.bandpower = features.zscore = None
+    if 'ssvep' not in enabled:
+        features.ssvep = None
+    if 'jaw' not in enabled:
+        features.enveloper = None
+    if not any(f in enabled for f in PREPROC_FEATURES):
+        features.preproc = None
+
+
+class BlockHistory:
+    """
+    The most recent `dur` seconds of input blocks, for warming up features as they are enabled.
+
+    Blocks are kept by reference, not copied: published messages are never modified, so
+    holding on to them costs nothing per block beyond the references.
+    """
+
+    def __init__(self, dur: float, time_axis: str = 'time'):
+        self.dur = dur
+        self.time_axis = time_axis
+        self.blocks: typing.Deque[typing.Tuple[AxisArray, float]] = deque() # (block, its duration)
+        self.total = 0.0 # sec held
+
+    def push(self, msg: AxisArray) -> None:
+        axis = msg.get_axis(self.time_axis)
+        block_dur = msg.data.shape[msg.get_axis_idx(self.time_axis)] * axis.gain
+        self.blocks.append((msg, block_dur))
+        self.total += block_dur
+        # Drop the oldest blocks as long as the rest still cover `dur`
+        while self.blocks and self.total - self.blocks[0][1] >= self.dur:
+            self.total -= self.blocks.popleft()[1]
+
+    def clear(self) -> None:
+        self.blocks.clear()
+        self.total = 0.0
+
+    def __iter__(self) -> typing.Iterator[AxisArray]:
+        return (msg for msg, _ in self.blocks)
+
+
+class BlockQueue:
+    """
+    Input blocks that arrived while an earlier one was being processed, for shedding load.
+
+    `take` hands back everything queued with runs of contiguous blocks concatenated along
+    time: every stage still sees every sample, so filter state stays continuous, but the
+    stages run once per run instead of once per block, and windowed band power and the
+    SSVEP decoder evaluate at most once for it.  Blocks are kept by reference, as in
+    :obj:`BlockHistory`.
+    """
+
+    def __init__(self, time_axis: str = 'time'):
+        self.time_axis = time_axis
+        self.blocks: typing.Deque[AxisArray] = deque()
+
+    def push(self, msg: AxisArray) -> None:
+        self.blocks.append(msg)
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def take(self) -> typing.List[AxisArray]:
+        """ Empties the queue; returns one block per run of contiguous, equally shaped blocks """
+        runs: typing.List[typing.List[AxisArray]] = []
+        end = None # time just past the previous block
+        while self.blocks:
+            msg = self.blocks.popleft()
+            idx = msg.get_axis_idx(self.time_axis)
+            axis = msg.get_axis(self.time_axis)
+            if runs:
+                last = runs[-1][-1]
+                contiguous = np.abs(axis.offset - end) < 0.5 * axis.gain and axis.gain == last.get_axis(self.time_axis).gain
+                same_shape = msg.dims == last.dims and np.delete(msg.data.shape, idx).tolist() == np.delete(last.data.shape, idx).tolist()
+            if runs and contiguous and same_shape:
+                runs[-1].append(msg)
+            else:
+                runs.append([msg])
+            end = axis.offset + msg.data.shape[idx] * axis.gain
+        return [
+            run[0] if len(run) == 1 else replace(run[0], data = np.concatenate([m.data for m in run], axis = run[0].get_axis_idx(self.time_axis)))
+            for run in runs
+        ]
+
+
+def calibrate_ssvep(
+    data: np.ndarray,
+    labels: np.ndarray,
+    fs: float,
+    freqs: typing.Sequence[float],
+    t0: float = 0.0,
+    stim_t0: float = 0.0,
+    settle: float = 1.0,
+    **kwargs,
+) -> SSVEPTemplates:
+    """
+    Fit SSVEP templates from a raw calibration recording.
+
+    The recording is passed through the same preprocessing as the live pipeline, so the
+    templates match what the decoder sees.
+
+    Args:
+        data: Raw EEG (time, ch).
+        labels: Index into `freqs` of the attended target for each sample; -1 for none.
+        fs: Sample rate of `data`.
+        freqs: Stimulus frequencies (Hz).
+        t0: Time of the first sample, in the time base of the live stream.
+        stim_t0: Time at which all stimuli were at phase 0, in the same time base.
+        settle: Seconds at the start to ignore while the filters settle.
+        **kwargs: Passed on to :obj:`fit_templates`.
+
+    Returns:
+        The fitted :obj:`SSVEPTemplates`.
+    """
+    preproc = preproc_stage()
+    msg = AxisArray(
+        np.asarray(data, dtype = float)[None],
+        dims = [PERFORMER_AXIS, 'time', 'ch'],
+        axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = t0)},
+    )
+    out = preproc(msg)
+    out_axis = out.get_axis('time')
+    n_out = out.data.shape[out.get_axis_idx('time')]
+    times = out_axis.offset + np.arange(n_out) * out_axis.gain
+    out_labels = np.asarray(labels)[np.clip(np.round((times - t0) * fs).astype(int), 0, len(labels) - 1)]
+    out_labels = np.where(times - t0 < settle, -1, out_labels)
+    return fit_templates(out.data[0], out_labels, times, 1.0 / out_axis.gain, freqs, stim_t0 = stim_t0, **kwargs)
+
+
+def bandpower_stage(
+    time_axis: str,
+    bands: typing.Sequence[typing.Tuple[float, float]],
+    engine: str = 'window',
+    order: int = 1,
+    tau: float = 0.02,
+    dtype: npt.DTypeLike = np.float64,
+) -> typing.Tuple[typing.Callable[[AxisArray], AxisArray], str]:
+    """ Band power stage of :obj:`eeg_features` and the axis its updates arrive along """
+    if engine == 'iir':
+        bandpower = iir_bandpower(
+            time_axis = time_axis,
+            bands = list(bands),
+            order = order,
+            tau = tau,
+            band_axis = 'freq',
+            dtype = dtype,
+        ).send
+        return bandpower, time_axis
+
+    bandpower = compose(
+        windowing(axis = time_axis, newaxis = 'window', window_dur = 2.0, window_shift = 0.5, zero_pad_until = 'input'),
+        spectrum(axis = time_axis, out_axis = 'freq', transform = SpectralTransform.REL_POWER),
+        # dB, with zero power (a flat or silent headset) floored at the smallest normal float
+        # instead of -inf, which would stick in the smoothing and z-score states
+        log(base = 10.0, clip_zero = True),
+        scale(10.0),
+        ranged_aggregate(axis = 'freq', bands = list(bands)),
+        butter(axis = 'window', order = 2, cutoff = 0.1)
+    )
+    return bandpower, 'window'
+
+
+def zscore_stage(
+    bandpower_axis: str,
+    ch_axis: str = 'ch',
+    tau: float = 5.0,
+    per_channel: bool = False,
+    init: typing.Optional[typing.Dict[str, np.ndarray]] = None,
+) -> typing.Generator[AxisArray, AxisArray, None]:
+    """ Band power z-score stage of :obj:`eeg_features` """
+    return ewm_zscore(
+        time_axis = bandpower_axis,
+        tau = tau,
+        reduce_axis = None if per_channel else ch_axis,
+        **(init or {})
+    )
+
+
+def imu_orientation(vqf: VQF, data: np.ndarray, work: Workspace) -> np.ndarray:
+    """
+    Feeds one IMU block to `vqf` and returns the latest orientation.
+
+    Args:
+        vqf: Orientation filter, carried across blocks.
+        data: (time, ch) Unicorn motion block: accelerometer (g) on channels 0-2 and
+            gyroscope (deg/s) on channels 3-5.
+        work: Holds the converted blocks, so steady-state calls allocate only VQF's outputs.
+
+    Returns:
+        Quaternion [w x y z] ("scalar first").
+    """
+    acc = np.multiply(data[:, :3], 9.8, out = work.get('acc', (data.shape[0], 3))) # Convert from g to m/s^2
+    gyr = np.deg2rad(data[:, 3:6], out = work.get('gyr', (data.shape[0], 3))) # Convert from deg/sec to rad/sec
+    return vqf.updateBatch(gyr, acc)['quat6D'][-1, :]
+
+
+def per_performer(msg: AxisArray, axis: str, feature_axis: str) -> np.ndarray:
+    """ Most recent entry along `axis`, averaged over everything but performers and `feature_axis`: (performer, feature) """
+    data = np.take(msg.data, -1, axis = msg.get_axis_idx(axis))
+    dims = [d for d in msg.dims if d != axis]
+    data = np.moveaxis(data, [dims.index(PERFORMER_AXIS), dims.index(feature_axis)], [0, 1])
+    return data.reshape(data.shape[:2] + (-1,)).mean(axis = 2)
+
+
+class PerformerStack:
+    """
+    Aligns blocks from several headsets into `[PERFORMER_AXIS, time, ch]` messages.
+
+    Blocks are queued per performer and released in lockstep: each `push` returns the
+    samples every performer has delivered so far.  If one headset falls more than
+    `max_skew` seconds behind (dropout, disconnect), the others are released anyway and
+    the missing samples are filled by holding that headset's last sample, so one stalled
+    device cannot freeze the whole show.  Late samples covering the filled span are dropped
+    when they arrive to keep the headsets aligned.
+
+    A headset that has never sent data has nothing to hold: its rows are zero, nothing is
+    counted as filled for it (its first block starts where the others are), it is only waited
+    for until the first release, and the output's `attrs['live']` (performer,) is False for it
+    until it sends.
+    """
+
+    def __init__(self, performers: typing.Sequence[str], time_axis: str = 'time', ch_axis: str = 'ch', max_skew: float = 0.5):
+        self.performers = list(performers)
+        self.index = {name: i for i, name in enumerate(self.performers)}
+        self.time_axis = time_axis
+        self.ch_axis = ch_axis
+        self.max_skew = max_skew
+        self.pending: typing.List[typing.Optional[np.ndarray]] = [None] * len(self.performers)
+        self.last: typing.List[typing.Optional[np.ndarray]] = [None] * len(self.performers)
+        self.filled = np.zeros(len(self.performers), dtype = int) # held samples not yet delivered
+        self.template: typing.Optional[AxisArray] = None
+        self.n_out = 0 # samples released so far
+
+    def push(self, key: str, msg: AxisArray) -> typing.Optional[AxisArray]:
+        """ Queue `msg` from performer `key`; returns newly aligned samples, if any """
+        idx = self.index[key]
+        data = msg.as2d(self.time_axis)
+        if self.template is None:
+            self.template = msg
+        if data.shape[0]:
+            self.last[idx] = data[-1]
+        late = min(self.filled[idx], data.shape[0])
+        self.filled[idx] -= late
+        data = data[late:]
+        pending = self.pending[idx]
+        self.pending[idx] = data if pending is None else np.concatenate([pending, data])
+
+        # Once released without them, headsets that never sent data aren't waited for any more
+        n_avail = [
+            0 if p is None else p.shape[0]
+            for p, last in zip(self.pending, self.last)
+            if last is not None or self.n_out == 0
+        ]
+        n = min(n_avail)
+        time_info = self.template.get_axis(self.time_axis)
+        if (max(n_avail) - n) * time_info.gain > self.max_skew:
+            n = max(n_avail)
+        if n == 0:
+            return None
+
+        stacked = np.empty((len(self.performers), n, data.shape[1]), dtype = data.dtype)
+        for i, pending in enumerate(self.pending):
+            n_have = 0 if pending is None else min(pending.shape[0], n)
+            if n_have:
+                stacked[i, :n_have] = pending[:n_have]
+                self.pending[i] = pending[n_have:]
+            if self.last[i] is None:
+                stacked[i, n_have:] = 0.0
+            else:
+                stacked[i, n_have:] = self.last[i]
+                self.filled[i] += n - n_have
+
+        out = AxisArray(
+            stacked,
+            dims = [PERFORMER_AXIS, self.time_axis, self.ch_axis],
+            axes = {
+                **{k: v for k, v in self.template.axes.items() if k != self.time_axis},
+                self.time_axis: AxisArray.LinearAxis(gain = time_info.gain, offset = time_info.offset + self.n_out * time_info.gain),
+            },
+            attrs = {'live': np.array([last is not None for last in self.last])},
+        )
+        self.n_out += n
+        return out
@@ -1,7 +1,10 @@
+import functools
 import typing
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field, replace
 
 import numpy as np
+import numpy.typing as npt
 from numpy.linalg import svd
 
 import ezmsg.core as ez
@@ -9,6 +12,12 @@ from ezmsg.util.generator import consumer
 from ezmsg.util.messages.axisarray import AxisArray
 from ezmsg.sigproc.sampler import SampleMessage, SampleTriggerMessage
 
+from neurotheatre.trca import SSVEPTemplates, template_scores
+from neurotheatre.workspace import Workspace
+
+if typing.TYPE_CHECKING:
+    from neurotheatre.offload import OrderedOffload
+
 
 @dataclass
 class FrequencyDecodeMessage(AxisArray):
@@ -26,6 +35,7 @@ def frequency_decode(
     freq_axis: str = 'freq',
     window_axis: typing.Optional[str] = None,
     calc_corrs: bool = True,
+    dtype: npt.DTypeLike = np.float64,
 ) -> typing.Generator[FrequencyDecodeMessage, typing.Union[SampleMessage, AxisArray], None]:
     """
     # `frequency_decode`
@@ -72,6 +82,10 @@ def frequency_decode(
         True (default): Calculate the correlation of the most significant canonical projection
         If False, just output singular values instead which are unbounded, but less computationally 
         expensive to calculate.  Interestingly, seems like somewhat of a worse metric?
+
+    * `dtype (DTypeLike)`: Working precision for the design matrices, data and SVDs
+        np.float64 (default).  np.float32 halves memory traffic; reference phases are still
+        computed in float64 before conversion so long windows stay accurate.
  
     ## Sends:
     * `AxisArray` or `SampleMessage` containing buffers of data to evaluate
@@ -83,6 +97,7 @@ def frequency_decode(
     harmonics = max(0, harmonics)
     max_int_time = max(0, max_int_time)
     output: FrequencyDecodeMessage = FrequencyDecodeMessage(np.array([]), dims = [""])
+    work = Workspace() # intermediates reused across blocks; only the (small) outputs are allocated
 
     while True:
         input = yield output
@@ -105,51 +120,60 @@ def frequency_decode(
         outputs = []
         for input_aa in input_aas:
 
-            t_ax = input_aa.ax(time_axis)
-            fs = 1.0 / t_ax.axis.gain
-            t = t_ax.values - t_ax.axis.offset
-            max_samp = int(max_int_time * fs) if max_int_time else len(t)
-            t = t[:max_samp]
+            gain = input_aa.ax(time_axis).axis.gain
+            fs = 1.0 / gain
+
+            # time-axis moved to dim 0, all other axes flattened to dim 1
+            X_in = input_aa.as2d(time_axis)
+            max_samp = min(int(max_int_time * fs), X_in.shape[0]) if max_int_time else X_in.shape[0]
 
             if len(test_freqs) == 0:
                 ez.logger.warning('no frequencies to test')
                 output = None
                 continue
 
-            cv = []
-            for test_freq in test_freqs:
+            # Design matrices of base frequencies and requested harmonics; only rebuilt when
+            # the frequencies, window length or sample rate change
+            designs = work.cached(
+                'designs',
+                (tuple(test_freqs), harmonics, max_samp, gain, np.dtype(dtype).str),
+                lambda: _design(test_freqs, harmonics, np.arange(max_samp) * gain, dtype),
+            )
 
-                # Create the design matrix of base frequency and requested harmonics
-                design = []
-                for harm_idx in range(harmonics + 1):
-                    f = test_freq * (harm_idx + 1)
-                    w = 2.0 * np.pi * f * t
-                    design.append(np.sin(w))
-                    design.append(np.cos(w))
-                design = np.array(design) # time is now dim 1
+            # Method works best with zero-mean, unit-variance data on the time dimension.
+            # Held channel-first and standardized one channel at a time: broadcasting ufuncs
+            # allocate an iteration buffer the size of the data even with `out=`
+            Xt = work.get('Xt', (X_in.shape[1], max_samp), dtype)
+            np.copyto(Xt, X_in[:max_samp].T, casting = 'same_kind')
+            for row in Xt:
+                row -= row.mean()
+                row /= np.sqrt(np.dot(row, row) / max_samp)
+            X = Xt.T
+
+            cv = []
+            for design in designs:
 
                 # We only care about highest canonical correlation
                 # which can be calculated using singular value decomposition
                 # https://numerical.recipes/whp/notes/CanonCorrBySVD.pdf
-                # time-axis moved to dim 0, all other axes flattened to dim 1
-                X = input_aa.as2d(time_axis)[:max_samp, ...] 
-                X = X - X.mean(0) # Method works best with zero-mean on time dimension.
-                X = X / X.std(0)
+                proj = np.matmul(design, X, out = work.get('proj', (design.shape[0], X.shape[1]), dtype))
                 
                 if calc_corrs:
                     # Calculate the canonical correlation of the first (strongest) canonical projection
-                    result = svd(design @ X, compute_uv = True, full_matrices = False)
-                    design_proj = result.U.T[:1, ...] @ design
-                    data_proj = result.Vh[:1, ...] @ X.T
-                    cv.append(np.corrcoef(design_proj, data_proj)[0,1])
+                    result = svd(proj, compute_uv = True, full_matrices = False)
+                    design_proj = np.matmul(result.U[:, 0], design, out = work.get('design_proj', (max_samp,), dtype))
+                    data_proj = np.matmul(result.Vh[0], Xt, out = work.get('data_proj', (max_samp,), dtype))
+                    design_proj -= design_proj.mean()
+                    data_proj -= data_proj.mean()
+                    cv.append(np.dot(design_proj, data_proj) / np.sqrt(np.dot(design_proj, design_proj) * np.dot(data_proj, data_proj)))
 
                 else:
                     # singular values are porportional to canonical correlations; 
                     # SVD guarantees max singular value is element 0
                     # Result isn't quite as useful as correlation, but this is much faster to calculate
-                    cv.append(svd(design @ X, compute_uv = False)[0])
+                    cv.append(svd(proj, compute_uv = False)[0])
 
-            cv = np.array(cv)
+            cv = np.array(cv, dtype = dtype)
             cv = calc_softmax(cv, axis = 0, beta = softmax_beta) if softmax_beta != 0 else cv
 
             if trigger and hasattr(trigger, 'decode'):
@@ -170,6 +194,320 @@ def frequency_decode(
             output = AxisArray.concatenate(*outputs, dim = window_axis, axis = window_axis_obj)
 
 
+def _design(freqs: typing.List[float], harmonics: int, t: np.ndarray, dtype: npt.DTypeLike) -> np.ndarray:
+    """ Reference sinusoids (n_freqs, 2 * (harmonics + 1), len(t)); phases are computed in float64 """
+    mult = np.arange(1, harmonics + 2)
+    w = 2.0 * np.pi * np.outer(freqs, mult)[..., None] * t # (freq, harm, time)
+    return np.stack([np.sin(w), np.cos(w)], axis = 2).reshape(len(freqs), -1, len(t)).astype(dtype)
+
+
+@functools.lru_cache(maxsize = 256)
+def reference_design(freqs: typing.Tuple[float, ...], harmonics: int, length: int, gain: float, dtype: str) -> np.ndarray:
+    """ `_design` of `length` samples from t = 0, shared (read-only) by every decoder in the process with the same targets """
+    design = _design(list(freqs), harmonics, np.arange(length) * gain, dtype)
+    design.flags.writeable = False
+    return design
+
+
+def cca_correlations(X: np.ndarray, designs: np.ndarray) -> np.ndarray:
+    """
+    Batched form of the correlation computed by `frequency_decode` (`calc_corrs = True`).
+
+    Every (observation, reference) pair is evaluated with a single stacked SVD rather than
+    one SVD per pair, so decoding several headsets costs little more than decoding one.
+
+    Args:
+        X: Standardized (zero-mean, unit-variance over time) data, (batch, time, ch).
+        designs: Reference signals from `_design`, (n_freqs, n_refs, time).
+
+    Returns:
+        Correlation of the strongest canonical projection, (batch, n_freqs).
+    """
+    A = designs[None] @ X[:, None] # (batch, freq, ref, ch)
+    U, _, Vh = svd(A, full_matrices = False)
+    design_proj = np.einsum('bfr,frt->bft', U[..., :, 0], designs)
+    data_proj = np.einsum('bfc,btc->bft', Vh[..., 0, :], X)
+    design_proj = design_proj - design_proj.mean(-1, keepdims = True)
+    data_proj = data_proj - data_proj.mean(-1, keepdims = True)
+    num = (design_proj * data_proj).sum(-1)
+    den = np.sqrt((design_proj ** 2).sum(-1) * (data_proj ** 2).sum(-1))
+    return num / den
+
+
+DYNAMIC_STOPPING_PARAMS = (
+    'freqs', 'harmonics', 'min_dur', 'max_dur', 'step',
+    'prob_thresh', 'margin_thresh', 'softmax_beta', 'refractory',
+    'method', 'templates', 'hold', 'channels',
+)
+
+
+@consumer
+def dynamic_stopping_decode(
+    time_axis: str = 'time',
+    freqs: typing.List[float] = [],
+    harmonics: int = 0,
+    min_dur: float = 1.0,
+    max_dur: float = 4.0,
+    step: float = 0.25,
+    prob_thresh: float = 0.8,
+    margin_thresh: float = 0.0,
+    softmax_beta: float = 1.0,
+    refractory: float = 1.0,
+    freq_axis: str = 'freq',
+    batch_axis: typing.Optional[str] = None,
+    method: str = 'cca',
+    templates: typing.Optional[typing.Sequence[typing.Optional[SSVEPTemplates]]] = None,
+    hold: bool = False,
+    channels: typing.Optional[npt.ArrayLike] = None,
+    dtype: npt.DTypeLike = np.float64,
+) -> typing.Generator[FrequencyDecodeMessage, AxisArray, None]:
+    """
+    # `dynamic_stopping_decode`
+    Decides on an SSVEP target as soon as the evidence is strong enough, rather than after a fixed window.
+
+    Incoming data accumulates into a growing window.  Once the window is `min_dur` long, it is
+    evaluated with canonical correlations (as in `frequency_decode`) every `step` seconds.  A decision is
+    emitted as soon as the softmax posterior of the best target reaches `prob_thresh` or the
+    correlation margin between the best and second best targets reaches `margin_thresh`.
+    After a decision the window is cleared and input is ignored for `refractory` seconds.
+    Windows longer than `max_dur` slide, keeping the most recent `max_dur` seconds.
+
+    ## Parameters:
+    * `time_axis (str)`: Name of the time axis in the input
+    * `freqs (List[float])`: Target frequencies (Hz)
+    * `harmonics (int)`: Harmonics beyond the fundamental in the reference signals; see `frequency_decode`
+    * `min_dur (float)`: Shortest window (sec) a decision can be made on
+    * `max_dur (float)`: Longest window (sec) evidence is accumulated over
+    * `step (float)`: Seconds of new data between evaluations
+    * `prob_thresh (float)`: Posterior needed for a decision.  Set > 1 to disable.
+    * `margin_thresh (float)`: Best minus second-best correlation needed for a decision.  0 (default) disables.
+    * `softmax_beta (float)`: Beta of the softmax over correlations that produces the posteriors
+    * `refractory (float)`: Seconds to ignore input after a decision
+    * `freq_axis (str)`: Name of the output axis
+    * `batch_axis (str | None)`: Axis holding independent observers (e.g. one entry per headset)
+        None (default): the input is a single observer.
+        If specified, each entry keeps its own window, evaluation schedule and refractory period, and
+        entries whose windows are the same length are decoded together with one stacked SVD.
+    * `method (str)`: How windows are scored against the targets
+        'cca' (default): canonical correlation with sin/cos references; needs no calibration.
+        'trca': correlation with calibrated templates through ensemble TRCA spatial filters.
+        'ecca': extended CCA; combines the TRCA, template-reference and plain CCA correlations.
+        See `neurotheatre.trca`.  Entries without usable templates fall back to 'cca'.
+    * `templates (List[SSVEPTemplates | None] | None)`: Calibration of each batch entry (one for a
+        single observer), fit at the input's sample rate for the same `freqs`.
+        The input's time axis offset must be in the time base of the templates' `stim_t0`.
+    * `hold (bool)`: Accumulate windows without evaluating them (no decisions, no SVDs).
+        Windows that are due are evaluated on the first block after the hold is released; used to warm
+        a decoder up on past data.
+    * `channels (ArrayLike | None)`: Boolean mask of the channels each entry is decoded from, (batch, ch)
+        ((ch,) for a single observer), e.g. from `neurotheatre.quality.signal_quality`.  None (default): all.
+        'cca' ignores the others, exactly as if they weren't there; calibrated templates use all channels.
+        Entries without any channel are paused: their windows are cleared, and they accumulate and
+        evaluate nothing until they have channels again.  A window that is flat on every channel it
+        uses (a headset that hasn't sent data yet) or holds non-finite samples is cleared unevaluated.
+    * `dtype (DTypeLike)`: Working precision of the window buffer and decoding
+
+    ## Sends:
+    * `AxisArray` of multichannel data with a LinearAxis time axis
+    * or a `dict` of new values for any of `DYNAMIC_STOPPING_PARAMS`, applied before the next block.
+        Accumulated windows are kept; changing `freqs` or `harmonics` only refreshes the reference signals.
+    ## Yields:
+    * `FrequencyDecodeMessage`: Posteriors when a decision is made, otherwise an empty message
+        (also in response to a parameter update).
+        `attrs` carries `decision_time` (window length in sec) and `margin`.
+        With a `batch_axis`, data is (batch, freq) and is yielded when any entry decides; rows, decision
+        times and margins of entries that did not decide are NaN.
+    """
+    empty = FrequencyDecodeMessage(np.array([]), dims = [""])
+    output: FrequencyDecodeMessage = empty
+
+    designs: typing.Dict[int, np.ndarray] = {} # window length -> references
+    buffer: typing.Optional[np.ndarray] = None # (batch, time, ch)
+    n_buf: np.ndarray = np.zeros(0, dtype = int) # valid samples in buffer
+    n_since_eval: np.ndarray = np.zeros(0, dtype = int)
+    n_refractory: np.ndarray = np.zeros(0, dtype = int) # samples left to ignore
+    # `channels` as (batch, ch) for the input shape `mask_for`; None if all are used
+    mask: typing.Optional[np.ndarray] = None
+    paused: typing.Optional[np.ndarray] = None # entries without channels
+    mask_for: typing.Optional[typing.Tuple[int, int]] = None
+    check_input = {"gain": None, "shape": None}
+
+    while True:
+        input: typing.Union[AxisArray, typing.Dict[str, typing.Any]] = yield output
+        output = empty
+
+        if isinstance(input, dict):
+            # Parameter update: keeps the accumulated windows; only the references are refreshed
+            unknown = set(input) - set(DYNAMIC_STOPPING_PARAMS)
+            if unknown:
+                raise ValueError(f'cannot update {sorted(unknown)}; tunable parameters are {DYNAMIC_STOPPING_PARAMS}')
+            if 'freqs' in input or 'harmonics' in input:
+                freqs = list(input.get('freqs', freqs))
+                harmonics = input.get('harmonics', harmonics)
+                designs = {}
+            min_dur = input.get('min_dur', min_dur)
+            step = input.get('step', step)
+            prob_thresh = input.get('prob_thresh', prob_thresh)
+            margin_thresh = input.get('margin_thresh', margin_thresh)
+            softmax_beta = input.get('softmax_beta', softmax_beta)
+            refractory = input.get('refractory', refractory)
+            method = input.get('method', method)
+            templates = input.get('templates', templates)
+            hold = input.get('hold', hold)
+            if 'channels' in input:
+                channels = input['channels']
+                mask_for = None
+            max_dur = input.get('max_dur', max_dur)
+            if buffer is not None and int(max_dur / check_input["gain"]) != buffer.shape[1]:
+                resized = np.empty((buffer.shape[0], int(max_dur / check_input["gain"]), buffer.shape[2]), dtype = dtype)
+                for b in range(buffer.shape[0]):
+                    keep = min(n_buf[b], resized.shape[1])
+                    resized[b, :keep] = buffer[b, n_buf[b] - keep:n_buf[b]]
+                    n_buf[b] = keep
+                buffer = resized
+            continue
+
+        if input.data.size == 0:
+            continue
+
+        gain = input.ax(time_axis).axis.gain
+        t_end = input.ax(time_axis).axis.offset # time of the newest sample, set below
+        if batch_axis is None:
+            data = input.as2d(time_axis)[None]
+        else:
+            data = np.moveaxis(input.data, [input.get_axis_idx(batch_axis), input.get_axis_idx(time_axis)], [0, 1])
+            data = data.reshape(data.shape[:2] + (-1,))
+
+        t_end += (data.shape[1] - 1) * gain
+
+        if gain != check_input["gain"] or (data.shape[0], data.shape[2]) != check_input["shape"]:
+            check_input["gain"] = gain
+            check_input["shape"] = (data.shape[0], data.shape[2])
+            designs = {}
+            buffer = np.empty((data.shape[0], int(max_dur / gain), data.shape[2]), dtype = dtype)
+            n_buf = np.zeros(data.shape[0], dtype = int)
+            n_since_eval = np.zeros_like(n_buf)
+            n_refractory = np.zeros_like(n_buf)
+            mask_for = None
+
+        if mask_for != check_input["shape"]:
+            mask_for = check_input["shape"]
+            mask = paused = None
+            if channels is not None and np.shape(channels)[-1] == data.shape[2]:
+                mask = np.broadcast_to(np.reshape(channels, (-1, data.shape[2])), mask_for).copy()
+                paused = ~mask.any(axis = 1)
+                n_buf[paused] = n_since_eval[paused] = 0
+                if mask.all():
+                    mask = paused = None
+
+        for b in range(data.shape[0]):
+            if paused is not None and paused[b]:
+                continue
+            skip = min(n_refractory[b], data.shape[1])
+            n_refractory[b] -= skip
+            # Append, sliding the window if it would exceed max_dur
+            n = min(data.shape[1] - skip, buffer.shape[1])
+            if n == 0:
+                continue
+            overflow = n_buf[b] + n - buffer.shape[1]
+            if overflow > 0:
+                buffer[b, :n_buf[b] - overflow] = buffer[b, overflow:n_buf[b]]
+                n_buf[b] -= overflow
+            buffer[b, n_buf[b]:n_buf[b] + n] = data[b, -n:]
+            n_buf[b] += n
+            n_since_eval[b] += n
+
+        if hold:
+            continue
+        ready = np.flatnonzero((n_buf * gain >= min_dur) & (n_since_eval * gain >= step))
+        if len(ready) == 0:
+            continue
+        n_since_eval[ready] = 0
+
+        probs = np.full((data.shape[0], len(freqs)), np.nan, dtype = dtype)
+        decision_time = np.full(data.shape[0], np.nan)
+        margins = np.full(data.shape[0], np.nan)
+        for length in np.unique(n_buf[ready]):
+            idx = ready[n_buf[ready] == length]
+            if length not in designs:
+                designs[length] = reference_design(tuple(freqs), harmonics, int(length), gain, np.dtype(dtype).str)
+            X = buffer[idx, :length]
+            X = X - X.mean(1, keepdims = True) # Method works best with zero-mean on time dimension.
+            std = X.std(1, keepdims = True)
+            good = std > 0
+            if mask is not None:
+                good &= mask[idx, None, :]
+            # Flat (a headset that never sent data) or non-finite windows would break the stacked SVD
+            valid = good.any(axis = (1, 2)) & np.isfinite(std).all(axis = (1, 2))
+            if not valid.all():
+                n_buf[idx[~valid]] = 0
+                idx, X, std, good = idx[valid], X[valid], std[valid], good[valid]
+                if len(idx) == 0:
+                    continue
+            calibrated = [
+                templates[b] if method != 'cca' and templates is not None and _usable(templates[b], freqs, gain) else None
+                for b in idx
+            ]
+            corrs = None
+            if method != 'trca' or None in calibrated:
+                if good.all():
+                    X_std = X / std
+                else:
+                    # A zeroed channel gets no weight in the SVD: CCA on the entry's channels only
+                    X_std = np.divide(X, std, out = np.zeros_like(X), where = good)
+                corrs = cca_correlations(X_std, designs[length]).astype(dtype, copy = False)
+            if any(tm is not None for tm in calibrated):
+                t = t_end - np.arange(length - 1, -1, -1) * gain
+                scores = np.empty((len(idx), len(freqs)), dtype = dtype)
+                for i, tm in enumerate(calibrated):
+                    if tm is None:
+                        scores[i] = corrs[i]
+                    else:
+                        scores[i] = template_scores(X[i], t, tm, method, None if corrs is None else corrs[i])
+                corrs = scores
+            p = calc_softmax(corrs, axis = 1, beta = softmax_beta)
+            top2 = np.sort(corrs, axis = 1)[:, -2:] if len(freqs) > 1 else np.concatenate([np.zeros_like(corrs), corrs], axis = 1)
+            margin = top2[:, 1] - top2[:, 0]
+
+            decided = (p.max(axis = 1) >= prob_thresh) | ((margin_thresh > 0) & (margin >= margin_thresh))
+            for i, b in enumerate(idx):
+                if decided[i]:
+                    probs[b] = p[i]
+                    decision_time[b] = n_buf[b] * gain
+                    margins[b] = margin[i]
+                    n_buf[b] = 0
+                    n_refractory[b] = int(refractory / gain)
+
+        if np.isnan(decision_time).all():
+            continue
+
+        if batch_axis is None:
+            output = FrequencyDecodeMessage(
+                probs[0],
+                dims = [freq_axis],
+                freqs = freqs,
+                attrs = {'decision_time': decision_time[0].item(), 'margin': margins[0].item()},
+            )
+        else:
+            output = FrequencyDecodeMessage(
+                probs,
+                dims = [batch_axis, freq_axis],
+                axes = {batch_axis: input.axes[batch_axis]} if batch_axis in input.axes else {},
+                freqs = freqs,
+                attrs = {'decision_time': decision_time, 'margin': margins},
+            )
+
+
+def _usable(templates: typing.Optional[SSVEPTemplates], freqs: typing.List[float], gain: float) -> bool:
+    """ Whether a calibration matches the decoder's targets and sample rate """
+    return (
+        templates is not None
+        and len(templates.freqs) == len(freqs)
+        and np.allclose(templates.freqs, freqs)
+        and abs(templates.fs * gain - 1.0) < 1e-6
+    )
+
+
 class FrequencyDecodeSettings(ez.Settings):
     harmonics: int = 0
     time_axis: typing.Union[str, int] = 0
@@ -179,10 +517,15 @@ class FrequencyDecodeSettings(ez.Settings):
     freq_axis: str = 'freq'
     window_axis: typing.Optional[str] = None
     calc_corrs: bool = True
+    dtype: str = 'float64'
+    workers: int = 0 # threads to decode on, off the event loop (0: inline); outputs keep the input order
+    max_pending: int = 2 # with workers: inputs that may wait for a thread before the oldest is dropped
 
 
 class FrequencyDecodeState(ez.State):
     gen: typing.Generator[typing.Optional[FrequencyDecodeMessage], typing.Union[SampleMessage, AxisArray], None]
+    executor: typing.Optional[ThreadPoolExecutor]
+    offload: typing.Optional['OrderedOffload']
 
 
 class FrequencyDecode(ez.Unit):
@@ -195,7 +538,8 @@ class FrequencyDecode(ez.Unit):
     OUTPUT_TRIGGER = ez.OutputStream(typing.Optional[SampleTriggerMessage])
 
     async def create_generator(self, settings: FrequencyDecodeSettings) -> None:
-        self.STATE.gen = frequency_decode(
+        factory = functools.partial(
+            frequency_decode,
             harmonics = settings.harmonics,
             time_axis = settings.time_axis,
             freqs = settings.freqs,
@@ -203,12 +547,25 @@ class FrequencyDecode(ez.Unit):
             softmax_beta = settings.softmax_beta,
             freq_axis = settings.freq_axis,
             window_axis = settings.window_axis,
-            calc_corrs = settings.calc_corrs
+            calc_corrs = settings.calc_corrs,
+            dtype = settings.dtype
         )
+        self.STATE.gen = factory()
+        if self.STATE.offload is not None:
+            self.STATE.offload.rebuild(factory)
 
     async def initialize(self) -> None:
+        self.STATE.executor = self.STATE.offload = None
+        if self.SETTINGS.workers > 0:
+            from neurotheatre.offload import OrderedOffload # imports this module
+            self.STATE.executor = ThreadPoolExecutor(max_workers = self.SETTINGS.workers, thread_name_prefix = 'decode')
+            self.STATE.offload = OrderedOffload(frequency_decode, self.STATE.executor, self.SETTINGS.max_pending)
         await self.create_generator(self.SETTINGS)
 
+    async def shutdown(self) -> None:
+        if self.STATE.executor is not None:
+            self.STATE.executor.shutdown(wait = False, cancel_futures = True)
+
     @ez.subscriber(INPUT_SETTINGS)
     async def on_settings(self, msg: FrequencyDecodeSettings) -> None:
         await self.create_generator(msg)
@@ -217,17 +574,35 @@ class FrequencyDecode(ez.Unit):
     @ez.publisher(OUTPUT_DECODE)
     @ez.publisher(OUTPUT_TRIGGER)
     async def on_signal(self, msg: typing.Union[AxisArray, SampleMessage]) -> typing.AsyncGenerator:
+        if self.STATE.offload is not None:
+            # Published by `publish_offloaded` once decoded
+            self.STATE.offload.submit(msg)
+            return
         output = self.STATE.gen.send(msg)
         yield self.OUTPUT_DECODE, output
         trigger = getattr(output, 'trigger', None)
         if trigger is not None:
             yield self.OUTPUT_TRIGGER, trigger
 
+    @ez.publisher(OUTPUT_DECODE)
+    @ez.publisher(OUTPUT_TRIGGER)
+    async def publish_offloaded(self) -> typing.AsyncGenerator:
+        if self.STATE.offload is None:
+            return
+        while True:
+            output = await self.STATE.offload.next()
+            if output is None:
+                continue # superseded before a thread took it
+            yield self.OUTPUT_DECODE, output
+            trigger = getattr(output, 'trigger', None)
+            if trigger is not None:
+                yield self.OUTPUT_TRIGGER, trigger
+
     
 def calc_softmax(cv: np.ndarray, axis: int, beta: float = 1.0):
     # Calculate softmax with shifting to avoid overflow
     # (https://doi.org/10.1093/imanum/draa038)
-    cv = cv - cv.max(axis = axis)
+    cv = cv - cv.max(axis = axis, keepdims = True)
     cv = np.exp(beta * cv)
-    cv = cv / np.sum(cv, axis = axis)
+    cv = cv / np.sum(cv, axis = axis, keepdims = True)
     return cv
\ No newline at end of file
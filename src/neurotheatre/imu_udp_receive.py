@@ -1,20 +1,237 @@
-import socket
+import asyncio
 import json
+import socket
+import time
+import typing
+
+from collections import deque
+from dataclasses import dataclass, field
+
+import ezmsg.core as ez
+import numpy as np
 
 from ezmsg.util.messagecodec import MessageDecoder
+from ezmsg.util.messages.axisarray import AxisArray, replace
+
+from neurotheatre.fanout import is_multicast
+
+
+@dataclass
+class LinkStats:
+    """
+    Loss, reordering and jitter of one IMU datagram stream.
+
+    Sequence numbers come from the sender (`seq` in the message attrs, see
+    :obj:`EEGOSC.process_motion`); streams without them only count packets.  Jitter is the
+    RFC 3550 inter-arrival jitter: the smoothed variation of arrival time minus the block's
+    time axis offset, so it does not depend on the two hosts' clocks agreeing.
+    """
+    received: int = 0
+    duplicates: int = 0
+    reordered: int = 0 # arrived after a later packet
+    late_dropped: int = 0 # reordered packets not published
+    first_seq: typing.Optional[int] = None
+    max_seq: int = -1
+    jitter: float = 0.0 # sec
+    transit: typing.Optional[float] = None # sec, arrival minus time axis offset of the last packet
+    recent: typing.Deque[int] = field(default_factory = lambda: deque(maxlen = 1024)) # for duplicate detection, oldest first
+    recent_set: typing.Set[int] = field(default_factory = set) # the same sequence numbers, to look them up in O(1)
+
+    @property
+    def expected(self) -> int:
+        return 0 if self.first_seq is None else self.max_seq - self.first_seq + 1
+
+    @property
+    def lost(self) -> int:
+        """ Packets never received (reordered ones that arrive eventually don't count) """
+        return max(self.expected - self.received, 0)
+
+    def update(self, seq: typing.Optional[int], media_time: float, arrival: float) -> str:
+        """ Account for one packet; returns 'in_order', 'late' (arrived after a later one) or 'duplicate' """
+        transit = arrival - media_time
+        if self.transit is not None:
+            self.jitter += (abs(transit - self.transit) - self.jitter) / 16.0
+        self.transit = transit
+
+        if seq is None:
+            self.received += 1
+            return 'in_order'
+        if seq in self.recent_set:
+            self.duplicates += 1
+            return 'duplicate'
+        if len(self.recent) == self.recent.maxlen:
+            self.recent_set.discard(self.recent[0])
+        self.recent.append(seq)
+        self.recent_set.add(seq)
+        self.received += 1
+        if self.first_seq is None:
+            self.first_seq = seq
+        if seq < self.max_seq:
+            self.reordered += 1
+            return 'late'
+        self.max_seq = seq
+        return 'in_order'
+
+    def summary(self) -> str:
+        loss = self.lost / self.expected * 100.0 if self.expected else 0.0
+        return (f'{self.received} packets, {self.lost} lost ({loss:.2f}%), {self.reordered} reordered, '
+            f'{self.duplicates} duplicates, jitter {self.jitter * 1e3:.2f} ms')
+
+
+class DatagramQueue(asyncio.DatagramProtocol):
+    """ Collects datagrams as the event loop receives them; `drain` hands over everything pending at once """
+
+    def __init__(self):
+        self.pending: typing.List[typing.Tuple[bytes, typing.Tuple[str, int], float]] = []
+        self.ready = asyncio.Event()
+
+    def datagram_received(self, data: bytes, addr: typing.Tuple[str, int]) -> None:
+        self.pending.append((data, addr, time.time()))
+        self.ready.set()
+
+    async def drain(self) -> typing.List[typing.Tuple[bytes, typing.Tuple[str, int], float]]:
+        """ Waits for at least one datagram; returns (data, sender, arrival time) of all pending ones """
+        await self.ready.wait()
+        self.ready.clear()
+        datagrams, self.pending = self.pending, []
+        return datagrams
+
+
+async def open_datagram_queue(address: str, rcvbuf: int = 1 << 20) -> typing.Tuple[asyncio.DatagramTransport, DatagramQueue]:
+    """ Binds a non-blocking UDP socket to `address` ('host:port', or a multicast group to join) feeding a :obj:`DatagramQueue` """
+    host, port = address.rsplit(':', 1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # A bigger kernel buffer rides out bursts while the loop is busy with other units
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.setblocking(False)
+    if is_multicast(host):
+        # Other listeners on this machine may join the same group
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('', int(port)))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(host) + socket.inet_aton('0.0.0.0'))
+    else:
+        sock.bind((host, int(port)))
+    transport, queue = await asyncio.get_running_loop().create_datagram_endpoint(DatagramQueue, sock = sock)
+    return transport, queue
+
+
+class MotionStreams:
+    """
+    Decodes IMU datagrams into AxisArrays and tracks each sender's :obj:`LinkStats`.
+
+    Datagrams hold one JSON-encoded AxisArray each (ezmsg's MessageEncoder, as sent by
+    :obj:`EEGOSC`, about 1 kB per 10-sample block).  With `merge`, consecutive in-order
+    blocks of the same stream received together are concatenated along `time_axis`, so a
+    burst becomes one message instead of many; blocks keep their order within each stream.
+    With `drop_late`, blocks that arrive after a later one are dropped: downstream
+    orientation filters expect time to move forward.
+    """
+
+    def __init__(self, time_axis: str = 'time', merge: bool = True, drop_late: bool = True):
+        self.time_axis = time_axis
+        self.merge = merge
+        self.drop_late = drop_late
+        self.stats: typing.Dict[str, LinkStats] = {}
+        self.decode_errors = 0
+
+    def receive(self, datagrams: typing.Iterable[typing.Tuple[bytes, typing.Tuple[str, int], float]]) -> typing.List[AxisArray]:
+        out: typing.List[AxisArray] = []
+        runs: typing.Dict[str, typing.List[AxisArray]] = {} # stream -> blocks of the open run
+        for data, addr, arrival in datagrams:
+            try:
+                msg = json.loads(data, cls = MessageDecoder)
+                offset = msg.get_axis(self.time_axis).offset
+            except (ValueError, AttributeError, KeyError, TypeError):
+                self.decode_errors += 1
+                continue
+            stream = f'{addr[0]}:{addr[1]}' + (f' {msg.key}' if msg.key else '')
+            stats = self.stats.setdefault(stream, LinkStats())
+            status = stats.update(msg.attrs.get('seq'), offset, arrival)
+            if status == 'duplicate':
+                continue
+            if status == 'late' and self.drop_late:
+                stats.late_dropped += 1
+                continue
+
+            msg = replace(msg, attrs = {k: v for k, v in msg.attrs.items() if k != 'seq'})
+            run = runs.get(stream)
+            if run is not None and self.merge and status == 'in_order' and self._continues(run[-1], msg):
+                run.append(msg)
+                continue
+            if run is not None:
+                out.append(self._concat(run))
+            runs[stream] = [msg]
+
+        out.extend(self._concat(run) for run in runs.values())
+        return out
+
+    def _continues(self, last: AxisArray, msg: AxisArray) -> bool:
+        if last.dims != msg.dims:
+            return False
+        idx = last.get_axis_idx(self.time_axis)
+        a, b = last.get_axis(self.time_axis), msg.get_axis(self.time_axis)
+        n = last.data.shape[idx]
+        return (
+            a.gain == b.gain
+            and abs(a.offset + n * a.gain - b.offset) < 0.5 * a.gain
+            and np.delete(last.data.shape, idx).tolist() == np.delete(msg.data.shape, idx).tolist()
+        )
+
+    def _concat(self, run: typing.List[AxisArray]) -> AxisArray:
+        if len(run) == 1:
+            return run[0]
+        return replace(run[0], data = np.concatenate([m.data for m in run], axis = run[0].get_axis_idx(self.time_axis)))
+
+
+class IMUReceiverSettings(ez.Settings):
+    address: str = '0.0.0.0:9001' # host:port to listen on, or a multicast group:port to join
+    time_axis: str = 'time'
+    rcvbuf: int = 1 << 20 # bytes of kernel receive buffer
+    merge: bool = True # concatenate contiguous blocks received together into one message
+    drop_late: bool = True # drop blocks that arrive after a later one
+    stats_interval: float = 10.0 # sec between loss/jitter log lines; 0 disables
+
+
+class IMUReceiverState(ez.State):
+    transport: asyncio.DatagramTransport
+    queue: DatagramQueue
+    streams: MotionStreams
+    last_stats: float = 0.0
+
+
+class IMUReceiver(ez.Unit):
+    """
+    Publishes IMU blocks received over UDP, e.g. from another machine's :obj:`EEGOSC`
+    (its `imu_address`), so remote headsets can feed `EEGOSC.INPUT_MOTION`.
+    """
+
+    SETTINGS = IMUReceiverSettings
+    STATE = IMUReceiverState
 
-# Configuration
-udp_ip = "0.0.0.0"   # Listen on all interfaces
-udp_port = 9001     # Port to listen on
+    OUTPUT_MOTION = ez.OutputStream(AxisArray)
 
-# Create a UDP socket
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    async def initialize(self) -> None:
+        self.STATE.streams = MotionStreams(self.SETTINGS.time_axis, self.SETTINGS.merge, self.SETTINGS.drop_late)
+        self.STATE.transport, self.STATE.queue = await open_datagram_queue(self.SETTINGS.address, self.SETTINGS.rcvbuf)
+        self.STATE.last_stats = time.monotonic()
+        ez.logger.info(f'listening for IMU datagrams on {self.SETTINGS.address}')
 
-# Bind the socket to the address and port
-sock.bind((udp_ip, udp_port))
+    @ez.publisher(OUTPUT_MOTION)
+    async def pub_motion(self) -> typing.AsyncGenerator:
+        while True:
+            datagrams = await self.STATE.queue.drain()
+            for msg in self.STATE.streams.receive(datagrams):
+                yield self.OUTPUT_MOTION, msg
+            self.log_stats()
 
-print(f"Listening on UDP port {udp_port}...")
+    def log_stats(self) -> None:
+        now = time.monotonic()
+        if self.SETTINGS.stats_interval and now - self.STATE.last_stats >= self.SETTINGS.stats_interval:
+            self.STATE.last_stats = now
+            for stream, stats in self.STATE.streams.stats.items():
+                ez.logger.info(f'imu {stream}: {stats.summary()}')
+            if self.STATE.streams.decode_errors:
+                ez.logger.warning(f'{self.STATE.streams.decode_errors} undecodable IMU datagrams')
 
-while True:
-    data, addr = sock.recvfrom(4096)  # Buffer size is 1024 bytes
-    print(f"Received message from {addr}: {json.loads(data.decode(), cls = MessageDecoder)}")
\ No newline at end of file
+    async def shutdown(self) -> None:
+        self.STATE.transport.close()
@@ -1,20 +1,23 @@
 import ezmsg.core as ez
 from ezmsg.util.messages.axisarray import AxisArray
-from typing import AsyncGenerator
-import numpy as np
+from typing import AsyncGenerator, Generator
+
+from neurotheatre.synthetic import synthetic_eeg
 
 class InjectorSettings ( ez.Settings):
-    # Flag to enable the signal injector. 
+    # Flag to enable the signal injector.
     # If set to False, injector will just be a pass through.
     # True is meant for simulator and False is meant for actual device
     enabled: bool = False
     freq: float = 14.5
+    amp: float = 1.0
 
 class InjectorState( ez.State ):
-    sidx: int = 0 # Sample index
+    gen: Generator[AxisArray, AxisArray, None]
 
 # This class injects and transforms signal from the BCI source
 # Useful to generate some dev/test data when enabled
+# Messages are never modified in place; see neurotheatre.synthetic for richer test signals
 class Injector( ez.Unit ):
     SETTINGS = InjectorSettings
     STATE = InjectorState
@@ -22,15 +25,18 @@ class Injector( ez.Unit ):
     INPUT_SIGNAL = ez.InputStream( AxisArray )
     OUTPUT_SIGNAL = ez.OutputStream( AxisArray )
 
+    async def initialize( self ) -> None:
+        self.STATE.gen = synthetic_eeg(
+            time_axis = 'time', # time axis is in the BCIDecoder source
+            ssvep_freqs = [ self.SETTINGS.freq ],
+            ssvep_amp = self.SETTINGS.amp,
+        )
+
     @ez.subscriber( INPUT_SIGNAL )
     @ez.publisher ( OUTPUT_SIGNAL )
     async def transform(self, msg: AxisArray ) -> AsyncGenerator:
         if (self.SETTINGS.enabled):
-            fs = 1.0 / msg.axes['time'].gain # time axis is in the BCIDecoder source
-            t = ( np.arange( msg.data.shape[0]) + self.STATE.sidx) / fs # time in seconds
-            #msg.data = np.zeros_like(msg.data)
-            msg.data = (msg.data.T + np.sin(2 * np.pi * self.SETTINGS.freq * t)).T # add sin to the random noise from openbci simulator
-            yield self.OUTPUT_SIGNAL, msg
-            self.STATE.sidx += msg.data.shape[0]
+            # add sin to the random noise from openbci simulator
+            yield self.OUTPUT_SIGNAL, self.STATE.gen.send( msg )
         else:
-            yield self.OUTPUT_SIGNAL, msg # Pass through if the Injector is not enabled
\ No newline at end of file
+            yield self.OUTPUT_SIGNAL, msg # Pass through if the Injector is not enabled
@@ -0,0 +1,189 @@
+import typing
+import ezmsg.core as ez
+import numpy as np
+
+from dataclasses import field, replace as dc_replace
+
+from ezmsg.unicorn.dashboard import UnicornDashboard, UnicornDashboardSettings
+from ezmsg.unicorn.device import UnicornSettings
+
+from ezmsg.util.messages.axisarray import AxisArray, replace
+
+from neurotheatre.features import PerformerStack
+from neurotheatre.osc import EEGOSC, EEGOSCSettings, EEGOSCState
+from neurotheatre.synthetic import SyntheticSource, SyntheticSourceSettings
+
+
+class PerformerTagSettings(ez.Settings):
+    performer: str
+
+
+class PerformerTag(ez.Unit):
+    """ Marks a headset's messages with its performer name (`AxisArray.key`) so one OSC unit can serve several headsets """
+
+    SETTINGS = PerformerTagSettings
+
+    INPUT_SIGNAL = ez.InputStream(AxisArray)
+    INPUT_MOTION = ez.InputStream(AxisArray)
+    OUTPUT_SIGNAL = ez.OutputStream(AxisArray)
+    OUTPUT_MOTION = ez.OutputStream(AxisArray)
+
+    @ez.subscriber(INPUT_SIGNAL, zero_copy = True)
+    @ez.publisher(OUTPUT_SIGNAL)
+    async def on_signal(self, msg: AxisArray) -> typing.AsyncGenerator:
+        yield self.OUTPUT_SIGNAL, replace(msg, key = self.SETTINGS.performer)
+
+    @ez.subscriber(INPUT_MOTION, zero_copy = True)
+    @ez.publisher(OUTPUT_MOTION)
+    async def on_motion(self, msg: AxisArray) -> typing.AsyncGenerator:
+        yield self.OUTPUT_MOTION, replace(msg, key = self.SETTINGS.performer)
+
+
+class MultiEEGOSCSettings(EEGOSCSettings):
+    performers: typing.List[str] = field(default_factory = lambda: ['p1']) # one per headset; also the OSC namespace ('/p1/eeg/alpha')
+    max_skew: float = 0.5 # sec a headset may lag before the others continue without it
+    hand_performer: typing.Optional[str] = None # performer whose jaw clenches drive the hand (default: the first)
+
+
+class MultiEEGOSCState(EEGOSCState):
+    stack: PerformerStack
+
+
+class MultiEEGOSC(EEGOSC):
+    """
+    EEGOSC for several headsets at once.
+
+    Input messages must carry the performer name in `key` (see :obj:`PerformerTag`).
+    EEG blocks are aligned across headsets and every feature stage runs once on the
+    stacked `[performer, time, ch]` array; results go out under `/<performer>/...`.
+    """
+
+    SETTINGS = MultiEEGOSCSettings
+    STATE = MultiEEGOSCState
+
+    async def initialize(self) -> None:
+        await super().initialize()
+        performers = self.SETTINGS.performers
+        self.STATE.prefixes = [f'{self.SETTINGS.address_prefix}/{p}' for p in performers]
+        hand_performer = self.SETTINGS.hand_performer
+        self.STATE.hand_idx = performers.index(hand_performer) if hand_performer is not None else 0
+        self.STATE.last_envelope = np.zeros(len(performers))
+        self.STATE.stack = PerformerStack(
+            performers,
+            time_axis = self.SETTINGS.time_axis,
+            ch_axis = self.SETTINGS.ch_axis,
+            max_skew = self.SETTINGS.max_skew,
+        )
+
+    def performer_names(self) -> typing.List[str]:
+        return self.SETTINGS.performers
+
+    @ez.subscriber(EEGOSC.INPUT_SIGNAL)
+    async def on_signal(self, msg: AxisArray):
+        if msg.key not in self.STATE.stack.index:
+            ez.logger.warning(f'dropping signal from unknown performer {msg.key!r}')
+            return
+        self.check_continuity(msg)
+        stacked = self.STATE.stack.push(msg.key, msg)
+        if stacked is not None:
+            self.submit(stacked)
+
+    @ez.subscriber(EEGOSC.INPUT_MOTION)
+    async def on_motion(self, msg: AxisArray):
+        if msg.key not in self.STATE.stack.index:
+            return
+        self.process_motion(msg, self.STATE.prefixes[self.STATE.stack.index[msg.key]])
+
+
+class PerformerCollection(ez.Collection):
+    """
+    Collection with one of each `PER_PERFORMER` member per performer, e.g. `DASHBOARD_P1`, `DASHBOARD_P2`.
+
+    ezmsg takes a collection's members from its class attributes, so they are declared on
+    a subclass made for the performers: run `System.for_performers(performers)(settings)`.
+    """
+
+    PER_PERFORMER: typing.ClassVar[typing.Dict[str, typing.Type[ez.Component]]] = {}
+    PERFORMERS: typing.ClassVar[typing.List[str]] = []
+
+    @classmethod
+    def for_performers(cls, performers: typing.Sequence[str]) -> typing.Type['PerformerCollection']:
+        members = {
+            f'{name}_{performer.upper()}': member()
+            for performer in performers
+            for name, member in cls.PER_PERFORMER.items()
+        }
+        return type(cls.__name__, (cls,), {'PERFORMERS': list(performers), **members})
+
+    def members(self, name: str) -> typing.List[ez.Component]:
+        """ The `name` member of each performer """
+        return [getattr(self, f'{name}_{performer.upper()}') for performer in self.PERFORMERS]
+
+
+class MultiOSCSystemSettings(ez.Settings):
+    osc_settings: MultiEEGOSCSettings
+    unicorn_settings: typing.List[UnicornSettings] # one per entry of osc_settings.performers
+
+
+class MultiOSCSystem(PerformerCollection):
+    """ One Unicorn dashboard per performer feeding a single batched MultiEEGOSC """
+
+    SETTINGS = MultiOSCSystemSettings
+    PER_PERFORMER = {'DASHBOARD': UnicornDashboard, 'TAG': PerformerTag}
+
+    OSC = MultiEEGOSC()
+
+    @property
+    def dashboards(self) -> typing.List[UnicornDashboard]:
+        return self.members('DASHBOARD')
+
+    def configure(self) -> None:
+        for performer, dashboard, tag, unicorn_settings in zip(
+            self.PERFORMERS, self.dashboards, self.members('TAG'), self.SETTINGS.unicorn_settings
+        ):
+            dashboard.apply_settings(UnicornDashboardSettings(device_settings = unicorn_settings))
+            tag.apply_settings(PerformerTagSettings(performer = performer))
+        self.OSC.apply_settings(self.SETTINGS.osc_settings)
+
+    def network(self) -> ez.NetworkDefinition:
+        network = []
+        for dashboard, tag in zip(self.dashboards, self.members('TAG')):
+            network += [
+                (dashboard.OUTPUT_SIGNAL, tag.INPUT_SIGNAL),
+                (dashboard.OUTPUT_MOTION, tag.INPUT_MOTION),
+                (tag.OUTPUT_SIGNAL, self.OSC.INPUT_SIGNAL),
+                (tag.OUTPUT_MOTION, self.OSC.INPUT_MOTION),
+            ]
+        return network
+
+
+class SyntheticMultiOSCSystemSettings(ez.Settings):
+    osc_settings: MultiEEGOSCSettings
+    source_settings: SyntheticSourceSettings # shared; each performer's source gets its own seed
+
+
+class SyntheticMultiOSCSystem(PerformerCollection):
+    """ MultiOSCSystem driven by one synthetic headset per performer, for load-testing """
+
+    SETTINGS = SyntheticMultiOSCSystemSettings
+    PER_PERFORMER = {'SOURCE': SyntheticSource, 'TAG': PerformerTag}
+
+    OSC = MultiEEGOSC()
+
+    def configure(self) -> None:
+        seed = self.SETTINGS.source_settings.seed or 0
+        for i, (performer, source, tag) in enumerate(zip(self.PERFORMERS, self.members('SOURCE'), self.members('TAG'))):
+            source.apply_settings(dc_replace(self.SETTINGS.source_settings, seed = seed + i))
+            tag.apply_settings(PerformerTagSettings(performer = performer))
+        self.OSC.apply_settings(self.SETTINGS.osc_settings)
+
+    def network(self) -> ez.NetworkDefinition:
+        network = []
+        for source, tag in zip(self.members('SOURCE'), self.members('TAG')):
+            network += [
+                (source.OUTPUT_SIGNAL, tag.INPUT_SIGNAL),
+                (source.OUTPUT_MOTION, tag.INPUT_MOTION),
+                (tag.OUTPUT_SIGNAL, self.OSC.INPUT_SIGNAL),
+                (tag.OUTPUT_MOTION, self.OSC.INPUT_MOTION),
+            ]
+        return network
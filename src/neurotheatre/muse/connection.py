@@ -0,0 +1,155 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+import typing
+
+from dataclasses import dataclass, asdict
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".neurotheatre", "muse_cache.json")
+
+
+@dataclass
+class MuseCacheEntry:
+    name: str
+    address: str
+    source_id: typing.Optional[str] = None  # LSL source id of the stream muselsl published for this device
+    sampling_rate: typing.Optional[float] = None
+
+
+class MuseDeviceCache:
+    """ Remembers the last Muse we streamed from so the next connection can skip the BLE scan """
+
+    def __init__(self, path: typing.Optional[str] = DEFAULT_CACHE_PATH):
+        self.path = path
+
+    def load(self, muse_name: typing.Optional[str] = None) -> typing.Optional[MuseCacheEntry]:
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "r") as f:
+                entry = MuseCacheEntry(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+        if muse_name is not None and entry.name != muse_name:
+            return None
+        return entry
+
+    def save(self, entry: MuseCacheEntry) -> None:
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(asdict(entry), f)
+
+
+def _muselsl_stream(address: str) -> None:
+    from muselsl import stream
+    stream(address)
+
+
+class MuseBackend:
+    """
+    Thin wrapper over the BLE/LSL calls used to bring up a Muse stream.
+    Swap this out (or subclass it) to run the connection logic against a mocked BLE/LSL layer.
+
+    muselsl streams for as long as the device does and has no way to be stopped, so it runs
+    in a child process: starting a stream stops the previous one first, and at most one
+    ever holds the Bluetooth device.
+    """
+
+    stream_target: typing.Callable[[str], None] = staticmethod(_muselsl_stream)
+
+    def __init__(self):
+        self.stream_process: typing.Optional[multiprocessing.Process] = None
+
+    async def discover(self, timeout: float) -> typing.List[typing.Tuple[str, str]]:
+        from bleak import BleakScanner
+        devices = await BleakScanner.discover(timeout=timeout)
+        return [(d.name, d.address) for d in devices if d.name and "Muse" in d.name]
+
+    def start_stream(self, address: str) -> None:
+        self.stop_stream()
+        self.stream_process = multiprocessing.Process(target=self.stream_target, args=(address,), name="muselsl-stream", daemon=True)
+        self.stream_process.start()
+
+    def stop_stream(self, timeout: float = 2.0) -> None:
+        process, self.stream_process = self.stream_process, None
+        if process is None:
+            return
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        process.close()
+
+    def resolve(self, prop: str, value: str, timeout: float) -> typing.List[typing.Any]:
+        from pylsl import resolve_byprop
+        return resolve_byprop(prop, value, timeout=timeout)
+
+
+@dataclass
+class MuseConnection:
+    info: typing.Any  # pylsl.StreamInfo (or whatever the backend resolves)
+    entry: MuseCacheEntry
+    cached: bool  # True if we connected without scanning
+    elapsed: float  # seconds spent bringing the stream up
+
+
+async def connect_muse(
+    backend: MuseBackend,
+    cache: MuseDeviceCache,
+    muse_name: typing.Optional[str] = None,
+    scan_timeout: float = 10.0,
+    resolve_timeout: float = 5.0,
+    direct_timeout: float = 3.0,
+) -> MuseConnection:
+    """
+    Bring up an LSL stream for a Muse, trying the cached device first and falling back to a BLE scan.
+
+    ## Parameters:
+    * `backend (MuseBackend)`: BLE/LSL layer to use
+    * `cache (MuseDeviceCache)`: Device cache; updated after every successful connection
+    * `muse_name (str | None)`: Only connect to a Muse with this name. None accepts any Muse.
+    * `scan_timeout (float)`: Seconds to scan for devices when the cached device is unavailable
+    * `resolve_timeout (float)`: Seconds to wait for the LSL stream after a scan
+    * `direct_timeout (float)`: Seconds to wait for the LSL stream of the cached device before scanning
+
+    ## Returns:
+    * `MuseConnection` with the resolved stream info and how the connection was made
+    """
+    start = time.perf_counter()
+
+    entry = cache.load(muse_name)
+    if entry is not None:
+        await asyncio.to_thread(backend.start_stream, entry.address)
+        prop, value = ("source_id", entry.source_id) if entry.source_id else ("type", "EEG")
+        streams = await asyncio.to_thread(backend.resolve, prop, value, direct_timeout)
+        if streams:
+            return MuseConnection(streams[0], entry, True, time.perf_counter() - start)
+
+    muses = await backend.discover(scan_timeout)
+    if not muses:
+        raise RuntimeError("No Muse devices found. Please ensure your Muse is powered on and discoverable.")
+
+    # Select muse from either the muse_name or
+    # the first available Muse device if muse_name is None
+    name, address = next((m for m in muses if m[0] == muse_name), muses[0])
+    await asyncio.to_thread(backend.start_stream, address)
+    streams = await asyncio.to_thread(backend.resolve, "type", "EEG", resolve_timeout)
+    if not streams:
+        raise RuntimeError("No LSL stream found. Please ensure the Muse is streaming data.")
+
+    info = streams[0]
+    entry = MuseCacheEntry(
+        name=name,
+        address=address,
+        source_id=info.source_id() or None,
+        sampling_rate=info.nominal_srate(),
+    )
+    cache.save(entry)
+    return MuseConnection(info, entry, False, time.perf_counter() - start)
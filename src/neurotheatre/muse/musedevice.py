@@ -1,20 +1,42 @@
+import asyncio
+import threading
+import typing
+
 import ezmsg.core as ez
 from ezmsg.util.messages.axisarray import AxisArray
 from typing import AsyncGenerator
 import numpy as np
-from bleak import BleakScanner
-from muselsl import list_muses, stream
-from pylsl import StreamInlet, resolve_byprop
+from pylsl import StreamInlet, local_clock, proc_clocksync, proc_dejitter
+
+from neurotheatre.muse.connection import MuseBackend, MuseConnection, MuseDeviceCache, connect_muse, DEFAULT_CACHE_PATH
 
 class MuseUnitSettings(ez.Settings):
     muse_name: str = None  # Name of the Muse device to connect to (None for auto-detection)
     axis: str = "time"     # Axis name for the time dimension
-    sampling_rate: float = 256.0  # Sampling rate of the Muse device (default: 256 Hz)
+    ch_axis: str = "ch"    # Axis name for the channel dimension
+    sampling_rate: float = 256.0  # Nominal sampling rate of the Muse device; the stream's own rate is used when it reports one
     blocksize: int = 10    # Number of samples per block
+    queue_blocks: int = 32 # Max blocks waiting to be published; oldest blocks are dropped beyond this
+    pull_timeout: float = 0.2 # Seconds the acquisition thread waits for data before re-checking for shutdown
+    latency_report_period: float = 10.0 # Seconds between acquisition-to-publish latency reports (0 to disable)
+    cache_path: typing.Optional[str] = DEFAULT_CACHE_PATH # Last-known device cache (None to always scan)
+    scan_timeout: float = 10.0 # Seconds to scan for devices when the cached device is unavailable
+    direct_timeout: float = 3.0 # Seconds to wait for the cached device's stream before falling back to a scan
+    reconnect_timeout: float = 2.0 # Seconds without data before reconnecting (0 to disable)
 
 
 class MuseUnitState(ez.State):
     inlet: StreamInlet = None  # LSL inlet for receiving data
+    loop: asyncio.AbstractEventLoop = None
+    queue: asyncio.Queue = None  # (pull_time, timestamp, data) blocks from the acquisition thread
+    thread: threading.Thread = None
+    running: threading.Event = None
+    n_dropped: int = 0 # Blocks dropped because the queue was full
+    last_data: float = 0.0 # LSL clock time of the last pulled block
+    cache: MuseDeviceCache = None
+    backend: MuseBackend = None
+    connection: MuseConnection = None
+    sampling_rate: float = 0.0 # Hz, as reported by the connected stream
 
 
 class MuseUnit(ez.Unit):
@@ -24,61 +46,145 @@ class MuseUnit(ez.Unit):
     OUTPUT_SIGNAL = ez.OutputStream(AxisArray)
 
     async def initialize(self) -> None:
-        # Discover Muse devices using BleakScanner
-        print("Scanning for Muse devices. Please wait upto 10 seconds.")
-        devices = await BleakScanner.discover(timeout=10.0)  # Set a timeout for scanning
-        if not devices:
-            raise RuntimeError("No Muse devices found. Please ensure your Muse is powered on and discoverable.")
-        muses = [device for device in devices if "Muse" in device.name]
-        if not muses:
-            raise RuntimeError("No Muse devices found. Please ensure your Muse is powered on and discoverable.")
-
-        muse_name = self.SETTINGS.muse_name
-        # Select muse from either the muse_name or 
-        # the first available Muse device if muse_name is None
-        muse = next((m for m in muses if m.name == muse_name), muses[0])
-        print(f"Starting stream for Muse: {muse.name} at {muse.address}")
-        stream(muse.address)
-
-        # Resolve the LSL stream
-        print("Resolving LSL stream...")
-        streams = resolve_byprop("type", "EEG", timeout=5)
-        if not streams:
-            raise RuntimeError("No LSL stream found. Please ensure the Muse is streaming data.")
-        sampling_rate = streams[0].nominal_srate()
+        self.STATE.loop = asyncio.get_running_loop()
+        self.STATE.queue = asyncio.Queue(maxsize=self.SETTINGS.queue_blocks)
+        self.STATE.cache = MuseDeviceCache(self.SETTINGS.cache_path)
+        self.STATE.backend = MuseBackend()
+        await self._connect()
+        print(f"Muse cold start took {self.STATE.connection.elapsed:.2f} s")
+
+    async def _connect(self) -> None:
+        if self.STATE.connection is None or not self.STATE.connection.cached:
+            print("Looking for Muse devices. Please wait upto 10 seconds.")
+        self.STATE.connection = await connect_muse(
+            self.STATE.backend,
+            self.STATE.cache,
+            muse_name=self.SETTINGS.muse_name,
+            scan_timeout=self.SETTINGS.scan_timeout,
+            direct_timeout=self.SETTINGS.direct_timeout,
+        )
+        info = self.STATE.connection.info
+        entry = self.STATE.connection.entry
+        print(f"Streaming from Muse: {entry.name} at {entry.address} ({'cached' if self.STATE.connection.cached else 'scanned'})")
+
+        # Settings are frozen: the rate of the stream we actually got lives in the state
+        sampling_rate = info.nominal_srate() or self.SETTINGS.sampling_rate
         if sampling_rate != self.SETTINGS.sampling_rate:
-            self.SETTINGS.sampling_rate = sampling_rate
             print(f"Updated sampling rate to: {sampling_rate} Hz")
-        self.STATE.inlet = StreamInlet(streams[0])
-        print(f"Connected to LSL stream: {streams[0].name()}")
+        self.STATE.sampling_rate = sampling_rate
+        # Let liblsl map timestamps to our clock and smooth out network/BLE jitter
+        self.STATE.inlet = StreamInlet(info, processing_flags=proc_clocksync | proc_dejitter)
+        print(f"Connected to LSL stream: {info.name()}")
+
+        self.STATE.last_data = local_clock()
+        self.STATE.running = threading.Event()
+        self.STATE.running.set()
+        self.STATE.thread = threading.Thread(
+            target=self._acquire,
+            args=(self.STATE.inlet, self.STATE.running),
+            name="muse-acquisition",
+            daemon=True
+        )
+        self.STATE.thread.start()
+
+    async def _stop_acquisition(self) -> None:
+        if self.STATE.running is not None:
+            self.STATE.running.clear()
+        if self.STATE.thread is not None:
+            # The thread may sit in a pull for up to pull_timeout; wait for it off the event loop
+            await asyncio.to_thread(self.STATE.thread.join, 2 * self.SETTINGS.pull_timeout + 1.0)
+        if self.STATE.inlet is not None:
+            self.STATE.inlet.close_stream()
+
+    @ez.task
+    async def watchdog(self) -> None:
+        # Reconnect in place when the headset goes quiet; downstream units keep their state
+        # because the graph is never torn down, they just see a gap in the time axis.
+        timeout = self.SETTINGS.reconnect_timeout
+        if not timeout:
+            return
+        while True:
+            await asyncio.sleep(timeout / 4)
+            if local_clock() - self.STATE.last_data < timeout:
+                continue
+            print(f"No Muse data for {timeout:.1f} s; reconnecting...")
+            await self._stop_acquisition()
+            try:
+                await self._connect()
+            except RuntimeError as e:
+                print(f"Muse reconnect failed: {e}")
+                self.STATE.last_data = local_clock()
+                continue
+            print(f"Muse reconnect took {self.STATE.connection.elapsed:.2f} s")
+
+    def _acquire(self, inlet: StreamInlet, running: threading.Event) -> None:
+        # Runs on a dedicated thread so the blocking pull never stalls the event loop.
+        # liblsl writes straight into a preallocated destination buffer; the only copy
+        # per block is the slice we hand over to the event loop.
+        n_ch = inlet.info().channel_count()
+        buffer = np.empty((self.SETTINGS.blocksize, n_ch), dtype=np.float32)
+
+        while running.is_set():
+            _, timestamps = inlet.pull_chunk(
+                timeout=self.SETTINGS.pull_timeout,
+                max_samples=self.SETTINGS.blocksize,
+                dest_obj=buffer,
+            )
+            if not timestamps:
+                continue
+            pull_time = local_clock()
+            self.STATE.last_data = pull_time
+            block = (pull_time, timestamps[0], buffer[:len(timestamps)].copy())
+            self.STATE.loop.call_soon_threadsafe(self._enqueue, block)
+
+    def _enqueue(self, block: typing.Tuple[float, float, np.ndarray]) -> None:
+        # Bounded hand-off: when the publisher falls behind, the stalest block goes
+        if self.STATE.queue.full():
+            self.STATE.queue.get_nowait()
+            self.STATE.n_dropped += 1
+        self.STATE.queue.put_nowait(block)
 
     @ez.publisher(OUTPUT_SIGNAL)
     async def stream_data(self) -> AsyncGenerator:
+        latency_sum, latency_max, n_blocks = 0.0, 0.0, 0
+        last_report = local_clock()
+
         while True:
-            # Pull a chunk of data from the LSL stream with the specified blocksize
-            # This is a blocking call, so it will wait until data is available
-            chunk, timestamps = self.STATE.inlet.pull_chunk(
-                timeout=1.0, max_samples=self.SETTINGS.blocksize
+            pull_time, offset, data = await self.STATE.queue.get()
+
+            # Create an AxisArray with the data and time axis
+            msg = AxisArray(
+                data=data,
+                axes={
+                    self.SETTINGS.axis: AxisArray.LinearAxis(
+                        gain=1.0 / self.STATE.sampling_rate,
+                        offset=offset,
+                    )
+                },
+                dims=[self.SETTINGS.axis, self.SETTINGS.ch_axis],
             )
-            if chunk and timestamps:
-                data = np.array(chunk)
-                time_axis = np.array(timestamps)
-
-                # Create an AxisArray with the data and time axis
-                msg = AxisArray(
-                    data=data,
-                    axes={
-                        self.SETTINGS.axis: AxisArray.LinearAxis(
-                            gain=(1.0 / self.SETTINGS.sampling_rate) * self.SETTINGS.blocksize,
-                            offset=time_axis[0],
-                        )
-                    },
-                    dims=["time", "channel"],  # Assuming time and channel dimensions
-                )
 
-                # Yield the AxisArray as the output signal
-                yield self.OUTPUT_SIGNAL, msg
+            # Yield the AxisArray as the output signal
+            yield self.OUTPUT_SIGNAL, msg
+
+            now = local_clock()
+            latency = now - pull_time
+            latency_sum += latency
+            latency_max = max(latency_max, latency)
+            n_blocks += 1
+            period = self.SETTINGS.latency_report_period
+            if period and now - last_report >= period:
+                print(
+                    f"Muse acquisition-to-publish latency: mean {1e3 * latency_sum / n_blocks:.2f} ms, "
+                    f"max {1e3 * latency_max:.2f} ms over {n_blocks} blocks "
+                    f"({self.STATE.n_dropped} dropped)"
+                )
+                latency_sum, latency_max, n_blocks = 0.0, 0.0, 0
+                last_report = now
 
     async def shutdown(self) -> None:
         # Stop the Muse stream (if applicable)
-        print("Shutting down Muse stream...")
\ No newline at end of file
+        print("Shutting down Muse stream...")
+        await self._stop_acquisition()
+        if self.STATE.backend is not None:
+            await asyncio.to_thread(self.STATE.backend.stop_stream)
@@ -0,0 +1,31 @@
+import ezmsg.core as ez
+
+from neurotheatre.envelopeplot import EnvelopePlot, EnvelopePlotSettings
+from neurotheatre.muse.musedevice import MuseUnit, MuseUnitSettings
+from neurotheatre.osc import EEGOSC, EEGOSCSettings
+
+
+class MuseOSCSystemSettings(ez.Settings):
+    muse_settings: MuseUnitSettings
+    osc_settings: EEGOSCSettings
+    plot_settings: EnvelopePlotSettings
+
+class MuseOSCSystem(ez.Collection):
+    """ OSC pipeline driven by a Muse headset over LSL, with the EEG's envelope plotted in the browser """
+
+    SETTINGS = MuseOSCSystemSettings
+
+    MUSE = MuseUnit()
+    OSC = EEGOSC()
+    PLOT = EnvelopePlot()
+
+    def configure(self) -> None:
+        self.MUSE.apply_settings(self.SETTINGS.muse_settings)
+        self.OSC.apply_settings(self.SETTINGS.osc_settings)
+        self.PLOT.apply_settings(self.SETTINGS.plot_settings)
+
+    def network(self) -> ez.NetworkDefinition:
+        return (
+            (self.MUSE.OUTPUT_SIGNAL, self.OSC.INPUT_SIGNAL),
+            (self.MUSE.OUTPUT_SIGNAL, self.PLOT.INPUT_SIGNAL),
+        )
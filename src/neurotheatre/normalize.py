@@ -0,0 +1,102 @@
+import typing
+
+import numpy as np
+import numpy.typing as npt
+import scipy.signal
+
+from ezmsg.util.generator import consumer
+from ezmsg.util.messages.axisarray import AxisArray, replace
+
+
+@consumer
+def ewm_zscore(
+    time_axis: str = 'time',
+    tau: float = 5.0,
+    reduce_axis: typing.Optional[str] = None,
+    init_mean: typing.Optional[npt.ArrayLike] = None,
+    init_var: typing.Optional[npt.ArrayLike] = None,
+    eps: float = 1e-12,
+) -> typing.Generator[AxisArray, AxisArray, None]:
+    """
+    Streaming z-score against an exponentially weighted mean and variance.
+
+    Each sample along `time_axis` updates the statistics with the incremental (Welford-style)
+    exponentially weighted recursions
+        diff = x - mean;  mean += alpha * diff;  var = (1 - alpha) * (var + alpha * diff ** 2)
+    with alpha = 1 - exp(-dt / tau), and is normalized by the updated statistics.  The recursions
+    are evaluated as linear filters, so a block of samples costs a couple of vectorized passes
+    regardless of the number of features.
+
+    Args:
+        time_axis: Axis along which samples arrive; its gain is the time between updates.
+        tau: Time constant (sec) of the statistics; larger means more history.
+        reduce_axis: If given, average over this axis (e.g. channels) before normalizing and drop it.
+        init_mean: Warm-start mean with the shape of one (reduced) sample.  Default: the first sample.
+        init_var: Warm-start variance.  Default: 0 (the first outputs are large until variance builds up).
+        eps: Added to the variance before dividing.
+
+    Returns:
+        A primed generator that accepts an :obj:`AxisArray` via `.send(axis_array)` and yields the
+        z-scored :obj:`AxisArray`.  Its `attrs` carry the current `mean` and `var`, which can be
+        stored and passed back as `init_mean` / `init_var` to warm-start a later session.
+    """
+    msg_out = AxisArray(np.array([]), dims = [""])
+
+    mean: typing.Optional[np.ndarray] = None
+    var: typing.Optional[np.ndarray] = None
+    filt: typing.Tuple[np.ndarray, ...] = ()
+
+    check_input = {"gain": None, "shape": None}
+
+    while True:
+        msg_in: AxisArray = yield msg_out
+
+        if msg_in.data.size == 0:
+            msg_out = msg_in
+            continue
+
+        dims = list(msg_in.dims)
+        data = msg_in.data
+        if reduce_axis is not None:
+            data = data.mean(axis = msg_in.get_axis_idx(reduce_axis))
+            dims.remove(reduce_axis)
+        axis_idx = dims.index(time_axis)
+        x = np.moveaxis(data, axis_idx, 0)
+
+        gain = msg_in.get_axis(time_axis).gain
+        if gain != check_input["gain"]:
+            check_input["gain"] = gain
+            alpha = 1.0 - np.exp(-gain / tau)
+            # mean[n] = alpha * x[n] + (1 - alpha) * mean[n-1]
+            # var[n] = alpha * (1 - alpha) * diff[n] ** 2 + (1 - alpha) * var[n-1]
+            a = np.array([1.0, alpha - 1.0])
+            filt = (np.array([alpha]), np.array([alpha * (1.0 - alpha)]), a, 1.0 - alpha)
+
+        if x.shape[1:] != check_input["shape"]:
+            check_input["shape"] = x.shape[1:]
+            mean = x[0].copy()
+            var = np.zeros_like(mean)
+            if init_mean is not None and np.shape(init_mean) == mean.shape:
+                mean = np.array(init_mean, dtype = mean.dtype)
+            if init_var is not None and np.shape(init_var) == var.shape:
+                var = np.array(init_var, dtype = var.dtype)
+
+        b_mean, b_var, a, decay = filt
+        means, _ = scipy.signal.lfilter(b_mean, a, x, axis = 0, zi = (decay * mean)[None])
+        diff = x - np.concatenate([mean[None], means[:-1]])
+        np.square(diff, out = diff)
+        varis, _ = scipy.signal.lfilter(b_var, a, diff, axis = 0, zi = (decay * var)[None])
+        mean, var = means[-1].copy(), varis[-1].copy()
+
+        varis += eps
+        np.sqrt(varis, out = varis)
+        z = x - means
+        z /= varis
+
+        msg_out = replace(
+            msg_in,
+            data = np.moveaxis(z, 0, axis_idx),
+            dims = dims,
+            axes = {k: v for k, v in msg_in.axes.items() if k != reduce_axis},
+            attrs = {**msg_in.attrs, 'mean': mean, 'var': var},
+        )
@@ -0,0 +1,229 @@
+import itertools
+import os
+import time
+import typing
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.features import eeg_features, compute_features, FEATURES, PERFORMER_AXIS
+
+
+@dataclass
+class BatchResult:
+    """ One recording processed by :obj:`run_batch` """
+    recording: str
+    output: str
+    duration: float # sec of recording
+    elapsed: float # sec of processing (in its worker)
+
+
+def extract_features(
+    data: np.ndarray,
+    fs: float,
+    t0: float = 0.0,
+    blocksize: int = 10,
+    chunk_dur: float = 60.0,
+    bands: typing.Optional[typing.Mapping[str, typing.Tuple[float, float]]] = None,
+    enabled: typing.Collection[str] = FEATURES,
+    **kwargs,
+) -> typing.Dict[str, np.ndarray]:
+    """
+    Run the live feature stages over a whole recording.
+
+    The stages are the ones :obj:`EEGOSC` runs (:obj:`eeg_features`), fed `chunk_dur`
+    seconds at a time instead of one `blocksize` block at a time.  Filter state carries
+    across chunks, so the output matches the live path sample for sample, with two stages
+    given live-sized input where the block boundaries matter: the first chunk is one block
+    (the windowed band power places its windows relative to the first block) and the SSVEP
+    decoder gets the preprocessed signal split back into live blocks (it evaluates at most
+    once per block).
+
+    Args:
+        data: Raw EEG (time, ch).
+        fs: Sample rate of `data`.
+        t0: Time of the first sample.
+        blocksize: Block size of the live stream to match.
+        chunk_dur: Seconds per vectorized chunk; rounded to whole blocks.
+        bands: Band power features by name, e.g. {'alpha': (8.0, 13.0)}.
+        enabled: Names from `FEATURES` to compute.
+        **kwargs: Passed on to :obj:`eeg_features`.
+
+    Returns:
+        Columns by '<stream>/<column>': every stream has a 'time' column and one column per
+        value.  Streams: 'preproc' (ch0, ch1, ...), 'bandpower' (<band>_ch0, ...) and 'zscore'
+        (<band>), 'ssvep' (one row per decision: <freq>Hz posteriors, decision_time, margin)
+        and 'envelope' (jaw).
+    """
+    bands = dict(bands or {})
+    features = eeg_features(bands = list(bands.values()), enabled = enabled, **kwargs)
+    ssvep, features.ssvep = features.ssvep, None
+    freqs = kwargs.get('ssvep_freqs', ())
+    labels = {'freq': list(bands), 'ch': None}
+
+    streams: typing.Dict[str, typing.List[typing.Tuple[np.ndarray, np.ndarray]]] = {}
+    names: typing.Dict[str, typing.List[str]] = {}
+
+    def append(stream: str, msg: AxisArray, axis: str, stream_labels: typing.Dict[str, typing.Optional[typing.List[str]]]) -> None:
+        if msg.data.size == 0:
+            return
+        times, values, columns = _table(msg, axis, stream_labels)
+        streams.setdefault(stream, []).append((times, values))
+        names[stream] = columns
+
+    n_chunk = max(int(round(chunk_dur * fs / blocksize)), 1) * blocksize
+    bounds = [0, min(blocksize, len(data))] + list(range(blocksize + n_chunk, len(data), n_chunk)) + [len(data)]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if stop <= start:
+            continue
+        msg = AxisArray(
+            np.asarray(data[start:stop])[None],
+            dims = [PERFORMER_AXIS, 'time', 'ch'],
+            axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = t0 + start / fs)},
+        )
+        out = compute_features(features, msg)
+        if 'preproc' in enabled:
+            append('preproc', out['preproc'], 'time', labels)
+        if 'bandpower' in out:
+            append('bandpower', out['bandpower'], features.bandpower_axis, labels)
+        if 'zscore' in out:
+            append('zscore', out['zscore'], features.bandpower_axis, labels)
+        if 'envelope' in out:
+            append('envelope', out['envelope'], 'time', {'ch': ['jaw']})
+        if ssvep is not None:
+            for block in live_blocks(out['preproc'], fs, t0, blocksize):
+                decision = ssvep.send(block)
+                if decision.data.size:
+                    axis = block.get_axis('time')
+                    t_end = axis.offset + (block.data.shape[1] - 1) * axis.gain
+                    row = np.concatenate([decision.data[0], [decision.attrs['decision_time'][0], decision.attrs['margin'][0]]])
+                    streams.setdefault('ssvep', []).append((np.array([t_end]), row[None]))
+                    names['ssvep'] = [f'{f:g}Hz' for f in freqs] + ['decision_time', 'margin']
+
+    columns = {}
+    for stream, parts in streams.items():
+        columns[f'{stream}/time'] = np.concatenate([times for times, _ in parts])
+        values = np.concatenate([values for _, values in parts])
+        for i, name in enumerate(names[stream]):
+            columns[f'{stream}/{name}'] = values[:, i]
+    return columns
+
+
+def _table(msg: AxisArray, axis: str, labels: typing.Dict[str, typing.Optional[typing.List[str]]]) -> typing.Tuple[np.ndarray, np.ndarray, typing.List[str]]:
+    """ A single performer's stage output as (times, values (time, column), column names) """
+    data = np.take(msg.data, 0, axis = msg.get_axis_idx(PERFORMER_AXIS))
+    dims = [d for d in msg.dims if d != PERFORMER_AXIS]
+    data = np.moveaxis(data, dims.index(axis), 0)
+    rest = [d for d in dims if d != axis]
+    info = msg.get_axis(axis)
+    times = info.offset + np.arange(data.shape[0]) * info.gain
+    dim_labels = [labels.get(d) or [f'{d}{i}' for i in range(n)] for d, n in zip(rest, data.shape[1:])]
+    columns = ['_'.join(parts) for parts in itertools.product(*dim_labels)]
+    return times, data.reshape(data.shape[0], -1), columns
+
+
+def live_blocks(preproc: AxisArray, fs: float, t0: float, blocksize: int) -> typing.Iterator[AxisArray]:
+    """ Splits a chunk of preprocessed signal into what each live block of raw input produced """
+    axis = preproc.get_axis('time')
+    n = preproc.data.shape[1]
+    if n == 0:
+        return
+    raw_idx = np.round((axis.offset + np.arange(n) * axis.gain - t0) * fs).astype(int)
+    splits = np.flatnonzero(np.diff(raw_idx // blocksize)) + 1
+    for start, stop in zip(np.concatenate([[0], splits]), np.concatenate([splits, [n]])):
+        yield AxisArray(
+            preproc.data[:, start:stop],
+            dims = preproc.dims,
+            axes = {**preproc.axes, 'time': AxisArray.LinearAxis(gain = axis.gain, offset = axis.offset + start * axis.gain)},
+        )
+
+
+def save_features(path: str, columns: typing.Mapping[str, np.ndarray], dtype: npt.DTypeLike = np.float32) -> None:
+    """ Writes `columns` to a compressed .npz, one array per column; values are stored as `dtype`, times as float64 """
+    np.savez_compressed(path, **{
+        name: column if name.endswith('/time') else column.astype(dtype, copy = False)
+        for name, column in columns.items()
+    })
+
+
+def load_features(path: str) -> typing.Dict[str, np.ndarray]:
+    """ Columns written by :obj:`save_features` """
+    with np.load(path) as f:
+        return {name: f[name] for name in f.files}
+
+
+def process_recording(recording: str, output: str, store: npt.DTypeLike = np.float32, **kwargs) -> BatchResult:
+    """
+    Features of one recording, written to `output`.
+
+    `recording` is an .npz with raw `data` (time, ch) and `fs`, optionally `t0`, as for
+    `calibrate_ssvep`.  Values are stored as `store`; `kwargs` go to :obj:`extract_features`.
+    """
+    tick = time.perf_counter()
+    with np.load(recording) as rec:
+        data, fs = rec['data'], float(rec['fs'])
+        t0 = float(rec['t0']) if 't0' in rec else 0.0
+    save_features(output, extract_features(data, fs, t0 = t0, **kwargs), store)
+    return BatchResult(recording, output, len(data) / fs, time.perf_counter() - tick)
+
+
+def run_batch(
+    recordings: typing.Sequence[str],
+    out_dir: str,
+    workers: typing.Optional[int] = None,
+    callback: typing.Optional[typing.Callable[[BatchResult], None]] = None,
+    **kwargs,
+) -> typing.List[BatchResult]:
+    """
+    Extract features from many recordings across a process pool.
+
+    Each recording is one task: a recording's filters run from its first sample to its
+    last, so it isn't split across workers.  Features of 'name.npz' go to
+    'out_dir/name.features.npz'; recordings from several directories keep their paths
+    relative to the directory they share ('a/s1.npz' and 'b/s1.npz' go to
+    'out_dir/a/s1.features.npz' and 'out_dir/b/s1.features.npz').
+
+    Args:
+        recordings: Recording .npz files (see :obj:`process_recording`).
+        out_dir: Where to write the feature files; created if missing.
+        workers: Processes to use.  Default: one per CPU.
+        callback: Called with each :obj:`BatchResult` as its recording finishes.
+        **kwargs: Passed on to :obj:`process_recording`.
+
+    Returns:
+        The results in the order of `recordings`.
+
+    Raises:
+        ValueError: If a recording is listed more than once.
+    """
+    paths = [os.path.abspath(recording) for recording in recordings]
+    if len(set(paths)) < len(paths):
+        raise ValueError('recordings are listed more than once')
+    root = os.path.commonpath([os.path.dirname(path) for path in paths]) if paths else ''
+    outputs = [
+        os.path.join(out_dir, f'{os.path.splitext(os.path.relpath(path, root))[0]}.features.npz')
+        for path in paths
+    ]
+    for directory in {out_dir, *(os.path.dirname(output) for output in outputs)}:
+        os.makedirs(directory, exist_ok = True)
+    results: typing.List[typing.Optional[BatchResult]] = [None] * len(recordings)
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = {
+            pool.submit(process_recording, recording, output, **kwargs): i
+            for i, (recording, output) in enumerate(zip(recordings, outputs))
+        }
+        for future in as_completed(futures):
+            result = results[futures[future]] = future.result()
+            if callback is not None:
+                callback(result)
+    return results
+
+
+def throughput(results: typing.Sequence[BatchResult], wall: float) -> float:
+    """ Recording-hours processed per minute of wall time """
+    return sum(result.duration for result in results) / 3600.0 / (wall / 60.0)
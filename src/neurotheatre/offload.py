@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import typing
+
+from collections import deque
+from concurrent.futures import Executor, Future
+
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.features import BlockQueue
+from neurotheatre.frequencydecoder import FrequencyDecodeMessage
+
+
+class SerialOffload:
+    """
+    Feeds a stateful decoder generator (e.g. :obj:`dynamic_stopping_decode`) from a thread pool.
+
+    A drop-in for the generator where it is only `send` to: `send` queues the input and
+    returns an empty message at once, so the event loop can handle other messages while the
+    SVDs run (NumPy releases the GIL in LAPACK).  The generator runs on one worker at a time,
+    inputs in the order they were sent, and `on_output(input, output)` is called on the event
+    loop with each result, in the same order.
+
+    Blocks still waiting behind a running send are superseded by the next one: they go to the
+    decoder together, concatenated along time (see :obj:`BlockQueue`), so no sample is lost
+    but the decoder evaluates once for all of them.  Parameter updates (dicts) keep their place.
+    """
+
+    def __init__(
+        self,
+        gen: typing.Generator[typing.Any, typing.Any, None],
+        executor: Executor,
+        on_output: typing.Callable[[AxisArray, typing.Any], None],
+        time_axis: str = 'time',
+    ):
+        self.gen = gen
+        self.executor = executor
+        self.on_output = on_output
+        self.time_axis = time_axis
+        self.loop = asyncio.get_running_loop()
+        self.waiting: typing.List[typing.Union[AxisArray, typing.Dict[str, typing.Any]]] = []
+        self.running: typing.Optional[Future] = None
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.superseded = 0 # blocks merged into a later send
+
+    def send(self, item: typing.Union[AxisArray, typing.Dict[str, typing.Any]]) -> FrequencyDecodeMessage:
+        self.waiting.append(item)
+        self.idle.clear()
+        if self.running is None:
+            self._start()
+        return FrequencyDecodeMessage(np.array([]), dims = [''])
+
+    def _batch(self) -> typing.List[typing.Union[AxisArray, typing.Dict[str, typing.Any]]]:
+        """ The waiting items with each run of blocks between parameter updates merged """
+        items: typing.List[typing.Union[AxisArray, typing.Dict[str, typing.Any]]] = []
+        queue = BlockQueue(self.time_axis)
+        for item in self.waiting + [None]:
+            if isinstance(item, AxisArray):
+                queue.push(item)
+                continue
+            n = len(queue)
+            blocks = queue.take()
+            self.superseded += n - len(blocks)
+            items += blocks
+            if item is not None:
+                items.append(item)
+        self.waiting = []
+        return items
+
+    def _start(self) -> None:
+        self.running = self.executor.submit(self._run, self._batch())
+        self.running.add_done_callback(lambda future: self.loop.call_soon_threadsafe(self._done, future))
+
+    def _run(self, items: typing.List[typing.Union[AxisArray, typing.Dict[str, typing.Any]]]) -> typing.List[typing.Tuple[AxisArray, typing.Any]]:
+        results = []
+        for item in items:
+            output = self.gen.send(item)
+            if isinstance(item, AxisArray):
+                results.append((item, output))
+        return results
+
+    def _done(self, future: Future) -> None:
+        self.running = None
+        if self.waiting:
+            self._start()
+        else:
+            self.idle.set()
+        for item, output in future.result():
+            self.on_output(item, output)
+
+    async def join(self) -> None:
+        """ Waits until every input sent so far has been decoded and handed to `on_output` """
+        await self.idle.wait()
+
+
+class OrderedOffload:
+    """
+    Runs a stateless decode step (e.g. :obj:`frequency_decode`) for each input on a thread
+    pool, several at once, and hands the outputs back in input order.
+
+    Each worker thread builds its own decoder with `factory`: decoders reuse work buffers
+    (see :obj:`Workspace`), so one can't be shared between threads.  At most `max_pending`
+    inputs wait for a worker; submitting another cancels the oldest waiting one, superseded
+    by the newer input, and its output is None.
+    """
+
+    def __init__(
+        self,
+        factory: typing.Callable[[], typing.Generator[typing.Any, typing.Any, None]],
+        executor: Executor,
+        max_pending: int = 2,
+    ):
+        self.factory = factory
+        self.version = 0 # bumped by `rebuild`; decoders of older versions are replaced
+        self.executor = executor
+        self.max_pending = max_pending
+        self.local = threading.local()
+        self.jobs: typing.Deque[Future] = deque()
+        self.submitted = asyncio.Event()
+        self.cancelled = 0
+
+    def rebuild(self, factory: typing.Callable[[], typing.Generator[typing.Any, typing.Any, None]]) -> None:
+        """ Decode inputs not yet started with decoders from `factory` """
+        self.factory = factory
+        self.version += 1
+
+    def _run(self, msg: typing.Any) -> typing.Any:
+        if getattr(self.local, 'version', None) != self.version:
+            self.local.gen = self.factory()
+            self.local.version = self.version
+        return self.local.gen.send(msg)
+
+    def submit(self, msg: typing.Any) -> None:
+        waiting = [job for job in self.jobs if not job.running() and not job.done()]
+        for job in waiting[:max(0, len(waiting) + 1 - self.max_pending)]:
+            if job.cancel():
+                self.cancelled += 1
+        self.jobs.append(self.executor.submit(self._run, msg))
+        self.submitted.set()
+
+    async def next(self) -> typing.Any:
+        """ Output of the oldest input not yet returned, once it is decoded; None if it was cancelled """
+        while not self.jobs:
+            self.submitted.clear()
+            await self.submitted.wait()
+        job = self.jobs[0]
+        # wait() rather than awaiting the job: a job cancelled by `submit` mustn't look like
+        # this task being cancelled
+        await asyncio.wait([asyncio.wrap_future(job)])
+        self.jobs.popleft()
+        return None if job.cancelled() else job.result()
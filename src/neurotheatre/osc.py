@@ -11,38 +11,72 @@ from vqf import VQF
 from ezmsg.unicorn.dashboard import UnicornDashboard, UnicornDashboardSettings
 from ezmsg.unicorn.device import UnicornSettings
 
-from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.util.messages.axisarray import AxisArray, replace
 from ezmsg.util.debuglog import DebugLog
 
-from pythonosc.udp_client import SimpleUDPClient
-
-from ezmsg.util.generator import compose
-from ezmsg.sigproc.window import windowing
-from ezmsg.sigproc.butterworthfilter import butter
-from ezmsg.sigproc.affinetransform import common_rereference
-from ezmsg.sigproc.downsample import downsample
-from ezmsg.sigproc.aggregate import ranged_aggregate
-from ezmsg.sigproc.spectrum import spectrum
-from ezmsg.sigproc.filter import filtergen
-from ezmsg.sigproc.math.abs import abs
-
+import os
 import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from ezmsg.util.messagecodec import MessageEncoder
 
-from neurotheatre.frequencydecoder import frequency_decode
+from neurotheatre.features import (
+    EEGFeatures, eeg_features, bandpower_stage, zscore_stage, compute_features, enable_features, disable_features,
+    BlockHistory, BlockQueue, imu_orientation, per_performer, FEATURES, PERFORMER_AXIS,
+)
+from neurotheatre.control import ConfigUpdate, CONFIG_PREFIX, RUNTIME_SETTINGS, SSVEP_PARAMS, serve_control
+from neurotheatre.trca import SSVEPTemplates, TemplateCache
+from neurotheatre.workspace import Workspace
+from neurotheatre.shmring import FeatureRings
+from neurotheatre.eegcodec import encode_block, CODECS
+from neurotheatre.fanout import FanOut
+from neurotheatre.quality import QUALITY_METRICS
+from neurotheatre.imu_udp_receive import IMUReceiver, IMUReceiverSettings
+from neurotheatre.offload import SerialOffload
+from neurotheatre.reblock import AdaptiveBlocker
+from neurotheatre.synthetic import SyntheticSource, SyntheticSourceSettings
 import struct
-import socket
 
 class EEGOSCSettings(ez.Settings):
-    td_address: str = '127.0.0.1:8000'
-    imu_address: str = '127.0.0.1:9001'
-    hand_address: str = '127.0.0.1:8002'
+    """
+    Settings of :obj:`EEGOSC`.
+
+    `backpressure` decides what happens to blocks that queue up behind a slow one:
+        'none': each is processed in turn.
+        'merge': they are processed together (see :obj:`BlockQueue`).
+        'latest': as 'merge', but per-sample streams only send the newest block's samples.
+        'adaptive': blocks are merged or split for the most throughput within `latency_budget`
+            (see :obj:`AdaptiveBlocker`).
+    """
+    td_address: str = '127.0.0.1:8000' # OSC destinations: comma-separated host:port, each a host or a multicast group (see FanOut)
+    imu_address: str = '127.0.0.1:9001' # where raw IMU blocks are forwarded (see IMUReceiver), as td_address; '' disables
+    hand_address: str = '127.0.0.1:8002' # where jaw clenches drive the hand, as td_address
+    multicast_ttl: int = 1 # hops multicast packets may take; 1 stays on the local network
+    multicast_interface: typing.Optional[str] = None # address of the interface to send multicast from (None: the system's choice)
+    address_prefix: str = '' # Prepended to every OSC address, e.g. '/p1' -> '/p1/eeg/alpha'
 
     time_axis: str = 'time'
     ch_axis: str = 'ch'
-    ssvep_dur: float = 8.0 # sec
+    ssvep_dur: float = 8.0 # sec, longest window evidence is accumulated over
+    ssvep_min_dur: float = 1.0 # sec, shortest window a decision can be made on
+    ssvep_step: float = 0.25 # sec between evaluations of the growing window
+    ssvep_prob_thresh: float = 0.6 # softmax posterior needed for a decision (> 1 disables)
+    ssvep_margin_thresh: float = 0.2 # best minus second-best correlation needed for a decision (0 disables)
+    ssvep_refractory: float = 1.0 # sec to wait after a decision before accumulating again
+    ssvep_harmonics: int = 2 # harmonics beyond the fundamental in the reference signals
     ssvep_freqs: typing.List[float] = field(default_factory = lambda: [7.0, 9.0, 11.0]) # Hz
+    ssvep_method: str = 'cca' # 'cca' (no calibration), 'trca' or 'ecca' (calibrated templates, see calibrate_ssvep)
+    ssvep_templates: typing.Optional[str] = None # calibration cache directory for 'trca'/'ecca'
+    ssvep_montage: str = 'unicorn8' # electrode montage; calibrations are cached per performer and montage
+    ssvep_stim_t0: typing.Optional[float] = None # sec, input time at which every stimulus is at phase 0 (None: the calibration's; see TemplateCache.load)
+    performer: str = 'p1' # whose calibration to load
     bands_tau: float = 5.0 # higher number = more history in bandpower z-score
+    bands_zscore_per_channel: bool = False # z-score each channel's band power separately (then average) instead of the channel mean
+    bands_zscore_stats: typing.Optional[str] = None # .npz to warm-start the z-score from and save it to on shutdown
+    bandpower_engine: str = 'window' # 'window': 2 s FFT windows every 0.5 s, 'iir': streaming band-pass filter bank
+    bandpower_order: int = 1 # 'iir' engine: Butterworth order of each band-pass
+    bandpower_tau: float = 0.02 # 'iir' engine: sec, smoothing time constant of the squared band signals
     bands: typing.Dict[str, typing.Tuple[float, float]] = field(
         default_factory = lambda: {
             'alpha': (8.0, 13.0), # Hz
@@ -50,24 +84,65 @@ class EEGOSCSettings(ez.Settings):
             'gamma': (30.0, 50.0) # Hz
         }
     )
+    precision: str = 'float64' # Working precision for neurotheatre's own stages ('float32' or 'float64')
     jaw_port: int = 8002 # Port for jaw clench detection
     jaw_thresh: float = 20 # Threshold for jaw clench detection in the envelope (in mv)
     imu_port: int = 9001
+    control_address: typing.Optional[str] = None # host:port to accept /config/<setting> updates on, e.g. '0.0.0.0:9000'
+    features: typing.List[str] = field(default_factory = lambda: list(FEATURES)) # features to compute and send, see FEATURES; the rest don't run
+    feature_history: float = 3.0 # sec of input kept while a feature is disabled, to warm it up when it is enabled
+    backpressure: str = 'none' # 'none', 'merge', 'latest' or 'adaptive'; see above
+    latency_budget: float = 0.1 # sec, 'adaptive' backpressure: longest a sample may wait for its outputs, and a block may hold up the event loop
+    ssvep_thread: bool = False # decode SSVEP on a worker thread (see SerialOffload), so motion and config messages are handled while the SVDs run
+    status_interval: float = 1.0 # sec between /status/lag [lag_ms, blocks queued, blocks shed] messages
+    preproc_codec: typing.Optional[str] = None # send the preprocessed EEG as one quantized packet per block (see eegcodec.py: 'int16', 'int16-delta', 'int16-zlib', 'int16-delta-zlib') instead of a float message per sample
+    preproc_bits: int = 16 # resolution of the preproc_codec packets; fewer bits give the '-zlib' codecs something to compress
+    quality: bool = False # track each channel's signal quality and compute features only from the usable channels (see signal_quality)
+    quality_line_freq: float = 60.0 # Hz, mains frequency for the line-noise metric
+    quality_min_channels: int = 4 # fewer usable channels than this and none of a performer's are used
+    quality_interval: float = 1.0 # sec between /eeg/quality/<metric> messages
+    shm_name: typing.Optional[str] = None # also write features to shared-memory rings '<shm_name>[_<performer>]_<stream>' for local readers (see shmring.py)
+
+ORIENTATION_LABELS = ['w', 'x', 'y', 'z', 'yaw', 'pitch', 'roll']
+
+BACKPRESSURE = ('none', 'merge', 'latest', 'adaptive')
 
 class EEGOSCState(ez.State):
-    preproc: typing.Callable
-    bandpower: typing.Callable
-    ssvep: typing.Callable
-    enveloper: typing.Callable
-    vqf: VQF
+    features: EEGFeatures
+    history: BlockHistory # recent input, kept while any feature is disabled
+    templates: typing.Optional[typing.List[typing.Optional[SSVEPTemplates]]] # SSVEP calibration of each performer
+    zscore_stats: typing.Dict[str, np.ndarray]
+    vqf: typing.Dict[str, VQF] # per address prefix
+    imu_seq: typing.Dict[str, int] # next IMU datagram sequence number per address prefix
+    preproc_seq: typing.Dict[str, int] # next preprocessed EEG packet sequence number per address prefix
+    work: Workspace # IMU conversion buffers
     bands: typing.List[typing.Tuple[float, float]]
     band_names: typing.List[str]
-
-    td_client: SimpleUDPClient
-    imu_client: socket.socket
-    hand_client: socket.socket
-
-    last_envelope: float = 0
+    prefixes: typing.List[str] # OSC address prefix of each performer
+    hand_idx: int # performer whose jaw clenches drive the hand
+
+    td_client: FanOut
+    imu_client: FanOut
+    hand_client: FanOut
+
+    last_envelope: np.ndarray
+
+    rings: typing.Optional[FeatureRings]
+    executor: typing.Optional[ThreadPoolExecutor] # SSVEP decoding thread, with ssvep_thread
+    pending_config: typing.List[ConfigUpdate]
+    next_offset: typing.Dict[typing.Optional[str], float] # expected time of each input's next block
+    bandpower_fs: typing.Optional[float] = None # Hz, rate of the band power stage's input (the preprocessed EEG) once a block has been through
+    blocks_dropped: int = 0
+    queue: BlockQueue # blocks waiting while one is processed ('merge'/'latest' backpressure)
+    blocker: AdaptiveBlocker # blocks waiting to be merged or split ('adaptive' backpressure)
+    release_timer: typing.Optional[asyncio.TimerHandle] = None # wakes process_queue when blocks held back by the blocker are due
+    queued: asyncio.Event
+    delay_floor: float # least delay seen from a block's last sample to its outputs; the rest is lag
+    next_status: float
+    next_quality: float
+    quality_good: typing.Optional[bytes] = None # usable-channel mask last sent
+    blocks_shed: int = 0 # blocks merged into others rather than processed alone
+    status_shed: int = 0 # blocks_shed at the last status message
 
 class EEGOSC(ez.Unit):
     SETTINGS = EEGOSCSettings
@@ -77,107 +152,445 @@ class EEGOSC(ez.Unit):
     INPUT_MOTION = ez.InputStream(AxisArray)
 
     async def initialize(self) -> None:
-        address, port = tuple(self.SETTINGS.td_address.split(':'))
-        self.STATE.td_client = SimpleUDPClient(address = address, port = int(port))
-
-        self.STATE.preproc = compose(
-            butter(axis = self.SETTINGS.time_axis, order = 3, cuton = 1.0, cutoff = 50.0),
-            downsample(axis = self.SETTINGS.time_axis, factor = 2),
-            common_rereference(axis = self.SETTINGS.ch_axis),
-        )
+        self.STATE.td_client = self.open_client('td_address')
+        self.STATE.imu_client = self.open_client('imu_address')
+        self.STATE.hand_client = self.open_client('hand_address')
 
         self.STATE.band_names, self.STATE.bands = zip(*self.SETTINGS.bands.items())
 
-        self.STATE.bandpower = compose(
-            windowing(axis = self.SETTINGS.time_axis, newaxis = 'window', window_dur = 2.0, window_shift = 0.5, zero_pad_until = 'input'),
-            spectrum(axis = self.SETTINGS.time_axis, out_axis = 'freq'),
-            ranged_aggregate(axis = 'freq', bands = self.STATE.bands),
-            butter(axis = 'window', order = 2, cutoff = 0.1)
+        self.STATE.zscore_stats = {}
+        stats_path = self.SETTINGS.bands_zscore_stats
+        if stats_path is not None and os.path.exists(stats_path):
+            with np.load(stats_path) as stats:
+                self.STATE.zscore_stats = {'mean': stats['mean'], 'var': stats['var']}
+
+        self.STATE.templates = self.load_templates()
+        self.STATE.executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'ssvep') if self.SETTINGS.ssvep_thread else None
+        self.STATE.features = self.build_features(self.SETTINGS.features)
+        self.offload_ssvep()
+        self.STATE.history = BlockHistory(self.SETTINGS.feature_history, self.SETTINGS.time_axis)
+
+        self.STATE.prefixes = [self.SETTINGS.address_prefix]
+        self.STATE.hand_idx = 0
+        self.STATE.last_envelope = np.zeros(1)
+        self.STATE.vqf = {}
+        self.STATE.imu_seq = {}
+        self.STATE.preproc_seq = {}
+        if self.SETTINGS.preproc_codec is not None and self.SETTINGS.preproc_codec not in CODECS:
+            raise ValueError(f'unknown preproc_codec {self.SETTINGS.preproc_codec!r}; expected one of {tuple(CODECS)}')
+        self.STATE.work = Workspace()
+        self.STATE.pending_config = []
+        self.STATE.next_offset = {}
+        self.STATE.rings = None if self.SETTINGS.shm_name is None else FeatureRings(self.SETTINGS.shm_name)
+        if self.SETTINGS.backpressure not in BACKPRESSURE:
+            raise ValueError(f'unknown backpressure {self.SETTINGS.backpressure!r}; expected one of {BACKPRESSURE}')
+        self.STATE.queue = BlockQueue(self.SETTINGS.time_axis)
+        self.STATE.blocker = AdaptiveBlocker(self.SETTINGS.latency_budget, self.SETTINGS.time_axis)
+        self.STATE.queued = asyncio.Event()
+        self.STATE.delay_floor = np.inf
+        self.STATE.next_status = 0.0
+        self.STATE.next_quality = 0.0
+
+    def open_client(self, setting: str, settings: typing.Optional[EEGOSCSettings] = None) -> FanOut:
+        """ A :obj:`FanOut` to the destinations of the address `setting` of `settings` (default: the current ones) """
+        settings = self.SETTINGS if settings is None else settings
+        return FanOut(getattr(settings, setting), settings.multicast_ttl, settings.multicast_interface)
+
+    def performer_names(self) -> typing.List[str]:
+        return [self.SETTINGS.performer]
+
+    def build_features(self, enabled: typing.Collection[str]) -> EEGFeatures:
+        """ Fresh stages for the `enabled` features from the current settings """
+        return eeg_features(
+            time_axis = self.SETTINGS.time_axis,
+            ch_axis = self.SETTINGS.ch_axis,
+            bands = self.STATE.bands,
+            bandpower_engine = self.SETTINGS.bandpower_engine,
+            bandpower_order = self.SETTINGS.bandpower_order,
+            bandpower_tau = self.SETTINGS.bandpower_tau,
+            bands_tau = self.SETTINGS.bands_tau,
+            bands_zscore_per_channel = self.SETTINGS.bands_zscore_per_channel,
+            zscore_init = {f'init_{k}': v for k, v in self.STATE.zscore_stats.items()},
+            ssvep_freqs = self.SETTINGS.ssvep_freqs,
+            ssvep_min_dur = self.SETTINGS.ssvep_min_dur,
+            ssvep_max_dur = self.SETTINGS.ssvep_dur,
+            ssvep_step = self.SETTINGS.ssvep_step,
+            ssvep_prob_thresh = self.SETTINGS.ssvep_prob_thresh,
+            ssvep_margin_thresh = self.SETTINGS.ssvep_margin_thresh,
+            ssvep_refractory = self.SETTINGS.ssvep_refractory,
+            ssvep_harmonics = self.SETTINGS.ssvep_harmonics,
+            ssvep_method = self.SETTINGS.ssvep_method,
+            ssvep_templates = self.STATE.templates,
+            quality = self.SETTINGS.quality,
+            quality_line_freq = self.SETTINGS.quality_line_freq,
+            quality_min_channels = self.SETTINGS.quality_min_channels,
+            dtype = self.SETTINGS.precision,
+            enabled = enabled,
         )
 
-        self.STATE.ssvep = compose(
-            windowing(axis = self.SETTINGS.time_axis, newaxis = 'window', window_dur = 4.0, window_shift = 0.5, zero_pad_until = 'input'),
-            frequency_decode(time_axis = self.SETTINGS.time_axis, harmonics = 2, freqs = self.SETTINGS.ssvep_freqs, softmax_beta = 5.0, window_axis = 'window', calc_corrs = True),
-        )
-
-        self.STATE.enveloper = compose(
-            # 1. Remove Powerline Noise
-            butter(axis = self.SETTINGS.time_axis, order = 3, cutoff = 58.0, cuton = 62.0),
-            # 2. Temporal Differential
-            filtergen(
-                axis = self.SETTINGS.time_axis, 
-                coefs = (
-                    np.array([1.0, -1.0]), 
-                    np.array([1.0, 0.0])), 
-                coef_type = 'ba'
-            ),
-            # 3. Rectify
-            abs(),
-            # 4. Smooth
-            butter(axis = self.SETTINGS.time_axis, order = 3, cutoff = 10.0),
-            # 5. Downsample
-            downsample(axis = self.SETTINGS.time_axis, factor = 10),
-            # 6. Average channels
-            ranged_aggregate(axis = self.SETTINGS.ch_axis, bands = [(0, 7)]),
-        )
-
-        self.STATE.vqf = VQF(1.0)
-
-        self.STATE.hand_client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.STATE.imu_client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    def switch_features(self, previous: typing.Collection[str]) -> None:
+        """ Drops the stages of features no longer enabled and warms up newly enabled ones from the history """
+        enabled = set(self.SETTINGS.features)
+        disable_features(self.STATE.features, enabled)
+        added = enabled - set(previous)
+        if added:
+            enable_features(self.STATE.features, self.build_features(added), self.STATE.history)
+            if 'jaw' in added:
+                self.STATE.last_envelope = np.zeros_like(self.STATE.last_envelope)
+        if enabled.issuperset(FEATURES):
+            self.STATE.history.clear()
+
+    def offload_ssvep(self) -> None:
+        """ Moves a newly built SSVEP decoder onto the decoding thread, with `ssvep_thread` """
+        ssvep = self.STATE.features.ssvep
+        if self.STATE.executor is not None and ssvep is not None and not isinstance(ssvep, SerialOffload):
+            self.STATE.features.ssvep = SerialOffload(ssvep, self.STATE.executor, self.on_ssvep, self.SETTINGS.time_axis)
+
+    def on_ssvep(self, block: AxisArray, posteriors: AxisArray) -> None:
+        """ An offloaded decoder's output for the preprocessed `block` """
+        if posteriors.data.size == 0 or 'ssvep' not in self.SETTINGS.features:
+            return
+        axis = block.get_axis(self.SETTINGS.time_axis)
+        self.send_ssvep(posteriors, axis.offset + (block.data.shape[block.get_axis_idx(self.SETTINGS.time_axis)] - 1) * axis.gain)
+
+    def load_templates(self, settings: typing.Optional[EEGOSCSettings] = None) -> typing.Optional[typing.List[typing.Optional[SSVEPTemplates]]]:
+        """ Each performer's SSVEP calibration from the template cache of `settings` (default: the current ones); None where there is none """
+        settings = self.SETTINGS if settings is None else settings
+        if settings.ssvep_method == 'cca' or settings.ssvep_templates is None:
+            return None
+        cache = TemplateCache(settings.ssvep_templates)
+        templates = []
+        for performer in self.performer_names():
+            tm = cache.load(performer, settings.ssvep_montage, dtype = settings.precision, stim_t0 = settings.ssvep_stim_t0)
+            if tm is None:
+                ez.logger.warning(f'no {settings.ssvep_montage} calibration for {performer} in {settings.ssvep_templates}; using cca')
+            templates.append(tm)
+        return templates
+
+    @ez.task
+    async def control_server(self) -> None:
+        if self.SETTINGS.control_address is None:
+            return
+        transport = await serve_control(self.SETTINGS.control_address, self.on_config, self.on_config_error)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            transport.close()
+
+    def on_config(self, setting: str, value: typing.Any, received: float) -> None:
+        # The server shares this unit's event loop and blocks are processed without awaiting,
+        # so applying on the next loop iteration always lands between blocks; updates from
+        # one burst of datagrams are applied together
+        if not self.STATE.pending_config:
+            asyncio.get_running_loop().call_soon(self.apply_config)
+        self.STATE.pending_config.append(ConfigUpdate(setting, value, received, self.STATE.blocks_dropped))
+
+    def on_config_error(self, address: str, reason: str) -> None:
+        ez.logger.warning(f'rejected {address}: {reason}')
+        self.STATE.td_client.send_message('/config/error', [address, reason])
+
+    def check_config(self, settings: EEGOSCSettings, changes: typing.Collection[str]) -> None:
+        """ Raises ValueError if the `changes` made to `settings` don't fit the other settings or the input """
+        if ('ssvep_dur' in changes or 'ssvep_min_dur' in changes) and settings.ssvep_min_dur > settings.ssvep_dur:
+            raise ValueError(f'ssvep_min_dur ({settings.ssvep_min_dur} s) exceeds ssvep_dur ({settings.ssvep_dur} s)')
+        if 'bands' in changes and self.STATE.bandpower_fs is not None:
+            nyquist = self.STATE.bandpower_fs / 2
+            over = [name for name, (low, high) in settings.bands.items() if high >= nyquist]
+            if over:
+                raise ValueError(f'bands {over} reach the {nyquist:g} Hz Nyquist frequency of the band power input')
+
+    def apply_config(self) -> None:
+        """
+        Applies queued updates, touching only the stages they affect.
+
+        Everything that can fail is built before the running stages and settings are touched, so
+        a rejected burst leaves them as they were; each of its updates gets a `/config/error`.
+        """
+        updates, self.STATE.pending_config = self.STATE.pending_config, []
+        changes = {update.setting: update.value for update in updates}
+        settings = replace(self.SETTINGS, **changes)
+        stages = {RUNTIME_SETTINGS[setting] for setting in changes}
+        features = self.STATE.features
+
+        templates = self.STATE.templates
+        bands, band_names, zscore_stats = self.STATE.bands, self.STATE.band_names, self.STATE.zscore_stats
+        bandpower, bandpower_axis, zscore = features.bandpower, features.bandpower_axis, features.zscore
+        clients = {}
+        try:
+            self.check_config(settings, changes)
+            if 'templates' in stages:
+                # Refolded at the new stimulus phase; the decoder keeps its windows
+                templates = self.load_templates(settings)
+            if 'bandpower' in stages:
+                band_names, bands = zip(*settings.bands.items())
+                # The statistics belong to the old features
+                zscore_stats = {}
+            if 'bandpower' in stages and features.bandpower is not None:
+                bandpower, bandpower_axis = bandpower_stage(
+                    settings.time_axis,
+                    bands,
+                    settings.bandpower_engine,
+                    settings.bandpower_order,
+                    settings.bandpower_tau,
+                    settings.precision,
+                )
+            if ('bandpower' in stages or 'zscore' in stages) and features.zscore is not None:
+                # Carry the statistics over unless the features themselves changed
+                zscore = zscore_stage(
+                    bandpower_axis,
+                    settings.ch_axis,
+                    settings.bands_tau,
+                    settings.bands_zscore_per_channel,
+                    {f'init_{k}': v for k, v in zscore_stats.items()},
+                )
+            for setting in ('td_address', 'imu_address', 'hand_address'):
+                if setting in changes:
+                    clients[setting.replace('_address', '_client')] = self.open_client(setting, settings)
+        except (ValueError, OSError) as e:
+            for client in clients.values():
+                client.close()
+            for update in updates:
+                self.on_config_error(f'{CONFIG_PREFIX}{update.setting}', str(e))
+            return
+
+        previous_features = self.SETTINGS.features
+        self.apply_settings(settings)
+        self.STATE.templates = templates
+        self.STATE.bands, self.STATE.band_names, self.STATE.zscore_stats = bands, band_names, zscore_stats
+        features.bandpower, features.bandpower_axis, features.zscore = bandpower, bandpower_axis, zscore
+
+        if 'ssvep' in stages and features.ssvep is not None:
+            features.ssvep.send({SSVEP_PARAMS[k]: v for k, v in changes.items() if k in SSVEP_PARAMS})
+        if 'templates' in stages and features.ssvep is not None:
+            features.ssvep.send({'templates': templates})
+
+        if 'features' in stages:
+            # After the rebuilds above so newly enabled stages warm up with the new settings
+            self.switch_features(previous_features)
+            self.offload_ssvep()
+
+        for name, client in clients.items():
+            getattr(self.STATE, name).close()
+            setattr(self.STATE, name, client)
+
+        applied = time.perf_counter()
+        for update in updates:
+            latency_ms = (applied - update.received) * 1e3
+            dropped = self.STATE.blocks_dropped - update.blocks_dropped
+            ez.logger.info(f'config {update.setting} = {update.value} ({RUNTIME_SETTINGS[update.setting]}) applied after {latency_ms:.1f} ms, {dropped} blocks dropped')
+            self.STATE.td_client.send_message('/config/ack', [update.setting, latency_ms, dropped])
+
+    def check_continuity(self, msg: AxisArray) -> None:
+        """ Counts input blocks missing between consecutive messages from the same source """
+        axis = msg.get_axis(self.SETTINGS.time_axis)
+        n = msg.data.shape[msg.get_axis_idx(self.SETTINGS.time_axis)]
+        expected = self.STATE.next_offset.get(msg.key)
+        if expected is not None and n > 0:
+            missing = (axis.offset - expected) / axis.gain
+            if missing > 0.5:
+                self.STATE.blocks_dropped += max(1, round(missing / n))
+        self.STATE.next_offset[msg.key] = axis.offset + n * axis.gain
 
     @ez.subscriber(INPUT_SIGNAL)
     async def on_signal(self, msg: AxisArray):
-        preproc: AxisArray = self.STATE.preproc(msg)
+        self.check_continuity(msg)
+        # A single headset is a batch of one performer
+        self.submit(replace(msg, data = msg.data[None], dims = [PERFORMER_AXIS] + list(msg.dims)))
+
+    def submit(self, msg: AxisArray) -> None:
+        """ Processes a `[PERFORMER_AXIS, time, ch]` block now, or queues it for `process_queue` when shedding load """
+        if self.SETTINGS.backpressure == 'none':
+            self.process_signal(msg)
+            return
+        if self.SETTINGS.backpressure == 'adaptive':
+            self.STATE.blocker.push(msg)
+        else:
+            self.STATE.queue.push(msg)
+        self.STATE.queued.set()
+
+    @ez.task
+    async def process_queue(self) -> None:
+        # Blocks are queued as they arrive and processed here, so whatever arrived while one
+        # batch was processed goes through the stages together with the next
+        if self.SETTINGS.backpressure == 'none':
+            return
+        queue = self.STATE.queue
+        while True:
+            await self.STATE.queued.wait()
+            self.STATE.queued.clear()
+            if self.SETTINGS.backpressure == 'adaptive':
+                await self.process_reblocked()
+                continue
+            if not queue:
+                continue
+            n_queued = len(queue)
+            newest = queue.blocks[-1].get_axis(self.SETTINGS.time_axis).offset
+            blocks = queue.take()
+            self.STATE.blocks_shed += n_queued - len(blocks)
+            for msg in blocks:
+                self.process_signal(msg, newest if self.SETTINGS.backpressure == 'latest' else None)
+
+    async def process_reblocked(self) -> None:
+        """ Processes the blocks the :obj:`AdaptiveBlocker` releases, timing each for its cost model """
+        blocker = self.STATE.blocker
+        merged = blocker.stats.merged
+        blocks = blocker.take()
+        self.STATE.blocks_shed += blocker.stats.merged - merged
+        if self.STATE.release_timer is not None:
+            self.STATE.release_timer.cancel()
+            self.STATE.release_timer = None
+        if blocker.release_at is not None:
+            # Due then even if the input stalls and no other block arrives to trigger a take
+            delay = max(0.0, blocker.release_at - time.perf_counter())
+            self.STATE.release_timer = asyncio.get_running_loop().call_later(delay, self.STATE.queued.set)
+        for i, (msg, arrived) in enumerate(blocks):
+            if i:
+                # Pieces of a split block: let motion and config messages in between
+                await asyncio.sleep(0)
+            tick = time.perf_counter()
+            self.process_signal(msg)
+            done = time.perf_counter()
+            blocker.record(msg.data.shape[msg.get_axis_idx(self.SETTINGS.time_axis)], done - tick, done - arrived)
+
+    def report_lag(self, t_end: float) -> None:
+        """ Sends `/status/lag` every `status_interval`: how far behind the input the outputs are, and the load shed """
+        # Source clocks may be offset from ours, so the lag is the delay beyond the least seen
+        delay = time.time() - t_end
+        self.STATE.delay_floor = min(self.STATE.delay_floor, delay)
+        now = time.perf_counter()
+        if now < self.STATE.next_status:
+            return
+        self.STATE.next_status = now + self.SETTINGS.status_interval
+        lag_ms = (delay - self.STATE.delay_floor) * 1e3
+        shed = self.STATE.blocks_shed
+        self.STATE.td_client.send_message(f'{self.SETTINGS.address_prefix}/status/lag', [lag_ms, len(self.STATE.queue) + len(self.STATE.blocker), shed])
+        if self.SETTINGS.backpressure == 'adaptive':
+            stats = self.STATE.blocker.stats
+            self.STATE.td_client.send_message(f'{self.SETTINGS.address_prefix}/status/reblock', [
+                stats.target, stats.per_call * 1e3, stats.per_sample * 1e6, stats.load, stats.merged, stats.split, stats.over_budget,
+            ])
+        self.report_destinations()
+        if shed > self.STATE.status_shed:
+            ez.logger.info(f'{lag_ms:.0f} ms behind; {shed - self.STATE.status_shed} blocks shed since the last report')
+        self.STATE.status_shed = shed
+
+    def report_destinations(self) -> None:
+        """ Sends `/status/destination [stream, address, datagrams, bytes, errors]` for each destination, once any stream has several """
+        clients = {'td': self.STATE.td_client, 'imu': self.STATE.imu_client, 'hand': self.STATE.hand_client}
+        if all(len(client) <= 1 for client in clients.values()):
+            return
+        for stream, client in clients.items():
+            for stats in client.stats:
+                self.STATE.td_client.send_message(f'{self.SETTINGS.address_prefix}/status/destination', [
+                    stream, stats.address, stats.datagrams, stats.bytes, stats.errors,
+                ])
+
+    def process_signal(self, msg: AxisArray, send_from: typing.Optional[float] = None) -> None:
+        """
+        Runs the feature stages on `[PERFORMER_AXIS, time, ch]` data and sends each performer's results.
+
+        Per-sample streams (preprocessed EEG, envelope) are only sent from time `send_from` on,
+        if given; every sample still goes through the stages, the rings and the jaw detection.
+        """
+        # Convert once at the boundary; no-op if the source already delivers the working precision
+        msg = replace(msg, data = msg.data.astype(self.SETTINGS.precision, copy = False))
+        features = self.STATE.features
+        prefixes = self.STATE.prefixes
+        if not set(self.SETTINGS.features).issuperset(FEATURES):
+            self.STATE.history.push(msg)
+
+        # Only the stages of enabled features run
+        out = compute_features(features, msg)
+        if 'preproc' in out:
+            self.STATE.bandpower_fs = 1.0 / out['preproc'].get_axis(self.SETTINGS.time_axis).gain
+        rings = self.STATE.rings
+        time_axis = msg.get_axis(self.SETTINGS.time_axis)
+        t_end = time_axis.offset + (msg.data.shape[msg.get_axis_idx(self.SETTINGS.time_axis)] - 1) * time_axis.gain
+
+        # Headsets that haven't sent anything yet (see PerformerStack) get nothing sent for them
+        live = msg.attrs.get('live', np.ones(len(prefixes), dtype = bool)).tolist()
+
+        # Which performers have channels worth computing features from
+        usable = live
+        if 'quality' in out:
+            usable = (out['quality'].attrs['good'].any(axis = -1).reshape(-1) & live).tolist()
+            self.send_quality(out['quality'])
 
         # Send processed EEG
-        for aa in preproc.iter_over_axis(self.SETTINGS.time_axis):
-            self.STATE.td_client.send_message('/eeg/preproc', aa.data.tolist())
-
-        # Calculate normalized bandpower
-        bandpower: AxisArray = self.STATE.bandpower(preproc)
-
-        band_dict: typing.Dict[str, float] = {}
-        if bandpower.data.size != 0:
-            # ez.logger.info(bandpower)
-            for band, aa in zip(self.STATE.band_names, bandpower.iter_over_axis('freq')):
-                value = aa.data.mean()
-                self.STATE.td_client.send_message(f'/eeg/{band}', value)
-                band_dict[band] = value
-                ez.logger.info(f'{band}: {value}')
-
-        mean_power = np.mean(np.array([v for v in band_dict.values()])).item()
-        for band, value in band_dict.items():
-            self.STATE.td_client.send_message(f'/eeg/{band}_norm', value / mean_power)
-            ez.logger.info(f'{band}_norm: {value / mean_power}')
-
-        # Calculate SSVEP posteriors
-        posteriors = self.STATE.ssvep(preproc)
-        if posteriors.data.size != 0:
-            probs = posteriors.isel(window = -1).data.flatten()
-            freq = self.SETTINGS.ssvep_freqs[probs.argmax().item()]
-            prob = probs[probs.argmax().item()].item()
-            ez.logger.info(posteriors)
-            self.STATE.td_client.send_message("/ssvep/focus", [freq, prob])
-
-        # Calculate Jaw Clench Envelope
-        envelope: AxisArray = self.STATE.enveloper(msg)
-        if envelope.data.size != 0:
-            for aa in envelope.iter_over_axis(self.SETTINGS.time_axis):
-                value = aa.data.item()
-                self.STATE.td_client.send_message('/eeg/envelope', value)
+        if 'preproc' in self.SETTINGS.features:
+            preproc = out['preproc']
+            preproc_data = np.moveaxis(preproc.data, preproc.get_axis_idx(self.SETTINGS.time_axis), 1)
+            axis = preproc.get_axis(self.SETTINGS.time_axis)
+            first = 0 if send_from is None else max(0, int(np.ceil((send_from - axis.offset) / axis.gain - 1e-6)))
+            if self.SETTINGS.preproc_codec is not None:
+                if first < preproc_data.shape[1]:
+                    for prefix, data, perf_live in zip(prefixes, preproc_data, live):
+                        if not perf_live:
+                            continue
+                        seq = self.STATE.preproc_seq.get(prefix, 0)
+                        self.STATE.preproc_seq[prefix] = seq + 1
+                        packet = encode_block(data[first:], axis.offset + first * axis.gain, 1.0 / axis.gain, seq, self.SETTINGS.preproc_codec, self.SETTINGS.preproc_bits)
+                        self.STATE.td_client.send_message(f'{prefix}/eeg/preproc/packet', packet)
+            else:
+                for samples in np.moveaxis(preproc_data[:, first:], 1, 0):
+                    for prefix, sample, perf_live in zip(prefixes, samples, live):
+                        if perf_live:
+                            self.STATE.td_client.send_message(f'{prefix}/eeg/preproc', sample.tolist())
+            if rings is not None:
+                times = axis.offset + np.arange(preproc_data.shape[1]) * axis.gain
+                labels = [f'ch{i}' for i in range(preproc_data.shape[2])]
+                for prefix, data in zip(prefixes, preproc_data):
+                    rings.write(prefix, 'preproc', times, data, labels)
+
+        # Normalized bandpower
+        if 'zscore' in out:
+            bandpower, zscore = out['bandpower'], out['zscore']
+            self.STATE.zscore_stats = {k: zscore.attrs[k] for k in ('mean', 'var')}
+
+            # Report the most recent value of each band
+            values = per_performer(bandpower, features.bandpower_axis, 'freq')
+            values_norm = per_performer(zscore, features.bandpower_axis, 'freq')
+            for prefix, perf_values, perf_norm, perf_usable in zip(prefixes, values, values_norm, usable):
+                if not perf_usable:
+                    continue
+                for band, value, value_norm in zip(self.STATE.band_names, perf_values.tolist(), perf_norm.tolist()):
+                    self.STATE.td_client.send_message(f'{prefix}/eeg/{band}', value)
+                    self.STATE.td_client.send_message(f'{prefix}/eeg/{band}_norm', value_norm)
+                    ez.logger.info(f'{prefix}{band}: {value} ({band}_norm: {value_norm})')
+                if rings is not None:
+                    labels = list(self.STATE.band_names) + [f'{band}_norm' for band in self.STATE.band_names]
+                    rings.write(prefix, 'bandpower', t_end, np.concatenate([perf_values, perf_norm]), labels)
+
+        # SSVEP decisions; offloaded decoders deliver theirs to on_ssvep instead
+        posteriors = out.get('ssvep')
+        if posteriors is not None and posteriors.data.size != 0:
+            self.send_ssvep(posteriors, t_end)
+
+        # Jaw Clench Envelope
+        envelope = out.get('envelope')
+        if envelope is not None and envelope.data.size != 0:
+            env_data = np.moveaxis(envelope.data, envelope.get_axis_idx(self.SETTINGS.time_axis), 1)
+            axis = envelope.get_axis(self.SETTINGS.time_axis)
+            first = 0 if send_from is None else max(0, int(np.ceil((send_from - axis.offset) / axis.gain - 1e-6)))
+            for i, values in enumerate(np.moveaxis(env_data.reshape(env_data.shape[:2]), 1, 0)):
+                if i >= first:
+                    for prefix, value, perf_live in zip(prefixes, values.tolist(), live):
+                        if perf_live:
+                            self.STATE.td_client.send_message(f'{prefix}/eeg/envelope', value)
 
                 # Check if the envelope exceeds the jaw threshold
                 # 'rest': 0, 'close': 1, 'open': 2
+                value = values[self.STATE.hand_idx]
+                last_value = self.STATE.last_envelope[self.STATE.hand_idx]
                 hand_packet: typing.Optional[bytes] = None
-                if self.STATE.last_envelope <= self.SETTINGS.jaw_thresh and value > self.SETTINGS.jaw_thresh:
+                if last_value <= self.SETTINGS.jaw_thresh and value > self.SETTINGS.jaw_thresh:
                     # Rising Edge
                     hand_packet = b''.join([
                         struct.pack('<B', 2),  # Movement (1 byte), 2 = close
                         struct.pack('<f', 0.5),  # Speed (4 bytes)
                         struct.pack('<H', 1000)  # Duration (2 bytes)
                     ])
-                elif self.STATE.last_envelope > self.SETTINGS.jaw_thresh and value < self.SETTINGS.jaw_thresh:
+                elif last_value > self.SETTINGS.jaw_thresh and value < self.SETTINGS.jaw_thresh:
                     # Falling Edge
                     hand_packet = b''.join([
                         struct.pack('<B', 1),  # Movement (1 byte), 1 = open
@@ -185,38 +598,91 @@ class EEGOSC(ez.Unit):
                         struct.pack('<H', 1000)  # Duration (2 bytes)
                     ])
 
-                self.STATE.last_envelope = value
+                self.STATE.last_envelope = values
 
                 if hand_packet:
-                    hand_addr, hand_port = tuple(self.SETTINGS.hand_address.split(':'))
-                    self.STATE.hand_client.sendto(hand_packet, (hand_addr, int(hand_port)))
+                    self.STATE.hand_client.send(hand_packet)
+
+        self.report_lag(t_end)
+
+    def send_quality(self, quality: AxisArray) -> None:
+        """ Sends each performer's usable channels when they change, and the channel quality metrics every `quality_interval` """
+        prefixes = self.STATE.prefixes
+        good = quality.attrs['good']
+        key = good.tobytes()
+        if key != self.STATE.quality_good:
+            self.STATE.quality_good = key
+            for prefix, perf_good in zip(prefixes, good.reshape(len(prefixes), -1).astype(int).tolist()):
+                self.STATE.td_client.send_message(f'{prefix}/eeg/quality/good', perf_good)
+            ez.logger.info(f'usable channels: {good.sum(axis = -1).tolist()}')
+        now = time.perf_counter()
+        if now < self.STATE.next_quality:
+            return
+        self.STATE.next_quality = now + self.SETTINGS.quality_interval
+        metrics = quality.data.reshape(len(prefixes), -1, len(QUALITY_METRICS))
+        for prefix, perf_metrics in zip(prefixes, metrics):
+            for name, values in zip(QUALITY_METRICS, perf_metrics.T.tolist()):
+                self.STATE.td_client.send_message(f'{prefix}/eeg/quality/{name}', values)
+
+    def send_ssvep(self, posteriors: AxisArray, t_end: float) -> None:
+        """ Sends each performer's SSVEP decision; rows of performers whose decoder isn't confident yet are NaN """
+        prefixes = self.STATE.prefixes
+        rings = self.STATE.rings
+        for prefix, probs, decision_time in zip(prefixes, posteriors.data, posteriors.attrs['decision_time']):
+            if np.isnan(decision_time):
+                continue
+            freq = self.SETTINGS.ssvep_freqs[probs.argmax().item()]
+            prob = probs.max().item()
+            ez.logger.info(f'{prefix}ssvep: {freq} Hz (p = {prob:.2f}) after {decision_time:.2f} s')
+            self.STATE.td_client.send_message(f'{prefix}/ssvep/focus', [freq, prob])
+            self.STATE.td_client.send_message(f'{prefix}/ssvep/decision_time', decision_time.item())
+            if rings is not None:
+                labels = [f'{f:g}Hz' for f in self.SETTINGS.ssvep_freqs] + ['decision_time']
+                rings.write(prefix, 'ssvep', t_end, np.append(probs, decision_time), labels)
+
+    async def shutdown(self) -> None:
+        if self.STATE.executor is not None:
+            self.STATE.executor.shutdown(wait = False, cancel_futures = True)
+        if self.SETTINGS.bands_zscore_stats is not None and self.STATE.zscore_stats:
+            np.savez(self.SETTINGS.bands_zscore_stats, **self.STATE.zscore_stats)
+        if self.STATE.rings is not None:
+            self.STATE.rings.close()
+        for client in (self.STATE.td_client, self.STATE.imu_client, self.STATE.hand_client):
+            client.close()
 
     @ez.subscriber(INPUT_MOTION)
     async def on_motion(self, msg: AxisArray):
+        self.process_motion(msg, self.SETTINGS.address_prefix)
+
+    def process_motion(self, msg: AxisArray, prefix: str) -> None:
+        """ Orientation estimate and IMU messages for the headset addressed by `prefix` """
         time_axis = msg.ax(self.SETTINGS.time_axis)
-        if time_axis.axis.gain != self.STATE.vqf.coeffs['gyrTs']:
-            self.STATE.vqf = VQF(time_axis.axis.gain)
+        vqf = self.STATE.vqf.get(prefix)
+        if vqf is None or time_axis.axis.gain != vqf.coeffs['gyrTs']:
+            vqf = self.STATE.vqf[prefix] = VQF(time_axis.axis.gain)
 
         data = msg.as2d(self.SETTINGS.time_axis) # guarantees time axis is dim 0
-        acc = np.ascontiguousarray(data[:, :3] * 9.8) # Convert from g to m/s^2
-        gyr = np.ascontiguousarray(np.deg2rad(data[:, 3:6])) # Convert from deg/sec to rad/sec
 
         # Output is quaternions in [w x y z] ("scalar first") format
-        orientation = self.STATE.vqf.updateBatch(gyr, acc)['quat6D'][-1, :]
+        orientation = imu_orientation(vqf, data, self.STATE.work)
         rotation = Rotation.from_quat(orientation, scalar_first = True)
         pitch, roll, yaw = rotation.as_euler('xyz') / np.pi # (-1.0 - 1.0)
 
-        aa = msg.isel({self.SETTINGS.time_axis: -1})
-        self.STATE.td_client.send_message('/imu/accel', aa.data[0:3].tolist())
-        self.STATE.td_client.send_message('/imu/gyro', aa.data[3:6].tolist())
-        self.STATE.td_client.send_message('/imu/orientation', orientation.flatten().tolist())
-        self.STATE.td_client.send_message('/imu/orientation_euler', [yaw, pitch, roll])
+        last = data[-1] # latest sample, without building a new AxisArray
+        self.STATE.td_client.send_message(f'{prefix}/imu/accel', last[0:3].tolist())
+        self.STATE.td_client.send_message(f'{prefix}/imu/gyro', last[3:6].tolist())
+        self.STATE.td_client.send_message(f'{prefix}/imu/orientation', orientation.flatten().tolist())
+        self.STATE.td_client.send_message(f'{prefix}/imu/orientation_euler', [yaw, pitch, roll])
+        if self.STATE.rings is not None:
+            t_end = time_axis.axis.offset + (data.shape[0] - 1) * time_axis.axis.gain
+            self.STATE.rings.write(prefix, 'orientation', t_end, np.append(orientation, [yaw, pitch, roll]), ORIENTATION_LABELS)
 
-        imu_addr, imu_port = self.SETTINGS.imu_address.split(':')
-        self.STATE.imu_client.sendto(
-            json.dumps(msg, cls = MessageEncoder).encode(), 
-            (imu_addr, int(imu_port))
-        )
+        if not len(self.STATE.imu_client):
+            return
+        # Sequence numbers let IMUReceiver count lost and reordered datagrams
+        seq = self.STATE.imu_seq.get(prefix, 0)
+        self.STATE.imu_seq[prefix] = seq + 1
+        self.STATE.imu_client.send(json.dumps(replace(msg, attrs = {**msg.attrs, 'seq': seq}), cls = MessageEncoder).encode())
 
 
 class OSCSystemSettings(ez.Settings):
@@ -244,3 +710,48 @@ class OSCSystem(ez.Collection):
             (self.DASHBOARD.OUTPUT_SIGNAL, self.OSC.INPUT_SIGNAL),
             (self.DASHBOARD.OUTPUT_MOTION, self.OSC.INPUT_MOTION),
         )
+
+
+class SyntheticOSCSystemSettings(ez.Settings):
+    osc_settings: EEGOSCSettings
+    source_settings: SyntheticSourceSettings
+
+class SyntheticOSCSystem(ez.Collection):
+    """ OSC pipeline driven by a synthetic headset; set source_settings.speed > 1 to load-test """
+
+    SETTINGS = SyntheticOSCSystemSettings
+
+    SOURCE = SyntheticSource()
+    OSC = EEGOSC()
+
+    def configure(self) -> None:
+        self.SOURCE.apply_settings(self.SETTINGS.source_settings)
+        self.OSC.apply_settings(self.SETTINGS.osc_settings)
+
+    def network(self) -> ez.NetworkDefinition:
+        return (
+            (self.SOURCE.OUTPUT_SIGNAL, self.OSC.INPUT_SIGNAL),
+            (self.SOURCE.OUTPUT_MOTION, self.OSC.INPUT_MOTION),
+        )
+
+
+class IMUOSCSystemSettings(ez.Settings):
+    receiver_settings: IMUReceiverSettings
+    osc_settings: EEGOSCSettings
+
+class IMUOSCSystem(ez.Collection):
+    """ IMU streams received over UDP (e.g. from another machine's EEGOSC) into EEGOSC's orientation and IMU messages """
+
+    SETTINGS = IMUOSCSystemSettings
+
+    RECEIVER = IMUReceiver()
+    OSC = EEGOSC()
+
+    def configure(self) -> None:
+        self.RECEIVER.apply_settings(self.SETTINGS.receiver_settings)
+        self.OSC.apply_settings(self.SETTINGS.osc_settings)
+
+    def network(self) -> ez.NetworkDefinition:
+        return (
+            (self.RECEIVER.OUTPUT_MOTION, self.OSC.INPUT_MOTION),
+        )
@@ -0,0 +1,148 @@
+import typing
+
+import numpy as np
+import scipy.signal
+
+from ezmsg.util.generator import consumer
+from ezmsg.util.messages.axisarray import AxisArray, replace
+
+from neurotheatre.workspace import Workspace
+
+
+def _block_operator(sos: np.ndarray, n: int, factor: int, first: int, mix: np.ndarray) -> np.ndarray:
+    """
+    The whole preprocessing of an `n`-sample block as one matrix.
+
+    Filtering a block is linear in the filter state going in and the block's samples, and so
+    are the kept outputs and the state going out.  Running `sos` once over unit states and
+    unit impulses gives that map for one channel; only the kept rows (`first::factor`) are
+    retained, and the channel mixing is folded in with a Kronecker product.  Columns are
+    `[state (s, ch); samples (t, ch)]`, rows `[kept outputs (k, ch); new state (s, ch)]`.
+    """
+    n_state = sos.shape[0] * 2
+    basis = np.eye(n_state + n)
+    zi = basis[:n_state].reshape(sos.shape[0], 2, n_state + n)
+    y, zf = scipy.signal.sosfilt(sos, basis[n_state:], axis = 0, zi = zi)
+    n_ch = mix.shape[0]
+    return np.concatenate([
+        np.kron(y[first::factor], mix),
+        np.kron(zf.reshape(n_state, n_state + n), np.eye(n_ch)),
+    ])
+
+
+@consumer
+def decimating_preproc(
+    time_axis: str = 'time',
+    ch_axis: str = 'ch',
+    order: int = 3,
+    cuton: float = 1.0,
+    cutoff: float = 50.0,
+    factor: int = 2,
+    rereference: bool = True,
+    block: int = 10,
+) -> typing.Generator[AxisArray, AxisArray, None]:
+    """
+    Butterworth band-pass, decimation and common average reference in one pass.
+
+    Equivalent (to rounding) to `butter` -> `downsample` -> `common_rereference`, but each
+    block goes through a single precomputed matrix (see :obj:`_block_operator`) that only
+    computes the samples kept after decimation, with the average reference folded in as a
+    channel-mixing matrix, instead of three stages each filtering or copying every sample
+    into a new message.  Filter state and the decimation phase carry across messages.
+
+    Args:
+        time_axis: Name of the time axis; must be a LinearAxis.
+        ch_axis: Name of the channel axis.
+        order: Butterworth order.
+        cuton: Band-pass low corner (Hz).
+        cutoff: Band-pass high corner (Hz).
+        factor: Keep every `factor`-th filtered sample.
+        rereference: Subtract the channel mean from each channel.
+        block: Messages are processed in pieces of this many samples, which bounds the size
+            of the block matrices (one per piece length and decimation phase).  Rounding
+            depends on where the pieces start: while the live block size is a multiple of
+            `block`, a longer message made of whole live blocks (offline chunks, merged
+            blocks) gives exactly the output of the blocks one by one.
+
+    Returns:
+        A primed generator that accepts an :obj:`AxisArray` via `.send(axis_array)` and yields
+        an :obj:`AxisArray` with the same dims at 1/`factor` the rate, computed in the input's
+        floating point precision (float64 for other inputs).  If a message is shorter than
+        the decimation interval the output has no samples.
+    """
+    if factor < 1:
+        raise ValueError("Decimation factor must be at least 1 (no decimation)")
+
+    msg_out = AxisArray(np.array([]), dims = [""])
+    work = Workspace() # block matrices, one per block length and phase
+
+    sos: typing.Optional[np.ndarray] = None
+    mix: typing.Optional[np.ndarray] = None
+    zi: typing.Optional[np.ndarray] = None # (batch, n_state * n_ch)
+    s_idx: int = 0 # position of the next input sample in the decimation cycle
+
+    check_input = {"gain": None, "shape": None, "key": None, "dtype": None}
+
+    while True:
+        msg_in: AxisArray = yield msg_out
+
+        axis_info = msg_in.get_axis(time_axis)
+        time_idx = msg_in.get_axis_idx(time_axis)
+        ch_idx = msg_in.get_axis_idx(ch_axis)
+        # [..., time, ch], flattened to one row per performer (or other leading index)
+        perm = [i for i in range(msg_in.data.ndim) if i not in (time_idx, ch_idx)] + [time_idx, ch_idx]
+        data = msg_in.data.transpose(perm)
+        batch_shape, (n, n_ch) = data.shape[:-2], data.shape[-2:]
+        rows = data.reshape(int(np.prod(batch_shape)), n * n_ch)
+        dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.dtype(np.float64)
+
+        b_reset = axis_info.gain != check_input["gain"]
+        b_reset = b_reset or data.shape[:-2] + data.shape[-1:] != check_input["shape"]
+        b_reset = b_reset or msg_in.key != check_input["key"]
+        b_reset = b_reset or dtype != check_input["dtype"]
+        if b_reset:
+            check_input["gain"] = axis_info.gain
+            check_input["shape"] = data.shape[:-2] + data.shape[-1:]
+            check_input["key"] = msg_in.key
+            check_input["dtype"] = dtype
+            sos = scipy.signal.butter(order, (cuton, cutoff), btype = 'bandpass', fs = 1.0 / axis_info.gain, output = 'sos')
+            # Steady state for a constant input of 1, as `butter` starts its filters
+            zi = np.tile(np.repeat(scipy.signal.sosfilt_zi(sos).reshape(-1), n_ch), (rows.shape[0], 1)).astype(dtype)
+            mix = np.eye(n_ch) - 1.0 / n_ch if rereference else np.eye(n_ch)
+            work = Workspace()
+            s_idx = 0
+
+        first = (-s_idx) % factor
+        n_kept = len(range(first, n, factor))
+        n_state = zi.shape[1]
+        # The output is the one fresh array per block: it is published and held downstream
+        out = np.empty((rows.shape[0], n_kept * n_ch), dtype = dtype)
+        done = kept = 0
+        while done < n:
+            size = min(block, n - done)
+            phase = (-(s_idx + done)) % factor
+            op_t = work.cached(f'op{size}_{phase}', n_ch, lambda: _block_operator(sos, size, factor, phase, mix).T.astype(dtype, order = 'C'))
+            k = len(range(phase, size, factor))
+            stacked = work.get(f'in{size}', (rows.shape[0], n_state + size * n_ch), dtype)
+            stacked[:, :n_state] = zi
+            stacked[:, n_state:] = rows[:, done * n_ch:(done + size) * n_ch]
+            result = np.matmul(stacked, op_t, out = work.get(f'out{size}_{phase}', (rows.shape[0], op_t.shape[1]), dtype))
+            out[:, kept * n_ch:(kept + k) * n_ch] = result[:, :k * n_ch]
+            zi[...] = result[:, k * n_ch:]
+            done += size
+            kept += k
+        s_idx = (s_idx + n) % factor
+
+        data_out = out.reshape(batch_shape + (n_kept, n_ch)).transpose([perm.index(i) for i in range(len(perm))])
+        msg_out = replace(
+            msg_in,
+            data = data_out,
+            axes = {
+                **msg_in.axes,
+                time_axis: replace(
+                    axis_info,
+                    gain = axis_info.gain * factor,
+                    offset = axis_info.offset + (first * axis_info.gain if n_kept else 0.0),
+                ),
+            },
+        )
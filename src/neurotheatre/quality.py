@@ -0,0 +1,180 @@
+import math
+import typing
+
+import numpy as np
+import scipy.signal
+
+from ezmsg.util.generator import consumer
+from ezmsg.util.messages.axisarray import AxisArray, replace
+
+from neurotheatre.bandpower import _band_sos
+from neurotheatre.preproc import _block_operator
+from neurotheatre.workspace import Workspace
+
+
+# Per-channel metrics of :obj:`signal_quality`, in the order of its 'quality' axis
+QUALITY_METRICS = ('flat', 'saturated', 'line_ratio', 'variance')
+
+
+def _quality_operator(line_sos: np.ndarray, band_sos: np.ndarray, n: int, alpha: float) -> np.ndarray:
+    """
+    Everything linear that :obj:`signal_quality` computes from an `n`-sample piece of one channel.
+
+    Columns are `[line filter state (2); band filter state (2); previous sample; running
+    mean; samples (n)]`; rows are the piece's line band and 1 - 40 Hz outputs, sample
+    differences and deviations from the running mean (updated with weight `alpha` first),
+    `n` each, followed by the new state in the column order.
+    """
+    line, band = (_block_operator(sos, n, 1, 0, np.eye(1)) for sos in (line_sos, band_sos))
+    op = np.zeros((4 * n + 6, 6 + n))
+    op[:n, :2], op[:n, 6:] = line[:n, :2], line[:n, 2:]
+    op[n:2 * n, 2:4], op[n:2 * n, 6:] = band[:n, :2], band[:n, 2:]
+    op[2 * n:3 * n, 6:] = np.eye(n) - np.eye(n, k = -1)
+    op[2 * n, 4] = -1.0
+    mean = op[4 * n + 5]
+    mean[5], mean[6:] = 1.0 - alpha, alpha / n
+    op[3 * n:4 * n, 6:] = np.eye(n)
+    op[3 * n:4 * n] -= mean
+    op[4 * n:4 * n + 2, :2], op[4 * n:4 * n + 2, 6:] = line[n:, :2], line[n:, 2:]
+    op[4 * n + 2:4 * n + 4, 2:4], op[4 * n + 2:4 * n + 4, 6:] = band[n:, :2], band[n:, 2:]
+    op[4 * n + 4, 5 + n] = 1.0
+    return op
+
+
+@consumer
+def signal_quality(
+    time_axis: str = 'time',
+    ch_axis: str = 'ch',
+    tau: float = 0.5,
+    line_freq: float = 60.0,
+    flat_thresh: float = 0.5,
+    saturation: float = 7.5e5,
+    saturated_thresh: float = 0.05,
+    line_thresh: float = 1.0,
+    var_thresh: float = 1e5,
+    min_channels: int = 4,
+    block: int = 10,
+) -> typing.Generator[AxisArray, AxisArray, None]:
+    """
+    Streaming per-channel signal quality of raw EEG, and which channels are usable.
+
+    Exponentially weighted statistics (time constant `tau`) of every channel, vectorized
+    over all other axes (e.g. performers):
+
+    * 'flat': RMS of the sample-to-sample differences (uV).  A channel that lost contact or
+      is stuck at a rail reads (nearly) constant.  Averaged geometrically, so a drop by
+      orders of magnitude registers within a fraction of a second.
+    * 'saturated': Fraction of samples at or beyond +-`saturation` (uV), the amplifier's range.
+    * 'line_ratio': Power within 2 Hz of `line_freq` over power in 1 - 40 Hz.
+    * 'variance': Variance about the running mean (uV^2): movement and cable swings.
+
+    A channel is good unless it is flat (below `flat_thresh`), saturated (above
+    `saturated_thresh`), swamped by line noise (above `line_thresh`) or moving (above
+    `var_thresh`).  If fewer than `min_channels` of a performer's channels are good, none
+    are: features of what is left wouldn't be worth computing.
+
+    All but the saturation count are linear in the samples and a little state per channel,
+    so each piece of at most `block` samples of every channel goes through one precomputed
+    matrix (see :obj:`_quality_operator`), much as in :obj:`decimating_preproc`.
+
+    Returns:
+        A primed generator that accepts raw :obj:`AxisArray` blocks via `.send(axis_array)`
+        and yields the metrics after each block, dims `[*other dims, ch_axis, 'quality']`
+        (see `QUALITY_METRICS`).  `attrs['good']` is the boolean mask of usable channels,
+        dims `[*other dims, ch_axis]`.  A block without samples yields the previous output.
+    """
+    msg_out = AxisArray(np.array([]), dims = [""])
+    work = Workspace() # block matrices, one per piece length
+
+    # Metrics (in QUALITY_METRICS order) from the running statistics, and their bounds
+    order = [2, 4, 0, 3]
+    low = np.array([flat_thresh, -np.inf, -np.inf, -np.inf])
+    high = np.array([np.inf, saturated_thresh, line_thresh, var_thresh])
+
+    sos: typing.Tuple[np.ndarray, np.ndarray] = (np.empty((0, 6)), np.empty((0, 6))) # line band, 1 - 40 Hz
+    zi: typing.Optional[np.ndarray] = None # (batch * ch, 6), see _quality_operator
+    # (batch * ch, 5) running mean squares of the line band, the 1 - 40 Hz band, the differences
+    # (log), the deviations, and the saturated fraction
+    stats: typing.Optional[np.ndarray] = None
+
+    check_input = {"gain": None, "shape": None, "key": None}
+
+    while True:
+        msg_in: AxisArray = yield msg_out
+
+        axis_info = msg_in.get_axis(time_axis)
+        time_idx = msg_in.get_axis_idx(time_axis)
+        ch_idx = msg_in.get_axis_idx(ch_axis)
+        perm = [i for i in range(msg_in.data.ndim) if i not in (time_idx, ch_idx)] + [time_idx, ch_idx]
+        data = msg_in.data.transpose(perm) # (*other, time, ch)
+        batch_shape, (n, n_ch) = data.shape[:-2], data.shape[-2:]
+        if n == 0:
+            continue
+        n_batch = math.prod(batch_shape)
+        # One row per channel of each performer (or other leading index)
+        rows = data.reshape(n_batch, n, n_ch).transpose(0, 2, 1).reshape(n_batch * n_ch, n)
+
+        b_reset = axis_info.gain != check_input["gain"]
+        b_reset = b_reset or data.shape[:-2] + data.shape[-1:] != check_input["shape"]
+        b_reset = b_reset or msg_in.key != check_input["key"]
+        if b_reset:
+            check_input["gain"] = axis_info.gain
+            check_input["shape"] = data.shape[:-2] + data.shape[-1:]
+            check_input["key"] = msg_in.key
+            fs = 1.0 / axis_info.gain
+            sos = (_band_sos(1, (line_freq - 2.0, line_freq + 2.0), fs), _band_sos(1, (1.0, 40.0), fs))
+            # Filters settled on the first sample, which is also the previous sample and the mean
+            states = np.concatenate([scipy.signal.sosfilt_zi(s).reshape(-1) for s in sos] + [np.ones(2)])
+            zi = rows[:, :1] * states
+            stats = None
+            work = Workspace()
+
+        # Hardly any block reaches the rails: only count when one does
+        clipping = np.abs(rows, out = work.get('abs', rows.shape)).max() >= saturation
+
+        done = 0
+        while done < n:
+            size = min(block, n - done)
+            alpha = 1.0 - math.exp(-size * axis_info.gain / tau)
+            op_t = work.cached(f'op{size}', None, lambda: _quality_operator(*sos, size, alpha).T.copy())
+            stacked = work.get(f'in{size}', (rows.shape[0], 6 + size))
+            stacked[:, :6] = zi
+            stacked[:, 6:] = rows[:, done:done + size]
+            result = np.matmul(stacked, op_t, out = work.get(f'out{size}', (rows.shape[0], op_t.shape[1])))
+            zi[...] = result[:, 4 * size:]
+
+            piece = work.get('piece', (rows.shape[0], 5))
+            outputs = result[:, :4 * size].reshape(rows.shape[0], 4, size)
+            np.square(outputs, out = outputs)
+            np.add.reduce(outputs, axis = -1, out = piece[:, :4])
+            if clipping:
+                np.add.reduce(work.get('abs', rows.shape)[:, done:done + size] >= saturation, axis = -1, out = piece[:, 4])
+            else:
+                piece[:, 4] = 0.0
+            piece *= 1.0 / size
+            np.log(np.add(piece[:, 2], 1e-6, out = piece[:, 2]), out = piece[:, 2])
+            if stats is None:
+                # Start from the first piece rather than from zero, which reads as flat
+                stats = piece.copy()
+            else:
+                piece -= stats
+                piece *= alpha
+                stats += piece
+            done += size
+
+        # The one fresh array per block: it is published and held downstream
+        metrics = stats[:, order]
+        np.exp(np.multiply(metrics[:, 0], 0.5, out = metrics[:, 0]), out = metrics[:, 0])
+        metrics[:, 2] /= np.maximum(stats[:, 1], 1e-12)
+        metrics = metrics.reshape(batch_shape + (n_ch, len(QUALITY_METRICS)))
+
+        good = np.logical_and.reduce((metrics >= low) & (metrics <= high), axis = -1)
+        good &= np.add.reduce(good, axis = -1, keepdims = True) >= min_channels
+
+        msg_out = replace(
+            msg_in,
+            data = metrics,
+            dims = [msg_in.dims[i] for i in perm if i != time_idx] + ['quality'],
+            axes = {k: v for k, v in msg_in.axes.items() if k != time_axis},
+            attrs = {**msg_in.attrs, 'good': good},
+        )
@@ -0,0 +1,205 @@
+import math
+import time
+import typing
+
+from collections import deque
+from dataclasses import dataclass
+
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray, replace
+
+
+@dataclass
+class ReblockStats:
+    """ What an :obj:`AdaptiveBlocker` decided, and the estimates it decided on """
+    target: int = 0 # samples per processed block
+    per_call: float = 0.0 # sec, estimated fixed cost of processing a block
+    per_sample: float = 0.0 # sec, estimated cost of each sample in it
+    spread: float = 0.0 # sec, standard deviation of the costs about the estimate
+    arrival: float = 0.0 # sec, measured time between input samples
+    load: float = 0.0 # estimated fraction of the time spent processing, at the target
+    catching_up: bool = False # no block length within the budget keeps up with the input
+    blocks_in: int = 0
+    merged: int = 0 # input blocks merged into others
+    split: int = 0 # extra blocks from splitting input blocks
+    over_budget: int = 0 # processed blocks whose oldest sample took longer than the budget
+
+
+class AdaptiveBlocker:
+    """
+    Re-blocks a stream of blocks to the length that gives the most throughput within a latency budget.
+
+    Processing a block is modelled as a fixed cost per call plus a cost per sample, fitted
+    online (with exponential forgetting) to the costs passed to `record`; planning adds
+    `margin` standard deviations of the costs about the fit, for the blocks on which band
+    power or the SSVEP decoder evaluate.  Merging `k` input blocks spreads the fixed cost
+    over more samples, but the oldest sample waits for the newest block to arrive: `take`
+    holds blocks back for as long as that wait plus the processing stays within `budget`
+    (sec).  An input block that alone would take longer than the budget to process is split
+    into pieces that don't, so that no call holds up the event loop for longer.
+
+    Whatever has queued up is merged without waiting, as in :obj:`BlockQueue`: one call
+    finishes every block in it sooner than one call each.  So if no block length within the
+    budget keeps up with the input (estimated load above `max_load`), nothing is held back,
+    splits stop, and `stats.over_budget` counts the blocks that end up late.
+
+    Every sample is passed on in order.  Only contiguous, equally shaped blocks are merged;
+    splits are cut at multiples of `step` samples, the piece length of the fused
+    preprocessing, so the stages give exactly the live output.  Blocks held back go out on
+    the first `take` after waiting longer would break the budget, or with `flush`; after a
+    `take` that holds some back, `release_at` is that time, so the caller can call `take`
+    again then if no other block arrives first.  Blocks without samples are dropped.
+    """
+
+    def __init__(
+        self,
+        budget: float,
+        time_axis: str = 'time',
+        step: int = 10,
+        max_merge: int = 20,
+        max_load: float = 0.8,
+        margin: float = 2.0,
+        forget: float = 0.95,
+        warmup: int = 5,
+    ):
+        self.budget = budget
+        self.time_axis = time_axis
+        self.step = step
+        self.max_merge = max_merge
+        self.max_load = max_load
+        self.margin = margin
+        self.forget = forget
+        self.warmup = warmup
+        self.blocks: typing.Deque[typing.Tuple[AxisArray, float]] = deque() # with their arrival times
+        self.release_at: typing.Optional[float] = None # when blocks held back by the last take are due
+        self.stats = ReblockStats()
+        # Exponentially weighted sums of 1, n, n^2, cost, n * cost and the squared residual
+        # over the recorded calls
+        self._sums = np.zeros(6)
+        self._n_records = 0
+        # Exponentially weighted time between and samples in pushed blocks
+        self._last_push: typing.Optional[float] = None
+        self._gaps = np.zeros(2)
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def push(self, msg: AxisArray, now: typing.Optional[float] = None) -> None:
+        now = time.perf_counter() if now is None else now
+        n = msg.data.shape[msg.get_axis_idx(self.time_axis)]
+        if n == 0:
+            return
+        if self._last_push is not None:
+            self._gaps *= self.forget
+            self._gaps += (now - self._last_push, n)
+            self.stats.arrival = self._gaps[0] / self._gaps[1] if self._gaps[1] else 0.0
+        elif not self.stats.arrival:
+            self.stats.arrival = msg.get_axis(self.time_axis).gain # until measured
+        self._last_push = now
+        self.blocks.append((msg, now))
+        self.stats.blocks_in += 1
+
+    def record(self, n: int, cost: float, latency: float) -> None:
+        """ A block of `n` samples from `take` took `cost` sec to process, `latency` sec after its oldest sample arrived """
+        residual = cost - self.cost(n) if self._n_records else 0.0
+        self._sums *= self.forget
+        self._sums += (1.0, n, n * n, cost, n * cost, residual * residual)
+        self._n_records += 1
+        s1, sn, snn, sc, snc, sr = self._sums
+        # Least squares of cost = per_call + per_sample * n, shrunk towards a proportional
+        # cost while the lengths seen so far barely differ
+        ridge = 1e-3 * s1
+        det = (s1 + ridge) * snn - sn * sn
+        per_call = (snn * sc - sn * snc) / det if det > 0 else 0.0
+        per_sample = ((s1 + ridge) * snc - sn * sc) / det if det > 0 else 0.0
+        if per_sample <= 0.0:
+            per_call, per_sample = sc / s1, 0.0
+        elif per_call < 0.0:
+            per_call, per_sample = 0.0, snc / snn
+        self.stats.per_call, self.stats.per_sample, self.stats.spread = per_call, per_sample, math.sqrt(sr / s1)
+        if latency > self.budget:
+            self.stats.over_budget += 1
+
+    def cost(self, n: int, margin: float = 0.0) -> float:
+        """ Estimated sec to process a block of `n` samples, plus `margin` standard deviations """
+        return self.stats.per_call + self.stats.per_sample * n + margin * self.stats.spread
+
+    def plan(self, m: int) -> int:
+        """ Samples per processed block for input blocks of `m` samples """
+        if self._n_records < self.warmup or m == 0:
+            return m
+        arrival = self.stats.arrival
+
+        def load(k: int) -> float:
+            return self.cost(k * m) / (k * m * arrival) if arrival > 0 else 0.0
+
+        fits = [k for k in range(1, self.max_merge + 1) if (k - 1) * m * arrival + self.cost(k * m, self.margin) <= self.budget]
+        self.stats.catching_up = False
+        if fits and load(fits[-1]) <= self.max_load:
+            k = fits[-1] # the most throughput within the budget
+        elif not fits and load(1) <= self.max_load:
+            # Even one block takes too long: pieces that each fit (or the shortest allowed)
+            per_sample = self.stats.per_sample
+            n = (self.budget - self.cost(0, self.margin)) / per_sample if per_sample > 0 else m
+            n = max(self.step, int(n // self.step) * self.step)
+            self.stats.target, self.stats.load = min(n, m), load(1)
+            return self.stats.target
+        else:
+            # Falling behind: the shortest merge that would keep up, beyond the budget
+            k = next((k for k in range(1, self.max_merge + 1) if load(k) <= self.max_load), self.max_merge)
+            self.stats.catching_up = True
+        self.stats.target, self.stats.load = k * m, load(k)
+        return self.stats.target
+
+    def take(self, now: typing.Optional[float] = None, flush: bool = False) -> typing.List[typing.Tuple[AxisArray, float]]:
+        """ Blocks to process now, each with the arrival time of its oldest sample; `flush` also releases those held back """
+        now = time.perf_counter() if now is None else now
+        out: typing.List[typing.Tuple[AxisArray, float]] = []
+        self.release_at = None
+        while self.blocks:
+            first, arrived = self.blocks[0]
+            idx = first.get_axis_idx(self.time_axis)
+            m = first.data.shape[idx]
+            target = self.plan(m)
+            if target < m:
+                self.blocks.popleft()
+                axis = first.get_axis(self.time_axis)
+                for start in range(0, m, target):
+                    out.append((replace(
+                        first,
+                        data = first.data[(slice(None),) * idx + (slice(start, start + target),)],
+                        axes = {**first.axes, self.time_axis: AxisArray.LinearAxis(unit = axis.unit, gain = axis.gain, offset = axis.offset + start * axis.gain)},
+                    ), arrived))
+                self.stats.split += math.ceil(m / target) - 1
+                continue
+
+            k = target // m
+            run = self._run(max(k, len(self.blocks)))
+            if len(run) < k and len(run) == len(self.blocks) and not flush:
+                # The rest of the merge hasn't arrived yet: wait for it unless that's too late
+                expected = self.blocks[-1][1] + (k - len(run)) * m * self.stats.arrival
+                if max(now, expected) - arrived + self.cost(k * m, self.margin) <= self.budget:
+                    self.release_at = arrived + self.budget - self.cost(k * m, self.margin)
+                    break
+            for _ in run:
+                self.blocks.popleft()
+            merged = run[0] if len(run) == 1 else replace(run[0], data = np.concatenate([msg.data for msg in run], axis = idx))
+            out.append((merged, arrived))
+            self.stats.merged += len(run) - 1
+        return out
+
+    def _run(self, k: int) -> typing.List[AxisArray]:
+        """ Up to `k` contiguous, equally shaped blocks from the front of the queue """
+        run = [self.blocks[0][0]]
+        for msg, _ in list(self.blocks)[1:k]:
+            last = run[-1]
+            idx = last.get_axis_idx(self.time_axis)
+            axis, last_axis = msg.get_axis(self.time_axis), last.get_axis(self.time_axis)
+            end = last_axis.offset + last.data.shape[idx] * last_axis.gain
+            contiguous = np.abs(axis.offset - end) < 0.5 * axis.gain and axis.gain == last_axis.gain
+            same_shape = msg.dims == last.dims and np.delete(msg.data.shape, idx).tolist() == np.delete(last.data.shape, idx).tolist()
+            if not (contiguous and same_shape):
+                break
+            run.append(msg)
+        return run
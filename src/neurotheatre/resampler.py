@@ -0,0 +1,204 @@
+import math
+import threading
+import typing
+
+import numpy as np
+import numpy.typing as npt
+
+from ezmsg.util.generator import consumer
+from ezmsg.util.messages.axisarray import AxisArray, replace
+
+
+@consumer
+def adaptive_resample(
+    axis: typing.Optional[str] = None,
+    fs_out: float = 44100.0,
+    dtype: npt.DTypeLike = None,
+) -> typing.Generator[AxisArray, typing.Union[AxisArray, typing.Dict[str, float]], None]:
+    """
+    Fractional-ratio resampler whose ratio can be trimmed while streaming.
+
+    Output samples are placed `1 / (fs_out * (1 + correction))` apart (in the input's time
+    base) and interpolated with a cubic Catmull-Rom spline.  The interpolation phase and the
+    last three input samples are carried across messages, so there are no seams at block
+    boundaries whatever the ratio; the output lags the input by two input samples.
+
+    Args:
+        axis: The name of the axis to resample; must be a LinearAxis.  None uses the first dim.
+        fs_out: Nominal output rate (Hz).  The input rate is read from the axis gain.
+        dtype: Working precision.  None keeps the input dtype.
+
+    Returns:
+        A primed generator.  `.send(axis_array)` yields the resampled :obj:`AxisArray`;
+        `.send({'correction': c})` sets the relative rate correction (e.g. 1e-4 produces
+        0.01% more output samples) for the following messages and yields an empty message.
+    """
+    msg_out = AxisArray(np.array([]), dims = [""])
+
+    correction = 0.0
+    history: typing.Optional[np.ndarray] = None # (3, ...) last input samples
+    pos = 1.0 # position of the next output sample, in input samples from history[0]
+
+    while True:
+        msg_in = yield msg_out
+
+        if isinstance(msg_in, dict):
+            correction = float(msg_in.get('correction', correction))
+            msg_out = AxisArray(np.array([]), dims = [""])
+            continue
+
+        if axis is None:
+            axis = msg_in.dims[0]
+        axis_idx = msg_in.get_axis_idx(axis)
+        axis_info = msg_in.get_axis(axis)
+        data = np.moveaxis(msg_in.data, axis_idx, 0)
+        if dtype is not None:
+            data = data.astype(dtype, copy = False)
+
+        if history is None:
+            if data.shape[0] == 0:
+                msg_out = replace(msg_in, data = np.moveaxis(data, 0, axis_idx))
+                continue
+            history = np.repeat(data[:1], 3, axis = 0)
+
+        x = np.concatenate([history, data])
+        step = 1.0 / (fs_out * axis_info.gain * (1.0 + correction)) # input samples per output sample
+        n_out = max(0, math.ceil((x.shape[0] - 2 - pos) / step))
+        p = pos + step * np.arange(n_out)
+        i = p.astype(int)
+        f = (p - i).reshape((-1,) + (1,) * (x.ndim - 1)).astype(x.dtype, copy = False)
+        p0, p1, p2, p3 = x[i - 1], x[i], x[i + 1], x[i + 2]
+        y = p1 + 0.5 * f * (p2 - p0 + f * (2.0 * p0 - 5.0 * p1 + 4.0 * p2 - p3 + f * (3.0 * (p1 - p2) + p3 - p0)))
+
+        # x[k] is at input time offset + (k - 3) * gain
+        offset = axis_info.offset + (pos - 3.0) * axis_info.gain
+        pos += step * n_out - data.shape[0]
+        history = x[-3:]
+
+        msg_out = replace(
+            msg_in,
+            data = np.moveaxis(y, 0, axis_idx),
+            axes = {**msg_in.axes, axis: replace(axis_info, gain = axis_info.gain * step, offset = offset)},
+        )
+
+
+class SampleFifo:
+    """
+    Ring buffer of audio frames between the EEG stream and the sound card callback thread.
+
+    Reads never block.  Until the buffer holds `prime` frames, and again after it runs dry,
+    reads return silence, so playback (re)starts with the target latency already buffered.
+    Writes that would exceed `capacity` drop the oldest frames.
+    """
+
+    def __init__(self, capacity: int, channels: int, prime: int, dtype: npt.DTypeLike = np.float32):
+        self.buffer = np.zeros((capacity, channels), dtype = dtype)
+        self.prime = min(prime, capacity)
+        self.primed = False
+        self.n_written = 0 # frames written since creation
+        self.n_read = 0 # frames read (played or dropped) since creation
+        self.underruns = 0 # times the buffer ran dry while playing
+        self.dropped = 0 # frames dropped on overflow
+        self._lock = threading.Lock()
+
+    @property
+    def fill(self) -> int:
+        return self.n_written - self.n_read
+
+    def write(self, frames: np.ndarray) -> None:
+        capacity = self.buffer.shape[0]
+        excess = max(0, frames.shape[0] - capacity)
+        frames = frames[excess:]
+        n = frames.shape[0]
+        with self._lock:
+            self.dropped += excess
+            overflow = self.fill + n - capacity
+            if overflow > 0:
+                self.n_read += overflow
+                self.dropped += overflow
+            start = self.n_written % capacity
+            first = min(n, capacity - start)
+            self.buffer[start:start + first] = frames[:first]
+            self.buffer[:n - first] = frames[first:]
+            self.n_written += n
+            if not self.primed and self.fill >= self.prime:
+                self.primed = True
+
+    def read(self, n: int) -> np.ndarray:
+        out = np.zeros((n, self.buffer.shape[1]), dtype = self.buffer.dtype)
+        capacity = self.buffer.shape[0]
+        with self._lock:
+            if not self.primed:
+                return out
+            available = min(n, self.fill)
+            start = self.n_read % capacity
+            first = min(available, capacity - start)
+            out[:first] = self.buffer[start:start + first]
+            out[first:available] = self.buffer[:available - first]
+            self.n_read += available
+            if available < n:
+                self.primed = False
+                self.underruns += 1
+        return out
+
+
+class DriftController:
+    """
+    Holds a FIFO at a target latency by trimming the resampling ratio.
+
+    The fill level (sampled right after each input block is written, so always at the same
+    point of the input sawtooth) is smoothed with a one-pole filter of time constant `tau`,
+    and a critically damped PI loop of bandwidth `bandwidth` turns the latency error into a
+    relative rate correction for :obj:`adaptive_resample`.  The integral term settles at the
+    rate mismatch between the EEG and audio clocks and is reported as `drift_ppm` (negative
+    when the EEG clock runs fast relative to the sound card).
+
+    Args:
+        target: Target latency (sec of buffered audio).
+        bandwidth: Loop natural frequency (Hz).  Lower is smoother pitch, slower lock.
+        tau: Time constant (sec) of the fill level smoother.
+        max_correction: Largest relative rate correction applied.
+    """
+
+    def __init__(self, target: float, bandwidth: float = 0.01, tau: float = 2.0, max_correction: float = 0.005):
+        w = 2.0 * np.pi * bandwidth
+        self.kp = 2.0 * w
+        self.ki = w * w
+        self.target = target
+        self.tau = tau
+        self.max_correction = max_correction
+        self.integral = 0.0
+        self.correction = 0.0
+        self.latency: typing.Optional[float] = None # smoothed fill level (sec)
+        self._t: typing.Optional[float] = None
+
+    @property
+    def drift_ppm(self) -> float:
+        return self.integral * 1e6
+
+    def restart(self) -> None:
+        """ Forget the fill level (e.g. after an underrun); the drift estimate is kept """
+        self.latency = None
+        self._t = None
+        self.correction = self.integral
+
+    def update(self, latency: float, t: float) -> float:
+        """
+        Args:
+            latency: Current FIFO fill (sec).
+            t: Time of the measurement (sec, any monotonic clock).
+
+        Returns:
+            The relative rate correction to apply from now on.
+        """
+        if self._t is None:
+            self.latency, self._t = latency, t
+            return self.correction
+        dt = max(t - self._t, 0.0)
+        self._t = t
+        self.latency += (1.0 - math.exp(-dt / self.tau)) * (latency - self.latency)
+        error = self.latency - self.target # too much buffered -> produce fewer samples
+        limit = self.max_correction
+        self.integral = min(max(self.integral - self.ki * error * dt, -limit), limit)
+        self.correction = min(max(self.integral - self.kp * error, -limit), limit)
+        return self.correction
@@ -0,0 +1,287 @@
+import mmap
+import os
+import struct
+import tempfile
+import time
+import typing
+
+import numpy as np
+import numpy.typing as npt
+
+
+# Shared-memory ring buffers for consumers on the same host.
+#
+# Each ring is a memory-mapped file holding the most recent frames of one stream
+# (e.g. one performer's preprocessed EEG).  One process writes; any number of readers
+# map the same file and read the latest frames without a socket or a copy.  Rings live
+# in `/dev/shm` where it exists (Linux, memory only) and the temp directory otherwise.
+#
+# Layout (little-endian, offsets in bytes):
+#
+#     0    8s   magic b'NTRING\x00\x01'
+#     8    u32  version (1)
+#     12   u32  header size (256)
+#     16   u32  capacity: number of frame slots
+#     20   u32  width: float32 values per frame
+#     24   u32  state: 1 open, 2 closed (writer stopped or replaced the ring; reopen by name)
+#     28   u32  reserved
+#     32   u64  write_seq: frames written so far; frame k (from 0) lives in slot k % capacity
+#     40   f64  creation time (unix sec)
+#     48   16   reserved
+#     64   192s labels: comma-separated UTF-8 value names, NUL padded
+#     256  u64[capacity]         slot_seq: k + 1 for the frame in the slot, 0 while it is written
+#     ...  f64[capacity]         time: stream time of each frame (sec)
+#     ...  f32[capacity, width]  values
+#
+# A writer sets a slot's `slot_seq` to 0, fills in the frame, sets `slot_seq` to k + 1
+# and only then advances `write_seq`.  A reader that finds `slot_seq` == k + 1 both
+# before and after copying frame k has a consistent frame; anything else means the
+# writer lapped it.  :obj:`RingReader` does exactly this and can serve as a reference
+# for readers in other languages.
+
+MAGIC = b'NTRING\x00\x01'
+VERSION = 1
+HEADER_SIZE = 256
+HEADER = struct.Struct('<8sIIIIII')
+LABELS_OFFSET = 64
+LABELS_SIZE = 192
+STATE_OFFSET = 24
+SEQ_OFFSET = 32
+CREATED_OFFSET = 40
+
+STATE_OPEN = 1
+STATE_CLOSED = 2
+
+RING_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def ring_path(name: str, directory: typing.Optional[str] = None) -> str:
+    """ File backing the ring called `name` """
+    return os.path.join(RING_DIR if directory is None else directory, f'{name}.ring')
+
+
+def ring_size(capacity: int, width: int) -> int:
+    return HEADER_SIZE + capacity * (8 + 8 + 4 * width)
+
+
+class _RingArrays:
+    """ numpy views of a ring's header fields and slots """
+
+    def __init__(self, buf: mmap.mmap, capacity: int, width: int):
+        self.write_seq = np.frombuffer(buf, '<u8', 1, SEQ_OFFSET)
+        self.state = np.frombuffer(buf, '<u4', 1, STATE_OFFSET)
+        offset = HEADER_SIZE
+        self.slot_seq = np.frombuffer(buf, '<u8', capacity, offset)
+        offset += 8 * capacity
+        self.time = np.frombuffer(buf, '<f8', capacity, offset)
+        offset += 8 * capacity
+        self.values = np.frombuffer(buf, '<f4', capacity * width, offset).reshape(capacity, width)
+
+
+class RingWriter:
+    """
+    Creates (or replaces) the ring `name` and appends frames to it.
+
+    Args:
+        name: Ring name; the backing file is :obj:`ring_path` (`name`).
+        width: Values per frame.
+        capacity: Frames kept; older frames are overwritten.
+        labels: Name of each value, stored in the header for readers.
+        directory: Where to put the backing file.  Default: `RING_DIR`.
+    """
+
+    def __init__(self, name: str, width: int, capacity: int = 1024, labels: typing.Sequence[str] = (), directory: typing.Optional[str] = None):
+        encoded = ','.join(labels).encode()
+        if len(encoded) > LABELS_SIZE:
+            raise ValueError(f'labels take {len(encoded)} bytes; the header has room for {LABELS_SIZE}')
+        self.name = name
+        self.path = ring_path(name, directory)
+        self.capacity = capacity
+        self.width = width
+        self.labels = list(labels)
+
+        # A reader of a ring being replaced still maps the old file: mark it closed so it
+        # reopens, then swap the new one in under the same name
+        _close_existing(self.path)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w+b') as f:
+            f.truncate(ring_size(capacity, width))
+            self._buf = mmap.mmap(f.fileno(), ring_size(capacity, width))
+        self._buf[:HEADER.size] = HEADER.pack(MAGIC, VERSION, HEADER_SIZE, capacity, width, STATE_OPEN, 0)
+        struct.pack_into('<d', self._buf, CREATED_OFFSET, time.time())
+        self._buf[LABELS_OFFSET:LABELS_OFFSET + len(encoded)] = encoded
+        self._arrays = _RingArrays(self._buf, capacity, width)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def frames_written(self) -> int:
+        return int(self._arrays.write_seq[0])
+
+    def write(self, times: npt.ArrayLike, values: npt.ArrayLike) -> None:
+        """
+        Append frames.
+
+        Args:
+            times: (n,) stream time of each frame.
+            values: (n, width) frame values (converted to float32).
+        """
+        times = np.atleast_1d(np.asarray(times))
+        values = np.asarray(values).reshape(len(times), self.width)
+        n = min(len(times), self.capacity)
+        if n == 0:
+            return
+        arrays = self._arrays
+        start = int(arrays.write_seq[0]) + len(times) - n # frames beyond capacity are overwritten anyway
+        seq = np.arange(start + 1, start + n + 1, dtype = np.uint64)
+        slots = (seq - 1) % self.capacity
+        arrays.slot_seq[slots] = 0
+        arrays.time[slots] = times[-n:]
+        arrays.values[slots] = values[-n:]
+        arrays.slot_seq[slots] = seq
+        arrays.write_seq[0] = start + n
+
+    def close(self, unlink: bool = True) -> None:
+        """ Mark the ring closed for readers and release it; `unlink` also removes the file """
+        if self._buf.closed:
+            return
+        self._arrays.state[0] = STATE_CLOSED
+        del self._arrays # views must go before the map can close
+        self._buf.close()
+        if unlink:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def _close_existing(path: str) -> None:
+    """ Flags a ring left at `path` (by a crashed or replaced writer) as closed """
+    try:
+        with open(path, 'r+b') as f:
+            if f.read(len(MAGIC)) == MAGIC:
+                f.seek(STATE_OFFSET)
+                f.write(struct.pack('<I', STATE_CLOSED))
+    except FileNotFoundError:
+        pass
+
+
+class RingReader:
+    """
+    Reference reader: maps the ring `name` and returns frames the writer has added.
+
+    `read` copies and validates new frames; `time`, `values` and `slot_seq` are
+    zero-copy views of the slots for consumers that handle the sequence checks
+    themselves (frame k is in slot k % capacity and valid while `slot_seq` == k + 1).
+
+    Raises:
+        FileNotFoundError: If no writer has created the ring.
+        ValueError: If the file isn't a ring of a supported version.
+    """
+
+    def __init__(self, name: str, directory: typing.Optional[str] = None):
+        self.name = name
+        self.path = ring_path(name, directory)
+        with open(self.path, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, header_size, capacity, width, _, _ = HEADER.unpack_from(self._buf)
+        if magic != MAGIC or version != VERSION or header_size != HEADER_SIZE:
+            self._buf.close()
+            raise ValueError(f'{self.path} is not a version {VERSION} ring')
+        self.capacity = capacity
+        self.width = width
+        self.labels = [label for label in bytes(self._buf[LABELS_OFFSET:LABELS_OFFSET + LABELS_SIZE]).rstrip(b'\0').decode().split(',') if label]
+        self.created = struct.unpack_from('<d', self._buf, CREATED_OFFSET)[0]
+        self._arrays = _RingArrays(self._buf, capacity, width)
+        self.time = self._arrays.time
+        self.values = self._arrays.values
+        self.slot_seq = self._arrays.slot_seq
+        self.next_frame = 0 # first frame the next `read` returns
+        self.lost = 0 # frames overwritten before they were read
+
+    @property
+    def frames_written(self) -> int:
+        return int(self._arrays.write_seq[0])
+
+    @property
+    def closed(self) -> bool:
+        """ The writer stopped or replaced the ring; open a new reader to follow it """
+        return int(self._arrays.state[0]) == STATE_CLOSED
+
+    def read(self, max_frames: typing.Optional[int] = None) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        Frames written since the last call (at most the newest `max_frames`; older ones are skipped).
+
+        Returns:
+            (times (n,), values (n, width)), copies.  Frames the writer overwrote before
+            they could be copied are left out and counted in `lost`.
+        """
+        end = self.frames_written
+        oldest = max(self.next_frame, end - self.capacity)
+        self.lost += oldest - self.next_frame
+        start = oldest if max_frames is None else max(oldest, end - max_frames)
+        self.next_frame = end
+        if end <= start:
+            return np.empty(0), np.empty((0, self.width), dtype = np.float32)
+
+        seq = np.arange(start + 1, end + 1, dtype = np.uint64)
+        slots = (seq - 1) % self.capacity
+        before = self.slot_seq[slots]
+        times = self.time[slots]
+        values = self.values[slots]
+        valid = (before == seq) & (self.slot_seq[slots] == seq)
+        if not valid.all():
+            self.lost += int(np.count_nonzero(~valid))
+            times, values = times[valid], values[valid]
+        return times, values
+
+    def latest(self, n: int = 1) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """ The newest `n` frames, without affecting what `read` returns next """
+        next_frame, lost = self.next_frame, self.lost
+        self.next_frame = 0
+        try:
+            return self.read(n)
+        finally:
+            self.next_frame, self.lost = next_frame, lost
+
+    def close(self) -> None:
+        del self.time, self.values, self.slot_seq, self._arrays
+        self._buf.close()
+
+
+class FeatureRings:
+    """
+    Rings for several performers' feature streams, named `<name><prefix>_<stream>` with
+    the OSC address prefix's slashes turned into underscores ('neurotheatre_p1_preproc',
+    or 'neurotheatre_preproc' for a single headset without a prefix).
+
+    A ring is created on its first write and replaced (readers see it closed) when the
+    number of values or their labels change, e.g. after new bands are configured.
+    """
+
+    def __init__(self, name: str, capacity: int = 1024, directory: typing.Optional[str] = None):
+        self.name = name
+        self.capacity = capacity
+        self.directory = directory
+        self.rings: typing.Dict[typing.Tuple[str, str], RingWriter] = {}
+
+    def ring_name(self, prefix: str, stream: str) -> str:
+        return f"{self.name}{prefix.replace('/', '_')}_{stream}"
+
+    def write(self, prefix: str, stream: str, times: npt.ArrayLike, values: npt.ArrayLike, labels: typing.Sequence[str]) -> None:
+        ring = self.rings.get((prefix, stream))
+        if ring is None or ring.labels != list(labels):
+            if ring is not None:
+                ring.close(unlink = False) # the replacement takes over the name
+            ring = self.rings[(prefix, stream)] = RingWriter(
+                self.ring_name(prefix, stream),
+                width = len(labels),
+                capacity = self.capacity,
+                labels = labels,
+                directory = self.directory,
+            )
+        ring.write(times, values)
+
+    def close(self) -> None:
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
@@ -12,7 +12,7 @@ class SignalToAudioSystemSettings(ez.Settings):
     unicorn_settings: UnicornSettings
     injector_settings: InjectorSettings
     butterworth_filter_settings: ButterworthFilterSettings
-    upsample_settings: UpsampleSettings
+    upsample_settings: UpsampleSettings # only used with audio_settings.adaptive = False
     audio_settings: AudioLoopbackSettings
 
 class SignalToAudioSystem(ez.Collection):
@@ -37,9 +37,16 @@ class SignalToAudioSystem(ez.Collection):
         self.AUDIOLB.apply_settings(self.SETTINGS.audio_settings)
 
     def network(self) -> ez.NetworkDefinition:
-        return (
+        network = [
             (self.DASHBOARD.OUTPUT_SIGNAL, self.INJECTOR.INPUT_SIGNAL),
             (self.INJECTOR.OUTPUT_SIGNAL, self.FILTER.INPUT_SIGNAL),
-            (self.FILTER.OUTPUT_SIGNAL, self.UPSAMPLE.INPUT_SIGNAL),
-            (self.UPSAMPLE.OUTPUT_SIGNAL, self.AUDIOLB.INPUT_SIGNAL)
-        )
\ No newline at end of file
+        ]
+        if self.SETTINGS.audio_settings.adaptive:
+            # AudioLoopback resamples to the sound card itself; upsampling first only adds an FFT per block
+            network.append((self.FILTER.OUTPUT_SIGNAL, self.AUDIOLB.INPUT_SIGNAL))
+        else:
+            network += [
+                (self.FILTER.OUTPUT_SIGNAL, self.UPSAMPLE.INPUT_SIGNAL),
+                (self.UPSAMPLE.OUTPUT_SIGNAL, self.AUDIOLB.INPUT_SIGNAL),
+            ]
+        return network
\ No newline at end of file
@@ -0,0 +1,304 @@
+import asyncio
+import time
+import typing
+
+from dataclasses import field
+
+import numpy as np
+import numpy.typing as npt
+
+import ezmsg.core as ez
+from ezmsg.util.generator import consumer
+from ezmsg.util.messages.axisarray import AxisArray, replace
+
+from neurotheatre.workspace import Workspace
+
+
+TABLE_SIZE = 4096 # Samples per wavetable cycle; nearest-sample lookup keeps phase error below 1/8192 cycle
+
+_SINE_TABLE = np.sin(2.0 * np.pi * np.arange(TABLE_SIZE) / TABLE_SIZE)
+
+
+class _OscillatorBank:
+    """
+    Phase-accumulating sine oscillators read from a shared wavetable.
+    Phases are kept in cycles so long runs never lose precision to a growing time vector.
+    """
+
+    def __init__(self, freqs: typing.Sequence[float], phase_offsets: typing.Optional[typing.Sequence[float]] = None):
+        self.freqs = np.asarray(freqs, dtype = np.float64)
+        self.phase = np.zeros(len(self.freqs)) if phase_offsets is None else np.asarray(phase_offsets, dtype = np.float64) % 1.0
+        self._ramp = np.arange(0)
+        self._inc = np.zeros(len(self.freqs))
+        self._work = Workspace()
+
+    def render(self, n: int, fs: float) -> np.ndarray:
+        """
+        Returns (n, n_osc) oscillator outputs and advances the phase by n samples.
+        The returned array is reused (overwritten) by the next call.
+        """
+        if len(self._ramp) < n:
+            self._ramp = np.arange(n, dtype = np.float64)
+        inc = np.divide(self.freqs, fs, out = self._inc)
+        phases = np.multiply.outer(self._ramp[:n], inc, out = self._work.get('phases', (n, len(inc))))
+        phases += self.phase
+        inc *= n
+        self.phase += inc
+        np.mod(self.phase, 1.0, out = self.phase)
+        phases *= TABLE_SIZE
+        phases += 0.5
+        idx = self._work.get('idx', phases.shape, np.intp)
+        np.copyto(idx, phases, casting = 'unsafe')
+        np.bitwise_and(idx, TABLE_SIZE - 1, out = idx)
+        return np.take(_SINE_TABLE, idx, out = self._work.get('out', phases.shape))
+
+
+@consumer
+def synthetic_eeg(
+    time_axis: str = 'time',
+    ssvep_freqs: typing.Optional[typing.Sequence[float]] = None,
+    ssvep_amp: float = 10.0,
+    ssvep_switch: float = 0.0,
+    band_mods: typing.Optional[typing.Mapping[str, typing.Tuple[float, float, float]]] = None,
+    emg_interval: float = 0.0,
+    emg_dur: float = 0.5,
+    emg_amp: float = 100.0,
+    noise_amp: float = 0.0,
+    ch_gains: typing.Optional[typing.List[float]] = None,
+    seed: typing.Optional[int] = None,
+    dtype: typing.Optional[npt.DTypeLike] = None,
+) -> typing.Generator[AxisArray, AxisArray, None]:
+    """
+    Adds synthetic neural activity to the AxisArrays sent to it.
+
+    The input is never modified; every output carries a freshly allocated data array, so
+    the same message can safely be shared with other subscribers.  Send an AxisArray of
+    zeros to use this as a pure signal source.
+
+    Args:
+        time_axis: Name of the time axis; must be a LinearAxis.
+        ssvep_freqs: SSVEP target frequencies (Hz).  Every target is present at once unless
+            `ssvep_switch` is set.  Default: none.
+        ssvep_amp: Amplitude of each SSVEP target.
+        ssvep_switch: If > 0, only one SSVEP target is present at a time and the attended
+            target cycles every `ssvep_switch` seconds.
+        band_mods: Band-power modulations as `{name: (carrier Hz, modulation Hz, amplitude)}`.
+            Each carrier is amplitude modulated (0 - amplitude) at the modulation frequency.
+            Default: none.
+        emg_interval: Seconds between jaw-clench EMG bursts (0 disables bursts).
+        emg_dur: Duration of each EMG burst in seconds.
+        emg_amp: Standard deviation of the broadband EMG bursts.
+        noise_amp: Standard deviation of background white noise.
+        ch_gains: Per-channel gain applied to the SSVEP and band components.  Default: 1.0 for all.
+        seed: Seed for the noise generator.
+        dtype: Output precision.  Default: the input dtype for floating point input, else float64.
+
+    Returns:
+        A primed generator that accepts an :obj:`AxisArray` via `.send(axis_array)` and
+        yields a new :obj:`AxisArray` with the synthetic activity added.
+    """
+    msg_out = AxisArray(np.array([]), dims = [""])
+
+    rng = np.random.default_rng(seed)
+    ssvep_freqs = [] if ssvep_freqs is None else list(ssvep_freqs)
+    band_specs = [] if band_mods is None else list(band_mods.values())
+    ssvep_bank = _OscillatorBank(ssvep_freqs)
+    carrier_bank = _OscillatorBank([c for c, _, _ in band_specs])
+    # Phase offset of -0.25 cycles turns the sine table into 0.5 * (1 - cos): a 0 - 1 envelope starting at 0
+    mod_bank = _OscillatorBank([m for _, m, _ in band_specs], phase_offsets = [-0.25] * len(band_specs))
+    band_amps = np.array([a for _, _, a in band_specs])
+
+    n_seen: int = 0 # samples processed so far
+    work = Workspace()
+    ramp = np.arange(0)
+
+    while True:
+        msg_in: AxisArray = yield msg_out
+
+        axis_idx = msg_in.get_axis_idx(time_axis)
+        fs = 1.0 / msg_in.get_axis(time_axis).gain
+        n = msg_in.data.shape[axis_idx]
+
+        data = np.moveaxis(msg_in.data, axis_idx, 0)
+        n_ch = int(np.prod(data.shape[1:]))
+        gains = work.cached('gains', n_ch, lambda: np.ones(n_ch) if ch_gains is None else np.asarray(ch_gains, dtype = np.float64)[:n_ch])
+        if len(ramp) < n:
+            ramp = np.arange(n)
+
+        # Components common to all channels, (n,); intermediates live in reused buffers
+        common = work.get('common', (n,))
+        common[:] = 0.0
+        part = work.get('part', (n,))
+        if len(ssvep_freqs):
+            tones = ssvep_bank.render(n, fs)
+            if ssvep_switch > 0:
+                # flat index of (sample, attended target) in tones
+                target = np.add(ramp[:n], n_seen, out = work.get('target', (n,), np.intp))
+                np.floor_divide(target, int(ssvep_switch * fs), out = target)
+                np.mod(target, len(ssvep_freqs), out = target)
+                target += np.multiply(ramp[:n], len(ssvep_freqs), out = work.get('row', (n,), np.intp))
+                np.take(tones.reshape(-1), target, out = part)
+            else:
+                np.sum(tones, axis = 1, out = part)
+            part *= ssvep_amp
+            common += part
+        if len(band_specs):
+            carriers = carrier_bank.render(n, fs)
+            envelopes = mod_bank.render(n, fs)
+            envelopes += 1.0
+            envelopes *= 0.5
+            carriers *= envelopes
+            common += np.matmul(carriers, band_amps, out = part)
+
+        # The output array is always new: messages are shared with other subscribers
+        out_dtype = dtype if dtype is not None else (data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64)
+        out = np.empty(data.shape, dtype = out_dtype)
+        np.multiply.outer(common, gains, out = out.reshape(n, n_ch))
+        out += data # copy-on-write: output buffer is new, input untouched
+
+        if emg_interval > 0:
+            sidx = np.add(ramp[:n], n_seen, out = work.get('sidx', (n,), np.intp))
+            np.mod(sidx, int(emg_interval * fs), out = sidx)
+            burst = np.less(sidx, int(emg_dur * fs), out = work.get('burst', (n,), np.bool_))
+            n_burst = int(np.count_nonzero(burst))
+            if n_burst:
+                out[burst] += emg_amp * rng.standard_normal((n_burst,) + data.shape[1:])
+
+        if noise_amp > 0:
+            noise = rng.standard_normal(out = work.get('noise', data.shape))
+            noise *= noise_amp
+            out += noise
+
+        n_seen += n
+        msg_out = replace(msg_in, data = np.moveaxis(out, 0, axis_idx))
+
+
+@consumer
+def synthetic_motion(
+    time_axis: str = 'time',
+    sway_freqs: typing.Tuple[float, float, float] = (0.2, 0.13, 0.05), # Hz, roll/pitch/yaw
+    sway_amps: typing.Tuple[float, float, float] = (20.0, 15.0, 90.0), # degrees
+    dtype: npt.DTypeLike = np.float64,
+) -> typing.Generator[AxisArray, AxisArray, None]:
+    """
+    Synthesizes IMU data for a performer slowly swaying their head.
+
+    Yields blocks shaped like Unicorn motion data: (time, 6) with accelerometer in g on
+    channels 0-2 and gyroscope in deg/s on channels 3-5.  Only the time axis (and block length)
+    of the input is used.
+    """
+    msg_out = AxisArray(np.array([]), dims = [""])
+
+    freqs = np.asarray(sway_freqs)
+    amps = np.deg2rad(sway_amps)
+    # sin and cos (cos = sin shifted by a quarter cycle) of each sway oscillator
+    bank = _OscillatorBank(np.concatenate([freqs, freqs]), phase_offsets = [0.0] * 3 + [0.25] * 3)
+
+    while True:
+        msg_in: AxisArray = yield msg_out
+
+        axis_idx = msg_in.get_axis_idx(time_axis)
+        fs = 1.0 / msg_in.get_axis(time_axis).gain
+        n = msg_in.data.shape[axis_idx]
+
+        osc = bank.render(n, fs)
+        angles = osc[:, :3] * amps
+        rates = osc[:, 3:] * amps * 2.0 * np.pi * freqs # d/dt of the angles, rad/s
+
+        roll, pitch = angles[:, 0], angles[:, 1]
+        out = np.empty((n, 6), dtype = dtype)
+        out[:, 0] = -np.sin(pitch)
+        out[:, 1] = np.sin(roll) * np.cos(pitch)
+        out[:, 2] = np.cos(roll) * np.cos(pitch)
+        out[:, 3:] = np.rad2deg(rates)
+
+        msg_out = AxisArray(
+            out,
+            dims = [time_axis, 'ch'],
+            axes = {time_axis: msg_in.get_axis(time_axis)},
+            key = msg_in.key,
+        )
+
+
+class SyntheticSourceSettings(ez.Settings):
+    fs: float = 200.0 # Hz
+    n_ch: int = 8
+    blocksize: int = 10
+    speed: float = 1.0 # Multiple of real-time to publish at; use > 1 to load-test downstream units
+    motion_fs: float = 200.0 # Hz
+    motion_blocksize: int = 10
+    time_axis: str = 'time'
+    ssvep_freqs: typing.List[float] = field(default_factory = lambda: [7.0, 9.0, 11.0]) # Hz
+    ssvep_amp: float = 10.0
+    ssvep_switch: float = 10.0 # Seconds per attended target (0 = all targets present)
+    band_mods: typing.Dict[str, typing.Tuple[float, float, float]] = field(
+        default_factory = lambda: {
+            'alpha': (10.0, 0.05, 20.0), # carrier Hz, modulation Hz, amplitude
+            'beta': (20.0, 0.08, 5.0),
+            'gamma': (40.0, 0.03, 2.0),
+        }
+    )
+    emg_interval: float = 5.0 # Seconds between jaw clenches (0 = none)
+    emg_dur: float = 0.5 # sec
+    emg_amp: float = 100.0
+    noise_amp: float = 5.0
+    seed: typing.Optional[int] = None
+    dtype: str = 'float64' # Working precision of the published data
+
+
+class SyntheticSourceState(ez.State):
+    eeg: typing.Generator[AxisArray, AxisArray, None]
+    motion: typing.Generator[AxisArray, AxisArray, None]
+
+
+class SyntheticSource(ez.Unit):
+    """ Standalone stand-in for a headset: publishes synthetic EEG and IMU streams """
+
+    SETTINGS = SyntheticSourceSettings
+    STATE = SyntheticSourceState
+
+    OUTPUT_SIGNAL = ez.OutputStream(AxisArray)
+    OUTPUT_MOTION = ez.OutputStream(AxisArray)
+
+    async def initialize(self) -> None:
+        self.STATE.eeg = synthetic_eeg(
+            time_axis = self.SETTINGS.time_axis,
+            ssvep_freqs = self.SETTINGS.ssvep_freqs,
+            ssvep_amp = self.SETTINGS.ssvep_amp,
+            ssvep_switch = self.SETTINGS.ssvep_switch,
+            band_mods = self.SETTINGS.band_mods,
+            emg_interval = self.SETTINGS.emg_interval,
+            emg_dur = self.SETTINGS.emg_dur,
+            emg_amp = self.SETTINGS.emg_amp,
+            noise_amp = self.SETTINGS.noise_amp,
+            seed = self.SETTINGS.seed,
+            dtype = self.SETTINGS.dtype,
+        )
+        self.STATE.motion = synthetic_motion(time_axis = self.SETTINGS.time_axis, dtype = self.SETTINGS.dtype)
+
+    async def _paced(self, fs: float, blocksize: int, n_ch: int) -> typing.AsyncGenerator[AxisArray, None]:
+        # Zero template blocks; read-only and reused because the generators never write to their input
+        zeros = np.zeros((blocksize, n_ch), dtype = self.SETTINGS.dtype)
+        zeros.flags.writeable = False
+        block_dur = blocksize / fs
+        t0 = time.time()
+        n_blocks = 0
+        while True:
+            yield AxisArray(
+                zeros,
+                dims = [self.SETTINGS.time_axis, 'ch'],
+                axes = {self.SETTINGS.time_axis: AxisArray.LinearAxis(gain = 1.0 / fs, offset = t0 + n_blocks * block_dur)},
+            )
+            n_blocks += 1
+            delay = t0 + n_blocks * block_dur / self.SETTINGS.speed - time.time()
+            await asyncio.sleep(max(delay, 0.0))
+
+    @ez.publisher(OUTPUT_SIGNAL)
+    async def pub_signal(self) -> typing.AsyncGenerator:
+        async for template in self._paced(self.SETTINGS.fs, self.SETTINGS.blocksize, self.SETTINGS.n_ch):
+            yield self.OUTPUT_SIGNAL, self.STATE.eeg.send(template)
+
+    @ez.publisher(OUTPUT_MOTION)
+    async def pub_motion(self) -> typing.AsyncGenerator:
+        async for template in self._paced(self.SETTINGS.motion_fs, self.SETTINGS.motion_blocksize, 6):
+            yield self.OUTPUT_MOTION, self.STATE.motion.send(template)
@@ -0,0 +1,242 @@
+import os
+import re
+import typing
+
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+import scipy.linalg
+
+
+@dataclass
+class SSVEPTemplates:
+    """
+    Calibrated SSVEP decoder for one performer and montage.
+
+    Templates are period-folded: each target's average response is stored as one stimulus
+    period (`n_bins` phase bins) relative to `stim_t0`, the time at which every stimulus was
+    at phase 0.  A window taken at any time can then be compared against the template at the
+    same stimulus phase, so decoding doesn't need trial onsets.
+    """
+    freqs: np.ndarray # (n_freqs,) Hz
+    fs: float # Hz, sample rate the templates were fit at (after preprocessing)
+    stim_t0: float # sec, in the data's time base
+    folded: np.ndarray # (n_freqs, n_bins, n_ch) period-folded class templates
+    filters: np.ndarray # (n_ch, n_freqs) ensemble TRCA spatial filters, one per target
+    ref_filters: np.ndarray # (n_ch, n_freqs) template <-> reference CCA filters (eCCA)
+    harmonics: int = 2
+
+    def __post_init__(self):
+        # Templates projected by each filter set, so runtime work is one matmul and a gather
+        self.folded_trca = self.folded @ self.filters # (n_freqs, n_bins, n_freqs)
+        self.folded_ref = np.einsum('fbc,cf->fb', self.folded, self.ref_filters) # (n_freqs, n_bins)
+
+    @property
+    def n_bins(self) -> int:
+        return self.folded.shape[1]
+
+    def phase_bins(self, t: np.ndarray) -> np.ndarray:
+        """ Template bin of each target's stimulus phase at times `t`: (n_freqs, len(t)) """
+        phase = np.outer(self.freqs, t - self.stim_t0) % 1.0
+        return np.minimum((phase * self.n_bins).astype(int), self.n_bins - 1)
+
+
+def _corr(a: np.ndarray, b: np.ndarray, axis: int = -1) -> np.ndarray:
+    a = a - a.mean(axis, keepdims = True)
+    b = b - b.mean(axis, keepdims = True)
+    return (a * b).sum(axis) / np.sqrt((a * a).sum(axis) * (b * b).sum(axis))
+
+
+def _references(freqs: np.ndarray, harmonics: int, t: np.ndarray) -> np.ndarray:
+    """ sin/cos references (n_freqs, time, 2 * (harmonics + 1)) at absolute phase """
+    w = 2.0 * np.pi * np.outer(freqs, np.arange(1, harmonics + 2))[:, None, :] * t[None, :, None]
+    return np.concatenate([np.sin(w), np.cos(w)], axis = 2)
+
+
+def _cca_weights(X: np.ndarray, Y: np.ndarray, reg: float = 1e-6) -> np.ndarray:
+    """ Spatial weights on X of the first canonical pair between X (time, ch) and Y (time, refs) """
+    X = X - X.mean(0)
+    Y = Y - Y.mean(0)
+    Cxx = X.T @ X + reg * np.trace(X.T @ X) * np.eye(X.shape[1])
+    Cyy = Y.T @ Y + reg * np.trace(Y.T @ Y) * np.eye(Y.shape[1])
+    Cxy = X.T @ Y
+    M = Cxy @ np.linalg.solve(Cyy, Cxy.T)
+    _, vecs = scipy.linalg.eigh(M, Cxx)
+    return vecs[:, -1]
+
+
+def fit_templates(
+    data: np.ndarray,
+    labels: np.ndarray,
+    times: np.ndarray,
+    fs: float,
+    freqs: typing.Sequence[float],
+    stim_t0: float = 0.0,
+    harmonics: int = 2,
+    n_bins: int = 64,
+    epoch_dur: float = 1.0,
+    reg: float = 1e-6,
+) -> SSVEPTemplates:
+    """
+    Fit TRCA and extended-CCA templates from a calibration recording.
+
+    Args:
+        data: Preprocessed EEG (time, ch), as it will be seen by the decoder.
+        labels: Index into `freqs` of the attended target for each sample; -1 for none.
+        times: Time (sec) of each sample, in the same time base as `stim_t0`.
+        fs: Sample rate of `data`.
+        freqs: Stimulus frequencies (Hz).
+        stim_t0: Time at which all stimuli were at phase 0.
+        harmonics: Harmonics beyond the fundamental in the eCCA reference signals.
+        n_bins: Phase bins per stimulus period in the folded templates.
+        epoch_dur: Approximate length (sec) of the phase-locked epochs TRCA is fit on.
+        reg: Relative ridge regularization of the covariance matrices.
+
+    Returns:
+        The fitted :obj:`SSVEPTemplates`.
+
+    Raises:
+        ValueError: If a target has fewer than two epochs of calibration data.
+    """
+    freqs = np.asarray(freqs, dtype = float)
+    n_ch = data.shape[1]
+    folded = np.zeros((len(freqs), n_bins, n_ch))
+    filters = np.zeros((n_ch, len(freqs)))
+    ref_filters = np.zeros((n_ch, len(freqs)))
+
+    for k, freq in enumerate(freqs):
+        mask = labels == k
+        phase = ((times - stim_t0) * freq) % 1.0
+        bins = np.minimum((phase * n_bins).astype(int), n_bins - 1)
+
+        # Period-folded template: mean response in each phase bin
+        counts = np.bincount(bins[mask], minlength = n_bins)
+        for c in range(n_ch):
+            folded[k, :, c] = np.bincount(bins[mask], weights = data[mask, c], minlength = n_bins)
+        folded[k] /= np.maximum(counts, 1)[:, None]
+        folded[k] -= folded[k].mean(0)
+
+        # TRCA: epochs start where the stimulus wraps to phase 0, so they are phase-locked
+        epoch_len = max(1, int(round(max(1, round(epoch_dur * freq)) / freq * fs)))
+        starts = np.flatnonzero(mask[1:] & (phase[1:] < phase[:-1])) + 1
+        epochs = []
+        next_free = 0
+        for start in starts:
+            if start >= next_free and start + epoch_len <= len(mask) and mask[start:start + epoch_len].all():
+                epochs.append(data[start:start + epoch_len] - data[start:start + epoch_len].mean(0))
+                next_free = start + epoch_len
+        if len(epochs) < 2:
+            raise ValueError(f'{freq} Hz: need at least two {epoch_len}-sample epochs of calibration data, found {len(epochs)}')
+        epochs = np.stack(epochs) # (trial, time, ch)
+        total = epochs.sum(0)
+        Q = np.einsum('ntc,ntd->cd', epochs, epochs)
+        S = total.T @ total - Q
+        Q += reg * np.trace(Q) * np.eye(n_ch)
+        _, vecs = scipy.linalg.eigh(S, Q)
+        filters[:, k] = vecs[:, -1]
+
+        # eCCA template <-> reference filter, fit over one epoch of the folded template
+        t = np.arange(epoch_len) / fs
+        tmpl = folded[k, np.minimum(((t * freq) % 1.0 * n_bins).astype(int), n_bins - 1)]
+        ref = _references(freqs[k:k + 1], harmonics, t)[0]
+        ref_filters[:, k] = _cca_weights(tmpl, ref, reg)
+
+    return SSVEPTemplates(freqs, float(fs), float(stim_t0), folded, filters, ref_filters, harmonics)
+
+
+def template_scores(
+    X: np.ndarray,
+    t: np.ndarray,
+    templates: SSVEPTemplates,
+    method: str = 'trca',
+    cca_corrs: typing.Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Score each target for one window.
+
+    Args:
+        X: Window (time, ch), zero-mean over time.
+        t: Time (sec) of each sample of `X`.
+        templates: Calibration for this performer.
+        method: 'trca' (ensemble TRCA correlation), or 'ecca' (mean of the signed squared
+            correlations of ensemble TRCA, the template <-> reference filter, and plain CCA).
+        cca_corrs: Plain CCA correlations (n_freqs,) for 'ecca'; see `cca_correlations`.
+
+    Returns:
+        Scores (n_freqs,); higher is more likely.
+    """
+    bins = templates.phase_bins(t) # (freq, time)
+    n_freqs = len(templates.freqs)
+
+    # One matrix multiply projects the window through all ensemble filters
+    XW = X @ templates.filters # (time, n_freqs)
+    tmpl = templates.folded_trca[np.arange(n_freqs)[:, None], bins] # (freq, time, n_freqs)
+    r_trca = _corr(XW.ravel()[None], tmpl.reshape(n_freqs, -1))
+    if method == 'trca':
+        return r_trca
+
+    Xr = X @ templates.ref_filters # (time, n_freqs)
+    tmpl_ref = templates.folded_ref[np.arange(n_freqs)[:, None], bins] # (freq, time)
+    r_ref = _corr(Xr.T, tmpl_ref)
+    rs = [r_trca, r_ref] if cca_corrs is None else [r_trca, r_ref, cca_corrs]
+    return np.mean([np.sign(r) * r ** 2 for r in rs], axis = 0)
+
+
+class TemplateCache:
+    """
+    Directory of calibrations, one compressed `.npz` per performer and montage.
+
+    Arrays are stored as float32; a 3-target, 8-channel calibration is a few kB.
+    """
+
+    def __init__(self, path: typing.Union[str, os.PathLike]):
+        self.path = path
+
+    def file(self, performer: str, montage: str) -> str:
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', f'{performer}--{montage}')
+        return os.path.join(self.path, f'{name}.npz')
+
+    def save(self, performer: str, montage: str, templates: SSVEPTemplates) -> str:
+        os.makedirs(self.path, exist_ok = True)
+        fname = self.file(performer, montage)
+        np.savez_compressed(
+            fname,
+            freqs = templates.freqs,
+            fs = templates.fs,
+            stim_t0 = templates.stim_t0,
+            harmonics = templates.harmonics,
+            folded = templates.folded.astype(np.float32),
+            filters = templates.filters.astype(np.float32),
+            ref_filters = templates.ref_filters.astype(np.float32),
+        )
+        return fname
+
+    def load(
+        self,
+        performer: str,
+        montage: str,
+        dtype: npt.DTypeLike = np.float64,
+        stim_t0: typing.Optional[float] = None,
+    ) -> typing.Optional[SSVEPTemplates]:
+        """
+        The stored calibration, or None if this performer/montage hasn't been calibrated.
+
+        Templates are folded on the stimulus phase, so they only match live data whose
+        stimuli are at phase 0 at `stim_t0` (sec, in the live data's time base).  None keeps
+        the calibration's `stim_t0`, which is only right if the stimuli have kept running
+        phase-locked to it and the live data shares the calibration recording's clock.
+        """
+        fname = self.file(performer, montage)
+        if not os.path.exists(fname):
+            return None
+        with np.load(fname) as f:
+            return SSVEPTemplates(
+                freqs = f['freqs'].astype(float),
+                fs = float(f['fs']),
+                stim_t0 = float(f['stim_t0']) if stim_t0 is None else stim_t0,
+                folded = f['folded'].astype(dtype),
+                filters = f['filters'].astype(dtype),
+                ref_filters = f['ref_filters'].astype(dtype),
+                harmonics = int(f['harmonics']),
+            )
@@ -1,15 +1,17 @@
 import typing
 import numpy as np
+import numpy.typing as npt
 
-from scipy.signal import resample
 import ezmsg.core as ez
 from ezmsg.util.messages.axisarray import AxisArray, slice_along_axis, replace
 from ezmsg.util.generator import consumer
 from ezmsg.sigproc.base import GenAxisArray
 
+from neurotheatre.workspace import Workspace
+
 @consumer
 def upsample(
-    axis: str | None = None, factor: int | None = None
+    axis: str | None = None, factor: int | None = None, dtype: npt.DTypeLike | None = None
 ) -> typing.Generator[AxisArray, AxisArray, None]:
     """
     Construct a generator that yields an upsampled version of the data .send() to it.
@@ -19,6 +21,8 @@ def upsample(
         axis: The name of the axis along which to upsample.
             Note: The axis must exist in the message .axes and be of type AxisArray.LinearAxis.
         factor: Upsampling factor.
+        dtype: Working precision. Input is converted once on the way in and the
+            resampling runs (and is output) in this precision. None keeps the input dtype.
 
     Returns:
         A primed generator object ready to receive an :obj:`AxisArray` via `.send(axis_array)`
@@ -28,6 +32,7 @@ def upsample(
         raise ValueError("Upsample factor must be at least 1 (no upsampling)")
 
     msg_out = AxisArray(np.array([]), dims=[""])
+    work = Workspace()  # FFT buffers reused across blocks of the same shape
 
     while True:
         msg_in: AxisArray = yield msg_out
@@ -40,8 +45,25 @@ def upsample(
         n_samples = msg_in.data.shape[axis_idx]
         upsampled_n_samples = n_samples * factor
 
-        # Perform Fourier-based resampling
-        upsampled_data = resample(msg_in.data, upsampled_n_samples, axis=axis_idx)
+        # Time on dim 0 (a view); converted into a reused buffer if a working precision is set
+        data = np.moveaxis(msg_in.data, axis_idx, 0)
+        if dtype is not None and data.dtype != dtype:
+            converted = work.get('data', data.shape, np.dtype(dtype))
+            np.copyto(converted, data, casting='same_kind')
+            data = converted
+        real_dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.dtype(np.float64)
+        complex_dtype = np.result_type(real_dtype, np.complex64)
+
+        # Fourier-based resampling, as scipy.signal.resample, into preallocated spectra
+        spectrum = np.fft.rfft(data, axis=0, out=work.get('spectrum', (n_samples // 2 + 1,) + data.shape[1:], complex_dtype))
+        if n_samples % 2 == 0 and factor > 1:
+            spectrum[n_samples // 2] *= 0.5  # split the unpaired Nyquist bin
+        padded = work.get('padded', (upsampled_n_samples // 2 + 1,) + data.shape[1:], complex_dtype)
+        padded[:spectrum.shape[0]] = spectrum
+        padded[spectrum.shape[0]:] = 0.0
+        # The output is the one fresh array per block: it is published and held downstream
+        upsampled_data = np.fft.irfft(padded, n=upsampled_n_samples, axis=0, out=np.empty((upsampled_n_samples,) + data.shape[1:], real_dtype))
+        upsampled_data *= factor
 
         # Update axis information
         upsampled_axes = {
@@ -52,7 +74,7 @@ def upsample(
             ),
         }
 
-        msg_out = replace(msg_in, data=upsampled_data, axes=upsampled_axes)
+        msg_out = replace(msg_in, data=np.moveaxis(upsampled_data, 0, axis_idx), axes=upsampled_axes)
 
 
 class UpsampleSettings(ez.Settings):
@@ -61,6 +83,7 @@ class UpsampleSettings(ez.Settings):
     """
     axis: str | None = None
     factor: int | None = None
+    dtype: str | None = None # e.g. 'float32'; None keeps the input dtype
 
 class Upsample(GenAxisArray):
     """:obj:`Unit` for :obj:`upsample`."""
@@ -70,5 +93,6 @@ class Upsample(GenAxisArray):
     def construct_generator(self):
         self.STATE.gen = upsample(
             axis=self.SETTINGS.axis,
-            factor=self.SETTINGS.factor
+            factor=self.SETTINGS.factor,
+            dtype=self.SETTINGS.dtype
         )
\ No newline at end of file
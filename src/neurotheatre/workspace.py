@@ -0,0 +1,35 @@
+import typing
+
+import numpy as np
+import numpy.typing as npt
+
+
+class Workspace:
+    """
+    Scratch arrays for code that runs on every block.
+
+    `get` hands back the same array for a name as long as the requested shape and dtype
+    don't change, so a stream with a steady block size allocates its intermediates once.
+    Arrays are uninitialized and overwritten by the next block: use them for intermediates
+    only, never for data that leaves the generator (published messages are held by
+    reference downstream).
+    """
+
+    def __init__(self):
+        self._arrays: typing.Dict[str, typing.Any] = {} # name -> array, or (key, array) for `cached`
+        self.allocations = 0 # arrays (re)allocated so far
+
+    def get(self, name: str, shape: typing.Tuple[int, ...], dtype: npt.DTypeLike = np.float64) -> np.ndarray:
+        arr = self._arrays.get(name)
+        if arr is None or arr.shape != shape or arr.dtype != dtype:
+            arr = self._arrays[name] = np.empty(shape, dtype = dtype)
+            self.allocations += 1
+        return arr
+
+    def cached(self, name: str, key: typing.Hashable, build: typing.Callable[[], np.ndarray]) -> np.ndarray:
+        """ `build()`'s result, rebuilt only when `key` differs from the previous call's for `name` """
+        entry = self._arrays.get(name)
+        if entry is None or entry[0] != key:
+            entry = self._arrays[name] = (key, build())
+            self.allocations += 1
+        return entry[1]
@@ -0,0 +1,119 @@
+import gc
+import time
+import tracemalloc
+
+import numpy as np
+
+from vqf import VQF
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.features import imu_orientation
+from neurotheatre.frequencydecoder import frequency_decode
+from neurotheatre.synthetic import synthetic_eeg, synthetic_motion
+from neurotheatre.upsample import upsample
+from neurotheatre.workspace import Workspace
+
+
+def _msg(data, fs = 200.0, offset = 0.0):
+    return AxisArray(data, dims = ['time', 'ch'], axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = offset)})
+
+
+def block_allocations(step, n_warmup = 50, n_blocks = 300):
+    """
+    Runs `step()` once per block and returns (net bytes retained per block, largest transient
+    bytes of any block) as seen by tracemalloc once the first `n_warmup` blocks have set up
+    any buffers.  Transients include the block's output.  Python's free lists are cleared
+    (`gc.collect`) before both readings so they don't count as retained.
+    """
+    for _ in range(n_warmup):
+        step()
+    tracemalloc.start()
+    try:
+        gc.collect()
+        start, _ = tracemalloc.get_traced_memory()
+        worst = 0
+        for _ in range(n_blocks):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            step()
+            _, peak = tracemalloc.get_traced_memory()
+            worst = max(worst, peak - before)
+        gc.collect()
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (end - start) / n_blocks, worst
+
+
+def decode_step(window = 800, n_ch = 8):
+    gen = frequency_decode(time_axis = 'time', harmonics = 2, freqs = [7.0, 9.0, 11.0, 13.0])
+    msg = _msg(np.random.default_rng(0).standard_normal((window, n_ch)))
+    return lambda: gen.send(msg), 4 * 8
+
+
+def upsample_step(n_ch = 8):
+    gen = upsample(axis = 'time', factor = 3, dtype = 'float32')
+    msg = _msg(np.random.default_rng(0).standard_normal((10, n_ch)))
+    return lambda: gen.send(msg), 30 * n_ch * 4
+
+
+def injector_step(n_ch = 8):
+    gen = synthetic_eeg(ssvep_freqs = [14.5], ssvep_amp = 1.0)
+    msg = _msg(np.random.default_rng(0).standard_normal((10, n_ch)))
+    return lambda: gen.send(msg), msg.data.nbytes
+
+
+def motion_step():
+    vqf = VQF(1.0 / 200.0)
+    work = Workspace()
+    motion = synthetic_motion().send(_msg(np.zeros((10, 6)))).data
+    return lambda: imu_orientation(vqf, motion, work), 0
+
+
+STEPS = {
+    'frequency_decode (4 s x 8 ch)': decode_step,
+    'upsample (10 x 8 ch, x3)': upsample_step,
+    'Injector / synthetic_eeg': injector_step,
+    'IMU orientation (10 samples)': motion_step,
+}
+
+
+def test_steady_state_allocations():
+    for name, make in STEPS.items():
+        step, output_bytes = make()
+        net, worst = block_allocations(step)
+        assert abs(net) < 16, f'{name}: {net} bytes retained per block'
+        assert worst < output_bytes + 8192, f'{name}: {worst} transient bytes per block'
+
+
+def test_workspace_reallocates_on_shape_change():
+    gen = upsample(axis = 'time', factor = 2)
+    rng = np.random.default_rng(0)
+    for n in (10, 10, 12, 12, 10):
+        x = rng.standard_normal((n, 2))
+        out = gen.send(_msg(x))
+        assert out.data.shape == (2 * n, 2)
+        assert np.allclose(out.data[::2], x, atol = 1e-12)
+
+    work = Workspace()
+    a = work.get('a', (4, 2))
+    assert work.get('a', (4, 2)) is a and work.allocations == 1
+    assert work.get('a', (4, 2), np.float32) is not a and work.allocations == 2
+    assert work.cached('d', (1, 2), lambda: np.ones(3)) is work.cached('d', (1, 2), lambda: np.zeros(3))
+    assert work.cached('d', (1, 3), lambda: np.zeros(3)).sum() == 0
+
+
+if __name__ == "__main__":
+    # Per-block allocations and compute time of the reworked generators
+    print(f"{'path':>30} {'net B/block':>12} {'max transient B':>16} {'of which output':>16} {'p50 us':>8} {'p99 us':>8}")
+    for name, make in STEPS.items():
+        step, output_bytes = make()
+        net, worst = block_allocations(step)
+        times = []
+        for _ in range(2000):
+            tick = time.perf_counter()
+            step()
+            times.append(time.perf_counter() - tick)
+        p50, p99 = np.percentile(times, [50, 99]) * 1e6
+        print(f"{name:>30} {net:>12.1f} {worst:>16} {output_bytes:>16} {p50:>8.1f} {p99:>8.1f}")
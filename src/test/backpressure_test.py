@@ -0,0 +1,119 @@
+import sys
+import time
+
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.features import compute_features, BlockQueue, FEATURES, PERFORMER_AXIS
+
+from conftest import _headsets, _features
+
+
+def _block(offset, n = 10, fs = 200.0, n_ch = 8):
+    return AxisArray(
+        np.full((1, n, n_ch), offset),
+        dims = [PERFORMER_AXIS, 'time', 'ch'],
+        axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = offset)},
+    )
+
+
+def test_queue_merges_contiguous_runs():
+    queue = BlockQueue()
+    for offset in (0.0, 0.05, 0.1, 0.2, 0.25): # 0.15 is missing
+        queue.push(_block(offset))
+    queue.push(_block(0.3, n_ch = 4))
+    assert len(queue) == 6
+    merged = queue.take()
+    assert len(queue) == 0
+    assert [m.data.shape for m in merged] == [(1, 30, 8), (1, 20, 8), (1, 10, 4)]
+    assert [m.get_axis('time').offset for m in merged] == [0.0, 0.2, 0.3]
+    assert np.array_equal(merged[0].data[0, :, 0], np.repeat([0.0, 0.05, 0.1], 10))
+    assert queue.take() == []
+
+
+def test_merged_blocks_keep_filters_continuous():
+    blocks = list(_headsets(2, 400))
+    one_by_one = _features(FEATURES, bandpower_engine = 'iir')
+    live = [compute_features(one_by_one, msg) for msg in blocks]
+
+    # Blocks arriving in bursts of up to 7, as behind a slow consumer
+    shedding = _features(FEATURES, bandpower_engine = 'iir')
+    queue = BlockQueue()
+    merged = []
+    bursts = np.random.default_rng(0).integers(1, 8, size = len(blocks))
+    i = 0
+    for burst in bursts:
+        for msg in blocks[i:i + burst]:
+            queue.push(msg)
+        i += burst
+        merged += [compute_features(shedding, msg) for msg in queue.take()]
+        if i >= len(blocks):
+            break
+
+    assert len(merged) < len(live) / 2
+    for stream in ('preproc', 'envelope', 'zscore'):
+        def joined(outs):
+            return np.concatenate([out[stream].data for out in outs], axis = outs[0][stream].get_axis_idx('time'))
+        assert np.array_equal(joined(live), joined(merged)), stream
+
+    # Fewer evaluations, but the decoder still decides on the merged blocks
+    decisions = [out['ssvep'] for out in merged if out['ssvep'].data.size]
+    assert len(decisions) >= 4
+
+
+def _simulate(features, blocks, interval, policy):
+    """
+    Feeds `blocks` arriving every `interval` seconds to `features` in real time.
+
+    Returns:
+        Each block's output latency (sec from its arrival to the end of the processing that
+        covered it), and the blocks shed.
+    """
+    queue = BlockQueue()
+    start = time.perf_counter()
+    arrivals = start + np.arange(len(blocks)) * interval
+    latencies = []
+    n_in = n_done = shed = 0
+    while n_done < len(blocks):
+        now = time.perf_counter()
+        while n_in < len(blocks) and arrivals[n_in] <= now:
+            queue.push(blocks[n_in])
+            n_in += 1
+        if not queue:
+            time.sleep(max(0.0, arrivals[n_in] - now))
+            continue
+        if policy == 'none':
+            batch, n = [queue.blocks.popleft()], 1
+        else:
+            n = len(queue)
+            batch = queue.take()
+            shed += n - len(batch)
+        for msg in batch:
+            compute_features(features, msg)
+        done = time.perf_counter()
+        latencies += (done - arrivals[n_done:n_done + n]).tolist()
+        n_done += n
+    return np.array(latencies), shed
+
+
+if __name__ == "__main__":
+    # Output latency under synthetic overload: blocks arrive faster than they can be processed one by one
+    # Usage: python backpressure_test.py [performers] [seconds of input]
+    n_performers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    dur = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    blocks = list(_headsets(n_performers, int(dur * 20)))
+
+    warm = _features(FEATURES)
+    tick = time.perf_counter()
+    for msg in blocks:
+        compute_features(warm, msg)
+    cost = (time.perf_counter() - tick) / len(blocks)
+    print(f'{n_performers} performers, all features: {cost * 1e3:.1f} ms per 50 ms block ({cost / 0.05:.0%} of real time)')
+
+    print(f"{'load':>6} {'policy':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'end ms':>8} {'shed':>6}")
+    for load in (0.5, 1.5, 3.0):
+        for policy in ('none', 'merge'):
+            latencies, shed = _simulate(_features(FEATURES), blocks, cost / load, policy)
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1e3
+            print(f"{load:>6.1f} {policy:>7} {p50:>8.1f} {p99:>8.1f} {latencies.max() * 1e3:>8.1f} {latencies[-1] * 1e3:>8.1f} {shed:>6}")
@@ -0,0 +1,113 @@
+import time
+
+import numpy as np
+import scipy.signal
+
+from ezmsg.util.generator import compose
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.window import windowing
+from ezmsg.sigproc.spectrum import spectrum
+from ezmsg.sigproc.aggregate import ranged_aggregate
+from ezmsg.sigproc.butterworthfilter import butter
+
+from neurotheatre.bandpower import iir_bandpower, _band_sos
+
+BANDS = [(8.0, 13.0), (13.0, 30.0), (30.0, 50.0)]
+FS = 100.0
+
+
+def _msgs(data, blocksize = 5, fs = FS):
+    for start in range(0, data.shape[0], blocksize):
+        yield AxisArray(
+            data[start:start + blocksize],
+            dims = ['time', 'ch'],
+            axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = start / fs)}
+        )
+
+
+def _tone_onset(freq, dur = 4.0, onset = 2.0, n_ch = 8):
+    t = np.arange(int(dur * FS)) / FS
+    x = np.sin(2 * np.pi * freq * t) * (t >= onset)
+    return np.tile(x[:, None], (1, n_ch))
+
+
+def test_band_selectivity():
+    gen = iir_bandpower(bands = BANDS)
+    out = np.concatenate([gen.send(msg).data for msg in _msgs(_tone_onset(20.0))])
+    assert out.shape[1:] == (3, 8)
+    final = out[-int(FS):].mean(axis = (0, 2))
+    assert final.argmax() == 1
+    assert final[1] > 3 * max(final[0], final[2])
+
+
+def test_blocking_does_not_change_output():
+    data = np.random.default_rng(0).standard_normal((400, 4))
+    whole = iir_bandpower(bands = BANDS, decimate = 3).send(next(_msgs(data, blocksize = 400))).data
+    gen = iir_bandpower(bands = BANDS, decimate = 3)
+    parts = np.concatenate([gen.send(msg).data for msg in _msgs(data, blocksize = 7)])
+    assert np.allclose(whole, parts)
+
+
+def test_matches_per_band_filters():
+    data = np.random.default_rng(0).standard_normal((300, 4))
+    for order in (1, 3):
+        gen = iir_bandpower(bands = BANDS, order = order)
+        out = np.concatenate([gen.send(msg).data for msg in _msgs(data, blocksize = 13)])
+        alpha = 1.0 - np.exp(-1.0 / FS / 0.02)
+        for b, band in enumerate(BANDS):
+            filtered = scipy.signal.sosfilt(_band_sos(order, band, FS), data, axis = 0)
+            expected = scipy.signal.lfilter([alpha], [1.0, alpha - 1.0], filtered ** 2, axis = 0)
+            assert np.allclose(out[:, b], expected)
+
+
+def test_decimated_time_axis():
+    gen = iir_bandpower(bands = BANDS, decimate = 4)
+    outs = [gen.send(msg) for msg in _msgs(np.zeros((20, 2)), blocksize = 5)]
+    times = np.concatenate([o.axes['time'].offset + o.axes['time'].gain * np.arange(o.data.shape[0]) for o in outs])
+    assert np.allclose(times, np.arange(0, 20, 4) / FS)
+
+
+def test_latency_under_100ms():
+    onset = 2.0
+    gen = iir_bandpower(bands = BANDS)
+    out = np.concatenate([gen.send(msg).data for msg in _msgs(_tone_onset(10.0, onset = onset))])[:, 0].mean(axis = -1)
+    t = np.arange(len(out)) / FS
+    t_half = t[np.argmax(out > 0.5 * out[-int(FS):].mean())]
+    assert t_half - onset < 0.1
+
+
+if __name__ == "__main__":
+    # Latency: time after a tone onset for each engine's output to cross halfway between its
+    # settled pre-onset and post-onset alpha power, observed once per 5-sample block as EEGOSC would
+    onset, dur = 20.0, 30.0
+    rng = np.random.default_rng(0)
+    data = _tone_onset(10.0, dur = dur, onset = onset) + 0.1 * rng.standard_normal((int(dur * FS), 8))
+
+    # (constructor, converts output to linear power) -- spectrum outputs dB
+    chains = {
+        'windowed fft': (lambda: compose(
+            windowing(axis = 'time', newaxis = 'window', window_dur = 2.0, window_shift = 0.5, zero_pad_until = 'input'),
+            spectrum(axis = 'time', out_axis = 'freq'),
+            ranged_aggregate(axis = 'freq', bands = BANDS),
+            butter(axis = 'window', order = 2, cutoff = 0.1),
+        ), lambda x: 10 ** (x / 10)),
+        'iir (defaults)': (lambda: iir_bandpower(bands = BANDS).send, lambda x: x),
+        'iir float32': (lambda: iir_bandpower(bands = BANDS, dtype = np.float32).send, lambda x: x),
+        'iir tau=0.1': (lambda: iir_bandpower(bands = BANDS, tau = 0.1).send, lambda x: x),
+    }
+    for name, (make, linear) in chains.items():
+        chain = make()
+        alpha, times, costs = [], [], []
+        for msg in _msgs(data):
+            start = time.perf_counter()
+            out = chain(msg)
+            costs.append(time.perf_counter() - start)
+            if out.data.size:
+                alpha.append(linear(np.asarray(out.data).reshape(-1, 3, 8)[-1, 0]).mean())
+                times.append(msg.axes['time'].offset + msg.data.shape[0] / FS)
+        alpha, times = np.array(alpha), np.array(times)
+        before = alpha[(times > onset - 2.0) & (times <= onset)].mean()
+        after = alpha[times > dur - 2.0].mean()
+        post = times > onset
+        t_half = times[post][np.argmax(alpha[post] > 0.5 * (before + after))] - onset
+        print(f"{name:>16}: {len(alpha) / dur:6.1f} updates/s | latency {1e3 * t_half:7.1f} ms | {1e6 * np.mean(costs):7.1f} us/block")
@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.calibration import (
+    load_rehearsal, sweep_jaw, sweep_ssvep, ssvep_grid, best, save_settings, load_settings, write_report, replay_ssvep,
+)
+from neurotheatre.frequencydecoder import reference_design
+from neurotheatre.synthetic import synthetic_eeg
+
+from conftest import FREQS, GAINS
+
+FS = 200.0
+BASE = {'ssvep_freqs': FREQS, 'ssvep_step': 0.25, 'ssvep_margin_thresh': 0.0, 'ssvep_refractory': 1.0}
+
+
+def _rehearsal(path, dur, trial = 6.0, rest = 4.0, emg_interval = 7.0, seed = 0):
+    """
+    Saves a labeled rehearsal: SSVEP trials of `trial` seconds cycling through FREQS with
+    `rest` seconds between them, and 0.5 s jaw clenches every `emg_interval` seconds.
+    """
+    n = int(dur * FS)
+    template = AxisArray(np.zeros((n, 8)), dims = ['time', 'ch'], axes = {'time': AxisArray.LinearAxis(gain = 1.0 / FS, offset = 0.0)})
+    base = synthetic_eeg(noise_amp = 5.0, emg_interval = emg_interval, seed = seed).send(template).data
+    ssvep = synthetic_eeg(ssvep_freqs = FREQS, ssvep_amp = 4.0, ssvep_switch = trial + rest, ch_gains = GAINS).send(template).data
+    i = np.arange(n)
+    attending = (i % int((trial + rest) * FS)) < int(trial * FS)
+    labels = np.where(attending, (i // int((trial + rest) * FS)) % len(FREQS), -1)
+    jaw = ((i % int(emg_interval * FS)) < int(0.5 * FS)).astype(int)
+    np.savez(path, data = base + ssvep * attending[:, None], fs = FS, labels = labels, jaw = jaw)
+    return path
+
+
+@pytest.fixture(scope = 'module')
+def rehearsals(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp('rehearsals')
+    return [load_rehearsal(_rehearsal(str(tmp / f'r{seed}.npz'), 60.0, seed = seed)) for seed in range(2)]
+
+
+def test_jaw_sweep(rehearsals):
+    results = sweep_jaw(rehearsals, [5.0, 20.0, 1e6])
+    low, mid, high = results
+    assert mid.detected == 1.0 and mid.false_per_min == 0.0 and 0.0 < mid.latency < 0.5
+    assert low.false_per_min > 0 # noise alone crosses it
+    assert np.isnan(high.latency) and high.detected == 0.0
+    assert best(results).settings == {'jaw_thresh': 20.0}
+
+
+def test_ssvep_sweep(rehearsals):
+    grid = ssvep_grid([0.5, 2.0], [4.0], [0, 2], [0.45, 0.99])
+    assert len(grid) == 8 and grid[0] == {'ssvep_harmonics': 0, 'ssvep_dur': 4.0, 'ssvep_min_dur': 0.5, 'ssvep_prob_thresh': 0.45}
+    results = sweep_ssvep(rehearsals, grid, BASE, workers = 2)
+    assert [r.settings for r in results] == grid
+    by = {(r.settings['ssvep_harmonics'], r.settings['ssvep_min_dur'], r.settings['ssvep_prob_thresh']): r for r in results}
+    assert by[2, 2.0, 0.45].accuracy > 0.9 and by[2, 2.0, 0.45].detected > 0.9
+    assert by[2, 0.5, 0.45].false_per_min > by[2, 2.0, 0.45].false_per_min # short windows trigger on noise
+    assert by[2, 2.0, 0.99].detected < by[2, 2.0, 0.45].detected
+    chosen = best(results, max_false_per_min = 1.0)
+    assert chosen.false_per_min <= 1.0 and chosen.detected > 0.9
+
+
+def test_decoders_share_reference_signals(rehearsals):
+    reference_design.cache_clear()
+    params = dict(freqs = FREQS, min_dur = 1.0, max_dur = 4.0, harmonics = 1)
+    replay_ssvep(rehearsals[0], prob_thresh = 0.45, **params)
+    misses = reference_design.cache_info().misses
+    replay_ssvep(rehearsals[0], prob_thresh = 0.6, **params)
+    assert reference_design.cache_info().misses == misses
+    assert not reference_design(tuple(FREQS), 1, 100, 0.01, '<f8').flags.writeable
+
+
+def test_settings_file(tmp_path):
+    path = str(tmp_path / 'calibration.json')
+    save_settings(path, {'jaw_thresh': 25.0, 'ssvep_harmonics': 1})
+    assert load_settings(path, ['jaw_thresh', 'ssvep_harmonics']) == {'jaw_thresh': 25.0, 'ssvep_harmonics': 1}
+    with pytest.raises(ValueError):
+        load_settings(path, ['jaw_thresh'])
+
+
+if __name__ == "__main__":
+    # Sweep wall time: intermediates cached once per rehearsal vs. preprocessing per grid point, 1 and all cores
+    # Usage: python calibration_test.py [minutes per rehearsal] [rehearsals]
+    import tempfile
+    from neurotheatre.offline import extract_features
+
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    n_rehearsals = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    grid = ssvep_grid([0.5, 1.0, 2.0], [4.0, 8.0], [0, 2], [0.45, 0.6])
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [_rehearsal(os.path.join(tmp, f'r{seed}.npz'), minutes * 60.0, seed = seed) for seed in range(n_rehearsals)]
+        tick = time.perf_counter()
+        rehearsals = [load_rehearsal(path) for path in paths]
+        load = time.perf_counter() - tick
+        print(f'{n_rehearsals} x {minutes:g} min rehearsals: preprocessing and envelope in {load:.2f} s')
+
+        tick = time.perf_counter()
+        results = sweep_jaw(rehearsals, np.arange(5.0, 60.0, 2.5))
+        chosen = best(results)
+        print(f'jaw: {len(results)} thresholds in {(time.perf_counter() - tick) * 1e3:.1f} ms; best {chosen.settings}, '
+            f'detected {chosen.detected:.2f}, {chosen.false_per_min:.2f} false/min, latency {chosen.latency:.2f} s')
+
+        print(f"{'grid points':>11} {'path':>32} {'s':>8} {'s/point':>8}")
+        tick = time.perf_counter()
+        for point in grid:
+            for path in paths:
+                with np.load(path) as rec:
+                    extract_features(rec['data'], FS, enabled = ['ssvep'], **{
+                        'ssvep_freqs': FREQS, 'ssvep_min_dur': point['ssvep_min_dur'], 'ssvep_max_dur': point['ssvep_dur'],
+                        'ssvep_harmonics': point['ssvep_harmonics'], 'ssvep_prob_thresh': point['ssvep_prob_thresh'],
+                    })
+        elapsed = time.perf_counter() - tick
+        print(f"{len(grid):>11} {'preprocessed per point, 1 proc':>32} {elapsed:>8.2f} {elapsed / len(grid):>8.2f}")
+        for workers in sorted({1, os.cpu_count()}):
+            reference_design.cache_clear()
+            tick = time.perf_counter()
+            results = sweep_ssvep(rehearsals, grid, BASE, workers = workers)
+            elapsed = time.perf_counter() - tick + load
+            print(f"{len(grid):>11} {f'cached, {workers} procs':>32} {elapsed:>8.2f} {elapsed / len(grid):>8.2f}")
+        write_report(os.path.join(tmp, 'sweep.csv'), results)
+        chosen = best(results)
+        print(f'ssvep best: {chosen.settings}, accuracy {chosen.accuracy:.2f}, detected {chosen.detected:.2f}, '
+            f'{chosen.false_per_min:.2f} false/min, latency {chosen.latency:.2f} s')
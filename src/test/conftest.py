@@ -0,0 +1,51 @@
+import socket
+
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.features import eeg_features, FEATURES, PERFORMER_AXIS
+from neurotheatre.synthetic import synthetic_eeg
+
+FREQS = [7.0, 9.0, 11.0]
+BANDS = {'alpha': (8.0, 13.0), 'beta': (13.0, 30.0), 'gamma': (30.0, 50.0)}
+
+# Occipital channels see the SSVEP most; a uniform one would vanish in the common average reference
+GAINS = [0.2, 0.2, 0.4, 0.4, 0.6, 1.0, 1.0, 1.0]
+
+
+def _headsets(n_performers, n_blocks, blocksize = 10, n_ch = 8, fs = 200.0, **kwargs):
+    """
+    Yields stacked (performer, time, ch) blocks from independent synthetic headsets.
+
+    By default each attends one SSVEP target at a time; `kwargs` override the arguments of
+    `synthetic_eeg`.
+    """
+    kwargs = {
+        'ssvep_freqs': FREQS, 'ssvep_amp': 10.0, 'ssvep_switch': 10.0, 'noise_amp': 5.0, 'emg_interval': 5.0, 'ch_gains': GAINS,
+        **kwargs,
+    }
+    gens = [synthetic_eeg(seed = p, **kwargs) for p in range(n_performers)]
+    for i in range(n_blocks):
+        template = AxisArray(
+            np.zeros((blocksize, n_ch)),
+            dims = ['time', 'ch'],
+            axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = i * blocksize / fs)},
+        )
+        yield AxisArray(
+            np.stack([gen.send(template).data for gen in gens]),
+            dims = [PERFORMER_AXIS, 'time', 'ch'],
+            axes = template.axes,
+        )
+
+
+def _features(enabled = FEATURES, **kwargs):
+    """ Feature stages for :obj:`_headsets`; `kwargs` override the arguments of `eeg_features` """
+    kwargs = {'ssvep_min_dur': 1.0, 'ssvep_prob_thresh': 0.45, **kwargs}
+    return eeg_features(bands = list(BANDS.values()), ssvep_freqs = FREQS, enabled = enabled, **kwargs)
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
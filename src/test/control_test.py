@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from pythonosc.udp_client import SimpleUDPClient
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.control import parse_update, serve_control, RUNTIME_SETTINGS, SSVEP_PARAMS
+from neurotheatre.features import eeg_features, bandpower_stage, zscore_stage
+from neurotheatre.frequencydecoder import dynamic_stopping_decode
+
+from conftest import _free_port
+from ssvep_dynamic_test import synthetic_session, FREQS
+
+
+def _stream(data, fs, blocksize = 10):
+    for start in range(0, data.shape[0], blocksize):
+        yield AxisArray(
+            data[start:start + blocksize],
+            dims = ['time', 'ch'],
+            axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = start / fs)},
+        )
+
+
+def _first_decision(gen, blocks):
+    for msg in blocks:
+        out = gen.send(msg)
+        if out.data.size:
+            return out
+    raise AssertionError('no decision')
+
+
+def test_parse_update():
+    assert parse_update('jaw_thresh', [25]) == 25.0
+    assert parse_update('ssvep_freqs', [8, 10.0, 12]) == [8.0, 10.0, 12.0]
+    assert parse_update('bands', ['alpha', 8, 13, 'beta', 13, 30]) == {'alpha': (8.0, 13.0), 'beta': (13.0, 30.0)}
+    assert parse_update('td_address', ['10.0.0.2:8000']) == '10.0.0.2:8000'
+    assert parse_update('td_address', ['10.0.0.2:8000', '239.1.1.1:8000']) == '10.0.0.2:8000,239.1.1.1:8000'
+    assert parse_update('features', ['jaw', 'ssvep']) == ['ssvep', 'jaw']
+    assert parse_update('features', []) == []
+    assert parse_update('ssvep_stim_t0', [1234]) == 1234.0
+    with pytest.raises(ValueError):
+        parse_update('precision', ['float32'])
+    with pytest.raises(ValueError):
+        parse_update('bands', ['alpha', 8])
+    with pytest.raises(ValueError):
+        parse_update('td_address', ['localhost'])
+    with pytest.raises(ValueError):
+        parse_update('hand_address', ['10.0.0.2:8002', 'localhost'])
+    with pytest.raises(ValueError):
+        parse_update('features', ['alpha'])
+    for setting, args in [
+        ('bands', ['alpha', 13, 8]),
+        ('bands', ['delta', 0, 4]),
+        ('ssvep_dur', [-1]),
+        ('ssvep_step', [0]),
+        ('bandpower_order', [0]),
+        ('bands_tau', [float('nan')]),
+        ('ssvep_refractory', [-0.5]),
+        ('ssvep_freqs', [8, -10]),
+    ]:
+        with pytest.raises(ValueError):
+            parse_update(setting, args)
+    assert parse_update('ssvep_harmonics', [0]) == 0
+    assert set(SSVEP_PARAMS) == {k for k, v in RUNTIME_SETTINGS.items() if v == 'ssvep'}
+
+
+def test_decoder_update_keeps_window():
+    data, labels, fs = synthetic_session(snr = 1.0)
+    kwargs = dict(freqs = FREQS, harmonics = 1, min_dur = 0.5, max_dur = 4.0, softmax_beta = 5.0, prob_thresh = 2.0)
+    gen = dynamic_stopping_decode(**kwargs)
+    blocks = list(_stream(data, fs))
+    for msg in blocks[:30]: # 3 s with decisions disabled
+        assert gen.send(msg).data.size == 0
+
+    # Enabling decisions decides on the 3 s already accumulated instead of starting over
+    assert gen.send({'prob_thresh': 0.0}).data.size == 0
+    out = _first_decision(gen, blocks[30:])
+    assert out.attrs['decision_time'] > 3.0
+
+    # New targets: the references change, decisions follow the new list
+    gen.send({'freqs': FREQS[:2], 'refractory': 0.0})
+    out = _first_decision(gen, blocks[40:])
+    assert len(out.data) == 2 and out.attrs['decision_time'] == pytest.approx(0.5)
+    with pytest.raises(ValueError):
+        gen.send({'time_axis': 'x'})
+
+
+def test_decoder_shrinking_max_dur_keeps_newest_samples():
+    data, labels, fs = synthetic_session(snr = 1.0)
+    gen = dynamic_stopping_decode(freqs = FREQS, min_dur = 0.5, max_dur = 4.0, prob_thresh = 2.0)
+    for msg in list(_stream(data, fs))[:30]:
+        gen.send(msg)
+    gen.send({'max_dur': 1.0, 'prob_thresh': 0.0})
+    out = _first_decision(gen, _stream(data[300:], fs))
+    assert out.attrs['decision_time'] == pytest.approx(1.0)
+
+
+def test_control_server_roundtrip():
+    port = _free_port()
+    updates, errors = [], []
+
+    async def run():
+        transport = await serve_control(
+            f'127.0.0.1:{port}',
+            lambda setting, value, received: updates.append((setting, value)),
+            lambda address, reason: errors.append(address),
+        )
+        client = SimpleUDPClient('127.0.0.1', port)
+        client.send_message('/config/jaw_thresh', 30.0)
+        client.send_message('/config/bands', ['alpha', 8.0, 13.0])
+        client.send_message('/config/precision', 'float32')
+        client.send_message('/other', 1)
+        for _ in range(100):
+            if len(updates) + len(errors) == 4:
+                break
+            await asyncio.sleep(0.01)
+        transport.close()
+
+    asyncio.run(run())
+    assert updates == [('jaw_thresh', 30.0), ('bands', {'alpha': (8.0, 13.0)})]
+    assert errors == ['/config/precision', '/other']
+
+
+if __name__ == "__main__":
+    # Cost of applying each kind of update vs. rebuilding the whole feature pipeline
+    # (what restarting the graph, or FrequencyDecode.on_settings-style rebuilds, would do)
+    bands = [(8.0, 13.0), (13.0, 30.0), (30.0, 50.0)]
+    data, labels, fs = synthetic_session(snr = 1.0, fs = 200.0)
+    features = eeg_features(bands = bands, ssvep_freqs = FREQS)
+    for msg in _stream(data[:2000], fs):
+        msg = AxisArray(msg.data[None], dims = ['performer', 'time', 'ch'], axes = msg.axes)
+        preproc = features.preproc(msg)
+        features.zscore.send(features.bandpower(preproc))
+        features.ssvep.send(preproc)
+
+    def timeit(fn, n = 200):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        return (time.perf_counter() - start) / n * 1e3
+
+    stats = {'init_mean': np.zeros(3), 'init_var': np.ones(3)}
+    print(f"{'update':>34} {'ms':>8}")
+    print(f"{'threshold (jaw_thresh)':>34} {timeit(lambda: None):>8.4f}")
+    print(f"{'ssvep thresholds':>34} {timeit(lambda: features.ssvep.send({'prob_thresh': 0.6})):>8.4f}")
+    print(f"{'ssvep_freqs (reference refresh)':>34} {timeit(lambda: features.ssvep.send({'freqs': FREQS})):>8.4f}")
+    print(f"{'bands_tau (z-score restart)':>34} {timeit(lambda: zscore_stage('window', 'ch', 2.0, False, stats)):>8.4f}")
+    print(f"{'bands (band power + z-score)':>34} {timeit(lambda: (bandpower_stage('time', bands), zscore_stage('window'))):>8.4f}")
+    print(f"{'full pipeline rebuild':>34} {timeit(lambda: eeg_features(bands = bands, ssvep_freqs = FREQS)):>8.4f}")
+    print("A full rebuild also discards filter state: the 2 s band power window and the SSVEP evidence must refill,")
+    print("and a graph restart additionally resets the VQF orientation filter.")
@@ -0,0 +1,110 @@
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+from neurotheatre.eegcodec import encode_block, decode_packet, EEGStreamDecoder, CODECS, HEADER
+from neurotheatre.features import preproc_stage
+
+from conftest import _headsets
+
+FS = 100.0
+UDP_IP_HEADER = 28 # bytes per datagram on the wire besides the OSC message
+
+
+def _preproc(n_blocks, n_performers = 1):
+    """ Preprocessed synthetic EEG, one (performer, time, ch) array per 50 ms block """
+    preproc = preproc_stage()
+    return [preproc(msg).data for msg in _headsets(n_performers, n_blocks)]
+
+
+@pytest.mark.parametrize('codec', list(CODECS))
+@pytest.mark.parametrize('bits', [16, 10])
+def test_round_trip_within_half_a_step(codec, bits):
+    blocks = _preproc(200)
+    for seq, block in enumerate(blocks):
+        packet = decode_packet(encode_block(block[0], 3.0 + seq * 0.05, FS, seq, codec, bits))
+        assert packet.seq == seq and packet.t0 == 3.0 + seq * 0.05 and packet.fs == FS
+        assert packet.data.shape == block[0].shape
+        step = (block.max() - block.min()) / (2 ** bits - 2)
+        assert np.abs(packet.data - block[0]).max() <= 0.5 * step + 1e-6 * np.abs(block).max()
+
+
+def test_delta_wraps_losslessly():
+    # Full-scale swings between neighbouring samples overflow int16 differences
+    data = np.tile([[-1.0], [1.0], [-1.0], [0.999], [0.0]], (3, 4))
+    for codec in ('int16', 'int16-delta', 'int16-delta-zlib'):
+        assert np.abs(decode_packet(encode_block(data, 0.0, FS, 0, codec)).data - data).max() < 1e-4
+
+
+def test_constant_and_empty_blocks():
+    flat = decode_packet(encode_block(np.full((5, 8), 2.5), 0.0, FS, 0, 'int16-delta-zlib'))
+    assert np.array_equal(flat.data, np.full((5, 8), 2.5, np.float32))
+    empty = decode_packet(encode_block(np.zeros((0, 8)), 0.0, FS, 0))
+    assert empty.data.shape == (0, 8)
+
+
+def test_compression_shrinks_packets():
+    t = np.arange(100) / FS
+    block = 40.0 * np.sin(2 * np.pi * 10.0 * t)[:, None] * np.linspace(0.5, 1.0, 8) # 1 s, smooth
+    block += np.random.default_rng(0).normal(scale = 0.5, size = block.shape)
+    sizes = {codec: len(encode_block(block, 0.0, FS, 0, codec, bits = 10)) for codec in CODECS}
+    assert sizes['int16'] == sizes['int16-delta'] == HEADER.size + block.size * 2
+    assert max(sizes['int16-zlib'], sizes['int16-delta-zlib']) < 0.8 * sizes['int16']
+
+    # Noise at full resolution doesn't compress; the packet goes out uncompressed
+    noise = np.random.default_rng(0).normal(size = (5, 8))
+    packet = encode_block(noise, 0.0, FS, 0, 'int16-zlib')
+    assert len(packet) == HEADER.size + noise.size * 2 and np.allclose(decode_packet(packet).data, noise, atol = 1e-3)
+
+
+def test_stream_decoder_counts_loss_and_duplicates():
+    blocks = _preproc(10)
+    packets = [encode_block(block[0], i * 0.05, FS, i) for i, block in enumerate(blocks)]
+    decoder = EEGStreamDecoder()
+    received = [decoder.push(packets[i], arrival = i * 0.05) for i in (0, 1, 3, 2, 2, 5, 6, 7, 8, 9)]
+    assert received[4] is None and all(p is not None for i, p in enumerate(received) if i != 4)
+    assert decoder.stats.lost == 1 and decoder.stats.duplicates == 1 and decoder.stats.reordered == 1
+
+
+def test_rejects_other_packets():
+    with pytest.raises(ValueError):
+        decode_packet(b'NTRING\x00\x01' + bytes(64))
+    with pytest.raises(ValueError):
+        decode_packet(b'NTEQ')
+
+
+def _osc_size(address, args):
+    builder = OscMessageBuilder(address = address)
+    for arg in args:
+        builder.add_arg(arg)
+    return len(builder.build().dgram) + UDP_IP_HEADER
+
+
+if __name__ == "__main__":
+    # Bandwidth, CPU cost and reconstruction error of the packet codecs vs. a float message per sample
+    # Usage: python eegcodec_test.py [seconds] [samples per packet]
+    dur = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    n_block = int(sys.argv[2]) if len(sys.argv) > 2 else 5 # 5: one live 50 ms block
+    signal = np.concatenate(_preproc(int(dur * 20)), axis = 1)[0]
+    blocks = [signal[i:i + n_block] for i in range(0, len(signal), n_block)]
+    print(f'{dur:g} s of preprocessed EEG (8 ch @ {FS:g} Hz) in packets of {n_block} samples, per performer')
+    print(f"{'codec':>17} {'bits':>4} {'bytes/s':>8} {'vs float':>8} {'encode us':>10} {'decode us':>10} {'max err uV':>11} {'snr dB':>7}")
+
+    per_sample = _osc_size('/eeg/preproc', [0.0] * 8) * len(signal) / dur
+    print(f"{'float per sample':>17} {32:>4} {per_sample:>8.0f} {1.0:>8.2f} {'':>10} {'':>10} {0.0:>11.4f} {'':>7}")
+    for bits in (16, 10):
+        for codec in CODECS:
+            start = time.perf_counter()
+            packets = [encode_block(block, 0.0, FS, seq, codec, bits) for seq, block in enumerate(blocks)]
+            encode = (time.perf_counter() - start) / len(blocks)
+            start = time.perf_counter()
+            decoded = [decode_packet(packet).data for packet in packets]
+            decode = (time.perf_counter() - start) / len(blocks)
+            sent = sum(_osc_size('/eeg/preproc/packet', [packet]) for packet in packets) / dur
+            error = np.concatenate(decoded) - signal
+            snr = 10 * np.log10(np.mean(signal ** 2) / np.mean(error ** 2))
+            print(f"{codec:>17} {bits:>4} {sent:>8.0f} {sent / per_sample:>8.2f} {encode * 1e6:>10.1f} {decode * 1e6:>10.1f} {np.abs(error).max():>11.4f} {snr:>7.1f}")
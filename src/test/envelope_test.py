@@ -0,0 +1,124 @@
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.downsample import downsample
+
+from neurotheatre.envelope import minmax_envelope
+
+
+def _blocks(data, fs, n):
+    """ `data` (time x ch) in blocks of `n` samples """
+    for start in range(0, data.shape[0], n):
+        yield AxisArray(
+            data[start:start + n],
+            dims = ['time', 'ch'],
+            axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = start / fs)},
+        )
+
+
+def _stream(stage, blocks):
+    send = stage.send
+    outs = [send(msg) for msg in blocks]
+    return np.concatenate([out.data for out in outs]), outs
+
+
+def _emg(fs, dur, seed = 0):
+    """ Background EEG with short EMG bursts (jaw clenches) of single-sample spikes on some channels """
+    rng = np.random.default_rng(seed)
+    n = int(fs * dur)
+    data = 20.0 * rng.standard_normal((n, 8))
+    spikes = rng.choice(n, size = int(dur * 5), replace = False)
+    data[spikes, :4] += rng.choice([-1.0, 1.0], size = (len(spikes), 4)) * 400.0
+    return data
+
+
+def test_keeps_every_peak():
+    fs = 1000.0
+    data = _emg(fs, 4.0)
+    env, outs = _stream(minmax_envelope(display_rate = 100.0), _blocks(data, fs, 7))
+    # 10 samples per column, two out each
+    assert env.shape == (2 * (data.shape[0] // 10), 8)
+    assert outs[-1].get_axis('time').gain == pytest.approx(1.0 / 200.0)
+    columns = data.reshape(-1, 10, 8)
+    assert np.array_equal(env.reshape(-1, 2, 8).max(axis = 1), columns.max(axis = 1))
+    assert np.array_equal(env.reshape(-1, 2, 8).min(axis = 1), columns.min(axis = 1))
+
+    # Decimating to as many points loses most spikes
+    decimated, _ = _stream(downsample(axis = 'time', factor = 5), _blocks(data, fs, 7))
+    assert np.sum(np.abs(decimated) > 300.0) < 0.5 * np.sum(np.abs(data) > 300.0)
+    assert np.sum(np.abs(env) > 300.0) == np.sum(np.abs(data) > 300.0)
+
+
+def test_blocks_give_the_same_envelope():
+    fs = 250.0
+    data = _emg(fs, 2.0)
+    whole, _ = _stream(minmax_envelope(display_rate = 50.0), _blocks(data, fs, data.shape[0]))
+    pieces, outs = _stream(minmax_envelope(display_rate = 50.0), _blocks(data, fs, 3))
+    assert np.array_equal(whole, pieces)
+    # Offsets are those of each output's first column
+    ends = np.cumsum([out.data.shape[0] for out in outs])
+    for out, end in zip(outs[1:], ends[:-1]):
+        if out.data.shape[0]:
+            assert out.get_axis('time').offset == pytest.approx(end * 5 / 2 / fs)
+
+
+def test_keeps_the_order_of_min_and_max():
+    data = np.array([[0.0], [5.0], [-3.0], [1.0], [-7.0], [2.0], [9.0], [0.0]])
+    env, _ = _stream(minmax_envelope(display_rate = 0.5), _blocks(data, 2.0, 8))
+    assert env[:, 0].tolist() == [5.0, -3.0, -7.0, 9.0]
+
+
+def test_slow_signals_pass_through():
+    data = _emg(100.0, 1.0)
+    stage = minmax_envelope(display_rate = 50.0)
+    msg = next(_blocks(data, 100.0, 100))
+    assert stage.send(msg) is msg
+
+
+def test_axis_and_rate_changes():
+    stage = minmax_envelope(axis = 'time', display_rate = 10.0)
+    data = np.arange(2 * 35 * 3, dtype = np.float32).reshape(2, 35, 3) # performer x time x ch
+    msg = AxisArray(data, dims = ['performer', 'time', 'ch'], axes = {'time': AxisArray.LinearAxis(gain = 0.01)})
+    out = stage.send(msg)
+    assert out.dims == msg.dims and out.data.shape == (2, 6, 3) and out.data.dtype == np.float32
+    assert out.data[1, :, 2].tolist() == [107.0, 134.0, 137.0, 164.0, 167.0, 194.0]
+    # A new sampling rate drops the five held samples
+    msg = AxisArray(data, dims = msg.dims, axes = {'time': AxisArray.LinearAxis(gain = 0.02)})
+    assert stage.send(msg).data.shape == (2, 14, 3)
+
+
+if __name__ == "__main__":
+    # What the dashboard plot receives per second of a headset, and how much of the EMG bursts survive
+    # Usage: python envelope_test.py [sampling rate] [display rate]
+    fs = float(sys.argv[1]) if len(sys.argv) > 1 else 1000.0
+    display_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 200.0
+    dur = 60.0
+    data = _emg(fs, dur)
+    n_spikes = np.sum(np.abs(data) > 300.0)
+    blocksize = int(fs / 20)
+
+    print(f'{fs:.0f} Hz x 8 ch, {blocksize}-sample blocks, {display_rate:.0f} columns/s')
+    print(f"{'stage':>14} {'points/s':>9} {'kB/s':>7} {'peaks':>6} {'us/block':>9}")
+    stages = [('full rate', None), ('downsample 2', lambda: downsample(axis = 'time', factor = 2))]
+    q = max(1, int(round(fs / display_rate)))
+    if q > 1:
+        stages.append((f'downsample {q}', lambda: downsample(axis = 'time', factor = q)))
+    stages.append(('min/max', lambda: minmax_envelope(display_rate = display_rate)))
+    for name, make in stages:
+        blocks = list(_blocks(data, fs, blocksize))
+        tick = time.perf_counter()
+        if make is None:
+            out = data
+        else:
+            out, _ = _stream(make(), blocks)
+        cost = (time.perf_counter() - tick) / len(blocks)
+        # The plot streams a float64 column per channel, plus time
+        points = out.shape[0] / dur
+        print(
+            f"{name:>14} {points:>9.0f} {points * 9 * 8 / 1e3:>7.1f} "
+            f"{np.sum(np.abs(out) > 300.0) / n_spikes:>6.0%} {cost * 1e6:>9.1f}"
+        )
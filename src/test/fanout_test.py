@@ -0,0 +1,159 @@
+import asyncio
+import socket
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from pythonosc.osc_message import OscMessage
+from pythonosc.udp_client import SimpleUDPClient
+
+import neurotheatre.fanout
+from neurotheatre.fanout import FanOut, parse_destinations, is_multicast
+from neurotheatre.imu_udp_receive import open_datagram_queue
+
+from conftest import _free_port
+
+GROUP = '239.255.42.99'
+
+
+def _receivers(n):
+    socks = []
+    for _ in range(n):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(1.0)
+        socks.append(sock)
+    return socks, ','.join(f'127.0.0.1:{sock.getsockname()[1]}' for sock in socks)
+
+
+def test_parse_destinations():
+    assert parse_destinations('10.0.0.5:8000, localhost:9000,') == [('10.0.0.5', 8000), ('localhost', 9000)]
+    assert parse_destinations('') == []
+    with pytest.raises(ValueError):
+        parse_destinations('10.0.0.5')
+    assert is_multicast(GROUP) and not is_multicast('10.0.0.5') and not is_multicast('localhost')
+
+
+def test_encodes_once_for_every_destination(monkeypatch):
+    builds = []
+    class Builder(neurotheatre.fanout.OscMessageBuilder):
+        def build(self):
+            builds.append(self.address)
+            return super().build()
+    monkeypatch.setattr(neurotheatre.fanout, 'OscMessageBuilder', Builder)
+
+    socks, spec = _receivers(3)
+    fanout = FanOut(spec)
+    fanout.send_message('/eeg/preproc', [1.0, 2.5, -3.0])
+    fanout.send_message('/eeg/alpha', 0.25)
+    assert builds == ['/eeg/preproc', '/eeg/alpha']
+    for sock in socks:
+        msgs = [OscMessage(sock.recv(1024)) for _ in range(2)]
+        assert [(m.address, m.params) for m in msgs] == [('/eeg/preproc', [1.0, 2.5, -3.0]), ('/eeg/alpha', [0.25])]
+    assert [(s.datagrams, s.errors) for s in fanout.stats] == [(2, 0)] * 3
+    fanout.close()
+
+
+def test_same_datagrams_as_simple_client():
+    socks, spec = _receivers(2)
+    fanout = FanOut(spec)
+    client = SimpleUDPClient('127.0.0.1', socks[1].getsockname()[1])
+    for value in ([7.0, 0.83], 'p1', b'\x00\x01blob', 3, None):
+        fanout.send_message('/x', value)
+        client.send_message('/x', value)
+        first, ours, theirs = socks[0].recv(1024), socks[1].recv(1024), socks[1].recv(1024)
+        assert first == ours == theirs
+    fanout.close()
+
+
+def test_one_bad_destination_does_not_stop_the_others():
+    socks, spec = _receivers(1)
+    # Broadcast without SO_BROADCAST is refused by the socket
+    fanout = FanOut(f'255.255.255.255:9,{spec}')
+    for i in range(3):
+        fanout.send(b'%d' % i)
+    assert [socks[0].recv(16) for _ in range(3)] == [b'0', b'1', b'2']
+    bad, good = fanout.stats
+    assert (bad.datagrams, bad.errors) == (0, 3) and bad.last_error
+    assert (good.datagrams, good.bytes, good.errors) == (3, 3, 0)
+    fanout.close()
+
+
+def test_multicast_reaches_every_member():
+    async def run():
+        port = _free_port()
+        members = [await open_datagram_queue(f'{GROUP}:{port}') for _ in range(2)]
+        fanout = FanOut(f'{GROUP}:{port}')
+        assert fanout.stats[0].multicast
+        fanout.send_message('/ssvep/focus', [9.0, 0.75])
+        received = [await asyncio.wait_for(queue.drain(), 2.0) for _, queue in members]
+        for transport, _ in members:
+            transport.close()
+        fanout.close()
+        return received
+
+    try:
+        received = asyncio.run(run())
+    except OSError as e:
+        pytest.skip(f'no multicast here: {e}')
+    for datagrams in received:
+        (data, _, _), = datagrams
+        assert OscMessage(data).params == [9.0, 0.75]
+
+
+def _cost(send, n_messages, receivers):
+    """ Sender CPU per message; the `receivers` are emptied after each run """
+    values = np.random.default_rng(0).standard_normal((n_messages, 8)).tolist()
+    tick = time.process_time()
+    for value in values:
+        send('/p1/eeg/preproc', value)
+    cost = (time.process_time() - tick) / n_messages
+    for sock in receivers:
+        sock.setblocking(False)
+        try:
+            while True:
+                sock.recv(1024)
+        except BlockingIOError:
+            pass
+    return cost
+
+
+if __name__ == "__main__":
+    # Sender CPU per /eeg/preproc message (8 floats) as destinations are added: one
+    # SimpleUDPClient per destination (encoding each time), a FanOut to as many unicast
+    # destinations, and a FanOut to one multicast group that all of them join.
+    # Usage: python fanout_test.py [messages]
+    n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{'destinations':>12} {'clients us':>11} {'fan-out us':>11} {'multicast us':>13}")
+    for n in (1, 2, 4, 8, 16):
+        socks, spec = _receivers(n)
+        clients = [SimpleUDPClient(host, port) for host, port in parse_destinations(spec)]
+        def send_all(address, value):
+            for client in clients:
+                client.send_message(address, value)
+        fanout = FanOut(spec)
+        port = _free_port()
+        members = []
+        for _ in range(n):
+            member = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            member.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            member.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+            member.bind(('', port))
+            member.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(GROUP) + socket.inet_aton('0.0.0.0'))
+            members.append(member)
+        multicast = FanOut(f'{GROUP}:{port}')
+
+        for sock in socks:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        costs = [
+            min(_cost(send, n_messages, receivers) for _ in range(5))
+            for send, receivers in ((send_all, socks), (fanout.send_message, socks), (multicast.send_message, members))
+        ]
+        errors = fanout.stats[0].errors + multicast.stats[0].errors
+        print(f"{n:>12} {costs[0] * 1e6:>11.1f} {costs[1] * 1e6:>11.1f} {costs[2] * 1e6:>13.1f}" + (f' ({errors} refused)' if errors else ''))
+        for sock in socks + members:
+            sock.close()
+        fanout.close()
+        multicast.close()
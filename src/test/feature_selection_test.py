@@ -0,0 +1,110 @@
+import time
+
+import numpy as np
+import pytest
+
+from neurotheatre.features import compute_features, enable_features, disable_features, BlockHistory, FEATURES
+
+from conftest import _headsets, _features
+
+
+def _first_decision(features, blocks):
+    """ Block index of the first SSVEP decision of any performer """
+    for i, msg in enumerate(blocks):
+        posteriors = compute_features(features, msg)['ssvep']
+        if posteriors.data.size and not np.isnan(posteriors.attrs['decision_time']).all():
+            return i
+    raise AssertionError('no decision')
+
+
+def test_only_enabled_stages_run():
+    features = _features(['jaw'])
+    assert features.preproc is None and features.bandpower is None and features.ssvep is None
+    msg = next(_headsets(1, 1))
+    assert set(compute_features(features, msg)) == {'envelope'}
+
+    # SSVEP alone still needs the shared preprocessing
+    features = _features(['ssvep', 'jaw'])
+    assert features.preproc is not None and features.bandpower is None
+    disable_features(features, ['jaw'])
+    assert features.preproc is None and features.ssvep is None and features.enveloper is not None
+
+    with pytest.raises(ValueError):
+        _features(['alpha'])
+
+
+def test_block_history_keeps_duration():
+    history = BlockHistory(1.0)
+    blocks = list(_headsets(1, 50))
+    for msg in blocks:
+        history.push(msg)
+    kept = list(history)
+    assert len(kept) == 20 and kept[-1] is blocks[-1]
+    history.clear()
+    assert list(history) == []
+
+
+def test_enabled_ssvep_decides_from_history():
+    blocks = list(_headsets(2, 300))
+    history = BlockHistory(3.0)
+    features = _features(['jaw'])
+    for msg in blocks[:200]:
+        history.push(msg)
+        compute_features(features, msg)
+
+    # Warmed up on the last 3 s, the decoder can decide on its next evaluation...
+    enable_features(features, _features(['ssvep']), history)
+    assert features.enveloper is not None
+    assert _first_decision(features, blocks[200:]) <= 5
+
+    # ...where a cold one has to collect `ssvep_min_dur` of new data first
+    cold = _features(['jaw'])
+    enable_features(cold, _features(['ssvep']), [])
+    assert _first_decision(cold, blocks[200:]) >= 20
+
+
+def test_enabled_bandpower_matches_running():
+    blocks = list(_headsets(2, 400))
+    running = _features(FEATURES, bandpower_engine = 'iir')
+    history = BlockHistory(3.0)
+    features = _features(['ssvep'], bandpower_engine = 'iir')
+    for msg in blocks[:300]:
+        compute_features(running, msg)
+        history.push(msg)
+        compute_features(features, msg)
+
+    enable_features(features, _features(['bandpower'], bandpower_engine = 'iir'), history)
+    for msg in blocks[300:]:
+        expected = compute_features(running, msg)['bandpower'].data
+        actual = compute_features(features, msg)['bandpower'].data
+        assert np.allclose(actual, expected, rtol = 0.05, atol = 1e-3 * np.abs(expected).max())
+
+
+if __name__ == "__main__":
+    # CPU per block for different feature sets, 1 and 4 performers, 10-sample blocks @ 200 Hz
+    SETS = [list(FEATURES), ['preproc'], ['bandpower'], ['ssvep'], ['jaw'], ['bandpower', 'jaw'], []]
+    print(f"{'features':>34} {'performers':>10} {'mean us':>8} {'p50 us':>8} {'p99 us':>8}")
+    for n_performers in (1, 4):
+        blocks = list(_headsets(n_performers, 1200))
+        for enabled in SETS:
+            features = _features(enabled)
+            times = []
+            for msg in blocks:
+                tick = time.perf_counter()
+                compute_features(features, msg)
+                times.append(time.perf_counter() - tick)
+            times = np.array(times[200:]) * 1e6 # skip the first second
+            name = ' + '.join(enabled) or '(none)'
+            print(f"{name:>34} {n_performers:>10} {times.mean():>8.1f} {np.percentile(times, 50):>8.1f} {np.percentile(times, 99):>8.1f}")
+
+    # One-off cost of switching a feature on, warmed up on 3 s of history
+    print(f"\n{'enabling':>34} {'performers':>10} {'ms':>8}")
+    for n_performers in (1, 4):
+        history = BlockHistory(3.0)
+        for msg in _headsets(n_performers, 600):
+            history.push(msg)
+        for added in (['bandpower'], ['ssvep'], ['jaw'], list(FEATURES)):
+            features = _features([])
+            tick = time.perf_counter()
+            enable_features(features, _features(added), history)
+            print(f"{' + '.join(added):>34} {n_performers:>10} {(time.perf_counter() - tick) * 1e3:>8.1f}")
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import multiprocessing
+import socket
+import time
+
+import numpy as np
+import pytest
+
+from ezmsg.util.messagecodec import MessageEncoder
+from ezmsg.util.messages.axisarray import AxisArray, replace
+
+from neurotheatre.imu_udp_receive import LinkStats, MotionStreams, open_datagram_queue
+from neurotheatre.synthetic import synthetic_motion
+
+from conftest import _free_port
+
+FS = 200.0
+
+
+def _block(i, blocksize = 10, key = ''):
+    motion = synthetic_motion().send(AxisArray(np.zeros((blocksize, 6)), dims = ['time', 'ch'], axes = {'time': AxisArray.LinearAxis(gain = 1.0 / FS, offset = 0.0)}))
+    return AxisArray(
+        motion.data + i,
+        dims = ['time', 'ch'],
+        axes = {'time': AxisArray.LinearAxis(gain = 1.0 / FS, offset = 100.0 + i * blocksize / FS)},
+        attrs = {'seq': i},
+        key = key,
+    )
+
+
+def _datagram(i, **kwargs):
+    return json.dumps(_block(i, **kwargs), cls = MessageEncoder).encode()
+
+
+def test_link_stats():
+    stats = LinkStats()
+    statuses = [stats.update(seq, seq * 0.05, seq * 0.05 + 0.01) for seq in (0, 1, 3, 2, 2, 5)]
+    assert statuses == ['in_order', 'in_order', 'in_order', 'late', 'duplicate', 'in_order']
+    assert (stats.received, stats.lost, stats.reordered, stats.duplicates) == (5, 1, 1, 1)
+    assert stats.jitter == pytest.approx(0.0, abs = 1e-12) # constant transit time
+
+    stats.update(6, 0.30, 0.35)
+    assert stats.jitter == pytest.approx(0.04 / 16)
+
+    # Only the last `recent` sequence numbers are remembered
+    for seq in range(7, 7 + stats.recent.maxlen):
+        stats.update(seq, seq * 0.05, seq * 0.05)
+    assert stats.recent_set == set(stats.recent)
+    assert stats.update(0, 0.0, 0.0) == 'late' and stats.update(7 + stats.recent.maxlen - 1, 0.0, 0.0) == 'duplicate'
+
+
+def test_merges_contiguous_blocks_per_stream():
+    streams = MotionStreams()
+    sender = ('10.0.0.2', 5000)
+    datagrams = [(_datagram(i), sender, 0.0) for i in (0, 1, 2, 4)] + [(b'not json', sender, 0.0)]
+    datagrams.insert(2, (_datagram(0, key = 'p2'), sender, 0.0))
+    out = streams.receive(datagrams)
+
+    # 0-2 merge, 4 follows a lost block; p2 is its own stream
+    assert [(m.key, m.data.shape[0], m.axes['time'].offset) for m in out] == [('', 30, 100.0), ('', 10, 100.2), ('p2', 10, 100.0)]
+    merged = out[0]
+    assert np.array_equal(merged.data[10:20], _block(1).data) and 'seq' not in merged.attrs
+    assert streams.stats['10.0.0.2:5000'].lost == 1 and streams.decode_errors == 1
+
+    # The lost block turning up late is dropped: the stream has moved past it
+    assert streams.receive([(_datagram(3), sender, 0.0)]) == []
+    assert streams.stats['10.0.0.2:5000'].lost == 0 and streams.stats['10.0.0.2:5000'].late_dropped == 1
+
+
+def test_loopback_receive():
+    async def run(n):
+        port = _free_port()
+        transport, queue = await open_datagram_queue(f'127.0.0.1:{port}')
+        streams = MotionStreams()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for i in range(n):
+                sock.sendto(_datagram(i), ('127.0.0.1', port))
+            out, wakeups = [], 0
+            while sum(m.data.shape[0] for m in out) < 10 * n:
+                out += streams.receive(await asyncio.wait_for(queue.drain(), 2.0))
+                wakeups += 1
+        transport.close()
+        return out, wakeups, streams
+
+    out, wakeups, streams = asyncio.run(run(50))
+    data = np.concatenate([m.data for m in out])
+    assert np.array_equal(data, np.concatenate([_block(i).data for i in range(50)]))
+    assert len(out) == wakeups < 50 # one merged message per wakeup
+    (stats,) = streams.stats.values()
+    assert stats.received == 50 and stats.lost == 0
+
+
+def _sender(port, n, rate, burst):
+    """ Sends `n` stamped blocks at `rate` blocks/s, `burst` datagrams at a time """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        t0 = time.time()
+        for i in range(0, n, burst):
+            while time.time() < t0 + i / rate:
+                pass
+            for j in range(i, min(i + burst, n)):
+                # media time = send time, for latency
+                block = replace(_block(j), axes = {'time': AxisArray.LinearAxis(gain = 1.0 / FS, offset = time.time())})
+                sock.sendto(json.dumps(block, cls = MessageEncoder).encode(), ('127.0.0.1', port))
+
+
+def loopback(n, rate, burst = 1, merge = True):
+    """
+    Streams `n` IMU blocks from another process into a receiver over loopback.
+
+    Returns:
+        (blocks/s, lost, reordered, jitter ms, latency percentiles 50/99 in ms, datagrams per wakeup, messages published)
+    """
+    async def run():
+        port = _free_port()
+        transport, queue = await open_datagram_queue(f'127.0.0.1:{port}')
+        streams = MotionStreams(merge = merge)
+        proc = multiprocessing.Process(target = _sender, args = (port, n, rate, burst))
+        proc.start()
+        latencies, wakeups, messages, tick = [], 0, 0, None
+        try:
+            while True:
+                datagrams = await asyncio.wait_for(queue.drain(), 1.0)
+                tick = tick or time.time()
+                wakeups += 1
+                out = streams.receive(datagrams)
+                now = time.time()
+                messages += len(out)
+                latencies += [now - m.axes['time'].offset for m in out]
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.time() - tick - 1.0
+        proc.join()
+        transport.close()
+        (stats,) = streams.stats.values()
+        return (stats.received / elapsed, stats.lost, stats.reordered, stats.jitter * 1e3,
+            np.percentile(np.array(latencies) * 1e3, [50, 99]), stats.received / wakeups, messages)
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    # IMU datagrams from another process over loopback into MotionStreams
+    print(f"{'blocks/s':>9} {'burst':>6} {'merge':>6} {'recv/s':>8} {'lost':>5} {'reord':>6} {'jitter ms':>10} {'p50 ms':>7} {'p99 ms':>7} {'dgrams/wake':>12} {'published':>10}")
+    for rate, burst, n in ((20.0, 1, 200), (160.0, 1, 1600), (2000.0, 1, 20000), (2000.0, 20, 20000), (20000.0, 50, 50000)):
+        for merge in (False, True):
+            throughput, lost, reordered, jitter, (p50, p99), per_wake, messages = loopback(n, rate, burst, merge)
+            print(f"{rate:>9.0f} {burst:>6} {str(merge):>6} {throughput:>8.0f} {lost:>5} {reordered:>6} {jitter:>10.3f} {p50:>7.3f} {p99:>7.3f} {per_wake:>12.1f} {messages:>10}")
+    print('20 blocks/s is one headset (10-sample blocks @ 200 Hz); latency is send to decoded message.')
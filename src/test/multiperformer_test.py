@@ -0,0 +1,189 @@
+import time
+
+import numpy as np
+import pytest
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.features import compute_features, per_performer, PerformerStack, PERFORMER_AXIS
+from neurotheatre.frequencydecoder import frequency_decode, dynamic_stopping_decode, cca_correlations, _design
+
+from conftest import _headsets, _features, FREQS
+
+# Every target at once and a modulated alpha rhythm, the same on every channel
+MIXED = dict(ssvep_switch = 0.0, band_mods = {'alpha': (10.0, 0.05, 20.0)}, ch_gains = None)
+
+
+def test_batched_cca_matches_frequency_decode():
+    rng = np.random.default_rng(0)
+    fs, n = 100.0, 150
+    X = rng.standard_normal((4, n, 8))
+    X += np.sin(2 * np.pi * 9.0 * np.arange(n) / fs)[None, :, None]
+    X = (X - X.mean(1, keepdims = True)) / X.std(1, keepdims = True)
+
+    corrs = cca_correlations(X, _design(FREQS, 2, np.arange(n) / fs, np.float64))
+
+    gen = frequency_decode(time_axis = 'time', harmonics = 2, freqs = FREQS, softmax_beta = 0.0)
+    for b in range(X.shape[0]):
+        msg = AxisArray(X[b], dims = ['time', 'ch'], axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = 0.0)})
+        assert np.allclose(corrs[b], gen.send(msg).data)
+
+
+def test_batched_decisions_match_individual_decoders():
+    kwargs = dict(freqs = FREQS, harmonics = 1, min_dur = 0.5, max_dur = 4.0, prob_thresh = 0.45, softmax_beta = 5.0, refractory = 0.5)
+    batched = dynamic_stopping_decode(batch_axis = PERFORMER_AXIS, **kwargs)
+    single = [dynamic_stopping_decode(**kwargs) for _ in range(3)]
+
+    n_decisions = 0
+    for msg in _headsets(3, 400, **MIXED):
+        out = batched.send(msg)
+        for p, gen in enumerate(single):
+            ref = gen.send(AxisArray(msg.data[p], dims = ['time', 'ch'], axes = msg.axes))
+            if ref.data.size == 0:
+                assert out.data.size == 0 or np.isnan(out.attrs['decision_time'][p])
+                continue
+            n_decisions += 1
+            assert np.allclose(out.data[p], ref.data)
+            assert np.isclose(out.attrs['decision_time'][p], ref.attrs['decision_time'])
+    assert n_decisions > 0
+
+
+def test_flat_and_broken_entries_are_skipped():
+    kwargs = dict(freqs = FREQS, harmonics = 1, min_dur = 0.5, max_dur = 4.0, prob_thresh = 0.45, softmax_beta = 5.0, refractory = 0.5)
+    batched = dynamic_stopping_decode(batch_axis = PERFORMER_AXIS, **kwargs)
+    single = dynamic_stopping_decode(**kwargs)
+    n_decisions = 0
+    for i, msg in enumerate(_headsets(1, 400, **MIXED)):
+        data = np.zeros((3,) + msg.data.shape[1:])
+        data[0] = msg.data[0]
+        if i == 100:
+            data[2, 3] = np.nan # one bad sample clears that window
+        out = batched.send(AxisArray(data, dims = msg.dims, axes = msg.axes))
+        ref = single.send(AxisArray(msg.data[0], dims = ['time', 'ch'], axes = msg.axes))
+        if ref.data.size:
+            n_decisions += 1
+            assert np.allclose(out.data[0], ref.data)
+        if out.data.size:
+            assert np.isnan(out.attrs['decision_time'][1:]).all()
+    assert n_decisions > 0
+
+
+def test_stacked_features_match_single_headset():
+    batched = _features(ssvep_min_dur = 0.5)
+    single = _features(ssvep_min_dur = 0.5)
+    for msg in _headsets(3, 200, **MIXED):
+        preproc = batched.preproc(msg)
+        power = batched.bandpower(preproc)
+
+        one = AxisArray(msg.data[1:2], dims = msg.dims, axes = msg.axes)
+        preproc_one = single.preproc(one)
+        power_one = single.bandpower(preproc_one)
+
+        assert np.allclose(preproc.data[1:2], preproc_one.data)
+        if power.data.size:
+            assert np.allclose(per_performer(power, 'window', 'freq')[1], per_performer(power_one, 'window', 'freq')[0])
+
+
+def _block(data, offset, fs = 200.0):
+    return AxisArray(data, dims = ['time', 'ch'], axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = offset)})
+
+
+def test_stack_waits_for_all_performers():
+    stack = PerformerStack(['a', 'b'])
+    assert stack.push('a', _block(np.ones((10, 2)), 0.0)) is None
+    out = stack.push('b', _block(2 * np.ones((6, 2)), 0.0))
+    assert out.dims == [PERFORMER_AXIS, 'time', 'ch']
+    assert out.data.shape == (2, 6, 2)
+    assert np.all(out.data[0] == 1) and np.all(out.data[1] == 2)
+    out = stack.push('b', _block(2 * np.ones((10, 2)), 0.03))
+    assert out.data.shape == (2, 4, 2)
+    assert np.isclose(out.axes['time'].offset, 6 / 200.0)
+
+
+def test_stack_holds_stalled_performer():
+    stack = PerformerStack(['a', 'b'], max_skew = 0.1)
+    stack.push('b', _block(np.full((1, 2), 5.0), 0.0))
+    stack.push('a', _block(np.ones((1, 2)), 0.0))
+    released = 0
+    for i in range(5):
+        out = stack.push('a', _block(np.ones((10, 2)), (1 + 10 * i) / 200.0))
+        if out is not None:
+            assert np.all(out.data[1] == 5.0) # b's last sample is held
+            released += out.data.shape[1]
+    assert released > 0
+    # b's late samples for the held span are dropped so the headsets stay aligned
+    assert stack.push('b', _block(np.zeros((released, 2)), 0.005)) is None
+    out = stack.push('b', _block(np.full((stack.pending[0].shape[0], 2), 7.0), 0.5))
+    assert np.all(out.data[1] == 7.0)
+
+
+@pytest.mark.filterwarnings('error::RuntimeWarning')
+def test_silent_performer_for_the_whole_show():
+    # 'flat' streams zeros, 'silent' never connects; 2 min 5 s of 50 ms blocks
+    stack = PerformerStack(['a', 'flat', 'silent'])
+    features = _features(ssvep_min_dur = 0.5)
+    decisions = np.zeros(3, dtype = int)
+    released = 0
+    for msg in _headsets(1, 2500, **MIXED):
+        outs = [
+            stack.push('a', _block(msg.data[0], msg.axes['time'].offset)),
+            stack.push('flat', _block(np.zeros_like(msg.data[0]), msg.axes['time'].offset)),
+        ]
+        if released:
+            # Only waited for (max_skew) at startup
+            assert outs[0] is None and outs[1].data.shape == (3, 10, 8)
+        for out in outs:
+            if out is None:
+                continue
+            released += out.data.shape[1]
+            assert out.attrs['live'].tolist() == [True, True, False]
+            computed = compute_features(features, out)
+            if 'zscore' in computed:
+                assert np.isfinite(per_performer(computed['zscore'], 'window', 'freq')).all()
+            posteriors = computed['ssvep']
+            if posteriors.data.size:
+                decisions += ~np.isnan(posteriors.attrs['decision_time'])
+    assert released == 2500 * 10
+    assert decisions[0] > 0 and decisions[2] == 0
+    assert stack.filled.tolist() == [0, 0, 0]
+
+    # When it does connect, its first block goes out with the others'
+    stack.push('silent', _block(np.full((10, 8), 3.0), 0.0))
+    stack.push('a', _block(np.ones((10, 8)), 0.0))
+    out = stack.push('flat', _block(np.zeros((10, 8)), 0.0))
+    assert out.attrs['live'].all() and np.all(out.data[2] == 3.0)
+
+
+if __name__ == "__main__":
+    # How CPU time and per-block latency scale with the number of headsets.
+    # 'loop' runs one copy of the feature stages per headset (what N EEGOSC units would do);
+    # 'batched' runs one copy on the stacked array (MultiEEGOSC).
+    # Blocks are 10 samples @ 200 Hz (50 ms of data); latency is the compute time per block.
+    n_blocks, block_dur = 400, 10 / 200.0
+    print(f"{'headsets':>8} {'mode':>8} {'CPU %':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for n_performers in (1, 2, 4, 8):
+        blocks = list(_headsets(n_performers, n_blocks, **MIXED))
+        for mode in ('loop', 'batched'):
+            pipelines = [_features(ssvep_min_dur = 0.5) for _ in range(n_performers if mode == 'loop' else 1)]
+            if mode == 'loop':
+                inputs = [[AxisArray(msg.data[p:p + 1], dims = msg.dims, axes = msg.axes) for p in range(n_performers)] for msg in blocks]
+            else:
+                inputs = [[msg] for msg in blocks]
+
+            latencies = []
+            cpu_start = time.process_time()
+            for msgs in inputs:
+                start = time.perf_counter()
+                for features, msg in zip(pipelines, msgs):
+                    preproc = features.preproc(msg)
+                    power = features.bandpower(preproc)
+                    if power.data.size:
+                        features.zscore.send(power)
+                    features.ssvep.send(preproc)
+                    features.enveloper(msg)
+                latencies.append(time.perf_counter() - start)
+            cpu = time.process_time() - cpu_start
+
+            latencies = np.array(latencies) * 1e3
+            cpu_pct = 100.0 * cpu / (n_blocks * block_dur)
+            print(f"{n_performers:>8} {mode:>8} {cpu_pct:>8.1f} {np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 99):>8.2f}")
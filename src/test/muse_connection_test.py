@@ -0,0 +1,127 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+
+from neurotheatre.muse.connection import MuseBackend, MuseDeviceCache, connect_muse
+
+
+class FakeStreamInfo:
+    def __init__(self, address):
+        self.address = address
+
+    def source_id(self):
+        return f"Muse{self.address}"
+
+    def nominal_srate(self):
+        return 256.0
+
+
+class FakeBackend(MuseBackend):
+    """ Simulates BLE scan and LSL resolve latencies without any hardware """
+
+    def __init__(self, devices, scan_time = 0.2, resolve_time = 0.05, reachable = True):
+        self.devices = devices
+        self.scan_time = scan_time
+        self.resolve_time = resolve_time
+        self.reachable = reachable
+        self.streaming = None
+        self.n_scans = 0
+
+    async def discover(self, timeout):
+        self.n_scans += 1
+        await asyncio.sleep(self.scan_time)
+        return list(self.devices)
+
+    def start_stream(self, address):
+        self.streaming = address if self.reachable else None
+
+    def resolve(self, prop, value, timeout):
+        time.sleep(self.resolve_time)
+        if self.streaming is None:
+            return []
+        info = FakeStreamInfo(self.streaming)
+        if prop == "source_id" and info.source_id() != value:
+            return []
+        return [info]
+
+
+def test_cold_start_scans_and_populates_cache(tmp_path):
+    cache = MuseDeviceCache(str(tmp_path / "muse.json"))
+    backend = FakeBackend([("Muse-1234", "AA:BB")])
+    conn = asyncio.run(connect_muse(backend, cache))
+    assert not conn.cached
+    assert backend.n_scans == 1
+    assert cache.load().address == "AA:BB"
+    assert cache.load().source_id == "MuseAA:BB"
+
+
+def test_reconnect_uses_cache_without_scanning(tmp_path):
+    cache = MuseDeviceCache(str(tmp_path / "muse.json"))
+    backend = FakeBackend([("Muse-1234", "AA:BB")])
+    cold = asyncio.run(connect_muse(backend, cache))
+
+    backend.streaming = None # headset dropped
+    warm = asyncio.run(connect_muse(backend, cache))
+    assert warm.cached
+    assert backend.n_scans == 1
+    assert warm.elapsed < cold.elapsed
+
+
+def test_falls_back_to_scan_when_cached_device_is_gone(tmp_path):
+    cache = MuseDeviceCache(str(tmp_path / "muse.json"))
+    asyncio.run(connect_muse(FakeBackend([("Muse-1234", "AA:BB")]), cache))
+
+    backend = FakeBackend([("Muse-5678", "CC:DD")])
+    backend.start_stream = lambda address: setattr(backend, 'streaming', address if address == "CC:DD" else None)
+    conn = asyncio.run(connect_muse(backend, cache, direct_timeout = 0.01))
+    assert not conn.cached
+    assert conn.entry.address == "CC:DD"
+    assert cache.load().address == "CC:DD"
+
+
+def test_cache_ignores_other_muse_names(tmp_path):
+    cache = MuseDeviceCache(str(tmp_path / "muse.json"))
+    asyncio.run(connect_muse(FakeBackend([("Muse-1234", "AA:BB")]), cache))
+    assert cache.load("Muse-1234") is not None
+    assert cache.load("Muse-5678") is None
+
+
+if __name__ == "__main__":
+    import tempfile, os
+    with tempfile.TemporaryDirectory() as d:
+        cache = MuseDeviceCache(os.path.join(d, "muse.json"))
+        backend = FakeBackend([("Muse-1234", "AA:BB")], scan_time = 10.0, resolve_time = 0.5)
+        cold = asyncio.run(connect_muse(backend, cache))
+        print(f"Cold start (simulated 10 s scan): {cold.elapsed:.2f} s")
+        backend.streaming = None
+        warm = asyncio.run(connect_muse(backend, cache))
+        print(f"Reconnect from cache: {warm.elapsed:.2f} s")
+
+
+def _fake_stream(address):
+    # Stands in for muselsl.stream: streams until stopped
+    while True:
+        time.sleep(1.0)
+
+
+class StreamingBackend(MuseBackend):
+    stream_target = staticmethod(_fake_stream)
+
+
+def test_reconnecting_replaces_the_stream(tmp_path):
+    cache = MuseDeviceCache(str(tmp_path / "muse.json"))
+    backend = StreamingBackend()
+    backend.resolve = lambda prop, value, timeout: [FakeStreamInfo("AA:BB")]
+    backend.discover = FakeBackend([("Muse-1234", "AA:BB")]).discover
+    threads = threading.active_count()
+
+    streams = []
+    for _ in range(3): # a cold start, then watchdog reconnects
+        asyncio.run(connect_muse(backend, cache))
+        streams.append(backend.stream_process)
+    assert [p.name for p in multiprocessing.active_children()] == ["muselsl-stream"]
+    assert streams[-1].is_alive() and threading.active_count() == threads
+
+    backend.stop_stream()
+    assert not multiprocessing.active_children()
@@ -0,0 +1,21 @@
+import sys
+
+import pytest
+
+pytest.importorskip('ezmsg.panel')
+pytest.importorskip('ezmsg.unicorn')
+pytest.importorskip('pylsl')
+
+from neurotheatre import command
+
+
+def test_museosc_builds_its_settings(monkeypatch):
+    runs = []
+    monkeypatch.setattr(command.ez, 'run', lambda **components: runs.append(components))
+    monkeypatch.setattr(sys, 'argv', ['museosc', '-d', 'Muse-1234', '-a', '10.0.0.5', '-p', '9000', '--blocksize', '16', '--display-rate', '50'])
+    command.museosc()
+
+    settings = runs[0]['MUSEOSC'].SETTINGS
+    assert settings.muse_settings.muse_name == 'Muse-1234' and settings.muse_settings.blocksize == 16
+    assert settings.osc_settings.td_address == '10.0.0.5:9000'
+    assert settings.plot_settings.display_rate == 50.0
@@ -0,0 +1,64 @@
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.normalize import ewm_zscore
+
+
+def _msgs(data, blocksize, gain = 0.5):
+    for start in range(0, data.shape[0], blocksize):
+        yield AxisArray(
+            data[start:start + blocksize],
+            dims = ['window', 'freq', 'ch'],
+            axes = {'window': AxisArray.LinearAxis(gain = gain, offset = start * gain)}
+        )
+
+
+def _reference(x, alpha, mean, var):
+    """ Sample-by-sample incremental EW mean/variance """
+    out = []
+    for sample in x:
+        diff = sample - mean
+        mean = mean + alpha * diff
+        var = (1 - alpha) * (var + alpha * diff ** 2)
+        out.append((sample - mean) / np.sqrt(var + 1e-12))
+    return np.array(out), mean, var
+
+
+def test_matches_incremental_reference():
+    x = np.random.default_rng(0).standard_normal((200, 3, 4)) + 5.0
+    gen = ewm_zscore(time_axis = 'window', tau = 5.0)
+    out = np.concatenate([gen.send(msg).data for msg in _msgs(x, 7)])
+    ref, _, _ = _reference(x, 1 - np.exp(-0.5 / 5.0), x[0], np.zeros_like(x[0]))
+    assert np.allclose(out, ref)
+
+
+def test_reduce_axis_and_stats():
+    x = np.random.default_rng(1).standard_normal((50, 3, 4))
+    gen = ewm_zscore(time_axis = 'window', tau = 5.0, reduce_axis = 'ch')
+    for msg in _msgs(x, 10):
+        out = gen.send(msg)
+    assert out.dims == ['window', 'freq']
+    assert out.data.shape == (10, 3)
+    _, mean, var = _reference(x.mean(axis = 2), 1 - np.exp(-0.1), x[0].mean(axis = 1), np.zeros(3))
+    assert np.allclose(out.attrs['mean'], mean)
+    assert np.allclose(out.attrs['var'], var)
+
+
+def test_warm_start_resumes_statistics():
+    x = np.random.default_rng(2).standard_normal((100, 3, 4)) * 3.0 + 1.0
+    gen = ewm_zscore(time_axis = 'window', tau = 5.0)
+    full = np.concatenate([gen.send(msg).data for msg in _msgs(x, 10)])
+
+    first = ewm_zscore(time_axis = 'window', tau = 5.0)
+    for msg in _msgs(x[:50], 10):
+        out = first.send(msg)
+    resumed = ewm_zscore(time_axis = 'window', tau = 5.0, init_mean = out.attrs['mean'], init_var = out.attrs['var'])
+    second = np.concatenate([resumed.send(msg).data for msg in _msgs(x[50:], 10)])
+    assert np.allclose(second, full[50:])
+
+
+def test_empty_input_passes_through():
+    gen = ewm_zscore(time_axis = 'window')
+    empty = AxisArray(np.array([]), dims = [''])
+    assert gen.send(empty) is empty
@@ -0,0 +1,134 @@
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pytest
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.features import eeg_features, compute_features, FEATURES
+from neurotheatre.offline import extract_features, load_features, run_batch, throughput
+from neurotheatre.synthetic import synthetic_eeg
+
+from conftest import BANDS, FREQS, GAINS
+
+FS = 200.0
+KWARGS = dict(ssvep_freqs = FREQS, ssvep_min_dur = 1.0, ssvep_prob_thresh = 0.45)
+
+
+def _recording(dur, seed = 0, n_ch = 8):
+    gen = synthetic_eeg(ssvep_freqs = FREQS, ssvep_amp = 10.0, ssvep_switch = 10.0, noise_amp = 5.0, emg_interval = 5.0, ch_gains = GAINS, seed = seed)
+    template = AxisArray(np.zeros((int(dur * FS), n_ch)), dims = ['time', 'ch'], axes = {'time': AxisArray.LinearAxis(gain = 1.0 / FS, offset = 0.0)})
+    return gen.send(template).data
+
+
+def _live(data, blocksize = 10, t0 = 0.0, **kwargs):
+    """ Stage outputs of the live path, one block at a time """
+    features = eeg_features(bands = list(BANDS.values()), **KWARGS, **kwargs)
+    out = {}
+    for start in range(0, len(data), blocksize):
+        msg = AxisArray(
+            data[start:start + blocksize][None],
+            dims = ['performer', 'time', 'ch'],
+            axes = {'time': AxisArray.LinearAxis(gain = 1.0 / FS, offset = t0 + start / FS)},
+        )
+        for stream, result in compute_features(features, msg).items():
+            out.setdefault(stream, []).append(result)
+    return out
+
+
+@pytest.mark.parametrize('engine', ['window', 'iir'])
+def test_matches_live_path(engine):
+    data = _recording(40.0)
+    live = _live(data, t0 = 3.0, bandpower_engine = engine)
+    offline = extract_features(data, FS, t0 = 3.0, chunk_dur = 7.0, bands = BANDS, bandpower_engine = engine, **KWARGS)
+
+    preproc = np.concatenate([m.data[0] for m in live['preproc']])
+    assert np.array_equal(np.stack([offline[f'preproc/ch{i}'] for i in range(8)], axis = 1), preproc)
+    assert offline['preproc/time'][0] == 3.0 and np.allclose(np.diff(offline['preproc/time']), 2.0 / FS)
+
+    axis = 'window' if engine == 'window' else 'time'
+    zscore = np.concatenate([np.moveaxis(m.data, [m.get_axis_idx(axis), m.get_axis_idx('performer')], [0, -1])[..., 0] for m in live['zscore']])
+    assert np.array_equal(np.stack([offline[f'zscore/{band}'] for band in BANDS], axis = 1), zscore)
+    assert len(offline['bandpower/time']) == len(zscore) and f'bandpower/{list(BANDS)[0]}_ch7' in offline
+
+    envelope = np.concatenate([m.data[0, :, 0] for m in live['envelope']])
+    assert np.array_equal(offline['envelope/jaw'], envelope)
+
+    decisions = [m for m in live['ssvep'] if m.data.size]
+    assert len(decisions) >= 5 and len(offline['ssvep/time']) == len(decisions)
+    probs = np.stack([offline[f'ssvep/{f:g}Hz'] for f in FREQS], axis = 1)
+    assert np.array_equal(probs, np.concatenate([m.data for m in decisions]))
+    assert np.array_equal(offline['ssvep/decision_time'], [m.attrs['decision_time'][0] for m in decisions])
+
+
+def test_only_enabled_streams():
+    offline = extract_features(_recording(5.0), FS, bands = BANDS, enabled = ['jaw'], **KWARGS)
+    assert set(offline) == {'envelope/time', 'envelope/jaw'}
+
+
+def test_batch_writes_columnar_files(tmp_path):
+    recordings = []
+    for seed in range(3):
+        recordings.append(str(tmp_path / f'session{seed}.npz'))
+        np.savez(recordings[-1], data = _recording(8.0, seed = seed), fs = FS, t0 = 10.0 * seed)
+
+    results = run_batch(recordings, str(tmp_path / 'features'), workers = 2, bands = BANDS, enabled = ['preproc', 'bandpower'])
+    assert [os.path.basename(r.output) for r in results] == [f'session{seed}.features.npz' for seed in range(3)]
+    assert all(r.duration == 8.0 for r in results)
+
+    columns = load_features(results[2].output)
+    expected = extract_features(_recording(8.0, seed = 2), FS, t0 = 20.0, bands = BANDS, enabled = ['preproc', 'bandpower'])
+    assert set(columns) == set(expected)
+    assert columns['preproc/ch0'].dtype == np.float32 and np.array_equal(columns['preproc/time'], expected['preproc/time'])
+    assert np.allclose(columns['zscore/alpha'], expected['zscore/alpha'], rtol = 1e-6)
+
+
+def test_batch_keeps_recordings_with_the_same_name_apart(tmp_path):
+    recordings = [str(tmp_path / day / 'session.npz') for day in ('mon', 'tue')]
+    for seed, recording in enumerate(recordings):
+        os.makedirs(os.path.dirname(recording))
+        np.savez(recording, data = _recording(2.0, seed = seed), fs = FS)
+
+    results = run_batch(recordings, str(tmp_path / 'features'), workers = 1, enabled = ['preproc'])
+    assert [os.path.relpath(r.output, tmp_path / 'features') for r in results] == [os.path.join(day, 'session.features.npz') for day in ('mon', 'tue')]
+    assert not np.array_equal(load_features(results[0].output)['preproc/ch0'], load_features(results[1].output)['preproc/ch0'])
+    with pytest.raises(ValueError):
+        run_batch(recordings + recordings[:1], str(tmp_path / 'features'), workers = 1, enabled = ['preproc'])
+
+
+if __name__ == "__main__":
+    # Recording-hours per minute, live block-by-block path vs. offline chunks across a process pool
+    # Usage: python offline_test.py [minutes per recording] [recordings]
+    minutes = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    n_recordings = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    kwargs = dict(bands = BANDS, **KWARGS)
+    data = _recording(minutes * 60.0)
+
+    print(f"{'features':>34} {'path':>22} {'rec-h/min':>10} {'x real time':>12}")
+    for enabled in (list(FEATURES), ['preproc', 'bandpower', 'jaw']):
+        name = ' + '.join(enabled)
+        tick = time.perf_counter()
+        _live(data[:int(60.0 * FS)], enabled = enabled)
+        live = time.perf_counter() - tick
+        print(f"{name:>34} {'live blocks':>22} {1.0 / 60.0 / (live / 60.0):>10.2f} {60.0 / live:>12.0f}")
+
+        for chunk_dur in (10.0, 60.0):
+            tick = time.perf_counter()
+            extract_features(data, FS, chunk_dur = chunk_dur, enabled = enabled, **kwargs)
+            elapsed = time.perf_counter() - tick
+            print(f"{name:>34} {f'{chunk_dur:g} s chunks':>22} {minutes / 60.0 / (elapsed / 60.0):>10.2f} {minutes * 60.0 / elapsed:>12.0f}")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            recordings = []
+            for seed in range(n_recordings):
+                recordings.append(os.path.join(tmp, f'rec{seed}.npz'))
+                np.savez(recordings[-1], data = data, fs = FS)
+            for workers in sorted({1, os.cpu_count()}):
+                tick = time.perf_counter()
+                results = run_batch(recordings, os.path.join(tmp, 'out'), workers = workers, enabled = enabled, **kwargs)
+                wall = time.perf_counter() - tick
+                label = f'{n_recordings} files, {workers} procs'
+                print(f"{name:>34} {label:>22} {throughput(results, wall):>10.2f} {throughput(results, wall) * 60.0:>12.0f}")
@@ -0,0 +1,166 @@
+import asyncio
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from vqf import VQF
+
+from neurotheatre.features import eeg_features, compute_features, imu_orientation, ssvep_stage, preproc_stage
+from neurotheatre.frequencydecoder import frequency_decode
+from neurotheatre.offload import SerialOffload, OrderedOffload
+from neurotheatre.workspace import Workspace
+
+from conftest import _headsets, BANDS, FREQS
+
+SSVEP = dict(freqs = FREQS, min_dur = 1.0, prob_thresh = 0.45)
+
+
+def _preprocessed(n_performers, n_blocks):
+    preproc = preproc_stage()
+    return [preproc(msg) for msg in _headsets(n_performers, n_blocks)]
+
+
+def test_serial_offload_matches_inline():
+    blocks = _preprocessed(2, 300)
+    inline = ssvep_stage(**SSVEP)
+    expected = [inline.send(block) for block in blocks]
+
+    async def offloaded():
+        outputs = []
+        with ThreadPoolExecutor(max_workers = 1) as executor:
+            lane = SerialOffload(ssvep_stage(**SSVEP), executor, lambda block, out: outputs.append(out))
+            for block in blocks:
+                assert lane.send(block).data.size == 0
+                await lane.join()
+        return outputs
+
+    outputs = asyncio.run(offloaded())
+    assert len(outputs) == len(expected)
+    decided = [i for i, out in enumerate(expected) if out.data.size]
+    assert len(decided) >= 4 and decided == [i for i, out in enumerate(outputs) if out.data.size]
+    for i in decided:
+        assert np.array_equal(outputs[i].data, expected[i].data, equal_nan = True)
+
+
+def test_waiting_blocks_are_merged_in_order():
+    blocks = _preprocessed(1, 6)
+
+    async def burst():
+        calls = []
+        with ThreadPoolExecutor(max_workers = 1) as executor:
+            lane = SerialOffload(ssvep_stage(**SSVEP), executor, lambda block, out: calls.append(block))
+            lane.send(blocks[0]) # starts right away
+            for item in [blocks[1], blocks[2], {'prob_thresh': 0.9}, blocks[3], blocks[4], blocks[5]]:
+                lane.send(item)
+            await lane.join()
+        return lane, calls
+
+    lane, calls = asyncio.run(burst())
+    assert lane.superseded == 3
+    assert [block.data.shape[1] for block in calls] == [5, 10, 15]
+    assert [block.get_axis('time').offset for block in calls] == [blocks[i].get_axis('time').offset for i in (0, 1, 3)]
+
+
+def _windows(n, fs = 200.0, seed = 0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(2.0 * fs)) / fs
+    for i in range(n):
+        f = FREQS[i % len(FREQS)]
+        data = np.sin(2 * np.pi * f * t)[:, None] * np.ones(8) + rng.normal(size = (len(t), 8))
+        yield AxisArray(data, dims = ['time', 'ch'], axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = i * 2.0)})
+
+
+def test_ordered_offload_keeps_input_order():
+    windows = list(_windows(12))
+    expected = [frequency_decode(time_axis = 'time', freqs = FREQS, harmonics = 1).send(w) for w in windows]
+
+    async def decode():
+        with ThreadPoolExecutor(max_workers = 3) as executor:
+            offload = OrderedOffload(lambda: frequency_decode(time_axis = 'time', freqs = FREQS, harmonics = 1), executor, max_pending = len(windows))
+            for w in windows:
+                offload.submit(w)
+            return [await offload.next() for _ in windows]
+
+    outputs = asyncio.run(decode())
+    assert [int(np.argmax(out.data)) for out in outputs] == [i % len(FREQS) for i in range(len(windows))]
+    assert all(np.allclose(out.data, exp.data) for out, exp in zip(outputs, expected))
+
+
+def test_ordered_offload_drops_superseded_inputs():
+    release = threading.Event()
+
+    def factory():
+        def gen():
+            msg = yield None
+            while True:
+                release.wait()
+                msg = yield msg
+        g = gen()
+        next(g)
+        return g
+
+    async def decode():
+        with ThreadPoolExecutor(max_workers = 1) as executor:
+            offload = OrderedOffload(factory, executor, max_pending = 2)
+            for i in range(6):
+                offload.submit(i)
+            await asyncio.sleep(0.05)
+            release.set()
+            return offload, [await offload.next() for _ in range(6)]
+
+    offload, outputs = asyncio.run(decode())
+    # 0 was running; 1 - 3 were superseded while 4 and 5 waited
+    assert outputs == [0, None, None, None, 4, 5] and offload.cancelled == 3
+
+
+async def _imu_latency(n_performers, dur, offload):
+    """ Lateness of 50 Hz IMU handling while the EEG features of `n_performers` run alongside """
+    # A strict threshold lets windows grow to the full 8 s, the costliest evaluations
+    features = eeg_features(
+        bands = list(BANDS.values()), ssvep_freqs = FREQS, ssvep_max_dur = 8.0, ssvep_step = 0.1, ssvep_prob_thresh = 0.9, ssvep_margin_thresh = 0.0,
+    )
+    executor = ThreadPoolExecutor(max_workers = 1)
+    if offload:
+        features.ssvep = SerialOffload(features.ssvep, executor, lambda block, out: None)
+    blocks = _headsets(n_performers, int(dur * 20))
+    motion = np.random.default_rng(0).normal(size = (4, 6))
+    vqf, work = VQF(0.005), Workspace()
+    lateness = []
+    start = time.perf_counter()
+
+    async def eeg():
+        for i, msg in enumerate(blocks):
+            await asyncio.sleep(max(0.0, start + i * 0.05 - time.perf_counter()))
+            compute_features(features, msg)
+
+    async def imu():
+        for i in range(int(dur * 50)):
+            due = start + i * 0.02
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            imu_orientation(vqf, motion, work)
+            lateness.append(time.perf_counter() - due)
+
+    await asyncio.gather(eeg(), imu())
+    if offload:
+        await features.ssvep.join()
+    executor.shutdown()
+    return np.array(lateness)
+
+
+if __name__ == "__main__":
+    # IMU handling latency with SSVEP decoding inline vs. on a worker thread
+    # Usage: python offload_test.py [performers] [seconds]
+    n_performers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    dur = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    print(f"{n_performers} performers, ssvep every 0.1 s over windows of up to 8 s")
+    print(f"{'ssvep':>8} {'imu p50 ms':>11} {'p99 ms':>8} {'max ms':>8}")
+    for offload in (False, True):
+        lateness = asyncio.run(_imu_latency(n_performers, dur, offload))
+        p50, p99 = np.percentile(lateness, [50, 99]) * 1e3
+        print(f"{'thread' if offload else 'inline':>8} {p50:>11.2f} {p99:>8.2f} {lateness.max() * 1e3:>8.2f}")
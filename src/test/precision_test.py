@@ -0,0 +1,76 @@
+import time
+
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.frequencydecoder import frequency_decode
+from neurotheatre.upsample import upsample
+from neurotheatre.preproc import decimating_preproc
+from neurotheatre.synthetic import synthetic_eeg
+
+FREQS = [7.0, 9.0, 11.0]
+
+
+def _session(dur = 4.0, fs = 100.0, n_ch = 8, dtype = np.float64):
+    gen = synthetic_eeg(ssvep_freqs = [9.0], ssvep_amp = 0.5, noise_amp = 1.0, seed = 0, dtype = dtype)
+    return gen.send(
+        AxisArray(
+            np.zeros((int(dur * fs), n_ch), dtype = dtype),
+            dims = ['time', 'ch'],
+            axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = 0.0)}
+        )
+    )
+
+
+def test_frequency_decode_float32_matches_float64():
+    msg = _session()
+    out64 = frequency_decode(time_axis = 'time', harmonics = 2, freqs = FREQS, softmax_beta = 0.0).send(msg)
+    out32 = frequency_decode(time_axis = 'time', harmonics = 2, freqs = FREQS, softmax_beta = 0.0, dtype = np.float32).send(msg)
+    assert out32.data.dtype == np.float32
+    assert np.allclose(out32.data, out64.data, atol = 1e-4)
+    assert out32.data.argmax() == out64.data.argmax()
+
+
+def test_upsample_float32_matches_float64():
+    msg = _session()
+    out64 = upsample(axis = 'time', factor = 3).send(msg)
+    out32 = upsample(axis = 'time', factor = 3, dtype = np.float32).send(msg)
+    assert out32.data.dtype == np.float32
+    scale = np.abs(out64.data).max()
+    assert np.abs(out32.data - out64.data).max() / scale < 1e-5
+
+
+def test_preproc_float32_matches_float64():
+    msg = _session(fs = 200.0)
+    msg32 = AxisArray(msg.data.astype(np.float32), dims = msg.dims, axes = msg.axes)
+    out64 = decimating_preproc().send(msg)
+    out32 = decimating_preproc().send(msg32)
+    assert out32.data.dtype == np.float32
+    scale = np.abs(out64.data).max()
+    assert np.abs(out32.data - out64.data).max() / scale < 1e-5
+
+
+def test_synthetic_keeps_float32():
+    msg = _session(dtype = np.float32)
+    assert msg.data.dtype == np.float32
+
+
+def _throughput(gen, msg, n = 200):
+    start = time.perf_counter()
+    for _ in range(n):
+        gen.send(msg)
+    return n / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    # Small blocks are dominated by per-call overhead; float32 pays off as arrays outgrow the caches
+    for dur, n_ch in ((4.0, 8), (8.0, 64), (30.0, 64)):
+        for dtype in (np.float64, np.float32):
+            win = _session(dur = dur, n_ch = n_ch, dtype = dtype)
+            fd = _throughput(frequency_decode(time_axis = 'time', harmonics = 2, freqs = FREQS, dtype = dtype), win, 50)
+            us = _throughput(upsample(axis = 'time', factor = 3, dtype = dtype), win, 50)
+            print(
+                f"{dur:5.1f} s x {n_ch:3d} ch {np.dtype(dtype).name}: "
+                f"frequency_decode {fd:8.1f} windows/s | upsample {us:8.1f} blocks/s | {win.data.nbytes / 1024:8.1f} KiB"
+            )
@@ -0,0 +1,91 @@
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from ezmsg.util.generator import compose
+from ezmsg.util.messages.axisarray import AxisArray
+from ezmsg.sigproc.butterworthfilter import butter
+from ezmsg.sigproc.downsample import downsample
+from ezmsg.sigproc.affinetransform import common_rereference
+
+from neurotheatre.features import PERFORMER_AXIS
+from neurotheatre.preproc import decimating_preproc
+
+from conftest import _headsets
+
+FS = 200.0
+
+
+def _chain():
+    """ The preprocessing as the separate ezmsg stages """
+    return compose(
+        butter(axis = 'time', order = 3, cuton = 1.0, cutoff = 50.0),
+        downsample(axis = 'time', factor = 2),
+        common_rereference(axis = 'ch'),
+    )
+
+
+def _split(data, sizes, dims = (PERFORMER_AXIS, 'time', 'ch')):
+    """ `data` (performer, time, ch) as messages of `sizes` samples, in the order of `dims` """
+    start = 0
+    for size in sizes:
+        block = np.moveaxis(data[:, start:start + size], [0, 1, 2], [dims.index(d) for d in (PERFORMER_AXIS, 'time', 'ch')])
+        yield AxisArray(block, dims = list(dims), axes = {'time': AxisArray.LinearAxis(gain = 1.0 / FS, offset = start / FS)})
+        start += size
+
+
+def _run(stage, msgs):
+    outs = [stage(msg) for msg in msgs]
+    return outs, np.concatenate([np.moveaxis(out.data, [out.get_axis_idx(PERFORMER_AXIS), out.get_axis_idx('time')], [0, 1]) for out in outs], axis = 1)
+
+
+@pytest.mark.parametrize('dims', [(PERFORMER_AXIS, 'time', 'ch'), ('ch', PERFORMER_AXIS, 'time')])
+def test_matches_separate_stages(dims):
+    data = 50.0 * np.random.default_rng(0).standard_normal((3, 2000, 8)) + 200.0 # with an offset to reject
+    sizes = np.random.default_rng(1).integers(0, 24, size = 200) # odd sizes flip the decimation phase
+    sizes = list(sizes[np.cumsum(sizes) <= 2000])
+
+    ref_outs, expected = _run(_chain(), _split(data, sizes, dims))
+    outs, fused = _run(decimating_preproc().send, _split(data, sizes, dims))
+    assert fused.shape == expected.shape
+    np.testing.assert_allclose(fused, expected, rtol = 0, atol = 1e-9 * np.abs(expected).max())
+    assert [out.dims for out in outs] == [out.dims for out in ref_outs]
+    for out, ref in zip(outs, ref_outs):
+        assert out.get_axis('time').gain == ref.get_axis('time').gain
+        assert out.get_axis('time').offset == pytest.approx(ref.get_axis('time').offset)
+
+
+def test_whole_blocks_match_exactly():
+    blocks = list(_headsets(2, 60))
+    _, one_by_one = _run(decimating_preproc().send, blocks)
+    data = np.concatenate([msg.data for msg in blocks], axis = 1)
+    _, merged = _run(decimating_preproc().send, _split(data, [30, 170, 400]))
+    assert np.array_equal(one_by_one, merged)
+
+
+def test_reset_on_new_rate():
+    stage = decimating_preproc().send
+    data = np.random.default_rng(0).standard_normal((1, 400, 4))
+    _run(stage, _split(data[:, :200], [10] * 20))
+    msg = AxisArray(data[:, 200:], dims = [PERFORMER_AXIS, 'time', 'ch'], axes = {'time': AxisArray.LinearAxis(gain = 1.0 / 250.0, offset = 0.0)})
+    fresh = decimating_preproc().send(msg)
+    assert np.array_equal(stage(msg).data, fresh.data) and fresh.get_axis('time').gain == 2.0 / 250.0
+
+
+if __name__ == "__main__":
+    # Per-block cost of the fused stage vs. the separate stages
+    # Usage: python preproc_test.py [seconds]
+    dur = float(sys.argv[1]) if len(sys.argv) > 1 else 20.0
+    print(f"{'performers':>10} {'stages us':>10} {'fused us':>9} {'speedup':>8}")
+    for n_performers in (1, 8, 32):
+        blocks = list(_headsets(n_performers, int(dur * 20)))
+        costs = []
+        for make in (_chain, lambda: decimating_preproc().send):
+            stage = make()
+            start = time.perf_counter()
+            for msg in blocks:
+                stage(msg)
+            costs.append((time.perf_counter() - start) / len(blocks) * 1e6)
+        print(f"{n_performers:>10} {costs[0]:>10.1f} {costs[1]:>9.1f} {costs[0] / costs[1]:>7.1f}x")
@@ -0,0 +1,198 @@
+import sys
+import time
+
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.features import compute_features, channel_subsets, PERFORMER_AXIS, FEATURES
+from neurotheatre.frequencydecoder import dynamic_stopping_decode
+from neurotheatre.quality import signal_quality, QUALITY_METRICS
+
+from conftest import _headsets, _features, FREQS
+
+FS = 200.0
+
+
+def _with_artifacts(blocks, artifacts):
+    """ `blocks` with `artifacts[(performer, ch)](t) -> samples` replacing those channels """
+    for msg in blocks:
+        data = msg.data.copy()
+        axis = msg.get_axis('time')
+        t = axis.offset + np.arange(data.shape[1]) * axis.gain
+        for (p, ch), artifact in artifacts.items():
+            data[p, :, ch] = artifact(t)
+        yield AxisArray(data, dims = msg.dims, axes = msg.axes)
+
+
+ARTIFACTS = {
+    (0, 0): lambda t: np.full_like(t, 1234.5), # lost contact: flat
+    (0, 1): lambda t: np.where(np.sin(2 * np.pi * 3.0 * t) > 0, 7.5e5, -7.5e5), # at the rails
+    (0, 2): lambda t: 200.0 * np.sin(2 * np.pi * 60.0 * t), # mains pickup
+    (0, 3): lambda t: 3000.0 * np.sin(2 * np.pi * 0.7 * t), # cable swinging
+}
+
+
+def _quality(blocks, **kwargs):
+    stage = signal_quality(**kwargs).send
+    for msg in blocks:
+        out = stage(msg)
+    return out
+
+
+def test_clean_signal_is_good():
+    out = _quality(_headsets(2, 100))
+    assert out.dims == [PERFORMER_AXIS, 'ch', 'quality'] and out.data.shape == (2, 8, len(QUALITY_METRICS))
+    assert out.attrs['good'].all()
+
+
+def test_each_artifact_flags_its_channel():
+    out = _quality(_with_artifacts(_headsets(2, 100), ARTIFACTS))
+    metrics = dict(zip(QUALITY_METRICS, np.moveaxis(out.data[0], -1, 0)))
+    assert metrics['flat'][0] < 0.5 < metrics['flat'][4:].min()
+    assert metrics['saturated'][1] > 0.9 and metrics['saturated'][[0, 2, 3]].max() == 0.0
+    assert metrics['line_ratio'][2] > 1.0 > metrics['line_ratio'][4:].max()
+    assert metrics['variance'][3] > 1e5 > metrics['variance'][4:].max()
+    assert out.attrs['good'].tolist() == [[False] * 4 + [True] * 4, [True] * 8]
+
+
+def test_too_few_channels_drop_the_performer():
+    out = _quality(_with_artifacts(_headsets(1, 100), ARTIFACTS), min_channels = 5)
+    assert not out.attrs['good'].any()
+
+
+def test_recovers_after_artifact():
+    flat = {(0, ch): (lambda t: np.zeros_like(t)) for ch in range(8)}
+    stage = signal_quality().send
+    for msg in _with_artifacts(_headsets(1, 40), flat):
+        assert not stage(msg).attrs['good'].any() or msg.get_axis('time').offset < 0.1
+    goods = [stage(msg).attrs['good'].all() for msg in list(_headsets(1, 80))[40:]]
+    assert goods[-1] and goods.index(True) < 20 # good again within a second
+
+
+def test_transposed_input():
+    blocks = list(_with_artifacts(_headsets(2, 60), ARTIFACTS))
+    expected = _quality(blocks)
+    transposed = _quality(AxisArray(msg.data.transpose(2, 0, 1), dims = ['ch', PERFORMER_AXIS, 'time'], axes = msg.axes) for msg in blocks)
+    assert transposed.dims == [PERFORMER_AXIS, 'ch', 'quality']
+    np.testing.assert_allclose(transposed.data, expected.data)
+    assert np.array_equal(transposed.attrs['good'], expected.attrs['good'])
+
+
+def test_masked_cca_matches_channel_subset():
+    blocks = list(_headsets(2, 100))
+    keep = np.array([[True, False, True, True, False, True, True, True], [True] * 8])
+    kwargs = dict(freqs = FREQS, harmonics = 1, min_dur = 1.0, max_dur = 4.0, step = 0.25, prob_thresh = 2.0, margin_thresh = 0.01, batch_axis = PERFORMER_AXIS)
+    masked = dynamic_stopping_decode(channels = keep, **kwargs)
+    # Entries are independent: the first should decode as if it had only its kept channels, the second as usual
+    subset = dynamic_stopping_decode(**kwargs)
+    full = dynamic_stopping_decode(**kwargs)
+    n_decisions = 0
+    for msg in blocks:
+        out = masked.send(msg)
+        refs = [subset.send(AxisArray(msg.data[:1, :, keep[0]], dims = msg.dims, axes = msg.axes)), full.send(msg)]
+        for b, ref in enumerate(refs):
+            decided = out.data.size and not np.isnan(out.attrs['decision_time'][b])
+            assert decided == bool(ref.data.size and not np.isnan(ref.attrs['decision_time'][b]))
+            if decided:
+                n_decisions += 1
+                np.testing.assert_allclose(out.data[b], ref.data[b])
+    assert n_decisions > 2
+
+
+def test_paused_entries_clear_their_window():
+    decoder = dynamic_stopping_decode(freqs = FREQS, min_dur = 0.5, max_dur = 4.0, prob_thresh = 0.0, batch_axis = PERFORMER_AXIS)
+    blocks = list(_headsets(2, 40))
+    decoder.send({'channels': np.array([[False] * 8, [True] * 8])})
+    decided = [decoder.send(msg).attrs.get('decision_time') for msg in blocks[:20]]
+    assert all(d is None or np.isnan(d[0]) for d in decided)
+    decoder.send({'channels': None})
+    times = [decoder.send(msg).attrs.get('decision_time') for msg in blocks[20:]]
+    assert any(t is not None and t[0] == 0.5 for t in times) # a fresh window, not the paused span
+
+
+def test_fill_averages_good_channels():
+    good = np.array([[True, False, True, False], [False] * 4, [True] * 4])
+    reference, fill = channel_subsets(good)
+    x = np.random.default_rng(0).standard_normal((3, 50, 4))
+    car = x - x.mean(axis = 2, keepdims = True)
+    referenced = car @ reference
+    assert np.allclose(referenced[0][:, [0, 2]], x[0][:, [0, 2]] - x[0][:, [0, 2]].mean(axis = 1, keepdims = True))
+    assert np.allclose(referenced[1:], car[1:])
+    filled = x @ fill
+    assert np.allclose(filled[0].mean(axis = 1), x[0][:, [0, 2]].mean(axis = 1))
+    assert np.allclose(filled[1:], x[1:])
+
+
+def test_gated_blocks_skip_features():
+    features = _features(FEATURES, quality = True)
+    off = {(p, ch): (lambda t: np.zeros_like(t)) for p in range(2) for ch in range(8)}
+    for msg in _headsets(2, 20):
+        out = compute_features(features, msg)
+    assert {'quality', 'preproc', 'bandpower', 'ssvep', 'envelope'} <= set(out)
+    outs = [compute_features(features, msg) for msg in _with_artifacts(_headsets(2, 20), off)]
+    assert set(outs[-1]) == {'quality', 'preproc', 'envelope'} # within a second of the headsets going flat
+    assert not outs[-1]['quality'].attrs['good'].any()
+
+
+def test_partially_bad_channels_keep_features_finite():
+    features = _features(FEATURES, quality = True)
+    decisions = np.zeros(2, dtype = int)
+    for msg in _with_artifacts(_headsets(2, 200), ARTIFACTS):
+        out = compute_features(features, msg)
+        if 'zscore' in out:
+            assert np.isfinite(out['bandpower'].data).all() and np.isfinite(out['zscore'].data).all()
+            assert np.abs(out['bandpower'].data).max() < 1e4 # the rails don't leak in through the reference
+        if out.get('ssvep') is not None and out['ssvep'].data.size:
+            decisions += np.isfinite(out['ssvep'].attrs['decision_time'])
+    assert decisions[1] > 0
+
+
+def _recording(dur, artifact_frac = 0.5, seed = 0):
+    """ Synthetic raw EEG (time, ch) where the headset is off (flat) or moving about `artifact_frac` of the time """
+    data = np.concatenate([msg.data[0] for msg in _headsets(1, int(dur * 20))])
+    rng = np.random.default_rng(seed)
+    t = np.arange(len(data)) / FS
+    start = 0.0
+    while start < dur:
+        length = rng.uniform(5.0, 20.0)
+        if rng.random() < artifact_frac:
+            span = (t >= start) & (t < start + length)
+            data[span] = 0.0 if rng.random() < 0.5 else 5000.0 * np.sin(2 * np.pi * 0.5 * t[span])[:, None]
+        start += length
+    return data, FS, 0.0
+
+
+if __name__ == "__main__":
+    # CPU per block spent on features with and without the quality gate, during artifacts (blocks
+    # the gate skips) and clean signal; each block's best of 3 runs
+    # Usage: python quality_test.py [recording.npz ...] (raw `data` (time, ch), `fs`, optional `t0`; default: synthetic)
+    if len(sys.argv) > 1:
+        recordings = []
+        for path in sys.argv[1:]:
+            with np.load(path) as rec:
+                recordings.append((path, rec['data'], float(rec['fs']), float(rec['t0']) if 't0' in rec else 0.0))
+    else:
+        recordings = [('synthetic, 50% artifacts', *_recording(300.0))]
+
+    print(f"{'recording':>26} {'period':>9} {'blocks':>7} {'ungated us':>11} {'gated us':>9} {'saved':>6}")
+    for name, data, fs, t0 in recordings:
+        blocksize = int(round(fs * 0.05))
+        blocks = [
+            AxisArray(data[None, i:i + blocksize], dims = [PERFORMER_AXIS, 'time', 'ch'], axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = t0 + i / fs)})
+            for i in range(0, len(data) - blocksize + 1, blocksize)
+        ]
+        costs = {False: np.full(len(blocks), np.inf), True: np.full(len(blocks), np.inf)}
+        for _ in range(3):
+            for quality in (False, True):
+                features = _features(FEATURES, quality = quality)
+                for i, msg in enumerate(blocks):
+                    tick = time.perf_counter()
+                    out = compute_features(features, msg)
+                    costs[quality][i] = min(costs[quality][i], time.perf_counter() - tick)
+                    if quality:
+                        blocks[i].attrs['gated'] = 'ssvep' not in out
+        gated = np.array([msg.attrs['gated'] for msg in blocks])
+        for period, sel in (('artifact', gated), ('clean', ~gated), ('all', np.ones_like(gated))):
+            ungated_us, gated_us = costs[False][sel].mean() * 1e6, costs[True][sel].mean() * 1e6
+            print(f"{name[-26:]:>26} {period:>9} {sel.sum():>7} {ungated_us:>11.1f} {gated_us:>9.1f} {1.0 - gated_us / ungated_us:>6.0%}")
@@ -0,0 +1,209 @@
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.features import compute_features, FEATURES, PERFORMER_AXIS
+from neurotheatre.reblock import AdaptiveBlocker
+
+from backpressure_test import _block, _simulate
+from conftest import _headsets, _features
+
+
+def _virtual(blocker, blocks, interval, per_call, per_sample, process = None):
+    """
+    Runs `blocks` arriving every `interval` sec through `blocker` on a virtual clock, where
+    processing `n` samples takes `per_call + per_sample * n` sec.
+
+    Returns:
+        The processed blocks and the clock when the last was done.
+    """
+    clock = 0.0
+    chunks = []
+    n_in = 0
+    while n_in < len(blocks):
+        clock = max(clock, n_in * interval)
+        while n_in < len(blocks) and n_in * interval <= clock:
+            blocker.push(blocks[n_in], n_in * interval)
+            n_in += 1
+        for chunk, arrived in blocker.take(clock):
+            n = chunk.data.shape[chunk.get_axis_idx('time')]
+            clock += per_call + per_sample * n
+            blocker.record(n, per_call + per_sample * n, clock - arrived)
+            chunks.append(chunk if process is None else process(chunk))
+    return chunks, clock
+
+
+def _samples(chunks):
+    return np.concatenate([chunk.data for chunk in chunks], axis = 1)
+
+
+def test_merges_as_many_as_the_budget_allows():
+    blocks = [_block(i * 0.05) for i in range(100)]
+    blocker = AdaptiveBlocker(0.12)
+    chunks, _ = _virtual(blocker, blocks, 0.05, 2e-3, 1e-5)
+    # Two blocks' wait plus processing fit in 120 ms, three don't
+    assert blocker.stats.target == 30 and not blocker.stats.catching_up
+    assert [c.data.shape[1] for c in chunks[-10:]] == [30] * 10
+    assert blocker.stats.over_budget == 0
+    assert len(blocker) == 2 # waiting for the rest of their merge
+    assert [c.get_axis('time').offset for c in chunks[-3:]] == pytest.approx([0.05 * i for i in (89, 92, 95)])
+
+    # The stream stops: the held blocks go out once waiting longer would break the budget
+    assert blocker.take(99 * 0.05 + 0.01) == []
+    release_at = blocker.release_at
+    assert 99 * 0.05 + 0.01 < release_at < 98 * 0.05 + 0.12
+    assert blocker.take(release_at - 1e-6) == [] and blocker.release_at == release_at
+    (last, arrived), = blocker.take(release_at + 1e-6)
+    assert arrived == 98 * 0.05 and last.data.shape[1] == 20
+    assert blocker.release_at is None
+    assert np.array_equal(_samples(chunks + [last]), _samples(blocks))
+
+
+def test_empty_blocks_are_dropped():
+    blocker = AdaptiveBlocker(0.12)
+    blocks = [_block(0.0), _block(0.05, n = 0), _block(0.05)]
+    for i, block in enumerate(blocks):
+        blocker.push(block, i * 0.05)
+    assert len(blocker) == 2 and blocker.stats.blocks_in == 2
+    chunks = [chunk for chunk, _ in blocker.take(0.1, flush = True)]
+    assert np.array_equal(_samples(chunks), _samples(blocks))
+
+
+def test_splits_blocks_costlier_than_the_budget():
+    blocks = [_block(i * 0.5, n = 100) for i in range(30)]
+    blocker = AdaptiveBlocker(5.5e-3)
+    chunks, _ = _virtual(blocker, blocks, 0.5, 1e-3, 1e-4)
+    # 45 samples take 5.5 ms; pieces are cut at multiples of 10
+    assert blocker.stats.target == 40
+    assert blocker.stats.per_call == pytest.approx(1e-3, rel = 0.05) and blocker.stats.per_sample == pytest.approx(1e-4, rel = 0.05)
+    assert [c.data.shape[1] for c in chunks[-6:]] == [40, 40, 20] * 2
+    assert [c.get_axis('time').offset for c in chunks[-3:]] == pytest.approx([14.5, 14.7, 14.9])
+    assert np.array_equal(_samples(chunks), _samples(blocks))
+
+
+def test_keeps_up_past_the_budget_when_overloaded():
+    blocks = [_block(i * 0.05) for i in range(200)]
+    blocker = AdaptiveBlocker(0.07)
+    # 60 ms per 50 ms block one at a time; nothing longer fits in the budget either
+    chunks, clock = _virtual(blocker, blocks, 0.05, 59e-3, 1e-4)
+    assert blocker.stats.catching_up and blocker.stats.target == 20
+    assert blocker.stats.load == pytest.approx(0.61, rel = 0.05)
+    # Whatever queued up while the last block was processed goes through at once
+    assert blocker.stats.merged >= 20
+    assert clock - 199 * 0.05 < 0.15 # not falling behind
+    assert np.array_equal(_samples(chunks), _samples(blocks))
+
+
+@pytest.mark.parametrize('n, per_call, per_sample, budget', [(10, 2e-3, 1e-5, 0.12), (40, 1e-3, 1e-4, 3.5e-3)])
+def test_reblocked_features_match_live(n, per_call, per_sample, budget):
+    blocks = list(_headsets(2, 400))
+    if n > 10:
+        blocks = [
+            AxisArray(np.concatenate([msg.data for msg in blocks[i:i + n // 10]], axis = 1), dims = blocks[i].dims, axes = blocks[i].axes)
+            for i in range(0, len(blocks), n // 10)
+        ]
+    one_by_one = _features(FEATURES, bandpower_engine = 'iir')
+    live = [compute_features(one_by_one, msg) for msg in blocks]
+
+    reblocked = _features(FEATURES, bandpower_engine = 'iir')
+    blocker = AdaptiveBlocker(budget)
+    outs, _ = _virtual(blocker, blocks, n / 200.0, per_call, per_sample, lambda msg: compute_features(reblocked, msg))
+    assert blocker.stats.merged if n == 10 else blocker.stats.split
+    for stream in ('preproc', 'envelope', 'zscore'):
+        axis = live[0][stream].get_axis_idx('time')
+        def joined(outs):
+            return np.concatenate([out[stream].data for out in outs if stream in out], axis = axis)
+        done = joined(outs) # the last blocks may still be held
+        assert np.array_equal(np.take(joined(live), np.arange(done.shape[axis]), axis = axis), done), stream
+
+
+def _simulate_adaptive(features, blocks, arrivals, budget):
+    """
+    Feeds `blocks` arriving at `arrivals` (sec from now) to `features` in real time through an :obj:`AdaptiveBlocker`.
+
+    Returns:
+        Each block's output latency (as in :obj:`_simulate`), the samples per processed
+        block, and the blocker.
+    """
+    blocker = AdaptiveBlocker(budget)
+    start = time.perf_counter()
+    arrivals = start + np.asarray(arrivals)
+    ends = np.cumsum([msg.data.shape[1] for msg in blocks]) # samples in and before each block
+    latencies = np.zeros(len(blocks))
+    sizes = []
+    n_in = n_done = processed = 0
+    while n_done < len(blocks):
+        now = time.perf_counter()
+        while n_in < len(blocks) and arrivals[n_in] <= now:
+            blocker.push(blocks[n_in], arrivals[n_in])
+            n_in += 1
+        chunks = blocker.take(now)
+        if not chunks:
+            # Nothing to do until the next block arrives (the last one is taken once it's late)
+            time.sleep(max(0.0, (arrivals[n_in] if n_in < len(blocks) else now + budget / 10) - time.perf_counter()))
+            if n_in == len(blocks) and len(blocker):
+                chunks = blocker.take(flush = True)
+        for chunk, arrived in chunks:
+            tick = time.perf_counter()
+            compute_features(features, chunk)
+            done = time.perf_counter()
+            n = chunk.data.shape[1]
+            blocker.record(n, done - tick, done - arrived)
+            sizes.append(n)
+            processed += n
+            while n_done < len(blocks) and ends[n_done] <= processed:
+                latencies[n_done] = done - arrivals[n_done]
+                n_done += 1
+    return latencies, np.array(sizes), blocker
+
+
+if __name__ == "__main__":
+    # Output latency, block sizes and CPU with adaptive re-blocking under synthetic load: blocks
+    # arrive faster than real time, at a given multiple of the rate they are processed one by
+    # one, and the budget is a multiple of processing one block
+    # Usage: python reblock_test.py [performers] [seconds of input] [budget in blocks' processing]
+    n_performers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    dur = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    budget_blocks = float(sys.argv[3]) if len(sys.argv) > 3 else 4.0
+    blocks = list(_headsets(n_performers, int(dur * 20)))
+
+    warm = _features(FEATURES)
+    tick = time.perf_counter()
+    for msg in blocks:
+        compute_features(warm, msg)
+    cost = (time.perf_counter() - tick) / len(blocks)
+    budget = budget_blocks * cost
+    print(f'{n_performers} performers, all features: {cost * 1e3:.2f} ms per block; budget {budget * 1e3:.2f} ms')
+
+    print(f"{'load':>6} {'policy':>9} {'p50 ms':>8} {'p99 ms':>8} {'end ms':>8} {'calls':>6} {'samples':>8} {'cpu us':>8} {'late':>6}")
+    for load in (0.5, 1.0, 1.5, 3.0):
+        interval = cost / load
+        for policy in ('none', 'merge', 'adaptive'):
+            cpu = time.process_time()
+            if policy == 'adaptive':
+                latencies, sizes, _ = _simulate_adaptive(_features(FEATURES), blocks, np.arange(len(blocks)) * interval, budget)
+                calls = len(sizes)
+            else:
+                latencies, shed = _simulate(_features(FEATURES), blocks, interval, policy)
+                calls = len(blocks) - shed
+            cpu = (time.process_time() - cpu) / len(blocks)
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1e3
+            print(
+                f"{load:>6.1f} {policy:>9} {p50:>8.2f} {p99:>8.2f} {latencies[-1] * 1e3:>8.2f} {calls:>6} "
+                f"{10.0 * len(blocks) / calls:>8.1f} {cpu * 1e6:>8.0f} {np.mean(latencies > budget):>6.0%}"
+            )
+
+    # A load that steps up and back down: the block size follows
+    print(f"\n{'phase':>6} {'load':>6} {'p99 ms':>8} {'samples':>8} {'late':>6}")
+    phases = np.array_split(np.arange(len(blocks)), 3)
+    loads = np.concatenate([np.full(len(sel), load) for sel, load in zip(phases, (0.5, 2.0, 0.5))])
+    arrivals = np.concatenate([[0.0], np.cumsum(cost / loads[:-1])])
+    latencies, sizes, _ = _simulate_adaptive(_features(FEATURES), blocks, arrivals, budget)
+    processed = np.cumsum(sizes) # samples after each call
+    for phase, sel in enumerate(phases):
+        calls = (processed > sel[0] * 10) & (processed <= (sel[-1] + 1) * 10)
+        print(f"{phase:>6} {loads[sel[0]]:>6.1f} {np.percentile(latencies[sel], 99) * 1e3:>8.2f} {sizes[calls].mean():>8.1f} {np.mean(latencies[sel] > budget):>6.0%}")
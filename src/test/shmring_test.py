@@ -0,0 +1,172 @@
+import multiprocessing
+import socket
+import tempfile
+import time
+
+import numpy as np
+import pytest
+
+from pythonosc.osc_message import OscMessage
+from pythonosc.udp_client import SimpleUDPClient
+
+from neurotheatre.shmring import RingWriter, RingReader, FeatureRings, ring_path
+
+
+def _frames(start, n, width):
+    times = np.arange(start, start + n) * 0.01
+    values = np.arange(start * width, (start + n) * width, dtype = np.float32).reshape(n, width)
+    return times, values
+
+
+def test_roundtrip_and_header(tmp_path):
+    writer = RingWriter('eeg', width = 3, capacity = 16, labels = ['a', 'b', 'c'], directory = tmp_path)
+    reader = RingReader('eeg', directory = tmp_path)
+    assert (reader.capacity, reader.width, reader.labels) == (16, 3, ['a', 'b', 'c'])
+
+    times, values = _frames(0, 5, 3)
+    writer.write(times, values)
+    t, v = reader.read()
+    assert np.array_equal(t, times) and np.array_equal(v, values)
+    assert reader.read()[0].size == 0
+
+    writer.write(*_frames(5, 2, 3))
+    t, v = reader.latest(4)
+    assert np.array_equal(t, _frames(3, 4, 3)[0])
+    assert np.array_equal(reader.read()[1], _frames(5, 2, 3)[1]) # latest doesn't consume
+
+    writer.close()
+    assert reader.closed
+    reader.close()
+    with pytest.raises(FileNotFoundError):
+        RingReader('eeg', directory = tmp_path)
+
+
+def test_lapped_reader_counts_lost_frames(tmp_path):
+    writer = RingWriter('eeg', width = 2, capacity = 16, directory = tmp_path)
+    reader = RingReader('eeg', directory = tmp_path)
+    for start in range(0, 40, 10):
+        writer.write(*_frames(start, 10, 2))
+    t, v = reader.read()
+    assert reader.lost == 24 and np.array_equal(v, _frames(24, 16, 2)[1])
+
+    # A frame caught mid-write (sequence 0) is left out rather than returned torn
+    writer.write(*_frames(40, 3, 2))
+    writer._arrays.slot_seq[41 % 16] = 0
+    t, v = reader.read()
+    assert np.array_equal(t, _frames(40, 3, 2)[0][[0, 2]]) and reader.lost == 25
+
+    # Blocks longer than the ring keep their newest frames
+    writer.write(*_frames(43, 40, 2))
+    assert writer.frames_written == 83
+    assert np.array_equal(reader.latest(16)[1], _frames(67, 16, 2)[1])
+    writer.close()
+    reader.close()
+
+
+def test_feature_rings_replace_on_new_layout(tmp_path):
+    rings = FeatureRings('nt', capacity = 8, directory = tmp_path)
+    rings.write('/p1', 'bandpower', 1.0, [1.0, 2.0], ['alpha', 'alpha_norm'])
+    reader = RingReader('nt_p1_bandpower', directory = tmp_path)
+    assert reader.labels == ['alpha', 'alpha_norm']
+
+    # New bands: readers of the old ring see it closed and reopen under the same name
+    rings.write('/p1', 'bandpower', 2.0, [1.0, 2.0, 3.0, 4.0], ['alpha', 'theta', 'alpha_norm', 'theta_norm'])
+    assert reader.closed
+    reader.close()
+    reader = RingReader('nt_p1_bandpower', directory = tmp_path)
+    t, v = reader.read()
+    assert reader.width == 4 and np.array_equal(t, [2.0])
+    reader.close()
+
+    rings.close()
+    assert not (tmp_path / 'nt_p1_bandpower.ring').exists()
+
+
+def _ring_reader(name, directory, n_frames, latencies):
+    """ Polls the ring until `n_frames` arrived; frame values carry the writer's perf_counter """
+    reader = RingReader(name, directory = directory)
+    local = []
+    while len(local) < n_frames:
+        t, v = reader.read()
+        now = time.perf_counter()
+        if len(t):
+            local.extend((now - t).tolist())
+        else:
+            time.sleep(0)
+    reader.close()
+    latencies.extend(local)
+
+
+def _osc_reader(port, n_frames, latencies, base):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', port))
+    sock.settimeout(2.0)
+    local = []
+    try:
+        while len(local) < n_frames:
+            msg = OscMessage(sock.recv(65536))
+            local.append(time.perf_counter() - base - msg.params[0]) # OSC floats are float32: stamps are relative to `base`
+    except socket.timeout:
+        pass # datagrams dropped by the socket buffer never arrive
+    latencies.extend(local)
+
+
+def compare(n_ch = 8, n_frames = 20000, blocksize = 5, rate = None):
+    """
+    Sends `n_frames` preprocessed-EEG-sized frames through OSC (one message per sample,
+    as EEGOSC does) and through a ring, each to a reader in another process.  With `rate`
+    (frames/s) frames are paced in blocks of `blocksize`; otherwise sent as fast as possible.
+
+    Returns:
+        {path: (frames/s sent, frames received, latency percentiles 50/99 in us)}
+    """
+    results = {}
+    manager = multiprocessing.Manager()
+    directory = tempfile.mkdtemp()
+    base = time.perf_counter()
+
+    for path in ('osc', 'ring'):
+        latencies = manager.list()
+        if path == 'osc':
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.bind(('127.0.0.1', 0))
+                port = s.getsockname()[1]
+            proc = multiprocessing.Process(target = _osc_reader, args = (port, n_frames, latencies, base))
+            proc.start()
+            time.sleep(0.5)
+            client = SimpleUDPClient('127.0.0.1', port)
+            def send(stamp, block):
+                for sample in block:
+                    client.send_message('/eeg/preproc', [stamp - base] + sample.tolist())
+        else:
+            writer = RingWriter('bench', width = n_ch, capacity = 4096, directory = directory)
+            proc = multiprocessing.Process(target = _ring_reader, args = ('bench', directory, n_frames, latencies))
+            proc.start()
+            time.sleep(0.5)
+            def send(stamp, block):
+                writer.write(np.full(len(block), stamp), block)
+
+        block = np.random.default_rng(0).standard_normal((blocksize, n_ch)).astype(np.float32)
+        tick = time.perf_counter()
+        for i in range(n_frames // blocksize):
+            if rate is not None:
+                while time.perf_counter() < tick + i * blocksize / rate:
+                    pass
+            send(time.perf_counter(), block)
+        elapsed = time.perf_counter() - tick
+        proc.join(10)
+        if path == 'ring':
+            writer.close()
+        lat = np.array(list(latencies)) * 1e6
+        results[path] = (n_frames / elapsed, len(lat), np.percentile(lat, [50, 99]) if len(lat) else (np.nan, np.nan))
+    manager.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    # Preprocessed EEG (8 ch) to a reader process on the same host: OSC over loopback vs a shared-memory ring
+    print(f"{'load':>26} {'path':>5} {'sent frames/s':>14} {'received':>9} {'p50 us':>8} {'p99 us':>9}")
+    for label, rate, n_frames in (('max rate', None, 20000), ('100 Hz x 8 performers', 800.0, 8000)):
+        for path, (throughput, received, (p50, p99)) in compare(n_frames = n_frames, rate = rate).items():
+            print(f"{label:>26} {path:>5} {throughput:>14.0f} {received:>9} {p50:>8.1f} {p99:>9.1f}")
+    print(f"\nRings live in {ring_path('<name>')}; OSC frames are one datagram per sample.")
@@ -0,0 +1,87 @@
+import sys
+
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.frequencydecoder import dynamic_stopping_decode
+from neurotheatre.synthetic import synthetic_eeg
+
+FREQS = [7.0, 9.0, 11.0]
+
+
+def synthetic_session(dur = 120.0, fs = 100.0, n_ch = 8, switch = 10.0, snr = 0.3, seed = 0):
+    """ Returns (data (time, ch), labels (time,) index of the attended target, fs) """
+    gen = synthetic_eeg(ssvep_freqs = FREQS, ssvep_amp = snr, ssvep_switch = switch, noise_amp = 1.0, seed = seed)
+    msg = AxisArray(
+        np.zeros((int(dur * fs), n_ch)),
+        dims = ['time', 'ch'],
+        axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = 0.0)}
+    )
+    data = gen.send(msg).data
+    labels = (np.arange(data.shape[0]) // int(switch * fs)) % len(FREQS)
+    return data, labels, fs
+
+
+def run_decoder(data, labels, fs, blocksize = 10, **kwargs):
+    """ Streams a session through the decoder; returns [(true label, decision, decision time)] """
+    gen = dynamic_stopping_decode(freqs = FREQS, **kwargs)
+    decisions = []
+    for start in range(0, data.shape[0], blocksize):
+        msg = AxisArray(
+            data[start:start + blocksize],
+            dims = ['time', 'ch'],
+            axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = start / fs)}
+        )
+        out = gen.send(msg)
+        if out.data.size:
+            end = min(start + blocksize, data.shape[0]) - 1
+            decisions.append((labels[end], out.data.argmax().item(), out.attrs['decision_time']))
+    return np.array(decisions).reshape(-1, 3)
+
+
+def test_confident_decisions_are_fast_and_accurate():
+    data, labels, fs = synthetic_session(snr = 1.0)
+    result = run_decoder(data, labels, fs, harmonics = 1, min_dur = 0.5, max_dur = 4.0, prob_thresh = 0.6, softmax_beta = 5.0)
+    assert len(result) > 10
+    assert (result[:, 0] == result[:, 1]).mean() > 0.9
+    assert result[:, 2].mean() < 2.0
+
+
+def test_refractory_period_spaces_decisions():
+    data, labels, fs = synthetic_session(snr = 1.0)
+    result = run_decoder(data, labels, fs, min_dur = 0.5, prob_thresh = 0.0, softmax_beta = 5.0, step = 0.1, refractory = 2.0)
+    # every 0.5 s window decides immediately; then 2 s of refractory
+    assert abs(len(result) - data.shape[0] / fs / 2.5) <= 1
+
+
+def test_no_decision_below_threshold():
+    data, labels, fs = synthetic_session(snr = 0.0)
+    result = run_decoder(data, labels, fs, prob_thresh = 0.99, softmax_beta = 5.0)
+    assert len(result) == 0
+
+
+if __name__ == "__main__":
+    # Decision time vs. accuracy report
+    # Usage: python ssvep_dynamic_test.py [recording.npz]
+    #   recording.npz must contain `data` (time, ch), `labels` (time,) target index, and `fs`
+    if len(sys.argv) > 1:
+        rec = np.load(sys.argv[1])
+        sessions = {sys.argv[1]: (rec['data'], rec['labels'], float(rec['fs']))}
+    else:
+        sessions = {f'synthetic snr={snr}': synthetic_session(snr = snr) for snr in (0.2, 0.3, 0.5)}
+
+    for name, (data, labels, fs) in sessions.items():
+        print(name)
+        print(f"{'criterion':>20} {'decisions':>10} {'accuracy':>9} {'mean time (s)':>14}")
+        for kwargs in (
+            *[dict(prob_thresh = p) for p in (0.5, 0.6, 0.7)],
+            *[dict(prob_thresh = 2.0, margin_thresh = m) for m in (0.1, 0.15, 0.2, 0.3)],
+        ):
+            result = run_decoder(data, labels, fs, harmonics = 2, min_dur = 0.5, max_dur = 8.0, softmax_beta = 5.0, refractory = 0.5, **kwargs)
+            crit = f"p >= {kwargs['prob_thresh']}" if 'margin_thresh' not in kwargs else f"margin >= {kwargs['margin_thresh']}"
+            if len(result) == 0:
+                print(f"{crit:>20} {0:>10}")
+                continue
+            acc = (result[:, 0] == result[:, 1]).mean()
+            print(f"{crit:>20} {len(result):>10} {acc:>9.2f} {result[:, 2].mean():>14.2f}")
@@ -0,0 +1,74 @@
+import time
+
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.synthetic import synthetic_eeg, synthetic_motion
+
+
+def _blocks(n_blocks, blocksize = 10, n_ch = 8, fs = 200.0):
+    for i in range(n_blocks):
+        yield AxisArray(
+            np.zeros((blocksize, n_ch)),
+            dims = ['time', 'ch'],
+            axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = i * blocksize / fs)},
+        )
+
+
+def test_phase_continuity_matches_direct_sine():
+    fs, freq = 200.0, 9.0
+    gen = synthetic_eeg(ssvep_freqs = [freq], ssvep_amp = 1.0)
+    out = np.concatenate([gen.send(msg).data for msg in _blocks(100, fs = fs)])
+    t = np.arange(out.shape[0]) / fs
+    assert np.abs(out[:, 0] - np.sin(2 * np.pi * freq * t)).max() < 1e-3
+
+
+def test_input_is_not_mutated():
+    gen = synthetic_eeg(ssvep_freqs = [7.0], emg_interval = 0.1, noise_amp = 1.0)
+    msg = next(_blocks(1))
+    msg.data.flags.writeable = False
+    out = gen.send(msg)
+    assert not np.shares_memory(out.data, msg.data)
+    assert np.all(msg.data == 0)
+
+
+def test_emg_bursts_are_gated():
+    fs = 200.0
+    gen = synthetic_eeg(emg_interval = 1.0, emg_dur = 0.25, emg_amp = 1.0, seed = 0)
+    out = np.concatenate([gen.send(msg).data for msg in _blocks(40, fs = fs)])
+    active = np.any(out != 0, axis = 1)
+    assert active.reshape(-1, int(fs))[:, :50].all()
+    assert not active.reshape(-1, int(fs))[:, 50:].any()
+
+
+def test_output_dtype():
+    msg = next(_blocks(1))
+    assert synthetic_eeg(ssvep_freqs = (7.0,)).send(msg).data.dtype == np.float64
+    assert synthetic_eeg(dtype = np.dtype(np.float32)).send(msg).data.dtype == np.float32
+    assert synthetic_eeg(dtype = 'float32').send(msg).data.dtype == np.float32
+
+
+def test_motion_is_unit_gravity():
+    gen = synthetic_motion()
+    out = np.concatenate([gen.send(msg).data for msg in _blocks(50, n_ch = 6)])
+    assert out.shape[1] == 6
+    assert np.allclose(np.linalg.norm(out[:, :3], axis = 1), 1.0, atol = 1e-6)
+
+
+if __name__ == "__main__":
+    # Throughput of the generator as a load source
+    for n_ch, blocksize in [(8, 10), (64, 100), (256, 1000)]:
+        gen = synthetic_eeg(
+            ssvep_freqs = [7.0, 9.0, 11.0],
+            band_mods = {'alpha': (10.0, 0.05, 20.0), 'beta': (20.0, 0.08, 5.0)},
+            emg_interval = 5.0,
+            noise_amp = 5.0,
+        )
+        blocks = list(_blocks(200, blocksize = blocksize, n_ch = n_ch, fs = 1000.0))
+        start = time.perf_counter()
+        for msg in blocks:
+            gen.send(msg)
+        elapsed = time.perf_counter() - start
+        n_samp = 200 * blocksize
+        print(f"{n_ch:4d} ch x {blocksize:5d} samp blocks: {n_samp / elapsed / 1e3:10.1f} ksamples/s ({n_samp / 1000.0 / elapsed:8.1f}x real-time @ 1 kHz)")
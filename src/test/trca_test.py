@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+from ezmsg.util.messages.axisarray import AxisArray
+
+from neurotheatre.features import calibrate_ssvep, preproc_stage, PERFORMER_AXIS
+from neurotheatre.frequencydecoder import dynamic_stopping_decode, cca_correlations, _design
+from neurotheatre.trca import TemplateCache, template_scores
+
+FREQS = [7.0, 9.0, 11.0]
+
+
+def structured_session(dur = 60.0, fs = 200.0, n_ch = 8, switch = 4.0, snr = 0.2, t0 = 1000.0, seed = 0, subject = 0):
+    """
+    SSVEP with what sin/cos references miss: a non-sinusoidal response whose phase and
+    gain differ per channel, buried in spatially correlated noise.  `subject` fixes the
+    spatial pattern so calibration and test sessions can share it.
+    Returns (data (time, ch), labels (time,), fs, t0) with stimulus phase 0 at t = 0.
+    """
+    pattern = np.random.default_rng(subject)
+    ch_phase = pattern.uniform(0, 2 * np.pi, n_ch)
+    ch_gain = pattern.uniform(0.2, 1.0, n_ch)
+    mix = pattern.standard_normal((n_ch, n_ch))
+
+    rng = np.random.default_rng(seed)
+    n = int(dur * fs)
+    t = t0 + np.arange(n) / fs
+    labels = (np.arange(n) // int(switch * fs)) % len(FREQS)
+    w = 2 * np.pi * np.array(FREQS)[labels][:, None] * t[:, None] + ch_phase
+    response = ch_gain * (np.sin(w) + 0.6 * np.sin(2 * w + 1.0) + 0.3 * np.sin(3 * w + 2.0))
+    noise = rng.standard_normal((n, n_ch)) @ mix
+    return snr * response + noise, labels, fs, t0
+
+
+def _preprocessed(data, fs, t0):
+    out = preproc_stage()(AxisArray(data[None], dims = [PERFORMER_AXIS, 'time', 'ch'], axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = t0)}))
+    axis = out.get_axis('time')
+    return out.data[0], axis.offset + np.arange(out.data.shape[1]) * axis.gain
+
+
+def run_decoder(data, labels, fs, t0, blocksize = 10, **kwargs):
+    gen = dynamic_stopping_decode(freqs = FREQS, harmonics = 2, softmax_beta = 5.0, **kwargs)
+    preproc = preproc_stage('time', 'ch')
+    results = []
+    for start in range(0, data.shape[0], blocksize):
+        msg = AxisArray(data[start:start + blocksize], dims = ['time', 'ch'], axes = {'time': AxisArray.LinearAxis(gain = 1.0 / fs, offset = t0 + start / fs)})
+        out = gen.send(preproc(msg))
+        if out.data.size:
+            results.append((labels[min(start + blocksize, len(labels)) - 1], out.data.argmax(), out.attrs['decision_time']))
+    return np.array(results).reshape(-1, 3)
+
+
+def test_cache_roundtrip(tmp_path):
+    data, labels, fs, t0 = structured_session(dur = 30.0)
+    templates = calibrate_ssvep(data, labels, fs, FREQS, t0 = t0)
+    cache = TemplateCache(tmp_path)
+    fname = cache.save('p1', 'unicorn8', templates)
+    assert os.path.getsize(fname) < 20e3
+    loaded = cache.load('p1', 'unicorn8')
+    assert np.allclose(loaded.folded, templates.folded, atol = 1e-5)
+    assert np.allclose(loaded.filters, templates.filters, atol = 1e-5)
+    assert loaded.stim_t0 == templates.stim_t0 and loaded.fs == templates.fs
+    assert cache.load('p2', 'unicorn8') is None
+    assert cache.load('p1', 'muse4') is None
+
+
+def test_calibrated_decoder_beats_cca_on_short_windows():
+    data, labels, fs, t0 = structured_session(dur = 60.0, seed = 0)
+    templates = calibrate_ssvep(data, labels, fs, FREQS, t0 = t0)
+    test, test_labels, _, _ = structured_session(dur = 120.0, seed = 1, t0 = 2000.0)
+
+    kwargs = dict(min_dur = 0.5, max_dur = 4.0, prob_thresh = 0.0, refractory = 0.5)
+    trca = run_decoder(test, test_labels, fs, 2000.0, method = 'trca', templates = [templates], **kwargs)
+    cca = run_decoder(test, test_labels, fs, 2000.0, **kwargs)
+    acc_trca = (trca[:, 0] == trca[:, 1]).mean()
+    acc_cca = (cca[:, 0] == cca[:, 1]).mean()
+    assert acc_trca > 0.9
+    assert acc_trca > acc_cca + 0.2
+
+
+def test_loading_at_the_live_stimulus_phase(tmp_path):
+    data, labels, fs, t0 = structured_session(dur = 60.0, seed = 0)
+    cache = TemplateCache(tmp_path)
+    cache.save('p1', 'unicorn8', calibrate_ssvep(data, labels, fs, FREQS, t0 = t0))
+    # The show's clock is 37 ms off the stimuli's: they are at phase 0 at t = 0.037
+    test, test_labels, _, _ = structured_session(dur = 60.0, seed = 1, t0 = 2000.0)
+    kwargs = dict(min_dur = 0.5, max_dur = 4.0, prob_thresh = 0.0, refractory = 0.5, method = 'trca')
+    accuracy = {}
+    for stim_t0 in (None, 0.037):
+        templates = cache.load('p1', 'unicorn8', stim_t0 = stim_t0)
+        results = run_decoder(test, test_labels, fs, 2000.037, templates = [templates], **kwargs)
+        accuracy[stim_t0] = (results[:, 0] == results[:, 1]).mean()
+    assert accuracy[0.037] > 0.9
+    assert accuracy[0.037] > accuracy[None] + 0.2
+
+
+def test_mismatched_templates_fall_back_to_cca():
+    data, labels, fs, t0 = structured_session(dur = 30.0)
+    templates = calibrate_ssvep(data, labels, fs, FREQS[:2], t0 = t0)
+    kwargs = dict(min_dur = 0.5, max_dur = 2.0, prob_thresh = 0.0, refractory = 0.5)
+    fallback = run_decoder(data, labels, fs, t0, method = 'ecca', templates = [templates], **kwargs)
+    cca = run_decoder(data, labels, fs, t0, **kwargs)
+    assert np.array_equal(fallback, cca)
+
+
+if __name__ == "__main__":
+    # Accuracy vs. window length of CCA and the calibrated decoders
+    # Usage: python trca_test.py [recording.npz]
+    #   recording.npz: raw `data` (time, ch), `labels` (time,), `fs`, optionally `t0` and `stim_t0`;
+    #   the first half calibrates, the second half is decoded
+    if len(sys.argv) > 1:
+        with np.load(sys.argv[1]) as rec:
+            data, labels, fs = rec['data'], rec['labels'], float(rec['fs'])
+            t0 = float(rec['t0']) if 't0' in rec else 0.0
+            stim_t0 = float(rec['stim_t0']) if 'stim_t0' in rec else 0.0
+        half = data.shape[0] // 2
+        sessions = {sys.argv[1]: ((data[:half], labels[:half], t0), (data[half:], labels[half:], t0 + half / fs), fs, stim_t0)}
+    else:
+        sessions = {}
+        for snr in (0.05, 0.1, 0.3):
+            cal, cal_labels, fs, cal_t0 = structured_session(dur = 60.0, snr = snr, seed = 0)
+            test, test_labels, _, test_t0 = structured_session(dur = 240.0, snr = snr, switch = 8.0, seed = 1, t0 = 5000.0)
+            sessions[f'synthetic snr={snr}'] = ((cal, cal_labels, cal_t0), (test, test_labels, test_t0), fs, 0.0)
+
+    for name, ((cal, cal_labels, cal_t0), (test, test_labels, test_t0), fs, stim_t0) in sessions.items():
+        templates = calibrate_ssvep(cal, cal_labels, fs, FREQS, t0 = cal_t0, stim_t0 = stim_t0)
+        X_all, t_all = _preprocessed(test, fs, test_t0)
+        pfs = templates.fs
+        test_labels = test_labels[::2][:len(t_all)]
+
+        print(name)
+        print(f"{'window (s)':>10} {'cca':>6} {'trca':>6} {'ecca':>6}   {'us/window cca / trca / ecca':>28}")
+        for dur in (0.25, 0.5, 1.0, 2.0, 4.0):
+            n = int(dur * pfs)
+            design = _design(FREQS, 2, np.arange(n) / pfs, np.float64)
+            correct = {'cca': 0, 'trca': 0, 'ecca': 0}
+            cost = {'cca': 0.0, 'trca': 0.0, 'ecca': 0.0}
+            n_windows = 0
+            for start in range(int(pfs), X_all.shape[0] - n, int(pfs * 0.37)):
+                if test_labels[start] != test_labels[start + n - 1]:
+                    continue
+                X = X_all[start:start + n] - X_all[start:start + n].mean(0)
+                t = t_all[start:start + n]
+                tick = time.perf_counter()
+                corrs = cca_correlations((X / X.std(0))[None], design)[0]
+                cost['cca'] += time.perf_counter() - tick
+                tick = time.perf_counter()
+                trca = template_scores(X, t, templates, 'trca')
+                cost['trca'] += time.perf_counter() - tick
+                tick = time.perf_counter()
+                ecca = template_scores(X, t, templates, 'ecca', corrs)
+                cost['ecca'] += time.perf_counter() - tick
+                for method, scores in (('cca', corrs), ('trca', trca), ('ecca', ecca)):
+                    correct[method] += scores.argmax() == test_labels[start]
+                n_windows += 1
+            cost['ecca'] += cost['cca'] # eCCA includes the plain CCA term
+            acc = {k: v / n_windows for k, v in correct.items()}
+            us = {k: v / n_windows * 1e6 for k, v in cost.items()}
+            print(f"{dur:>10.2f} {acc['cca']:>6.2f} {acc['trca']:>6.2f} {acc['ecca']:>6.2f}   {us['cca']:>8.0f} / {us['trca']:>6.0f} / {us['ecca']:>6.0f}")